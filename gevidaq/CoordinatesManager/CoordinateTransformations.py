@@ -9,25 +9,23 @@ Created on Tue Jun 23 09:21:44 2020
 Modified based on Izak's code for higher level interface.
 """
 
+import collections
 import importlib.resources
 import logging
 
 import numpy as np
-from scipy import optimize
 
 from . import Registration
 
 
-def _transform_x(p, *kwargs):
-    order = int(np.sqrt(len(kwargs)))
-    c = np.reshape(np.asarray(kwargs), (order, order))
-    return np.polynomial.polynomial.polyval2d(p[:, 0], p[:, 1], c)
-
-
-def _transform_y(p, *kwargs):
-    order = int(np.sqrt(len(kwargs)))
-    c = np.reshape(np.asarray(kwargs), (order, order))
-    return np.polynomial.polynomial.polyval2d(p[:, 0], p[:, 1], c)
+def _vandermonde(coord, order):
+    """
+    Terms x**i * y**j of the points, in the order of c[i, j].
+    """
+    coord = np.asarray(coord, dtype=float)
+    return np.polynomial.polynomial.polyvander2d(
+        coord[..., 0], coord[..., 1], [order, order]
+    )
 
 
 def polynomial2DFit(p, q, order=1):
@@ -35,6 +33,10 @@ def polynomial2DFit(p, q, order=1):
     Input an array of coordinates p and q in frame P and Q. The function returns
     a function matrix that transforms P into Q using polynomial transform.
 
+    Least squares through np.linalg.lstsq, with the columns of the
+    Vandermonde matrix scaled to unit norm, as x**2 * y**2 of camera pixels
+    is orders of magnitude larger than 1.
+
     param p, q = np.array([p1_x, p1_y],
                           [p2_x, p2_y,
                             .., ..])
@@ -42,24 +44,25 @@ def polynomial2DFit(p, q, order=1):
     param order = order of polynomial transform, order should be smaller than
                   the number of input points
 
-    return = stacked polynomial coefficients matrices, rounded to 4 decimals
+    return = stacked polynomial coefficients matrices, shape
+             (order + 1, order + 1, 2)
 
     """
-    if isinstance(p, list):
-        p = np.array(p)
-    if isinstance(q, list):
-        q = np.array(q)
-
-    init_param = np.ones((order + 1, order + 1))
-    params_x, _ = optimize.curve_fit(_transform_x, p, q[:, 0], init_param)
-    params_y, _ = optimize.curve_fit(_transform_y, p, q[:, 1], init_param)
-
-    return np.stack(
-        (
-            np.reshape(params_x, (order + 1, order + 1)),
-            np.reshape(params_y, (order + 1, order + 1)),
-        ),
-        axis=2,
+    V = _vandermonde(p, order)
+    q = np.asarray(q, dtype=float)
+
+    norms = np.linalg.norm(V, axis=0)
+    norms[norms == 0] = 1
+    coefficients, _, rank, _ = np.linalg.lstsq(V / norms, q, rcond=None)
+    if rank < V.shape[1]:
+        logging.info(
+            "Transformation is underdetermined, rank {} of {}".format(
+                rank, V.shape[1]
+            )
+        )
+
+    return np.reshape(
+        coefficients / norms[:, np.newaxis], (order + 1, order + 1, 2)
     )
 
 
@@ -68,25 +71,97 @@ def transform(coord, c):
     param coord: np.ndarray of shape nx2 containing x and y coordinates.
     param c: matrix containing the transformation coefficients.
 
+    All points are transformed in one product with their Vandermonde matrix.
     """
-    if isinstance(coord, list):
-        coord = np.array(coord)
+    coord = np.asarray(coord, dtype=float)
+    order = c.shape[0] - 1
+    return np.reshape(
+        _vandermonde(coord, order) @ np.reshape(c, (-1, 2)), coord.shape
+    )
 
-    if coord.ndim == 1:
-        new_coord_x = np.polynomial.polynomial.polyval2d(
-            coord[0], coord[1], c[:, :, 0]
-        )
-        new_coord_y = np.polynomial.polynomial.polyval2d(
-            coord[0], coord[1], c[:, :, 1]
-        )
-    else:
-        new_coord_x = np.polynomial.polynomial.polyval2d(
-            coord[:, 0], coord[:, 1], c[:, :, 0]
-        )
-        new_coord_y = np.polynomial.polynomial.polyval2d(
-            coord[:, 0], coord[:, 1], c[:, :, 1]
-        )
-    return np.transpose(np.stack((new_coord_x, new_coord_y)))
+
+# === Warping whole images ===
+# (coefficients, shapes): flat source index of every target pixel, the least
+# recently used first. A DMD table is 3 MB, one per laser is enough.
+WARP_MAPS_SIZE = 4
+_warp_maps = collections.OrderedDict()
+
+
+def warp_map(c, source_shape, target_shape, grid=33):
+    """
+    Lookup table of the source pixel that lands on every target pixel.
+
+    The inverse transformation is fitted, like for "Galvo2Camera", on a grid
+    by grid of source points and their transformed positions, and evaluated
+    on all target pixels once. The table is cached per transformation and
+    shapes, for the last WARP_MAPS_SIZE of them.
+
+    Parameters
+    c : np.ndarray
+        Coefficients from source to target, like a saved DMD transformation.
+    source_shape, target_shape : tuple
+        (rows, columns) of the images.
+
+    Returns
+    np.ndarray of int32 and shape target_shape, flat indices into the
+    source, source size for target pixels outside of it.
+    """
+    key = (c.tobytes(), c.shape, tuple(source_shape), tuple(target_shape))
+    if key in _warp_maps:
+        _warp_maps.move_to_end(key)
+        return _warp_maps[key]
+
+    source_points = np.stack(
+        np.meshgrid(
+            np.linspace(0, source_shape[0] - 1, grid),
+            np.linspace(0, source_shape[1] - 1, grid),
+            indexing="ij",
+        ),
+        axis=-1,
+    ).reshape(-1, 2)
+    inverse = polynomial2DFit(
+        transform(source_points, c), source_points, order=c.shape[0] - 1
+    )
+
+    target_points = np.stack(
+        np.indices(target_shape, dtype=float), axis=-1
+    ).reshape(-1, 2)
+    rows, columns = np.rint(transform(target_points, inverse)).T
+
+    inside = (
+        (rows >= 0)
+        & (rows < source_shape[0])
+        & (columns >= 0)
+        & (columns < source_shape[1])
+    )
+    # Camera frames have less than 2**31 pixels, int32 halves the table.
+    lookup = np.full(len(target_points), np.prod(source_shape), dtype=np.int32)
+    lookup[inside] = rows[inside].astype(np.int32) * source_shape[1] + columns[
+        inside
+    ].astype(np.int32)
+
+    _warp_maps[key] = lookup.reshape(target_shape)
+    while len(_warp_maps) > WARP_MAPS_SIZE:
+        _warp_maps.popitem(last=False)
+    return _warp_maps[key]
+
+
+def warp_image(image, c, target_shape, fill=0):
+    """
+    Warp an image, like a camera mask, with the transformation c into
+    target_shape, like the DMD, with one gather from the cached warp_map.
+    """
+    lookup = warp_map(c, image.shape, target_shape)
+    # The extra last element is what lands outside of the source.
+    source = np.append(np.ravel(image), np.asarray(fill, dtype=image.dtype))
+    return source[lookup]
+
+
+def clear_warp_maps():
+    """
+    Forget the cached lookup tables, after registering again.
+    """
+    _warp_maps.clear()
 
 
 # Integrated transformation
@@ -265,9 +340,20 @@ def transform_coordinates(list_of_coordinates, transform_matrix):
         List of np.array.
 
     """
-    new_list_of_coordinates = []
-    for roi in list_of_coordinates:
-        new_list_of_coordinates.append(transform(roi, transform_matrix))
+    rois = [np.asarray(roi, dtype=float) for roi in list_of_coordinates]
+    if len(rois) == 0:
+        return np.array(rois)
+
+    # All points in one transform, then split back into rois.
+    transformed = transform(
+        np.concatenate([np.reshape(roi, (-1, 2)) for roi in rois]),
+        transform_matrix,
+    )
+    splits = np.cumsum([roi.size // 2 for roi in rois])[:-1]
+    new_list_of_coordinates = [
+        np.reshape(points, roi.shape)
+        for points, roi in zip(np.split(transformed, splits), rois)
+    ]
 
     return np.array(new_list_of_coordinates)
 
@@ -320,6 +406,101 @@ def transform_between_PMT_Galvo(coordinates_list, direction, scanning_config):
     return np.array(Transformed_coordinates)
 
 
+# === Benchmark ===
+def benchmark_transformations(points=100_000, rois=1000, order=2):
+    """
+    Time fitting a camera to DMD transformation with curve_fit and with
+    polynomial2DFit, transforming dense contours of rois cells per roi and
+    in one batch, and warping a camera mask onto the DMD.
+
+    Returns
+    dict of name to seconds.
+    """
+    import time
+
+    from scipy import optimize
+
+    rng = np.random.default_rng(0)
+    camera = rng.uniform(0, 2048, (25, 2))
+    true = np.zeros((order + 1, order + 1, 2))
+    true[0, 0] = [-40, 30]
+    true[1, 0, 0], true[0, 1, 1] = 0.36, 0.38
+    true[0, 1, 0], true[1, 0, 1] = 0.02, -0.01
+    true[2, 0, 0], true[0, 2, 1] = 1e-5, -2e-5
+    dmd = transform(camera, true) + rng.normal(0, 0.1, camera.shape)
+    results = {}
+
+    # Before: curve_fit on polyval2d, from all ones.
+    def polyval(p, *kwargs):
+        c = np.reshape(np.asarray(kwargs), (order + 1, order + 1))
+        return np.polynomial.polynomial.polyval2d(p[:, 0], p[:, 1], c)
+
+    start = time.perf_counter()
+    fitted = np.stack(
+        [
+            np.reshape(
+                optimize.curve_fit(
+                    polyval, camera, dmd[:, axis], np.ones((order + 1) ** 2)
+                )[0],
+                (order + 1, order + 1),
+            )
+            for axis in (0, 1)
+        ],
+        axis=2,
+    )
+    results["fit curve_fit"] = time.perf_counter() - start
+    results["fit curve_fit error"] = np.abs(
+        transform(camera, fitted) - transform(camera, true)
+    ).max()
+
+    start = time.perf_counter()
+    c = polynomial2DFit(camera, dmd, order=order)
+    results["fit lstsq"] = time.perf_counter() - start
+    results["fit lstsq error"] = np.abs(
+        transform(camera, c) - transform(camera, true)
+    ).max()
+
+    # Dense contours of rois cells.
+    contours = np.array_split(rng.uniform(0, 2048, (points, 2)), rois)
+    # Before: polyval2d per roi.
+    start = time.perf_counter()
+    before = [
+        np.transpose(
+            np.stack(
+                [
+                    np.polynomial.polynomial.polyval2d(
+                        contour[:, 0], contour[:, 1], c[:, :, axis]
+                    )
+                    for axis in (0, 1)
+                ]
+            )
+        )
+        for contour in contours
+    ]
+    results["contours per roi"] = time.perf_counter() - start
+    start = time.perf_counter()
+    after = transform_coordinates(contours, c)
+    results["contours batched"] = time.perf_counter() - start
+    assert np.allclose(np.concatenate(before), np.concatenate(after))
+
+    mask = np.zeros((2048, 2048), dtype=np.uint8)
+    mask[500:1500, 700:900] = 1
+    clear_warp_maps()
+    start = time.perf_counter()
+    warp_image(mask, c, (768, 1024))
+    results["warp first"] = time.perf_counter() - start
+    start = time.perf_counter()
+    warped = warp_image(mask, c, (768, 1024))
+    results["warp cached"] = time.perf_counter() - start
+    row, column = np.rint(transform([1000, 800], c)).astype(int)
+    assert warped[row, column] == 1 and warped[0, 0] == 0
+
+    for name, value in results.items():
+        unit = "px" if name.endswith("error") else "s"
+        logging.info("{:>24}: {:10.4g} {}".format(name, value, unit))
+    return results
+
+
 if __name__ == "__main__":
     new_list_of_coordinates = general_coordinates_transformation(
         np.array([[251, 249], [100, 100]]),
@@ -44,6 +44,7 @@ from .. import Icons
 from ..ImageAnalysis.ImageProcessing import ProcessImage
 from ..StylishQT import SquareImageView, cleanButton, roundQGroupBox
 from . import (
+    CoordinateTransformations,
     DMDWidget,
     GalvoWidget,
     ManualRegistration,
@@ -368,6 +369,7 @@ class CoordinatesWidgetUI(QWidget):
 
     def cast_transformation_to_DMD(self, transformation, laser):
         self.DMDWidget.transform[laser] = transformation
+        CoordinateTransformations.clear_warp_maps()
         self.DMDWidget.save_transformation()
 
     def cast_transformation_to_galvos(self, transformation):
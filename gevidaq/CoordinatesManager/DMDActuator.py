@@ -8,11 +8,10 @@ Created on Mon Jul  6 09:38:26 2020
 
 import importlib.resources
 import logging
+import os
 import sys
 
-import numpy as np
-
-from .backend import ALP4
+from .backend import ALP4, dmd_sequence
 
 
 class DMDActuator:
@@ -22,8 +21,20 @@ class DMDActuator:
 
         # self.repeat specifies whether continuously projecting or not.
         self.repeat = True
+        # Upload masks at 1 bit per pixel, and masks per AlpSeqPut.
+        self.packed = True
+        self.chunk_size = 16
+
+        # Uploaded sequences by mask hash, switched to without uploading.
+        self.sequence_cache = dmd_sequence.SequenceCache(self.DMD)
 
     def initialize_DMD(self):
+        if os.environ.get("GEVIDAQ_DMD_BACKEND") == "simulated":
+            self.DMD = ALP4.ALP4(library=dmd_sequence.SimulatedALPLib())
+            self.DMD.Initialize()
+            logging.info("Simulated DMD Initialized")
+            return
+
         # Load the Vialux .dll
         traversable = importlib.resources.files(sys.modules[__package__])
         with importlib.resources.as_file(traversable) as path:
@@ -38,50 +49,49 @@ class DMDActuator:
     def disconnect_DMD(self):
         # Clear onboard memory and disconnect
         self.DMD.Free()
+        self.sequence_cache.forget()
         logging.info("DMD disconnected")
 
-    def send_data_to_DMD(self, img_seq):
+    def send_data_to_DMD(self, img_seq, key=None):
         """
         Load image or image sequence to onboard memory of DMD.
         In case of binary illumination, bit depth of image should be 1.
 
+        Masks already on the board are not uploaded again, their sequence
+        is selected instead.
+
         param mask: 2d binary numpy array or stack of 2d arrays
         type mask: Illumination mask
+        param key: str, optional, what the masks are made from, like
+            dmd_sequence.sequence_key of ROIs and transformation, by default
+            the hash of the masks
         """
+        if key is None:
+            key = dmd_sequence.mask_key(img_seq)
+        if self.select_sequence(key):
+            return
+
+        # Binary amplitude masks, bit depth 1, packed 8 pixels per byte
+        # unless self.packed is False, chunk_size masks per AlpSeqPut.
+        self.sequence_id, self.upload_report = self.sequence_cache.put(
+            key, img_seq, packed=self.packed, chunkSize=self.chunk_size
+        )
+        self.seq_length = self.upload_report["pictures"]
+        logging.info("Data loaded to DMD")
 
-        if len(img_seq.shape) == 2:
-            self.seq_length = 1
-            self.image = img_seq.ravel()
-
-        # In case it's one image with newaxis(empty axis on 3rd dimension)
-        elif img_seq.shape[2] == 1:
-            self.seq_length = 1
-            self.image = img_seq[:, :, 0].ravel()
-        elif img_seq.shape[2] > 1:
-            self.seq_length = img_seq.shape[2]
-
-            self.image = np.concatenate(
-                [img_seq[:, :, 0].ravel(), img_seq[:, :, 1].ravel()]
-            )
-            for i in range(2, self.seq_length):
-                self.image = np.hstack([self.image, img_seq[:, :, i].ravel()])
-
-        self.image = (
-            self.image > 0
-        ) * 1  # First part makes it True/False, multiplying by 1 converts it to binary
-
-        # Binary amplitude image (0 or 1)
-        bitDepth = 1
-        self.image *= 2**8 - 1
-        self.image = self.image.astype(int)
-        # Allocate the onboard memory for the image sequence
-        # nbImg defines the number of masks
-
-        self.DMD.SeqAlloc(nbImg=self.seq_length, bitDepth=bitDepth)
+    def select_sequence(self, key):
+        """
+        Select the sequence of key if it is on the board.
 
-        # Send the image sequence as a 1D list/array/numpy array
-        self.DMD.SeqPut(imgData=self.image)
-        logging.info("Data loaded to DMD")
+        Returns
+        bool, False if the masks of key have to be sent.
+        """
+        selected = self.sequence_cache.select(key)
+        if selected is None:
+            return False
+        self.sequence_id, self.seq_length = selected
+        logging.info("Mask sequence already on DMD")
+        return True
 
     def start_projection(self):
         """
@@ -144,6 +154,6 @@ class DMDActuator:
 
     def free_memory(self):
         self.DMD.Halt()
-        self.DMD.FreeSeq()
+        self.sequence_cache.clear()
 
         self.repeat = True
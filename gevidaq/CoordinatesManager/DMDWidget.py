@@ -38,6 +38,10 @@ from skimage.color import rgb2gray
 from ..ImageAnalysis.ImageProcessing import ProcessImage
 from ..StylishQT import roundQGroupBox
 from . import CoordinateTransformations, DMDActuator, Registration, Registrator
+from .backend import dmd_sequence
+
+# Rows and columns of the DMD masks.
+DMD_SHAPE = (768, 1024)
 
 
 class DMDWidget(QWidget):
@@ -55,6 +59,9 @@ class DMDWidget(QWidget):
         )
 
         self.dmd_mask = None
+        # What dmd_mask was made from, for the sequence cache of the DMD.
+        self.dmd_mask_key = None
+        self.dmd_mask_signal = None
         self.init_gui()
 
     def init_gui(self):
@@ -96,11 +103,7 @@ class DMDWidget(QWidget):
         self.load_mask_container_stack = QStackedWidget()
 
         self.connect_button.clicked.connect(self.connect)
-        self.register_button.clicked.connect(
-            lambda: self.register(
-                self.transform_for_laser_menu.selectedItems()[0].text()
-            )
-        )
+        self.register_button.clicked.connect(self.register_selected_laser)
         self.project_button.clicked.connect(self.project)
         self.clear_button.clicked.connect(self.clear)
         self.white_project_button.clicked.connect(self.project_full_white)
@@ -268,6 +271,11 @@ class DMDWidget(QWidget):
 
         self.Illumination_time_textbox.setText(str(illumination_time))
 
+    def register_selected_laser(self):
+        laser = self.selected_laser()
+        if laser is not None:
+            self.register(laser)
+
     def register(self, laser):
         self.sig_start_registration.emit()
         # Add control for lasers, signal slot should be there in AOTF widget
@@ -275,6 +283,8 @@ class DMDWidget(QWidget):
         self.transform[laser] = registrator.registration(
             registration_pattern="circle"
         )
+        # Lookup tables of the old transformation are of no use anymore.
+        CoordinateTransformations.clear_warp_maps()
         self.save_transformation()
         self.sig_finished_registration.emit()
 
@@ -312,10 +322,17 @@ class DMDWidget(QWidget):
             image = plt.imread(self.loadFileName)
             # jpg has RGB channels, clean the 3rd channel and make it 2d.
             image_gray = rgb2gray(image)
+            if not self.is_dmd_shape(image_gray):
+                # A mask in camera pixels, warp it onto the DMD.
+                laser = self.selected_laser()
+                if laser is None:
+                    return
+                image_gray = self.camera_mask_to_dmd(image_gray, laser)
 
             check, image = self.check_mask_format_valid(image_gray)
 
             if check:
+                self.set_dmd_mask(image_gray)
                 self.DMD_actuator.send_data_to_DMD(image_gray)
                 logging.info("Image loaded")
                 self.load_mask_container_stack.setCurrentIndex(0)
@@ -343,6 +360,14 @@ class DMDWidget(QWidget):
                 single_mask = plt.imread(foldername + "/" + list_dir[i])
                 # jpg has RGB channels
                 single_mask_gray = rgb2gray(single_mask)
+                if not self.is_dmd_shape(single_mask_gray):
+                    # A mask in camera pixels, warp it onto the DMD.
+                    laser = self.selected_laser()
+                    if laser is None:
+                        return
+                    single_mask_gray = self.camera_mask_to_dmd(
+                        single_mask_gray, laser
+                    )
                 check, valid_single_mask = self.check_mask_format_valid(
                     single_mask_gray
                 )
@@ -351,6 +376,7 @@ class DMDWidget(QWidget):
                 else:
                     return
 
+            self.set_dmd_mask(image_sequence)
             self.DMD_actuator.send_data_to_DMD(image_sequence)
 
             self.load_mask_container_stack.setCurrentIndex(0)
@@ -370,6 +396,19 @@ class DMDWidget(QWidget):
                 Signal sent out from CoordinateWidget which contains list of ROIs
                 and other parameters for transformation and mask generation.
         """
+        # ROIs, mask settings and transformation of every frame.
+        key = dmd_sequence.sequence_key(
+            [
+                (name, signal, self.transform[signal[4]])
+                for name, signal in sig_from_CoordinateWidget.items()
+            ]
+        )
+        self.dmd_mask_signal = sig_from_CoordinateWidget
+        if self.DMD_actuator.select_sequence(key):
+            # Already on the DMD, masks are not made again.
+            self.dmd_mask, self.dmd_mask_key = None, key
+            return
+
         for each_mask_key in sig_from_CoordinateWidget:
             logging.info(f"len {len(sig_from_CoordinateWidget)}")
             list_of_rois = sig_from_CoordinateWidget[each_mask_key][0]
@@ -406,7 +445,16 @@ class DMDWidget(QWidget):
         if self.dmd_mask is None:
             logging.warn("no dmd mask has been added")
         else:
-            self.DMD_actuator.send_data_to_DMD(self.dmd_mask)
+            self.dmd_mask_key = key
+            self.DMD_actuator.send_data_to_DMD(self.dmd_mask, key=key)
+
+    def set_dmd_mask(self, mask):
+        """
+        Set masks loaded from files, keyed by their content on the DMD.
+        """
+        self.dmd_mask = mask
+        self.dmd_mask_key = None
+        self.dmd_mask_signal = None
 
     def project_full_white(self):
         self.DMD_actuator.send_data_to_DMD(np.ones((1024, 768)))
@@ -420,17 +468,23 @@ class DMDWidget(QWidget):
         self.project_button.setText("Stop projecting")
 
     def interupt_projection(self):
+        # The sequence stays on the DMD for continue_projection.
         if self.project_button.text() == "Stop projecting":
             self.DMD_actuator.stop_projection()
-            self.DMD_actuator.free_memory()
             self.project_button.setText("Start projecting")
 
     def continue_projection(self):
         self.DMD_actuator.stop_projection()
-        self.DMD_actuator.free_memory()
 
         if self.project_button.text() == "Stop projecting":
-            self.DMD_actuator.send_data_to_DMD(self.dmd_mask)
+            if self.dmd_mask is not None:
+                self.DMD_actuator.send_data_to_DMD(
+                    self.dmd_mask, key=self.dmd_mask_key
+                )
+            elif self.dmd_mask_signal is not None:
+                if not self.DMD_actuator.select_sequence(self.dmd_mask_key):
+                    # Evicted from the DMD, make the masks again.
+                    self.receive_mask_coordinates(self.dmd_mask_signal)
             self.DMD_actuator.start_projection()
 
     def transform_coordinates(self, list_of_rois, for_which_laser):
@@ -447,6 +501,34 @@ class DMDWidget(QWidget):
 
         return new_list_of_rois
 
+    @staticmethod
+    def is_dmd_shape(mask):
+        """
+        If a 2d mask has the DMD resolution, in either orientation. Other
+        masks are taken to be in camera pixels, the warp map is made for
+        their shape.
+        """
+        return mask.ndim != 2 or mask.shape in (DMD_SHAPE, DMD_SHAPE[::-1])
+
+    def selected_laser(self):
+        """
+        Laser selected for the transformation, None if there is none.
+        """
+        selected = self.transform_for_laser_menu.selectedItems()
+        if len(selected) == 0:
+            logging.info("Select the laser of the transformation first.")
+            return None
+        return selected[0].text()
+
+    def camera_mask_to_dmd(self, camera_mask, for_which_laser):
+        """
+        Warp a mask in camera pixels onto the DMD with the transformation of
+        the laser, a single gather from the cached lookup table.
+        """
+        return CoordinateTransformations.warp_image(
+            camera_mask, self.transform[for_which_laser], DMD_SHAPE
+        )
+
     def project(self):
         if self.project_button.text() == "Start projecting":
             # Set the settings first.
@@ -531,7 +613,7 @@ class DMDWidget(QWidget):
 
     def clear(self):
         self.DMD_actuator.free_memory()
-        self.dmd_mask = None
+        self.set_dmd_mask(None)
 
     def set_transformation_saving_location(self, traversable):
         self.transformation_location = traversable
@@ -377,7 +377,18 @@ class ALP4:
     This class controls a Vialux DMD board based on the Vialux ALP 4.X API.
     """
 
-    def __init__(self, version="4.3", libDir="./"):
+    def __init__(self, version="4.3", libDir="./", library=None):
+        """
+        PARAMETERS
+        library : object, optional
+                  An already loaded ALP library, like
+                  dmd_sequence.SimulatedALPLib, used instead of the dll.
+        """
+        if library is not None:
+            self._ALPLib = library
+            self._initAttributes()
+            return
+
         os_type = platform.system()
         if libDir.endswith("/"):
             libPath = libDir
@@ -402,7 +413,9 @@ class ALP4:
         # print('Loading library: ' + libPath)
 
         self._ALPLib = ct.CDLL(libPath)
+        self._initAttributes()
 
+    def _initAttributes(self):
         # Class parameters
         # ID of the current ALP device
         self.ALP_ID = ct.c_ulong(0)
@@ -556,9 +569,11 @@ class ALP4:
 
         PARAMETERS
 
-        imgData : list, 1D array or 1D ndarray
+        imgData : list, 1D array or ndarray
                   Data stream corresponding to a sequence of nSizeX by nSizeX images.
                   Values has to be between 0 and 255.
+                  A C contiguous uint8 ndarray is passed by pointer without copy,
+                  any other is converted to one first.
         SequenceId : ctypes c_long
                      Sequence identifier. If not specified, set the last sequence allocated in the DMD board memory
         PicOffset : int, optional
@@ -585,9 +600,9 @@ class ALP4:
             SequenceId = self._lastDDRseq
 
         if dataFormat == "Python":
-            pImageData = (ct.c_ubyte * imgData.size)()
-            for ind, x in enumerate(imgData):
-                pImageData[ind] = x
+            # Keep the converted array referenced until AlpSeqPut returns.
+            imgData = np.ascontiguousarray(imgData, dtype=np.uint8)
+            pImageData = imgData.ctypes.data_as(ct.c_void_p)
         elif dataFormat == "C":
             pImageData = ct.cast(imgData, ct.c_void_p)
 
@@ -602,16 +617,48 @@ class ALP4:
             "Cannot send image sequence to device.",
         )
 
+    def SeqPutChunked(
+        self, imgData, SequenceId=None, PicOffset=0, chunkSize=16
+    ):
+        """
+        Load a sequence in parts of chunkSize pictures with SeqPut, so a long
+        sequence does not need one transfer of all of it, and the loading can
+        be interleaved with preparing the next pictures.
+
+        Usage:
+        SeqPutChunked(imgData, SequenceId = None, PicOffset = 0, chunkSize = 16)
+
+        PARAMETERS
+
+        imgData : ndarray
+                  Pictures along the first axis, like (nbImg, nSizeY, nSizeX)
+                  uint8, or (nbImg, bytes per picture) for other data formats.
+        SequenceId : ctypes c_long
+                     Sequence identifier. If not specified, set the last sequence allocated in the DMD board memory
+        PicOffset : int, optional
+                    Picture number in the sequence where imgData[0] goes.
+        chunkSize : int, optional
+                    Pictures per SeqPut.
+        """
+        imgData = np.ascontiguousarray(imgData, dtype=np.uint8)
+        nbImg = imgData.shape[0]
+        for start in range(0, nbImg, chunkSize):
+            chunk = imgData[start : start + chunkSize]
+            self.SeqPut(
+                chunk,
+                SequenceId=SequenceId,
+                PicOffset=PicOffset + start,
+                PicLoad=len(chunk),
+            )
+
     def ImgToBitPlane(self, imgArray, bitShift=0):
         """
         Create a bit plane from the imgArray.
         The bit plane is an (nSizeX x nSizeY / 8) array containing only the bit values
         corresponding to the bit number bitShift.
         For a bit depth = 8, 8 bit planes can be extracted from the imgArray bu iterating ImgToBitPlane.
-
-        WARNING: This function is slow. It is advised not to use it in a loop to convert a sequence
-        of image arrays to bit planes. Use for tests only. It is recommended to directly generate images
-        as bitplanes.
+        The bits are packed with np.packbits, bit 7 of a byte is the leftmost of 8 pixels,
+        as in the ALP_DATA_BINARY_TOPDOWN data format.
 
         Usage:
 
@@ -628,17 +675,13 @@ class ALP4:
 
         RETURNS
 
-        bitPlane: list
+        bitPlane: ndarray of uint8
                   Array (nSizeX x nSizeY)/8
 
 
         """
-        bitPlane = [0] * (self.nSizeX * self.nSizeY // 8)
-        for ind, value in enumerate(imgArray):
-            bitPlane[(ind - ind % 8) // 8] += (2 ** (7 - ind % 8)) * (
-                (int(value) >> bitShift) % 2
-            )
-        return bitPlane
+        imgArray = np.asarray(imgArray).ravel().astype(np.int64)
+        return np.packbits((imgArray >> bitShift) & 1)
 
     def SetTiming(
         self,
@@ -740,7 +783,7 @@ class ALP4:
             ),
             "Error sending request.",
         )
-        return ret.value()
+        return ret.value
 
     def SeqInquire(self, inquireType, SequenceId=None):
         """
@@ -9,9 +9,10 @@ Created on Tue Dec  4 14:12:40 2018
 import logging
 import os
 
-import numpy as np
 from DMDManager.backend import ALP4  # TODO import failure
 
+from . import dmd_sequence
+
 
 class DMD_manager:
     def __init__(self):
@@ -44,35 +45,9 @@ class DMD_manager:
 
         """
 
-        if len(img_seq.shape) == 2:
-            self.seq_length = 1
-            self.image = img_seq.ravel()
-        else:
-            self.seq_length = img_seq.shape[2]
-
-            self.image = np.concatenate(
-                [img_seq[:, :, 0].ravel(), img_seq[:, :, 1].ravel()]
-            )
-            for i in range(2, self.seq_length):
-                self.image = np.hstack([self.image, img_seq[:, :, i].ravel()])
-
-        # self.image = np.squeeze(np.reshape(img_seq, (1, -1), order='F'))
-
-        self.image = (
-            self.image > 0
-        ) * 1  # First part makes it True/False, multiplying by 1 converts it to binary
-        logging.info(self.image.shape)
-
-        # Binary amplitude image (0 or 1)
-        bitDepth = 1
-        self.image *= 2**8 - 1
-        self.image = self.image.astype(int)
-        # Allocate the onboard memory for the image sequence
-        # nbImg defines the number of masks
-        self.DMD.SeqAlloc(nbImg=self.seq_length, bitDepth=bitDepth)
-
-        # Send the image sequence as a 1D list/array/numpy array
-        self.DMD.SeqPut(imgData=self.image)
+        # Binary amplitude masks, bit depth 1, packed 8 pixels per byte.
+        SequenceId, report = dmd_sequence.upload_sequence(self.DMD, img_seq)
+        self.seq_length = report["pictures"]
 
     def startProjection(self, frame_rate=None):
         """
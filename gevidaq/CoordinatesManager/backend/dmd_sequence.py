@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+"""
+Preparing DMD mask sequences for upload.
+
+The masks of a sequence are converted once to one contiguous uint8 buffer of
+shape (pictures, rows, columns), which ALP4.SeqPut hands to AlpSeqPut by
+pointer, and long sequences go up in chunks with ALP4.SeqPutChunked.
+
+    sequence = masks_to_sequence(img_seq)
+    DMD.SeqAlloc(nbImg=len(sequence), bitDepth=1)
+    DMD.SeqPutChunked(sequence)
+
+Binary masks are better packed to one bit per pixel, 8 pixels per byte in the
+ALP_DATA_BINARY_TOPDOWN data format, which is 8 times less to transfer:
+
+    upload_sequence(DMD, img_seq, packed=True)
+
+SequenceCache keeps uploaded sequences on the board by the hash of what they
+show, so projecting a pattern again only restarts its sequence.
+
+SimulatedALPLib stands in for the ALP dll, ALP4.ALP4(library=...), to run
+and time the upload without a DMD.
+"""
+
+import collections
+import ctypes as ct
+import hashlib
+import logging
+import time
+
+import numpy as np
+
+from . import ALP4
+
+
+def masks_to_sequence(img_seq):
+    """
+    Masks as one contiguous sequence buffer, 255 where the mask is on.
+
+    Parameters
+    img_seq : np.ndarray
+        One mask (rows, columns), or a stack (rows, columns, pictures) like
+        DMDWidget makes.
+
+    Returns
+    np.ndarray of uint8 and shape (pictures, rows, columns).
+    """
+    img_seq = np.asarray(img_seq)
+    if img_seq.ndim == 2:
+        img_seq = img_seq[np.newaxis]
+    else:
+        img_seq = np.moveaxis(img_seq, 2, 0)
+    sequence = np.empty(img_seq.shape, dtype=np.uint8)
+    np.multiply(img_seq > 0, 255, out=sequence, casting="unsafe")
+    return sequence
+
+
+def pack_masks(img_seq):
+    """
+    Masks packed to bits, for the ALP_DATA_BINARY_TOPDOWN data format.
+
+    Parameters
+    img_seq : np.ndarray
+        One mask (rows, columns), or a stack (rows, columns, pictures),
+        columns a multiple of 8.
+
+    Returns
+    np.ndarray of uint8 and shape (pictures, rows, columns / 8), bit 7 of
+    every byte is the leftmost of its 8 pixels.
+    """
+    img_seq = np.asarray(img_seq)
+    if img_seq.ndim == 2:
+        img_seq = img_seq[:, :, np.newaxis]
+    if img_seq.shape[1] % 8:
+        raise ValueError(
+            "Mask width {} is not a multiple of 8".format(img_seq.shape[1])
+        )
+    # Pack along the columns first, the transpose then moves 8 times less.
+    packed = np.packbits(img_seq > 0, axis=1)
+    return np.ascontiguousarray(np.moveaxis(packed, 2, 0))
+
+
+def upload_sequence(DMD, img_seq, packed=True, chunkSize=16):
+    """
+    Allocate a binary sequence for the masks and upload them in chunks.
+
+    Parameters
+    DMD : ALP4.ALP4
+        Initialized DMD.
+    img_seq : np.ndarray
+        One mask (rows, columns), or a stack (rows, columns, pictures).
+    packed : bool
+        Upload 1 bit per pixel in the ALP_DATA_BINARY_TOPDOWN data format,
+        else 1 byte per pixel.
+    chunkSize : int
+        Pictures per AlpSeqPut.
+
+    Returns
+    (SequenceId, report), report is a dict with the pictures, the bytes
+    uploaded and saved, the upload seconds and the binary pictures that
+    still fit in the board memory.
+    """
+    start = time.perf_counter()
+    if packed:
+        sequence = pack_masks(img_seq)
+    else:
+        sequence = masks_to_sequence(img_seq)
+    nbImg = len(sequence)
+
+    SequenceId = DMD.SeqAlloc(nbImg=nbImg, bitDepth=1)
+    if packed:
+        DMD.SeqControl(
+            ALP4.ALP_DATA_FORMAT, ALP4.ALP_DATA_BINARY_TOPDOWN, SequenceId
+        )
+    DMD.SeqPutChunked(sequence, SequenceId=SequenceId, chunkSize=chunkSize)
+
+    unpacked_bytes = sequence[0].size * nbImg * (8 if packed else 1)
+    report = {
+        "pictures": nbImg,
+        "bytes": sequence.nbytes,
+        "bytes saved": unpacked_bytes - sequence.nbytes,
+        "seconds": time.perf_counter() - start,
+        "pictures free": int(DMD.DevInquire(ALP4.ALP_AVAIL_MEMORY)),
+    }
+    logging.info(
+        "Uploaded {} masks, {:.1f} MB in {:.0f} ms, {:.1f} MB saved by "
+        "packing, room for {} more binary masks".format(
+            nbImg,
+            report["bytes"] / 1e6,
+            report["seconds"] * 1000,
+            report["bytes saved"] / 1e6,
+            report["pictures free"],
+        )
+    )
+    return SequenceId, report
+
+
+# === Sequence cache ===
+def sequence_key(*parts):
+    """
+    Hash of parts, like masks, ROI coordinates, mask settings and the
+    transformation, as a hex string.
+
+    np.ndarray parts are hashed by shape, dtype and content, lists and
+    tuples item by item, anything else by repr.
+    """
+    digest = hashlib.sha1()
+
+    def update(part):
+        if isinstance(part, np.ndarray):
+            digest.update(repr((part.shape, part.dtype.str)).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (list, tuple)):
+            digest.update(
+                "{}{}".format(type(part).__name__, len(part)).encode()
+            )
+            for item in part:
+                update(item)
+        else:
+            digest.update(repr(part).encode())
+
+    update(parts)
+    return digest.hexdigest()
+
+
+def mask_key(img_seq):
+    """
+    sequence_key of the masks as they are projected, on or off per pixel.
+    """
+    img_seq = np.asarray(img_seq)
+    if img_seq.ndim == 2:
+        img_seq = img_seq[:, :, np.newaxis]
+    return sequence_key("masks", img_seq.shape, np.packbits(img_seq > 0))
+
+
+class SequenceCache:
+    """
+    Sequences on the DMD board by key, least recently used evicted first.
+
+    Parameters
+    DMD : ALP4.ALP4
+        Initialized DMD.
+    max_pictures : int, optional
+        Binary pictures the cache may hold, else as many as fit in the
+        board memory.
+    """
+
+    def __init__(self, DMD, max_pictures=None):
+        self.DMD = DMD
+        self.max_pictures = max_pictures
+        # key: (SequenceId, pictures), least recently used first.
+        self.sequences = collections.OrderedDict()
+        self.current = None
+
+    def __contains__(self, key):
+        return key in self.sequences
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def pictures(self):
+        return sum(pictures for _, pictures in self.sequences.values())
+
+    def select(self, key):
+        """
+        Make the sequence of key the one ALP4 runs and sets by default.
+
+        Returns
+        (SequenceId, pictures), or None if key is not on the board.
+        """
+        if key not in self.sequences:
+            return None
+        self.sequences.move_to_end(key)
+        SequenceId, pictures = self.sequences[key]
+        # Run, SetTiming, SeqControl and SeqInquire act on the last one.
+        self.DMD._lastDDRseq = SequenceId
+        self.current = key
+        return SequenceId, pictures
+
+    def put(self, key, img_seq, packed=True, chunkSize=16):
+        """
+        Upload the masks as the sequence of key, evicting least recently
+        used sequences until they fit, and select it.
+
+        Returns
+        (SequenceId, report), see upload_sequence.
+        """
+        nbImg = 1 if np.ndim(img_seq) == 2 else np.shape(img_seq)[2]
+        if key in self.sequences:
+            self.discard(key)
+        self.make_room(nbImg)
+
+        SequenceId, report = upload_sequence(
+            self.DMD, img_seq, packed=packed, chunkSize=chunkSize
+        )
+        self.sequences[key] = (SequenceId, nbImg)
+        self.select(key)
+        return SequenceId, report
+
+    def make_room(self, nbImg):
+        """
+        Evict until nbImg binary pictures fit, the selected sequence last.
+        """
+        while self.sequences and not self._fits(nbImg):
+            keys = [key for key in self.sequences if key != self.current]
+            if not keys:
+                # Only the projected one left, stop it before freeing.
+                self.DMD.Halt()
+                keys = [self.current]
+            logging.info("Evicting DMD sequence {}".format(keys[0][:8]))
+            self.discard(keys[0])
+
+    def _fits(self, nbImg):
+        if (
+            self.max_pictures is not None
+            and self.pictures() + nbImg > self.max_pictures
+        ):
+            return False
+        return self.DMD.DevInquire(ALP4.ALP_AVAIL_MEMORY) >= nbImg
+
+    def discard(self, key):
+        """
+        Free the sequence of key on the board.
+        """
+        SequenceId, _ = self.sequences.pop(key)
+        self.DMD.FreeSeq(SequenceId)
+        if key == self.current:
+            self.current = None
+            self.DMD._lastDDRseq = None
+
+    def clear(self):
+        """
+        Free all cached sequences.
+        """
+        for key in list(self.sequences):
+            self.discard(key)
+
+    def forget(self):
+        """
+        Drop all entries without freeing, after the DMD itself was freed.
+        """
+        self.sequences.clear()
+        self.current = None
+
+
+# === Simulated ALP library ===
+# Return codes of the dll, ALP4 only has their messages.
+ALP_PARM_INVALID = 1005
+ALP_MEMORY_FULL = 1007
+ALP_SEQ_IN_USE = 1008
+
+
+def _value(argument):
+    return getattr(argument, "value", argument)
+
+
+def _target(pointer):
+    """
+    The ctypes object behind ct.byref(...).
+    """
+    return pointer._obj
+
+
+class SimulatedALPLib:
+    """
+    The AlpXxx functions of the ALP dll used by ALP4, on host memory.
+
+    Parameters
+    size : tuple
+        (nSizeX, nSizeY) of the DMD, the default is the 1024 x 768 XGA.
+    memory : int
+        Board memory in binary pictures, the default is 4 GB.
+    bandwidth : float, optional
+        Bytes per second of the USB link, AlpSeqPut sleeps accordingly.
+    """
+
+    def __init__(self, size=(1024, 768), memory=43690, bandwidth=None):
+        self.size = size
+        self.memory = memory
+        self.bandwidth = bandwidth
+        self.sequences = {}
+        self.running = None
+        self.calls = []
+        self._next_id = 1
+
+    # === Device ===
+    def AlpDevAlloc(self, DeviceNum, InitFlag, DeviceIdPtr):
+        _target(DeviceIdPtr).value = 1
+        return ALP4.ALP_OK
+
+    def AlpDevInquire(self, DeviceId, InquireType, UserVarPtr):
+        values = {
+            ALP4.ALP_DEV_DMDTYPE: ALP4.ALP_DMDTYPE_XGA,
+            ALP4.ALP_AVAIL_MEMORY: self.available_memory(),
+        }
+        if _value(InquireType) not in values:
+            return ALP_PARM_INVALID
+        _target(UserVarPtr).value = values[_value(InquireType)]
+        return ALP4.ALP_OK
+
+    def AlpDevControl(self, DeviceId, ControlType, ControlValue):
+        return ALP4.ALP_OK
+
+    def AlpDevHalt(self, DeviceId):
+        self.running = None
+        return ALP4.ALP_OK
+
+    def AlpDevFree(self, DeviceId):
+        self.sequences.clear()
+        self.running = None
+        return ALP4.ALP_OK
+
+    def available_memory(self):
+        used = sum(
+            sequence["bitDepth"] * sequence["nbImg"]
+            for sequence in self.sequences.values()
+        )
+        return self.memory - used
+
+    # === Sequences ===
+    def picture_bytes(self, sequence):
+        if sequence["controls"].get(ALP4.ALP_DATA_FORMAT) in (
+            ALP4.ALP_DATA_BINARY_TOPDOWN,
+            ALP4.ALP_DATA_BINARY_BOTTOMUP,
+        ):
+            return self.size[0] * self.size[1] // 8
+        return self.size[0] * self.size[1]
+
+    def AlpSeqAlloc(self, DeviceId, BitPlanes, PicNum, SequenceIdPtr):
+        bitDepth, nbImg = _value(BitPlanes), _value(PicNum)
+        if not 1 <= bitDepth <= 8 or nbImg < 1:
+            return ALP_PARM_INVALID
+        if bitDepth * nbImg > self.available_memory():
+            return ALP_MEMORY_FULL
+        sequence_id = self._next_id
+        self._next_id += 1
+        sequence = {
+            "bitDepth": bitDepth,
+            "nbImg": nbImg,
+            "timing": None,
+            "controls": {},
+        }
+        sequence["data"] = np.zeros(
+            (nbImg, self.picture_bytes(sequence)), dtype=np.uint8
+        )
+        self.sequences[sequence_id] = sequence
+        _target(SequenceIdPtr).value = sequence_id
+        return ALP4.ALP_OK
+
+    def AlpSeqControl(self, DeviceId, SequenceId, ControlType, ControlValue):
+        sequence = self.sequences.get(_value(SequenceId))
+        if sequence is None:
+            return ALP_PARM_INVALID
+        sequence["controls"][_value(ControlType)] = _value(ControlValue)
+        if _value(ControlType) == ALP4.ALP_DATA_FORMAT:
+            sequence["data"] = np.zeros(
+                (sequence["nbImg"], self.picture_bytes(sequence)),
+                dtype=np.uint8,
+            )
+        return ALP4.ALP_OK
+
+    def AlpSeqTiming(self, DeviceId, SequenceId, *timing):
+        sequence = self.sequences.get(_value(SequenceId))
+        if sequence is None:
+            return ALP_PARM_INVALID
+        sequence["timing"] = [_value(t) for t in timing]
+        return ALP4.ALP_OK
+
+    def AlpSeqInquire(self, DeviceId, SequenceId, InquireType, UserVarPtr):
+        sequence = self.sequences.get(_value(SequenceId))
+        if sequence is None:
+            return ALP_PARM_INVALID
+        values = {
+            ALP4.ALP_PICNUM: sequence["nbImg"],
+            ALP4.ALP_BITNUM: sequence["bitDepth"],
+        }
+        _target(UserVarPtr).value = values.get(_value(InquireType), 0)
+        return ALP4.ALP_OK
+
+    def AlpSeqPut(
+        self, DeviceId, SequenceId, PicOffset, PicLoad, UserArrayPtr
+    ):
+        sequence = self.sequences.get(_value(SequenceId))
+        if sequence is None:
+            return ALP_PARM_INVALID
+        if _value(SequenceId) == self.running:
+            return ALP_SEQ_IN_USE
+        offset, load = _value(PicOffset), _value(PicLoad)
+        if load == 0:
+            load = sequence["nbImg"] - offset
+        if offset < 0 or offset + load > sequence["nbImg"]:
+            return ALP_PARM_INVALID
+
+        target = sequence["data"][offset : offset + load]
+        ct.memmove(target.ctypes.data, UserArrayPtr, target.nbytes)
+        if self.bandwidth is not None:
+            time.sleep(target.nbytes / self.bandwidth)
+        self.calls.append(("AlpSeqPut", _value(SequenceId), offset, load))
+        return ALP4.ALP_OK
+
+    def AlpSeqFree(self, DeviceId, SequenceId):
+        if _value(SequenceId) == self.running:
+            return ALP_SEQ_IN_USE
+        if self.sequences.pop(_value(SequenceId), None) is None:
+            return ALP_PARM_INVALID
+        return ALP4.ALP_OK
+
+    # === Projection ===
+    def AlpProjStart(self, DeviceId, SequenceId):
+        if _value(SequenceId) not in self.sequences:
+            return ALP_PARM_INVALID
+        self.running = _value(SequenceId)
+        self.calls.append(("AlpProjStart", self.running))
+        return ALP4.ALP_OK
+
+    def AlpProjStartCont(self, DeviceId, SequenceId):
+        return self.AlpProjStart(DeviceId, SequenceId)
+
+    def AlpProjWait(self, DeviceId):
+        return ALP4.ALP_OK
+
+    def AlpProjControl(self, DeviceId, ControlType, ControlValue):
+        return ALP4.ALP_OK
+
+    def AlpProjInquire(self, DeviceId, SequenceId, InquireType, UserVarPtr):
+        return ALP4.ALP_OK
+
+    def projected(self):
+        """
+        The pictures of the running sequence, (pictures, bytes per picture).
+        """
+        if self.running is None:
+            return None
+        return self.sequences[self.running]["data"]
+
+
+def simulated_DMD(**kwargs):
+    """
+    An initialized ALP4.ALP4 on a SimulatedALPLib made with kwargs.
+    """
+    DMD = ALP4.ALP4(library=SimulatedALPLib(**kwargs))
+    DMD.Initialize()
+    return DMD
+
+
+# === Benchmark ===
+def benchmark_dmd_upload(nbImg=100, legacy_frames=3, chunkSize=16):
+    """
+    Time the upload of nbImg random masks to a simulated DMD, the way
+    DMDActuator.send_data_to_DMD did it before (np.hstack per frame, int
+    array, per pixel copy in SeqPut) against masks_to_sequence and
+    SeqPut by pointer.
+
+    The old way is timed on legacy_frames frames and given per frame, it
+    takes minutes for 100.
+
+    Returns
+    dict of name to seconds per frame.
+    """
+    rng = np.random.default_rng(0)
+    img_seq = rng.random((768, 1024, nbImg)) > 0.5
+    results = {}
+
+    # Before: hstack per frame, int array, per element copy.
+    DMD = simulated_DMD()
+    legacy = img_seq[:, :, :legacy_frames]
+    start = time.perf_counter()
+    image = np.concatenate([legacy[:, :, 0].ravel(), legacy[:, :, 1].ravel()])
+    for i in range(2, legacy_frames):
+        image = np.hstack([image, legacy[:, :, i].ravel()])
+    image = ((image > 0) * 1 * (2**8 - 1)).astype(int)
+    DMD.SeqAlloc(nbImg=legacy_frames, bitDepth=1)
+    pImageData = (ct.c_ubyte * image.size)()
+    for ind, x in enumerate(image):
+        pImageData[ind] = x
+    DMD._ALPLib.AlpSeqPut(
+        DMD.ALP_ID,
+        DMD._lastDDRseq,
+        ct.c_long(0),
+        ct.c_long(0),
+        pImageData,
+    )
+    results["per element"] = (time.perf_counter() - start) / legacy_frames
+    expected = DMD._ALPLib.sequences[DMD._lastDDRseq.value]["data"].copy()
+
+    # Now: one conversion, upload by pointer, whole or in chunks.
+    for name, put in (
+        ("by pointer", lambda sequence: DMD.SeqPut(sequence)),
+        (
+            "by pointer, chunks of {}".format(chunkSize),
+            lambda sequence: DMD.SeqPutChunked(sequence, chunkSize=chunkSize),
+        ),
+    ):
+        DMD = simulated_DMD()
+        start = time.perf_counter()
+        sequence = masks_to_sequence(img_seq)
+        DMD.SeqAlloc(nbImg=nbImg, bitDepth=1)
+        put(sequence)
+        results[name] = (time.perf_counter() - start) / nbImg
+        uploaded = DMD._ALPLib.sequences[DMD._lastDDRseq.value]["data"]
+        assert np.array_equal(uploaded[:legacy_frames], expected)
+
+    for name, seconds in results.items():
+        logging.info(
+            "{:>26}: {:9.2f} ms per frame, {:8.2f} s for {} frames".format(
+                name, seconds * 1000, seconds * nbImg, nbImg
+            )
+        )
+    return results
+
+
+def benchmark_packed_upload(nbImg=1000, bandwidth=40e6, chunkSize=64):
+    """
+    Time the upload of nbImg random masks at 8 and at 1 bit per pixel, to a
+    simulated DMD on a link of bandwidth bytes per second, and the bit
+    packing against the per pixel ALP4.ImgToBitPlane.
+
+    Returns
+    dict of name to upload report, see upload_sequence.
+    """
+    rng = np.random.default_rng(0)
+    # Random bits, unpacked, without a float array of all the masks.
+    img_seq = np.unpackbits(
+        rng.integers(0, 256, (768, 128, nbImg), dtype=np.uint8), axis=1
+    ).view(bool)
+    results = {}
+
+    DMD = simulated_DMD(bandwidth=bandwidth)
+    start = time.perf_counter()
+    bitPlane = DMD.ImgToBitPlane(img_seq[:, :, 0] * 255)
+    logging.info(
+        "ImgToBitPlane of one mask: {:.1f} ms".format(
+            (time.perf_counter() - start) * 1000
+        )
+    )
+    start = time.perf_counter()
+    sequence = pack_masks(img_seq)
+    logging.info(
+        "pack_masks of {} masks: {:.1f} ms".format(
+            nbImg, (time.perf_counter() - start) * 1000
+        )
+    )
+    assert np.array_equal(sequence[0].ravel(), bitPlane)
+
+    for name, packed in (("8 bit", False), ("packed", True)):
+        DMD = simulated_DMD(bandwidth=bandwidth)
+        SequenceId, results[name] = upload_sequence(
+            DMD, img_seq, packed=packed, chunkSize=chunkSize
+        )
+        uploaded = DMD._ALPLib.sequences[SequenceId.value]["data"]
+        if packed:
+            uploaded = np.unpackbits(uploaded, axis=1) * 255
+        assert np.array_equal(
+            uploaded[-1].reshape(768, 1024) > 0, img_seq[:, :, -1]
+        )
+
+    for name, report in results.items():
+        logging.info(
+            "{:>7}: {} masks, {:7.1f} MB in {:6.2f} s".format(
+                name,
+                report["pictures"],
+                report["bytes"] / 1e6,
+                report["seconds"],
+            )
+        )
+    return results
+
+
+def benchmark_sequence_cache(
+    patterns=4, frames=20, projections=40, bandwidth=40e6
+):
+    """
+    Time projecting patterns of frames masks in turn, projections times,
+    re-uploading every time against selecting from a SequenceCache, then
+    check the eviction on a board with room for fewer patterns.
+
+    Returns
+    dict of name to seconds.
+    """
+    rng = np.random.default_rng(0)
+    masks = [
+        np.unpackbits(
+            rng.integers(0, 256, (768, 128, frames), dtype=np.uint8), axis=1
+        ).view(bool)
+        for _ in range(patterns)
+    ]
+    order = rng.integers(0, patterns, projections)
+    results = {}
+
+    DMD = simulated_DMD(bandwidth=bandwidth)
+    start = time.perf_counter()
+    for index in order:
+        DMD.Halt()
+        if DMD.Seqs:
+            DMD.FreeSeq()
+        upload_sequence(DMD, masks[index])
+        DMD.Run()
+    results["upload every time"] = time.perf_counter() - start
+
+    DMD = simulated_DMD(bandwidth=bandwidth)
+    cache = SequenceCache(DMD)
+    start = time.perf_counter()
+    for index in order:
+        DMD.Halt()
+        key = mask_key(masks[index])
+        if cache.select(key) is None:
+            cache.put(key, masks[index])
+        DMD.Run()
+    results["cached"] = time.perf_counter() - start
+    # One sequence per pattern projected, the random order can miss some.
+    assert len(cache) == len(set(order))
+
+    # Room for two patterns, the least recently used goes.
+    DMD = simulated_DMD(memory=2 * frames + frames // 2)
+    cache = SequenceCache(DMD)
+    keys = [mask_key(mask) for mask in masks[:3]]
+    cache.put(keys[0], masks[0])
+    cache.put(keys[1], masks[1])
+    cache.select(keys[0])
+    cache.put(keys[2], masks[2])
+    assert keys[1] not in cache and keys[0] in cache and keys[2] in cache
+
+    for name, seconds in results.items():
+        logging.info(
+            "{:>18}: {:6.2f} s for {} projections of {} patterns".format(
+                name, seconds, projections, patterns
+            )
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # The DCAM driver failed to load and logged while importing.
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+    benchmark_dmd_upload()
+    benchmark_packed_upload()
+    benchmark_sequence_cache()
@@ -13,6 +13,37 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 
+def transform_points(r, A, order):
+    """
+    Transform points with the regression vector A of polynomialRegression.
+
+    Parameters
+    r : np.ndarray
+        One point [x, y] or points of shape (n, 2).
+    A : np.ndarray
+        [t_x, t_y, x coefficients of x, y, x**2, y**2, ..., y coefficients].
+    order : int
+        Order of the polynomial.
+
+    Returns
+    np.ndarray of the shape of r.
+    """
+    r = np.asarray(r, dtype=float)
+    points = np.reshape(r, (-1, 2))
+    A = np.ravel(A)
+    # Columns x, y, x**2, y**2, ..., the order of the coefficients in A.
+    powers = np.hstack([points**i for i in range(1, order + 1)])
+    half = 2 * order
+    transformed = np.stack(
+        (
+            A[0] + powers @ A[2 : 2 + half],
+            A[1] + powers @ A[2 + half :],
+        ),
+        axis=1,
+    )
+    return np.reshape(transformed, r.shape)
+
+
 class polynomialRegression:
     def addPoints(self, q, p):
         """
@@ -36,31 +67,10 @@ class polynomialRegression:
 
         q = np.array([[1,1], [1, 2], [1,3]])
 
+        All points are transformed at once, see transform_points.
         """
 
-        if r.ndim == 1:
-            Q = self._createTransformationMatrix(r)
-
-            if Q is None:
-                return
-
-            return np.squeeze(
-                np.reshape(np.dot(Q, self.A), (-1, 2), order="F")
-            )
-
-        else:
-            num_points = r.shape[0]
-
-        transformed_points = np.zeros([num_points, 2])
-
-        for i in range(num_points):
-            Q = self._createTransformationMatrix(r[i, :])
-
-            if Q is None:
-                return
-
-            transformed_points[i, :] = np.squeeze(np.dot(Q, self.A))
-        return np.reshape(transformed_points, (-1, 2), order="F")
+        return transform_points(r, self.A, self.order)
 
     def _createTransformationMatrix(self, q):
         if len(q.shape) == 1:
@@ -135,26 +145,24 @@ class polynomialRegression:
 
         self.P = np.reshape(self.p, (-1, 1), order="F")
 
-        # Standard regression formula
-        try:
-            self.A = np.dot(
-                np.dot(
-                    np.linalg.inv(np.dot(self.Q.transpose(), self.Q)),
-                    self.Q.transpose(),
-                ),
-                self.P,
-            )
-        except np.linalg.LinAlgError:
+        # Least squares by SVD, not inv(Q.T Q), which squares the condition
+        # number of Q, with the columns scaled as x**N is far larger than 1.
+        norms = np.linalg.norm(self.Q, axis=0)
+        norms[norms == 0] = 1
+        self.A, _, rank, _ = np.linalg.lstsq(
+            self.Q / norms, self.P, rcond=None
+        )
+        self.A /= norms[:, np.newaxis]
+        if rank < self.Q.shape[1]:
             logging.info(
                 "Matrix is singular. Try different set of input points. "
                 + "Points should not be colinear"
             )
-            return
+            return None, None
 
         self.t = self.A[0:2]
         logging.info("Translation vector =")
         logging.info(np.around(self.t, 5))
-        logging.info()
 
         # Because of the order in the A vector, the a_n, b_n, c_n and d_n are not
         # in consequetive order in A. Therefore, a moveaxis() is performed.
@@ -171,7 +179,6 @@ class polynomialRegression:
         for i in range(self.order):
             logging.info(f"{i + 1} 'th order transformation matrix =")
             logging.info(np.around(self.T[i, :, :], 5))
-            logging.info()
 
         self.flag_transformation_found = True
         return self.T, self.t
@@ -9,14 +9,12 @@ import logging
 import os
 import time
 
-import nidaqmx
 import numpy as np
 import tifffile as skimtiff
 from nidaqmx.constants import AcquisitionType
-from nidaqmx.stream_readers import AnalogSingleChannelReader
-from nidaqmx.stream_writers import AnalogMultiChannelWriter
 
 from ..NIDAQ import wavegenerator
+from ..NIDAQ.daq_backend import get_backend
 from ..PI_ObjectiveMotor.focuser import PIMotor
 
 
@@ -60,8 +58,10 @@ class RasterScan:
         self.flag_continuous = continuous
         self.flag_return_image = return_image
 
-        # Generate galvo samples
-        self.samples_X, self.samples_Y = wavegenerator.waveRecPic(
+        # Galvo samples of all frames to average, x in row 0 and y in row 1.
+        # They are cached, so scanning again with the same settings, like
+        # during autofocus, costs nothing to set up.
+        self.Galvo_samples = wavegenerator.cached_raster_scan_samples(
             sampleRate=self.Daq_sample_rate,
             imAngle=0,
             voltXMin=-1 * self.edge_volt,
@@ -71,29 +71,27 @@ class RasterScan:
             xPixels=self.pixel_number,
             yPixels=self.pixel_number,
             sawtooth=True,
+            repeats=self.averagenum,
         )
         # Calculate number of all samples to feed to daq.
-        self.Totalscansamples = len(self.samples_X) * self.averagenum
+        self.Totalscansamples = self.Galvo_samples.shape[1]
+        self.samples_X, self.samples_Y = self.Galvo_samples[
+            :, : self.Totalscansamples // self.averagenum
+        ]
         # Number of samples of each individual line of x scanning, including fly backs.
         # Devided by pixel number as it's repeated for each y line.
         self.total_X_sample_number = int(
             len(self.samples_X) / self.pixel_number
         )
 
-        self.repeated_samples_X = np.tile(self.samples_X, self.averagenum)
-        self.repeated_samples_Y = np.tile(self.samples_Y, self.averagenum)
-
-        self.Galvo_samples = np.vstack(
-            (self.repeated_samples_X, self.repeated_samples_Y)
-        )
-
     def run(self):
         """
         Starts writing a waveform continuously while reading
         the buffer periodically
         """
 
-        with nidaqmx.Task() as slave_Task, nidaqmx.Task() as master_Task:
+        daq = get_backend()
+        with daq.Task() as slave_Task, daq.Task() as master_Task:
             slave_Task.ao_channels.add_ao_voltage_chan("/Dev1/ao0:1")
             master_Task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
 
@@ -127,8 +125,12 @@ class RasterScan:
                     samps_per_chan=self.Totalscansamples,
                 )
 
-            reader = AnalogSingleChannelReader(master_Task.in_stream)
-            writer = AnalogMultiChannelWriter(slave_Task.out_stream)
+            reader = daq.stream_readers.AnalogSingleChannelReader(
+                master_Task.in_stream
+            )
+            writer = daq.stream_writers.AnalogMultiChannelWriter(
+                slave_Task.out_stream
+            )
 
             reader.auto_start = False
             writer.auto_start = False
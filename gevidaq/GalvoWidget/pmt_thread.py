@@ -11,11 +11,10 @@ import logging
 
 import nidaqmx
 import numpy as np
-from nidaqmx.stream_readers import AnalogSingleChannelReader
-from nidaqmx.stream_writers import AnalogMultiChannelWriter
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from ..NIDAQ import wavegenerator
+from ..NIDAQ.daq_backend import get_backend
 
 # For continuous raster scanning
 
@@ -59,7 +58,8 @@ class pmtimaging_continuous_Thread(QThread):
         """
 
         # DAQ
-        with nidaqmx.Task() as slave_Task3, nidaqmx.Task() as master_Task:
+        daq = get_backend()
+        with daq.Task() as slave_Task3, daq.Task() as master_Task:
             # slave_Task3 = nidaqmx.Task()
             slave_Task3.ao_channels.add_ao_voltage_chan("/Dev1/ao0:1")
             master_Task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
@@ -77,8 +77,12 @@ class pmtimaging_continuous_Thread(QThread):
                 samps_per_chan=self.readNumber,
             )
 
-            reader = AnalogSingleChannelReader(master_Task.in_stream)
-            writer = AnalogMultiChannelWriter(slave_Task3.out_stream)
+            reader = daq.stream_readers.AnalogSingleChannelReader(
+                master_Task.in_stream
+            )
+            writer = daq.stream_writers.AnalogMultiChannelWriter(
+                slave_Task3.out_stream
+            )
 
             reader.auto_start = False
             writer.auto_start = False
@@ -143,8 +147,8 @@ class pmtimagingTest:
         self.Galvo_samples_offset = 0
         self.offsetsamples_galvo = []
 
-        # Generate galvo samples
-        self.samples_1, self.samples_2 = wavegenerator.waveRecPic(
+        # Generate galvo samples, repeated for the frames to average.
+        self.Galvo_samples = wavegenerator.cached_raster_scan_samples(
             sampleRate=self.Daq_sample_rate,
             imAngle=0,
             voltXMin=Value_voltXMin,
@@ -154,25 +158,16 @@ class pmtimagingTest:
             xPixels=Value_xPixels,
             yPixels=Value_yPixels,
             sawtooth=True,
+            repeats=self.averagenum,
         )
-        # ScanArrayX = wavegenerator.xValuesSingleSawtooth(sampleRate = Daq_sample_rate, voltXMin = Value_voltXMin, voltXMax = Value_voltXMax, xPixels = Value_xPixels, sawtooth = True)
-        self.Totalscansamples = (
-            len(self.samples_1) * self.averagenum
-        )  # Calculate number of samples to feed to scanner, by default it's one frame
+        # Calculate number of samples to feed to scanner, by default it's one frame
+        self.Totalscansamples = self.Galvo_samples.shape[1]
+        self.samples_1, self.samples_2 = self.Galvo_samples[
+            :, : self.Totalscansamples // self.averagenum
+        ]
         self.ScanArrayXnum = int(
             len(self.samples_1) / Value_yPixels
         )  # number of samples of each individual line of x scanning
-        # print(self.ScanArrayXnum)
-        # print(self.Digital_container_feeder[:, 0])
-
-        self.repeated_samples_1 = np.tile(self.samples_1, self.averagenum)
-        self.repeated_samples_2_yaxis = np.tile(
-            self.samples_2, self.averagenum
-        )
-
-        self.Galvo_samples = np.vstack(
-            (self.repeated_samples_1, self.repeated_samples_2_yaxis)
-        )
 
         self.pmtimagingThread = pmtimaging_continuous_Thread(
             self.Galvo_samples,
@@ -244,7 +239,8 @@ class pmtimaging_continuous_Thread_contour(QThread):
         """
 
         # DAQ
-        with nidaqmx.Task() as slave_Task3, nidaqmx.Task() as master_Task:
+        daq = get_backend()
+        with daq.Task() as slave_Task3, daq.Task() as master_Task:
             # slave_Task3 = nidaqmx.Task()
             slave_Task3.ao_channels.add_ao_voltage_chan("/Dev1/ao0:1")
             master_Task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
@@ -262,8 +258,12 @@ class pmtimaging_continuous_Thread_contour(QThread):
                 samps_per_chan=self.readNumber,
             )
 
-            reader = AnalogSingleChannelReader(master_Task.in_stream)
-            writer = AnalogMultiChannelWriter(slave_Task3.out_stream)
+            reader = daq.stream_readers.AnalogSingleChannelReader(
+                master_Task.in_stream
+            )
+            writer = daq.stream_writers.AnalogMultiChannelWriter(
+                slave_Task3.out_stream
+            )
 
             reader.auto_start = False
             writer.auto_start = False
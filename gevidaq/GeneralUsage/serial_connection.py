@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent serial connections, one per device.
+
+Opening a USB serial port takes tens to hundreds of ms, and some controllers
+reset when it is opened. So instead of opening the port for every command,
+get_connection(address) gives the one SerialConnection of that port. It keeps
+the port open and sends the commands of all users in order from its own I/O
+thread, so a status query from a watchdog thread can no longer run into a move
+command from the GUI.
+
+    connection = get_connection("COM6", baudrate=9600)
+    reply = connection.query("Where X Y\\r")        # waits for the reply
+    connection.write("Move X = 0 Y = 0\\r")         # waits until written
+    future = connection.submit("*STB?\\r", reply="line")
+    ...
+    status = future.result()
+
+Replies are read until a terminator ("line"), as a number of bytes (int), or
+not at all (None). With pipeline_depth > 1 the I/O thread writes several
+queued commands before reading their replies in order, for devices that
+buffer commands.
+
+On a serial error or a missing reply the port is closed and opened again, and
+the command is sent again up to retries times before its future gets the
+exception. Any other error, like a reply that can't be handled, goes to the
+futures of the batch right away. query() and write() wait at most
+result_timeout seconds for their command. Every command is timed,
+statistics() gives the latency per command.
+
+With the environment variable GEVIDAQ_SERIAL_BACKEND set to "simulated",
+get_connection opens ports to the simulated devices of simulated_serial
+instead.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+import serial
+
+
+class SerialCommand:
+    """
+    A command waiting in the queue of a SerialConnection.
+    """
+
+    def __init__(self, payload, reply, terminator, timeout, name):
+        self.payload = payload
+        self.reply = reply
+        self.terminator = terminator
+        self.timeout = timeout
+        self.name = name
+        self.future = Future()
+        self.queued = time.perf_counter()
+        self.written = False
+
+
+class SerialConnection:
+    """
+    One open serial port and the I/O thread that owns it.
+
+    Parameters
+    address : str
+        Port like "COM6", or a pyserial URL like "loop://".
+    baudrate : int
+        Baud rate.
+    timeout : float
+        Default seconds to wait for a reply.
+    retries : int
+        Number of times a command is sent again after a serial error.
+    reconnect_delay : float
+        Seconds between closing the port after an error and opening it again.
+    pipeline_depth : int
+        Number of queued commands written before reading their replies.
+    result_timeout : float
+        Seconds query() and write() wait for their command to be done,
+        including the time it waits in the queue.
+    port_factory : callable, optional
+        Opens the port, called like serial.serial_for_url, which is the
+        default.
+    serial_kwargs
+        Passed on to the port, like stopbits.
+    """
+
+    def __init__(
+        self,
+        address,
+        baudrate=9600,
+        timeout=1.0,
+        retries=2,
+        reconnect_delay=0.2,
+        pipeline_depth=1,
+        result_timeout=30.0,
+        port_factory=None,
+        **serial_kwargs,
+    ):
+        self.address = address
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.reconnect_delay = reconnect_delay
+        self.pipeline_depth = pipeline_depth
+        self.result_timeout = result_timeout
+        self.port_factory = port_factory or serial.serial_for_url
+        self.serial_kwargs = serial_kwargs
+
+        self.closed = False
+        self.reconnects = 0
+        # (command name, seconds in the queue, seconds of I/O)
+        self.latencies = []
+        self._port = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="serial {}".format(address), daemon=True
+        )
+        self._thread.start()
+
+    # === Commands ===
+    def submit(
+        self, command, reply=None, terminator=b"\n", timeout=None, name=None
+    ):
+        """
+        Queue a command.
+
+        Parameters
+        command : str or bytes
+            Command including its end of line, str is encoded as ascii.
+        reply : None, "line" or int
+            No reply, a reply up to and including terminator, or a reply of
+            that many bytes.
+        terminator : bytes
+            End of a "line" reply.
+        timeout : float, optional
+            Seconds to wait for the reply, default the timeout of the
+            connection.
+        name : str, optional
+            Name in the latency statistics, default the first word of the
+            command.
+
+        Returns
+        concurrent.futures.Future with the reply bytes, None without reply.
+        """
+        if self.closed:
+            raise serial.SerialException(
+                "Connection to {} is closed".format(self.address)
+            )
+        if isinstance(command, str):
+            command = command.encode("ascii", errors="replace")
+        if name is None:
+            words = command.split()
+            name = words[0].decode("ascii", errors="replace") if words else ""
+        item = SerialCommand(
+            command,
+            reply,
+            terminator,
+            self.timeout if timeout is None else timeout,
+            name,
+        )
+        self._queue.put(item)
+        return item.future
+
+    def query(self, command, reply="line", terminator=b"\n", timeout=None):
+        """
+        Send command and wait for its reply.
+
+        Returns
+        The reply bytes.
+
+        Raises
+        The exception of the command, or TimeoutError if it is not done
+        within result_timeout seconds.
+        """
+        future = self.submit(command, reply, terminator, timeout)
+        return future.result(self.result_timeout)
+
+    def write(self, command):
+        """
+        Send a command without reply and wait until it is written.
+        """
+        self.submit(command).result(self.result_timeout)
+
+    def close(self):
+        """
+        Finish the queued commands and close the port.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    # === I/O thread ===
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.pipeline_depth:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._execute(batch)
+
+        self._close_port()
+
+    def _open_port(self):
+        if self._port is None:
+            self._port = self.port_factory(
+                self.address,
+                baudrate=self.baudrate,
+                timeout=self.timeout,
+                **self.serial_kwargs,
+            )
+
+    def _close_port(self):
+        if self._port is not None:
+            try:
+                self._port.close()
+            except Exception as exc:
+                logging.critical("caught exception", exc_info=exc)
+            self._port = None
+
+    def _read_reply(self, item):
+        self._port.timeout = item.timeout
+        if item.reply == "line":
+            reply = self._port.read_until(item.terminator)
+            complete = reply.endswith(item.terminator)
+        else:
+            reply = self._port.read(item.reply)
+            complete = len(reply) == item.reply
+        if not complete:
+            raise serial.SerialTimeoutException(
+                "No complete reply to {} from {}, got {}".format(
+                    item.payload, self.address, reply
+                )
+            )
+        return reply
+
+    def _execute(self, batch):
+        for attempt in range(self.retries + 1):
+            pending = [item for item in batch if not item.future.done()]
+            if len(pending) == 0:
+                return
+            try:
+                self._open_port()
+                # Replies nobody asked for, like the ":A" after a Ludl move,
+                # would otherwise be read as the reply to this batch.
+                if self._port.in_waiting > 0:
+                    self._port.reset_input_buffer()
+                started = time.perf_counter()
+                for item in pending:
+                    if item.reply is not None or not item.written:
+                        self._port.write(item.payload)
+                        item.written = True
+                self._port.flush()
+                for item in pending:
+                    reply = None
+                    if item.reply is not None:
+                        reply = self._read_reply(item)
+                    finished = time.perf_counter()
+                    self.latencies.append(
+                        (item.name, started - item.queued, finished - started)
+                    )
+                    item.future.set_result(reply)
+                return
+            except (serial.SerialException, OSError) as exc:
+                logging.critical("caught exception", exc_info=exc)
+                logging.info(
+                    "Serial error on {}, reconnecting, attempt {}".format(
+                        self.address, attempt + 1
+                    )
+                )
+                self._close_port()
+                self.reconnects += 1
+                time.sleep(self.reconnect_delay)
+                error = exc
+            except Exception as exc:
+                # Not a connection problem, sending again would not help.
+                logging.critical("caught exception", exc_info=exc)
+                error = exc
+                break
+
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    # === Statistics ===
+    def statistics(self):
+        """
+        Latency per command name, in ms.
+
+        Returns
+        pd.DataFrame with "count" and the mean, median, 95th percentile and
+        maximum of "latency" (queue and I/O) and of "io".
+        """
+        table = pd.DataFrame(
+            self.latencies, columns=["command", "queue", "io"]
+        )
+        table["latency"] = table["queue"] + table["io"]
+        grouped = table.groupby("command")
+        statistics = pd.DataFrame({"count": grouped.size()})
+        for column in ("latency", "io"):
+            seconds = grouped[column]
+            statistics[column + " mean"] = seconds.mean() * 1000
+            statistics[column + " median"] = seconds.median() * 1000
+            statistics[column + " p95"] = seconds.quantile(0.95) * 1000
+            statistics[column + " max"] = seconds.max() * 1000
+        return statistics
+
+
+# === Connections of all devices ===
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(address, device=None, **kwargs):
+    """
+    The open connection to address, made with kwargs if there is none yet.
+
+    The port itself is opened by the first command.
+
+    Parameters
+    device : str, optional
+        Kind of device, like "ludl", for the simulated backend. See
+        simulated_serial.DEVICE_TYPES.
+    """
+    with _connections_lock:
+        connection = _connections.get(address)
+        if connection is None or connection.closed:
+            if (
+                os.environ.get("GEVIDAQ_SERIAL_BACKEND") == "simulated"
+                and kwargs.get("port_factory") is None
+            ):
+                from .simulated_serial import simulated_port_factory
+
+                kwargs["port_factory"] = simulated_port_factory(device)
+            connection = SerialConnection(address, **kwargs)
+            _connections[address] = connection
+        return connection
+
+
+def close_all():
+    """
+    Close the connections to all devices.
+    """
+    with _connections_lock:
+        connections = list(_connections.values())
+        _connections.clear()
+    for connection in connections:
+        connection.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    # Loopback port, every command comes back as its reply.
+    commands = ["Where X Y\n"] * 200 + ["Status\n"] * 200
+    for depth in (1, 8):
+        connection = SerialConnection("loop://", pipeline_depth=depth)
+        start = time.perf_counter()
+        futures = [connection.submit(c, reply="line") for c in commands]
+        replies = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        assert replies == [c.encode() for c in commands]
+        connection.close()
+        logging.info(
+            "pipeline_depth {}: {} queries in {:.3f} s\n{}".format(
+                depth,
+                len(commands),
+                elapsed,
+                connection.statistics().round(3).to_string(),
+            )
+        )
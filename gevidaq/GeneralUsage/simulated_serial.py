@@ -0,0 +1,757 @@
+# -*- coding: utf-8 -*-
+"""
+Software stand-ins for the serial instruments.
+
+Each simulated device answers the ASCII command set of the real one:
+
+    SimulatedLudlStage : MAC5000 stage controller, "Where X Y", "Move X = ..",
+        "Movrel", "Status", ... Replies ":A ..." and moves at a set speed.
+    SimulatedInsightX3 : InSight X3 laser, "*STB?", "READ:PCTWarmedup?",
+        "WAVelength", "ON", "SHUTter 1", ... with warm-up and turn-on times.
+    SimulatedELL9Filter : ELL9K filter slider, "0ma", "0fw", "0bw", "0gp",
+        commands without end of line, replies "0PO" and the position in hex.
+    SimulatedPatchStar : Scientifica PatchStar, "P", "ABS", "REL", "S", ...
+    SimulatedPressureController : "P", "PH", "S", ... and a continuous stream
+        of "PS <sensor 1> <sensor 2>" readings.
+
+Every device has a response latency, motion speed and settle time, and error
+injection: a command can get no reply (error_rate), a garbled reply
+(garble_rate) or make the port fail like an unplugged USB cable
+(disconnect_rate).
+
+A device is reached through a SimulatedSerialPort, an in-process object with
+the methods of serial.Serial that the code uses, or on Linux through a pty
+with PtySerialDevice, which gives a real port name for code that opens
+serial.Serial itself, like PressureController.
+
+Setting the environment variable GEVIDAQ_SERIAL_BACKEND to "simulated" makes
+get_connection open simulated ports, so LudlStage, InsightX3, ELL9Filter and
+ScientificaPatchStar run unchanged. The device at an address is made on first
+use, or can be set beforehand with add_device to change its settings.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import serial
+
+
+class SimulatedDevice:
+    """
+    Base of the simulated instruments.
+
+    Parameters
+    response_latency : float
+        Seconds from the end of a command to its reply.
+    error_rate : float
+        Chance that a command gets no reply.
+    garble_rate : float
+        Chance that a reply comes back with a wrong byte.
+    disconnect_rate : float
+        Chance that a write fails with a SerialException.
+    seed : int, optional
+        Seed of the error injection.
+    """
+
+    # End of a command, None for devices that have none.
+    command_terminator = b"\r"
+
+    def __init__(
+        self,
+        response_latency=0.005,
+        error_rate=0.0,
+        garble_rate=0.0,
+        disconnect_rate=0.0,
+        seed=None,
+    ):
+        self.response_latency = response_latency
+        self.error_rate = error_rate
+        self.garble_rate = garble_rate
+        self.disconnect_rate = disconnect_rate
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.commands = []
+
+    def split_commands(self, buffer):
+        """
+        Complete commands at the start of buffer.
+
+        Returns
+        (list of commands as str, rest of buffer)
+        """
+        *commands, rest = buffer.split(self.command_terminator)
+        return [c.decode("ascii", errors="replace") for c in commands], rest
+
+    def respond(self, command):
+        """
+        Reply to a command, with the error injection.
+
+        Returns
+        Reply bytes, or None.
+        """
+        with self.lock:
+            self.commands.append(command)
+            reply = self.handle(command.strip())
+        if reply is None:
+            return None
+        if isinstance(reply, str):
+            reply = reply.encode("ascii")
+        if self.rng.random() < self.error_rate:
+            logging.info("Simulated reply to {} lost.".format(command))
+            return None
+        if len(reply) > 0 and self.rng.random() < self.garble_rate:
+            reply = bytearray(reply)
+            reply[self.rng.integers(len(reply))] = ord("?")
+            reply = bytes(reply)
+        return reply
+
+    def handle(self, command):
+        raise NotImplementedError
+
+    def stream(self, since, now):
+        """
+        Output the device sends by itself between since and now.
+        """
+        return b""
+
+
+class LinearMotion:
+    """
+    Axes moving at a constant speed to a target, then settling.
+    """
+
+    def __init__(self, position, speed, settle_time):
+        self.start = np.array(position, dtype="float64")
+        self.target = self.start.copy()
+        self.speed = speed
+        self.settle_time = settle_time
+        self.start_time = time.perf_counter()
+        self.end_time = self.start_time
+
+    def position(self, now=None):
+        now = time.perf_counter() if now is None else now
+        distance = self.target - self.start
+        duration = np.abs(distance).max() / self.speed
+        fraction = 1.0 if duration == 0 else (now - self.start_time) / duration
+        return self.start + distance * min(max(fraction, 0.0), 1.0)
+
+    def move_to(self, target):
+        now = time.perf_counter()
+        self.start = self.position(now)
+        self.target = np.array(target, dtype="float64")
+        self.start_time = now
+        self.end_time = (
+            now
+            + np.abs(self.target - self.start).max() / self.speed
+            + self.settle_time
+        )
+
+    def moving(self):
+        return time.perf_counter() < self.end_time
+
+    def stop(self):
+        now = time.perf_counter()
+        self.start = self.target = self.position(now)
+        self.start_time = self.end_time = now
+
+
+# === Devices ===
+class SimulatedLudlStage(SimulatedDevice):
+    """
+    Ludl MAC5000, speed in stage indices per second.
+    """
+
+    def __init__(self, speed=15000, settle_time=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.motion = LinearMotion((0, 0), speed, settle_time)
+        self.joystick = True
+
+    def handle(self, command):
+        words = command.replace("=", " ").split()
+        if len(words) == 0:
+            return ":N -1\n"
+        verb = words[0].lower()
+        axes = dict(zip(words[1::2], words[2::2]))
+
+        if verb == "where":
+            x, y = np.round(self.motion.position()).astype(int)
+            return ":A {} {}\n".format(x, y)
+        elif verb == "status":
+            # One character, no end of line.
+            return "B" if self.motion.moving() else "N"
+        elif verb in ("move", "vmove", "movrel"):
+            current = self.motion.target if verb != "movrel" else None
+            position = self.motion.position()
+            target = list(position if current is None else current)
+            for index, axis in enumerate(("X", "Y")):
+                if axis in axes:
+                    value = float(axes[axis])
+                    if verb == "movrel":
+                        target[index] = position[index] + value
+                    else:
+                        target[index] = value
+            self.motion.move_to(target)
+            return ":A\n"
+        elif verb == "home":
+            self.motion.move_to((-100000, -100000))
+            return ":A\n"
+        elif verb == "here":
+            self.motion.stop()
+            self.motion.start = self.motion.target = np.zeros(2)
+            return ":A\n"
+        elif verb == "joystick":
+            self.joystick = "+" in command
+            return ":A\n"
+        elif verb == "remres":
+            self.motion.stop()
+            return None
+        return ":N -1\n"
+
+
+class SimulatedInsightX3(SimulatedDevice):
+    """
+    InSight X3 laser.
+
+    Parameters
+    warmup_time : float
+        Seconds from power up to READ:PCTWarmedup? 100.
+    turn_on_time : float
+        Seconds from ON to the RUN state.
+    tuning_speed : float
+        nm per second of a wavelength change.
+    """
+
+    def __init__(
+        self, warmup_time=2.0, turn_on_time=1.0, tuning_speed=200, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.warmup_time = warmup_time
+        self.turn_on_time = turn_on_time
+        self.power_up = time.perf_counter()
+        self.turned_on = None
+        self.shutter = False
+        self.mode = "RUN"
+        self.watchdog = 0
+        self.wavelength = LinearMotion((800,), tuning_speed, 0)
+
+    def warmed_up(self):
+        elapsed = time.perf_counter() - self.power_up
+        return min(int(100 * elapsed / self.warmup_time), 100)
+
+    def state(self):
+        if self.warmed_up() < 100:
+            return 20
+        if self.turned_on is None:
+            return 25
+        if time.perf_counter() - self.turned_on < self.turn_on_time:
+            return 40
+        return 60 if self.mode == "ALIGN" else 50
+
+    def status_byte(self):
+        state = self.state()
+        status = state << 16
+        if state >= 50:
+            # Emission and pulsing.
+            status |= 0b11
+        if self.shutter:
+            status |= 1 << 2
+        # Fixed beam shutter, always open on this laser.
+        status |= 1 << 3
+        if self.turned_on is not None:
+            status |= 1 << 5
+        return status
+
+    def handle(self, command):
+        words = command.split()
+        if len(words) == 0:
+            return None
+        verb = words[0].upper()
+
+        if verb == "*IDN?":
+            return "Spectra-Physics,InSight X3,00000,1.0\n"
+        elif verb == "*STB?":
+            return "{}\n".format(self.status_byte())
+        elif verb == "READ:PCTWARMEDUP?":
+            return "{:03d}\n".format(self.warmed_up())
+        elif verb == "READ:POWER?":
+            power = 1.5 if self.state() == 50 else 0.0
+            return "{:.3f}\n".format(power)
+        elif verb == "WAVELENGTH?":
+            return "{}\n".format(int(self.wavelength.target[0]))
+        elif verb == "WAVELENGTH" and len(words) > 1:
+            wavelength = float(words[1])
+            if 680 <= wavelength <= 1300:
+                self.wavelength.move_to((wavelength,))
+        elif verb == "TIMER:WATCHDOG" and len(words) > 1:
+            self.watchdog = float(words[1])
+        elif verb == "MODE" and len(words) > 1:
+            self.mode = words[1].upper()
+        elif verb == "ON":
+            # Ignored while warming up.
+            if self.warmed_up() == 100 and self.turned_on is None:
+                self.turned_on = time.perf_counter()
+        elif verb == "OFF":
+            self.turned_on = None
+            self.shutter = False
+        elif verb == "SHUTTER" and len(words) > 1:
+            self.shutter = words[1] == "1"
+        elif verb == "SAVE":
+            return "SAVE\n"
+        return None
+
+
+class SimulatedELL9Filter(SimulatedDevice):
+    """
+    ELL9K four position filter slider on address 0.
+
+    Parameters
+    move_time : float
+        Seconds per position moved.
+    """
+
+    command_terminator = None
+    POSITIONS = (0x00, 0x1F, 0x3E, 0x5D)
+
+    def __init__(self, move_time=0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.motion = LinearMotion((0,), 0x1F / move_time, 0)
+
+    def split_commands(self, buffer):
+        # The commands have no end of line, their length follows from the
+        # command name.
+        lengths = {b"ho": 4, b"fw": 3, b"bw": 3, b"gp": 3, b"ma": 11}
+        commands = []
+        while len(buffer) >= 3:
+            length = lengths.get(buffer[1:3])
+            if length is None:
+                # Out of sync, drop a byte.
+                buffer = buffer[1:]
+                continue
+            if len(buffer) < length:
+                break
+            commands.append(buffer[:length].decode("ascii", errors="replace"))
+            buffer = buffer[length:]
+        return commands, buffer
+
+    def position_reply(self):
+        return "0PO{:08X}\r\n".format(int(self.motion.target[0]))
+
+    def handle(self, command):
+        name = command[1:3]
+        target = int(self.motion.target[0])
+        if name == "ho":
+            self.motion.move_to((0,))
+        elif name == "fw":
+            self.motion.move_to((min(target + 0x1F, self.POSITIONS[-1]),))
+        elif name == "bw":
+            self.motion.move_to((max(target - 0x1F, 0),))
+        elif name == "ma":
+            self.motion.move_to((int(command[3:11], 16),))
+        elif name != "gp":
+            return "0GS0A\r\n"
+        return self.position_reply()
+
+
+class SimulatedPatchStar(SimulatedDevice):
+    """
+    Scientifica PatchStar, speed in PatchStar units (10 nm) per second.
+    """
+
+    def __init__(self, speed=100000, settle_time=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.motion = LinearMotion((0, 0, 0), speed, settle_time)
+
+    def handle(self, command):
+        words = command.split()
+        if len(words) == 0:
+            return "E\r"
+        verb = words[0].upper()
+
+        if verb in ("P", "POS"):
+            x, y, z = np.round(self.motion.position()).astype(int)
+            return "{}\t{}\t{}\r".format(x, y, z)
+        elif verb == "S":
+            return "1\r" if self.motion.moving() else "0\r"
+        elif verb == "ZERO":
+            if self.motion.moving():
+                return "E\r"
+            self.motion.start = self.motion.target = np.zeros(3)
+            return "A\r"
+        elif verb in ("ABS", "REL") and len(words) == 4:
+            values = np.array([float(w) for w in words[1:]])
+            if verb == "REL":
+                values = values + self.motion.position()
+            self.motion.move_to(values)
+            return "A\r"
+        elif verb == "STOP":
+            self.motion.stop()
+            return "A\r"
+        return "E\r"
+
+
+class SimulatedPressureController(SimulatedDevice):
+    """
+    Pressure controller that streams "PS <sensor 1> <sensor 2>" lines.
+
+    Parameters
+    stream_interval : float
+        Seconds between two readings.
+    time_constant : float
+        Seconds for the pressure to follow the set point.
+    """
+
+    command_terminator = b"\n"
+
+    def __init__(self, stream_interval=0.02, time_constant=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.stream_interval = stream_interval
+        self.time_constant = time_constant
+        self.setpoint = 0.0
+        self.pressure = 0.0
+        self.pulse = 0.0
+        self.idle = False
+        self.last_update = time.perf_counter()
+
+    def handle(self, command):
+        words = command.split()
+        if len(words) == 0:
+            return None
+        verb = words[0].upper()
+        if verb in ("P", "PH") and len(words) > 1:
+            self.setpoint = float(words[1])
+        elif verb == "S" and len(words) > 1:
+            self.pulse = float(words[1])
+        elif verb == "IDLE":
+            self.idle = True
+        elif verb == "W8KE":
+            self.idle = False
+        return None
+
+    def stream(self, since, now):
+        if self.idle:
+            return b""
+        lines = []
+        first = np.ceil(since / self.stream_interval) * self.stream_interval
+        with self.lock:
+            for moment in np.arange(first, now, self.stream_interval):
+                step = moment - self.last_update
+                self.last_update = moment
+                target = self.setpoint + self.pulse
+                self.pulse = 0.0
+                self.pressure += (target - self.pressure) * (
+                    1 - np.exp(-step / self.time_constant)
+                )
+                lines.append("PS {:.1f} {:.1f}\n".format(self.pressure, 0.0))
+        return "".join(lines).encode("ascii")
+
+
+# === Ports ===
+class SimulatedSerialPort:
+    """
+    In-process port to a simulated device, with the methods of
+    serial.Serial that the device classes use.
+    """
+
+    def __init__(self, device, timeout=None, **kwargs):
+        self.device = device
+        self.timeout = timeout
+        self.is_open = True
+        self._input = b""
+        # (time the bytes are there, bytes)
+        self._pending = []
+        self._command_buffer = b""
+        self._streamed_until = time.perf_counter()
+        self._lock = threading.Lock()
+
+    # Context manager like serial.Serial.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.is_open = False
+
+    def _check_open(self):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+    def write(self, data):
+        self._check_open()
+        if self.device.rng.random() < self.device.disconnect_rate:
+            self.is_open = False
+            raise serial.SerialException("Simulated device disconnected")
+        now = time.perf_counter()
+        with self._lock:
+            self._command_buffer += bytes(data)
+            commands, self._command_buffer = self.device.split_commands(
+                self._command_buffer
+            )
+            for command in commands:
+                reply = self.device.respond(command)
+                if reply is not None:
+                    self._pending.append(
+                        (now + self.device.response_latency, reply)
+                    )
+        return len(data)
+
+    def flush(self):
+        self._check_open()
+
+    def _collect(self):
+        now = time.perf_counter()
+        with self._lock:
+            streamed = self.device.stream(self._streamed_until, now)
+            self._streamed_until = now
+            ready = [reply for when, reply in self._pending if when <= now]
+            self._pending = [
+                (when, reply) for when, reply in self._pending if when > now
+            ]
+            self._input += streamed + b"".join(ready)
+
+    @property
+    def in_waiting(self):
+        self._check_open()
+        self._collect()
+        return len(self._input)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        self._collect()
+        self._input = b""
+
+    def _read(self, enough):
+        """
+        Wait until enough(input) gives the number of bytes to return, or
+        until the timeout.
+        """
+        self._check_open()
+        deadline = (
+            None
+            if self.timeout is None
+            else (time.perf_counter() + self.timeout)
+        )
+        while True:
+            self._collect()
+            size = enough(self._input)
+            if size is not None:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                size = len(self._input)
+                break
+            time.sleep(0.0005)
+        data, self._input = self._input[:size], self._input[size:]
+        return data
+
+    def read(self, size=1):
+        return self._read(lambda data: size if len(data) >= size else None)
+
+    def read_until(self, expected=b"\n", size=None):
+        def enough(data):
+            index = data.find(expected)
+            if index >= 0:
+                return index + len(expected)
+            if size is not None and len(data) >= size:
+                return size
+            return None
+
+        return self._read(enough)
+
+    def readline(self):
+        return self.read_until(b"\n")
+
+
+class PtySerialDevice:
+    """
+    Serve a simulated device on a pty, Linux only.
+
+    port is the name of the other end, to open with serial.Serial(port).
+    """
+
+    def __init__(self, device):
+        import tty
+
+        self.device = device
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._pending = []
+        self._thread = threading.Thread(
+            target=self._serve, name="pty " + self.port, daemon=True
+        )
+        self._thread.start()
+
+    def _serve(self):
+        import select
+
+        buffer = b""
+        streamed_until = time.perf_counter()
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.001)
+            if readable:
+                buffer += os.read(self._master, 4096)
+                commands, buffer = self.device.split_commands(buffer)
+                now = time.perf_counter()
+                for command in commands:
+                    reply = self.device.respond(command)
+                    if reply is not None:
+                        self._pending.append(
+                            (now + self.device.response_latency, reply)
+                        )
+            now = time.perf_counter()
+            output = self.device.stream(streamed_until, now)
+            streamed_until = now
+            output += b"".join(r for when, r in self._pending if when <= now)
+            self._pending = [(w, r) for w, r in self._pending if w > now]
+            if output:
+                os.write(self._master, output)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+# === Simulated backend of get_connection ===
+DEVICE_TYPES = {
+    "ludl": SimulatedLudlStage,
+    "insight": SimulatedInsightX3,
+    "ell9": SimulatedELL9Filter,
+    "patchstar": SimulatedPatchStar,
+    "pressure": SimulatedPressureController,
+}
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+
+def add_device(address, device):
+    """
+    Put a simulated device at address.
+    """
+    with _devices_lock:
+        _devices[address] = device
+    return device
+
+
+def get_device(address, device_type=None):
+    """
+    The simulated device at address, a new one of device_type if there is
+    none.
+    """
+    with _devices_lock:
+        device = _devices.get(address)
+        if device is None:
+            if device_type not in DEVICE_TYPES:
+                raise serial.SerialException(
+                    "No simulated device at {}".format(address)
+                )
+            device = DEVICE_TYPES[device_type]()
+            _devices[address] = device
+        return device
+
+
+def simulated_port_factory(device_type=None):
+    """
+    Port factory for SerialConnection that opens simulated ports.
+    """
+
+    def open_port(address, timeout=None, **kwargs):
+        return SimulatedSerialPort(
+            get_device(address, device_type), timeout=timeout
+        )
+
+    return open_port
+
+
+if __name__ == "__main__":
+    # Before the imports, some of them log when the vendor dlls are missing.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from ..InsightX3.TwoPhotonLaser_backend import InsightX3
+    from ..PatchClamp.micromanipulator import ScientificaPatchStar
+    from ..PatchClamp.pressurecontroller import PressureController
+    from ..SampleStageControl.stage import LudlStage
+    from ..ThorlabsFilterSlider.filterpyserial import ELL9Filter
+    from .serial_connection import SerialConnection, close_all
+
+    os.environ["GEVIDAQ_SERIAL_BACKEND"] = "simulated"
+
+    # Stage: moves and the verify-after-move loop of the screening.
+    stage = LudlStage("COM12")
+    start = time.perf_counter()
+    for row in range(0, 5 * 1568, 1568):
+        stage.moveAbs(row, 0)
+        assert stage.waitForPos(row, 0, poll_interval=0.01)
+    logging.info(
+        "Stage: 5 coordinates in {:.2f} s".format(time.perf_counter() - start)
+    )
+    logging.info(stage.connection.statistics().round(2).to_string())
+
+    # Laser start up.
+    add_device("COM11", SimulatedInsightX3(warmup_time=0.5, turn_on_time=0.3))
+    laser = InsightX3("COM11")
+    while int(laser.QueryWarmupTime()) != 100:
+        time.sleep(0.1)
+    laser.SetWavelength(1280)
+    laser.Turn_On_PumpLaser()
+    while "Laser state:RUN" not in laser.QueryStatus():
+        time.sleep(0.1)
+    laser.Open_TunableBeamShutter()
+    assert "Tunable beam shutter open" in laser.QueryStatus()
+
+    # Filter slider.
+    slider = ELL9Filter("COM9")
+    slider.moveToPosition(2)
+    assert slider.getPosition() == 2
+
+    # Micromanipulator, wait_until_finished polls every 0.1 s.
+    patchstar = ScientificaPatchStar("COM16", 9600)
+    start = time.perf_counter()
+    patchstar.moveRel(dx=50)
+    logging.info(
+        "PatchStar: 50 um move took {:.2f} s, the move itself {:.2f} s".format(
+            time.perf_counter() - start, 5000 / 100000 + 0.05
+        )
+    )
+    assert abs(patchstar.getPos()[0] - 50) < 0.01
+
+    # Pressure controller opens the port itself, so it gets a pty.
+    if hasattr(os, "openpty"):
+        pty = PtySerialDevice(SimulatedPressureController())
+        controller = PressureController(pty.port, 9600)
+        controller.setPres(100)
+        time.sleep(0.5)
+        logging.info("Pressure: {}".format(controller.readFlush().strip()))
+        controller.close()
+        pty.close()
+
+    # Error injection: a device that drops replies and off the bus now and
+    # then, the connection reconnects and sends the command again.
+    device = SimulatedPatchStar(error_rate=0.02, disconnect_rate=0.02, seed=1)
+    add_device("COM17", device)
+    connection = SerialConnection(
+        "COM17",
+        timeout=0.05,
+        retries=3,
+        reconnect_delay=0.01,
+        port_factory=simulated_port_factory(),
+    )
+    for i in range(200):
+        connection.query("P\r", terminator=b"\r")
+    logging.info(
+        "Unreliable PatchStar: 200 queries, {} reconnects\n{}".format(
+            connection.reconnects, connection.statistics().round(2).to_string()
+        )
+    )
+    connection.close()
+
+    close_all()
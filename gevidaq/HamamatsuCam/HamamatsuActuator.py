@@ -6,9 +6,7 @@ Created on Wed May 27 17:14:53 2020
 @author: xinmeng
 """
 import ctypes
-import importlib.resources
 import logging
-import sys
 import threading
 import time
 
@@ -16,6 +14,7 @@ import numpy as np
 import tifffile as skimtiff
 
 from . import HamamatsuDCAM
+from .stream_writer import FrameStreamWriter
 
 # Script based Hamamatsu camera operations
 
@@ -53,10 +52,7 @@ class CamActuator:
     def initializeCamera(self):
         # Initialize the camera
         # Set default camera properties.
-        files = importlib.resources.files(sys.modules[__package__])
-        traversable = files.joinpath("19_12/dcamapi.dll")
-        with importlib.resources.as_file(traversable) as path:
-            self.dcam = ctypes.WinDLL(str(path))
+        self.dcam = HamamatsuDCAM.dcam
 
         paraminit = HamamatsuDCAM.DCAMAPI_INIT(0, 0, 0, 0, None, None)
         paraminit.size = ctypes.sizeof(paraminit)
@@ -215,10 +211,12 @@ class CamActuator:
         # Stop the acquisition
         self.hcam.stopAcquisition()
 
-    def StartStreaming(self, BufferNumber, **kwargs):
+    def StartStreaming(self, BufferNumber, saving_dir=None, **kwargs):
         # Start the camera video streaming.
         # - trigger_source: specify the camera trigger mode.
         # - BufferNumber: number of frames assigned for video.
+        # - saving_dir: if given, frames are written to this file while
+        # streaming instead of being kept in memory until StopStreaming.
         # - **kwargs can be set as camera property name and desired value pairs,
         # like: trigger_active = "SYNCREADOUT"
 
@@ -236,6 +234,14 @@ class CamActuator:
         self.hcam.startAcquisition()
         self.isStreaming = True
 
+        self.stream_writer = None
+        if saving_dir is not None:
+            self.stream_writer = FrameStreamWriter(
+                saving_dir,
+                (self.hcam.frame_y, self.hcam.frame_x),
+                metadata=self.metaData,
+            ).start()
+
         self.getFrames_Thread = threading.Thread(
             target=self.pullFrames, args=(BufferNumber,)
         )
@@ -252,28 +258,40 @@ class CamActuator:
             ] = (
                 self.hcam.getFrames()
             )  # frames is a list with HCamData type, with np_array being the image.
-            for aframe in frames:
-                self.video_list.append(aframe.np_array)
-                self.imageCount += 1
+            if self.stream_writer is not None:
+                self.stream_writer.putFrames(frames)
+                self.imageCount += len(frames)
+            else:
+                for aframe in frames:
+                    self.video_list.append(aframe.np_array)
+                    self.imageCount += 1
 
             if self.imageCount >= BufferNumber:
                 self.isStreaming = False
 
     def StopStreaming(self, saving_dir=None):
         # Stop the streaming and save the file.
-        # - saving_dir: directory in which the video is saved.
+        # - saving_dir: directory in which the video is saved. Ignored if
+        # the frames are already written while streaming.
         self.isStreaming = False
+        self.getFrames_Thread.join()
         # Stop the acquisition
         self.hcam.stopAcquisition()
 
-        if saving_dir is not None:
+        if self.stream_writer is not None:
+            self.isSaving = True
+            self.stream_status = self.stream_writer.close()
+            self.stream_status["camera_max_backlog"] = self.hcam.max_backlog
+            self.stream_status["camera_overruns"] = self.hcam.buffer_overruns
+            self.stream_writer = None
+
+        elif saving_dir is not None:
             self.isSaving = True
             # Save the file.
             with skimtiff.TiffWriter(saving_dir, append=True) as tif:
                 for eachframe in range(self.imageCount):
-                    image = np.resize(
-                        self.video_list[eachframe],
-                        (self.dims[1], self.dims[0]),
+                    image = self.video_list[eachframe].reshape(
+                        (self.dims[1], self.dims[0])
                     )
                     tif.save(image, compress=0, description=self.metaData)
         self.isSaving = False
@@ -289,15 +307,18 @@ if __name__ == "__main__":
     cam = CamActuator()
     cam.initializeCamera()
 
+    tif_name = r"M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\test.tif"  # TODO hardcoded path
     cam.StartStreaming(
-        BufferNumber=10, trigger_source="INTERNAL", exposure_time=0.0015
+        BufferNumber=10,
+        saving_dir=tif_name,
+        trigger_source="INTERNAL",
+        exposure_time=0.0015,
     )
     logging.info("main thread continues")
     # Make sure that the camera is prepared before waveform execution.
     time.sleep(3.5)
     cam.isSaving = True
-    tif_name = r"M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\test.tif"  # TODO hardcoded path
-    cam.StopStreaming(saving_dir=tif_name)
+    cam.StopStreaming()
     # Make sure that the saving process is finished.
     while cam.isSaving is True:
         logging.info("Camera saving...")
@@ -19,6 +19,7 @@ import ctypes
 import ctypes.util
 import importlib.resources
 import logging
+import os
 import sys
 import time
 
@@ -74,12 +75,36 @@ DCAMBUF_ATTACHKIND_FRAME = 0
 DCAMBUF_ATTACHKIND_TIMESTAMP = 1
 DCAMBUF_ATTACHKIND_FRAMESTAMP = 2
 
-# Specify dcam-api location
-try:
+
+def load_dcamapi():
+    """
+    Load dcamapi.dll, or the software camera from simulated_dcam if the
+    environment variable GEVIDAQ_CAMERA_BACKEND is "simulated".
+    """
+    if os.environ.get("GEVIDAQ_CAMERA_BACKEND") == "simulated":
+        from .simulated_dcam import SimulatedDCAMAPI
+
+        return SimulatedDCAMAPI()
+
+    # Specify dcam-api location
     files = importlib.resources.files(sys.modules[__package__])
     traversable = files.joinpath("19_12/dcamapi.dll")
     with importlib.resources.as_file(traversable) as path:
-        dcam = ctypes.WinDLL(str(path))
+        return ctypes.WinDLL(str(path))
+
+
+def use_dcamapi(api):
+    """
+    Replace the dcam-api used by all cameras, e.g. by a SimulatedDCAMAPI with
+    custom settings.
+    """
+    global dcam
+    dcam = api
+    return dcam
+
+
+try:
+    dcam = load_dcamapi()
 except Exception as exc:
     logging.critical("could not load dll", exc_info=exc)
 
@@ -363,6 +388,7 @@ class HamamatsuCamera(object):
         self.last_frame_number = 0
         self.properties = None
         self.max_backlog = 0
+        self.buffer_overruns = 0
         self.number_image_buffers = 0
 
         self.acquisition_mode = "run_till_abort"
@@ -406,6 +432,8 @@ class HamamatsuCamera(object):
         """
         self.buffer_index = -1
         self.last_frame_number = 0
+        self.max_backlog = 0
+        self.buffer_overruns = 0
 
         # Set sub array mode.
         self.setSubArrayMode()
@@ -769,6 +797,7 @@ class HamamatsuCamera(object):
             logging.info(
                 ">> Warning! hamamatsu camera frame buffer overrun detected!"
             )
+            self.buffer_overruns += 1
         if backlog > self.max_backlog:
             self.max_backlog = backlog  # Update the number of frames accumulated in the buffer.
         self.last_frame_number = cur_frame_number
@@ -928,10 +957,11 @@ class HamamatsuCamera(object):
         # Stop acquisition.
         self.checkStatus(dcam.dcamcap_stop(self.camera_handle), "dcamcap_stop")
 
+        # The backlog counters are reset by captureSetup, so that they can
+        # still be read after the acquisition stopped.
         logging.info(
-            f"max camera backlog was {self.max_backlog} of {self.number_image_buffers}"
+            f"max camera backlog was {self.max_backlog} of {self.number_image_buffers}, {self.buffer_overruns} overruns"
         )
-        self.max_backlog = 0
 
         # Free image buffers.
         self.number_image_buffers = 0
@@ -1138,8 +1168,9 @@ class HamamatsuCameraMR(HamamatsuCamera):
                 "dcambuf_release",
             )
 
-        logging.info(f"max camera backlog was: {self.max_backlog}")
-        self.max_backlog = 0
+        logging.info(
+            f"max camera backlog was: {self.max_backlog}, {self.buffer_overruns} overruns"
+        )
 
 
 class HamamatsuCameraRE(HamamatsuCamera):
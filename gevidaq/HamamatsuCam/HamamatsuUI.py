@@ -7,7 +7,6 @@ Created on Tue Apr 14 18:47:31 2020
 
 import ctypes
 import ctypes.util
-import importlib.resources
 import logging
 import os
 import sys
@@ -43,6 +42,7 @@ from skimage.measure import block_reduce
 
 from .. import Icons, StylishQT
 from ..HamamatsuCam import HamamatsuDCAM
+from .stream_writer import FrameStreamWriter
 
 """
 Some general settings for pyqtgraph, these only have to do with appearance
@@ -66,6 +66,8 @@ class CameraUI(QMainWindow):
 
         self.isLiving = False
         self.isStreaming = False
+        # Write the streamed frames to disk.
+        self.StreamSaveFile = True
         self.Live_item_autolevel = True
         self.ShowROIImgSwitch = False
         self.ROIselector_ispresented = False
@@ -851,10 +853,7 @@ class CameraUI(QMainWindow):
         # Load dcamapi.dll version: 19.12.641.5901
         """
 
-        files = importlib.resources.files(sys.modules[__package__])
-        traversable = files.joinpath("19_12/dcamapi.dll")
-        with importlib.resources.as_file(traversable) as path:
-            self.dcam = ctypes.WinDLL(str(path))
+        self.dcam = HamamatsuDCAM.dcam
 
         paraminit = HamamatsuDCAM.DCAMAPI_INIT(0, 0, 0, 0, None, None)
         paraminit.size = ctypes.sizeof(paraminit)
@@ -1689,7 +1688,12 @@ class CameraUI(QMainWindow):
         if self.isStreaming is False and self.isLiving is False:
             self.StartStream_Thread = threading.Thread(
                 target=self.StartStreaming,
-                args=(self.StopSignal, self.BufferNumber, self.StreamDuration),
+                args=(
+                    self.StopSignal,
+                    self.BufferNumber,
+                    self.StreamDuration,
+                    self.StreamSaveFile,
+                ),
             )
             self.StartStream_Thread.start()
 
@@ -1702,11 +1706,15 @@ class CameraUI(QMainWindow):
             self.CamStreamActionContainer.setEnabled(False)
 
             self.StopStream_Thread = threading.Thread(
-                target=self.StopStreaming, args=(True,)
+                target=self.StopStreaming, args=(self.StreamSaveFile,)
             )
             self.StopStream_Thread.start()
 
-    def StartStreaming(self, StopSignal, BufferNumber, StreamDuration):
+    def StartStreaming(
+        self, StopSignal, BufferNumber, StreamDuration, saveFile=True
+    ):
+        # - saveFile: write the frames to disk while streaming, otherwise
+        #   they are only counted.
         # Get propreties and stored as metadata
         self.GetKeyCameraProperties()
         # === Start the acquisition ===
@@ -1720,11 +1728,11 @@ class CameraUI(QMainWindow):
 
             self.hcam.setACQMode("fixed_length", number_frames=BufferNumber)
             self.hcam.startAcquisition()
+            self.StartStreamWriter(saveFile)
             QTimer.singleShot(StreamDuration * 1000, self.StopStreamingThread)
             # self.StreamDuration_timer.start(StreamDuration*1000) # Starts or restarts the timer with a timeout of duration msec milliseconds.
 
             # Start pulling out frames from buffer
-            self.video_list = []
             self.imageCount = 0  # The actual frame number that gets recorded.
             # Record for range() number of images.
             while self.isStreaming is True:
@@ -1734,13 +1742,10 @@ class CameraUI(QMainWindow):
                 ] = (
                     self.hcam.getFrames()
                 )  # frames is a list with HCamData type, with np_array being the image.
-                for aframe in frames:
-                    self.video_list.append(aframe.np_array)
-                    self.imageCount += 1
-
-                    self.CamStreamingLabel.setText(
-                        "Recording, {} frames..".format(self.imageCount)
-                    )
+                if self.stream_writer is not None:
+                    self.stream_writer.putFrames(frames)
+                self.imageCount += len(frames)
+                self.UpdateStreamingLabel()
 
         # Frame number hard limit
         elif StopSignal == "Frames":
@@ -1752,29 +1757,41 @@ class CameraUI(QMainWindow):
 
             self.hcam.setACQMode("fixed_length", number_frames=BufferNumber)
             self.hcam.startAcquisition()
+            self.StartStreamWriter(saveFile)
 
-            # Start pulling out frames from buffer
-            self.video_list = []
-
-            for _ in range(
-                BufferNumber
-            ):  # Record for range() number of images.
+            # Start pulling out frames from buffer, until all frames are in or
+            # the streaming is stopped by hand. getFrames waits at most 0.1 s.
+            while self.imageCount < BufferNumber and self.isStreaming is True:
                 [
                     frames,
                     self.dims,
                 ] = (
                     self.hcam.getFrames()
                 )  # frames is a list with HCamData type, with np_array being the image.
-                for aframe in frames:
-                    self.video_list.append(aframe.np_array)
-                    self.imageCount += 1
-
-                    self.CamStreamingLabel.setText(
-                        "Recording, {} frames..".format(self.imageCount)
-                    )
+                if self.stream_writer is not None:
+                    self.stream_writer.putFrames(frames)
+                self.imageCount += len(frames)
+                self.UpdateStreamingLabel()
 
             self.StopStreamingThread()
 
+    def StartStreamWriter(self, saveFile=True):
+        # Frames are written to disk while streaming, from the camera buffers.
+        if saveFile is not True:
+            self.stream_writer = None
+            return
+        self.stream_writer = FrameStreamWriter(
+            self.get_file_dir(),
+            (self.hcam.frame_y, self.hcam.frame_x),
+            metadata=self.metaData,
+        ).start()
+
+    def UpdateStreamingLabel(self):
+        text = "Recording, {} frames..".format(self.imageCount)
+        if self.stream_writer is not None and self.stream_writer.backlog > 0:
+            text += " {} waiting for disk".format(self.stream_writer.backlog)
+        self.CamStreamingLabel.setText(text)
+
     def StopStreaming(self, saveFile):
         # Stop the acquisitiondjc
         AcquisitionEndTime = time.time()
@@ -1792,48 +1809,61 @@ class CameraUI(QMainWindow):
                 )
             )
         )
-        self.hcam.stopAcquisition()
         self.isStreaming = False
+        # Make sure no frames are queued after the writer is closed.
+        if threading.current_thread() is not self.StartStream_Thread:
+            self.StartStream_Thread.join()
+        self.hcam.stopAcquisition()
         self.StreamBusymovie.stop()
         self.StreamStatusStackedWidget.setCurrentIndex(2)
 
-        if saveFile is True:
-            # Save the file.
-            with skimtiff.TiffWriter(
-                self.get_file_dir(), append=True, imagej=True
-            ) as tif:
-                write_starttime = time.time()
-                for eachframe in range(self.imageCount):
-                    image = np.resize(
-                        self.video_list[eachframe],
-                        (self.dims[1], self.dims[0]),
-                    )
-                    tif.save(image, compress=0, description=self.metaData)
-                    # === Update file saving progress bar ===
-                    if (
-                        eachframe / self.imageCount * 100
-                        - int(eachframe / self.imageCount * 100)
-                        <= 0.1
-                    ):
-                        self.CamStreamSaving_progressbar.setValue(
-                            int(eachframe / self.imageCount * 100)
-                        )
-
-            logging.info(
-                "Done writing "
-                + str(self.imageCount)
-                + " frames, recorded for "
-                + str(round(AcquisitionEndTime, 2))
-                + " seconds, saving video takes {} seconds.".format(
-                    round(time.time() - write_starttime, 2)
-                )
-            )
+        if self.stream_writer is None:
+            self.stream_status = {"frames_written": 0, "overruns": 0}
+        elif saveFile is True:
+            self.FinishStreamWriter(AcquisitionEndTime)
+        else:
+            # Recording is not kept, drop what was written so far.
+            self.stream_status = self.stream_writer.close()
+            if os.path.exists(self.stream_writer.filename):
+                os.remove(self.stream_writer.filename)
+            logging.info("Streamed frames discarded.")
+        self.stream_writer = None
 
         self.StartStreamButton.setEnabled(False)
         self.CamStreamActionContainer.setEnabled(True)
         self.StreamStatusStackedWidget.setCurrentIndex(0)
         self.CamStreamIsFree.setText(
-            "Acquisition done. Frames acquired: {}.".format(self.imageCount)
+            "Acquisition done. Frames acquired: {}. Writer overruns: {}.".format(
+                self.imageCount, self.stream_status["overruns"]
+            )
+        )
+
+    def FinishStreamWriter(self, AcquisitionEndTime):
+        # === Wait for the writer to catch up ===
+        write_starttime = time.time()
+        while self.stream_writer.backlog > 0:
+            self.CamStreamSaving_progressbar.setValue(
+                int(
+                    self.stream_writer.frames_written
+                    / self.stream_writer.frames_queued
+                    * 100
+                )
+            )
+            time.sleep(0.1)
+        self.stream_status = self.stream_writer.close()
+        self.stream_status["camera_max_backlog"] = self.hcam.max_backlog
+        self.stream_status["camera_overruns"] = self.hcam.buffer_overruns
+
+        logging.info(
+            "Done writing "
+            + str(self.stream_status["frames_written"])
+            + " frames, recorded for "
+            + str(
+                round(AcquisitionEndTime - self.hcam.AcquisitionStartTime, 2)
+            )
+            + " seconds, finishing the video takes {} seconds.".format(
+                round(time.time() - write_starttime, 2)
+            )
         )
 
     def SetSavingDirectory(self):
@@ -0,0 +1,693 @@
+# -*- coding: utf-8 -*-
+"""
+Software stand-in for dcamapi.dll.
+
+SimulatedDCAMAPI provides the dcamapi functions that HamamatsuDCAM calls
+through ctypes, with the same arguments and return codes. HamamatsuCamera,
+HamamatsuCameraMR and everything built on them (CamActuator, CameraUI,
+streaming, live view, autofocus) therefore run unchanged without a camera,
+including the frame pull path: buffer attach, newFrames and getFrames.
+
+It emulates an Orca Flash 4.0 (C13440-20CU): properties with ranges and text
+options, subarray ROI and binning, "fixed_length" (snap) and
+"run_till_abort" (sequence) capture and a ring buffer that a producer thread
+fills with synthetic images at the camera frame rate. Frames can be dropped
+on purpose to test the bookkeeping downstream; dropped frames show up as
+gaps in the frame stamps. The first pixel of every frame holds the low 16
+bits of its frame stamp.
+
+Select it by setting the environment variable GEVIDAQ_CAMERA_BACKEND to
+"simulated" before HamamatsuDCAM is imported, or with
+HamamatsuDCAM.use_dcamapi(SimulatedDCAMAPI(...)).
+"""
+
+import ctypes
+import logging
+import threading
+import time
+
+import numpy as np
+
+from . import HamamatsuDCAM as dcamapi
+
+# Error codes returned by the dll, as signed 32 bit integers.
+DCAMERR_TIMEOUT = ctypes.c_int32(0x80000106).value
+DCAMERR_ABORT = ctypes.c_int32(0x80000102).value
+DCAMERR_BUSY = ctypes.c_int32(0x80000101).value
+DCAMERR_INVALIDPROPERTYID = ctypes.c_int32(0x80000821).value
+DCAMERR_INVALIDVALUE = ctypes.c_int32(0x80000822).value
+DCAMERR_NOTWRITABLE = ctypes.c_int32(0x80000823).value
+DCAMERR_OUTOFRANGE = ctypes.c_int32(0x80000824).value
+DCAMERR_NOPROPERTY = ctypes.c_int32(0x80000828).value
+DCAMERR_INVALIDFRAMEINDEX = ctypes.c_int32(0x80000833).value
+DCAMERR_NOBUFFER = ctypes.c_int32(0x80000832).value
+
+SENSOR_SIZE = 2048
+# Rows are read out from the center in both directions.
+LINE_INTERVAL = 9.74436090225564e-06
+
+# name: (type, writable, default, min, max, text options)
+PROPERTIES = {
+    "binning": ("MODE", True, 1, 1, 4, {"1x1": 1, "2x2": 2, "4x4": 4}),
+    "bit_per_channel": ("LONG", True, 16, 8, 16, None),
+    "buffer_framebytes": ("LONG", False, 8388608, 0, 8388608, None),
+    "buffer_pixel_type": (
+        "MODE",
+        False,
+        2,
+        1,
+        3,
+        {"MONO8": 1, "MONO16": 2, "MONO12": 3},
+    ),
+    "buffer_rowbytes": ("LONG", False, 4096, 0, 4096, None),
+    "conversion_factor_coeff": ("REAL", False, 0.47, 0.47, 0.47, None),
+    "conversion_factor_offset": ("REAL", False, 100.0, 100.0, 100.0, None),
+    "defect_correct_mode": ("MODE", True, 1, 1, 2, {"OFF": 1, "ON": 2}),
+    "exposure_time": ("REAL", True, 0.008029353383458646, 3.8e-5, 10.0, None),
+    "hot_pixel_correct_level": (
+        "MODE",
+        True,
+        1,
+        1,
+        3,
+        {"STANDARD": 1, "MINIMUM": 2, "AGGRESSIVE": 3},
+    ),
+    "image_detector_pixel_height": ("REAL", False, 6.5, 6.5, 6.5, None),
+    "image_detector_pixel_width": ("REAL", False, 6.5, 6.5, 6.5, None),
+    "image_framebytes": ("LONG", False, 8388608, 0, 8388608, None),
+    "image_height": ("LONG", False, 2048, 4, 2048, None),
+    "image_pixel_type": (
+        "MODE",
+        True,
+        2,
+        1,
+        3,
+        {"MONO8": 1, "MONO16": 2, "MONO12": 3},
+    ),
+    "image_rowbytes": ("LONG", False, 4096, 0, 4096, None),
+    "image_width": ("LONG", False, 2048, 4, 2048, None),
+    "internal_frame_interval": ("REAL", False, 0.01, 0.0, 10.0, None),
+    "internal_frame_rate": ("REAL", False, 100.0, 0.1, 30000.0, None),
+    "internal_line_interval": (
+        "REAL",
+        False,
+        LINE_INTERVAL,
+        LINE_INTERVAL,
+        LINE_INTERVAL,
+        None,
+    ),
+    "master_pulse_interval": ("REAL", True, 0.1, 1e-5, 10.0, None),
+    "master_pulse_mode": (
+        "MODE",
+        True,
+        1,
+        1,
+        3,
+        {"CONTINUOUS": 1, "START": 2, "BURST": 3},
+    ),
+    "output_trigger_kind[0]": (
+        "MODE",
+        True,
+        2,
+        1,
+        5,
+        {
+            "LOW": 1,
+            "EXPOSURE": 2,
+            "PROGRAMABLE": 3,
+            "TRIGGER READY": 4,
+            "HIGH": 5,
+        },
+    ),
+    "output_trigger_polarity[0]": (
+        "MODE",
+        True,
+        1,
+        1,
+        2,
+        {"NEGATIVE": 1, "POSITIVE": 2},
+    ),
+    "readout_speed": ("LONG", True, 2, 1, 2, None),
+    "sensor_mode": (
+        "MODE",
+        True,
+        1,
+        1,
+        16,
+        {
+            "AREA": 1,
+            "PROGRESSIVE": 12,
+            "SPLIT VIEW": 14,
+            "DUAL LIGHT SHEET": 16,
+        },
+    ),
+    "sensor_temperature": ("REAL", False, -7.0, -7.0, -7.0, None),
+    "subarray_hpos": ("LONG", True, 0, 0, 2044, None),
+    "subarray_hsize": ("LONG", True, 2048, 4, 2048, None),
+    "subarray_mode": ("MODE", True, 1, 1, 2, {"OFF": 1, "ON": 2}),
+    "subarray_vpos": ("LONG", True, 0, 0, 2044, None),
+    "subarray_vsize": ("LONG", True, 2048, 4, 2048, None),
+    "timing_readout_time": ("REAL", False, 0.01, 0.0, 1.0, None),
+    "trigger_active": (
+        "MODE",
+        True,
+        1,
+        1,
+        3,
+        {"EDGE": 1, "LEVEL": 2, "SYNCREADOUT": 3},
+    ),
+    "trigger_mode": ("MODE", True, 1, 1, 6, {"NORMAL": 1, "START": 6}),
+    "trigger_polarity": (
+        "MODE",
+        True,
+        1,
+        1,
+        2,
+        {"NEGATIVE": 1, "POSITIVE": 2},
+    ),
+    "trigger_source": (
+        "MODE",
+        True,
+        1,
+        1,
+        4,
+        {"INTERNAL": 1, "EXTERNAL": 2, "SOFTWARE": 3, "MASTER PULSE": 4},
+    ),
+    "trigger_times": ("LONG", True, 1, 1, 10000, None),
+}
+
+TYPE_FLAGS = {
+    "MODE": dcamapi.DCAMPROP_TYPE_MODE,
+    "LONG": dcamapi.DCAMPROP_TYPE_LONG,
+    "REAL": dcamapi.DCAMPROP_TYPE_REAL,
+}
+
+# Subarray positions and sizes are multiples of this.
+SUBARRAY_STEP = 4
+PROPERTY_ID_BASE = 0x00400000
+
+
+def _value(arg):
+    """Value of a plain python number, a ctypes simple type or a byref."""
+    arg = getattr(arg, "_obj", arg)
+    return getattr(arg, "value", arg)
+
+
+def _target(arg):
+    """Object a ctypes.byref argument points to."""
+    return getattr(arg, "_obj", arg)
+
+
+def _write_string(address, text, size):
+    encoded = text.encode()[: size - 1] + b"\x00"
+    ctypes.memmove(address, encoded, len(encoded))
+
+
+def _field_address(structure, field):
+    """Pointer value stored in a c_char_p field, as an integer address."""
+    offset = getattr(type(structure), field).offset
+    return ctypes.c_void_p.from_buffer(structure, offset).value
+
+
+class SimulatedDCAMAPI:
+    """
+    The dcamapi functions used by HamamatsuDCAM, backed by a software camera.
+    """
+
+    def __init__(
+        self,
+        frame_rate=None,
+        drop_probability=0.0,
+        model="C13440-20CU",
+        seed=None,
+    ):
+        """
+        Parameters
+        frame_rate : float
+            Frames per second delivered by the camera. If None the internal
+            frame rate that follows from exposure time and ROI is used, also
+            for external triggering.
+        drop_probability : float
+            Chance that a frame is lost before it reaches the ring buffer.
+        model : str
+            Model name reported by dcamdev_getstring.
+        seed : int
+            Seed of the random generator for noise and frame drops.
+        """
+        self.frame_rate = frame_rate
+        self.drop_probability = drop_probability
+        self.model = model
+        self.rng = np.random.default_rng(seed)
+
+        self.names = list(PROPERTIES)
+        self.ids = {
+            name: PROPERTY_ID_BASE + 0x10 * (i + 1)
+            for i, name in enumerate(self.names)
+        }
+        self.names_by_id = {
+            prop_id: name for name, prop_id in self.ids.items()
+        }
+        self.values = {name: spec[2] for name, spec in PROPERTIES.items()}
+        self._update_derived()
+
+        self.buffers = []
+        self._own_buffers = []
+        self.capturing = False
+        self.frame_count = 0
+        self.frames_dropped = 0
+        self.frame_stamps = []
+        self.timestamps = []
+
+        self._lock = threading.Condition()
+        self._wait_seen = 0
+        self._stopped = threading.Event()
+        self._producer = None
+
+    # === dcamapi ===
+
+    def dcamapi_init(self, paraminit):
+        _target(paraminit).iDeviceCount = 1
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamapi_uninit(self):
+        self.dcamcap_stop(None)
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamdev_open(self, paramopen):
+        _target(paramopen).hdcam = 1
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamdev_close(self, camera_handle):
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamdev_getstring(self, camera_id, paramstring):
+        paramstring = _target(paramstring)
+        _write_string(
+            _field_address(paramstring, "text"),
+            self.model,
+            paramstring.textbytes,
+        )
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamwait_open(self, paramwait):
+        _target(paramwait).hwait = 1
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamwait_close(self, wait_handle):
+        return dcamapi.DCAMERR_NOERROR
+
+    # === Properties ===
+
+    def dcamprop_getnextid(self, camera_handle, prop_id, option):
+        prop_id = _target(prop_id)
+        if _value(option) & dcamapi.DCAMPROP_OPTION_NEXT:
+            later = [i for i in self.names_by_id if i > prop_id.value]
+            if len(later) == 0:
+                return DCAMERR_NOPROPERTY
+            prop_id.value = min(later)
+        elif prop_id.value != 0:
+            nearest = [i for i in self.names_by_id if i >= prop_id.value]
+            if len(nearest) == 0:
+                return DCAMERR_NOPROPERTY
+            prop_id.value = min(nearest)
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamprop_getname(self, camera_handle, prop_id, c_buf, c_buf_len):
+        name = self.names_by_id.get(_value(prop_id))
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        _write_string(
+            ctypes.addressof(c_buf),
+            name.upper().replace("_", " "),
+            _value(c_buf_len),
+        )
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamprop_getattr(self, camera_handle, p_attr):
+        p_attr = _target(p_attr)
+        name = self.names_by_id.get(p_attr.iProp)
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        type_, writable, default, valuemin, valuemax, texts = PROPERTIES[name]
+        attribute = TYPE_FLAGS[type_] | dcamapi.DCAMPROP_ATTR_READABLE
+        if writable:
+            attribute |= dcamapi.DCAMPROP_ATTR_WRITABLE
+        if texts is not None:
+            attribute |= dcamapi.DCAMPROP_ATTR_HASVALUETEXT
+        p_attr.attribute = attribute
+        p_attr.valuemin = valuemin
+        p_attr.valuemax = valuemax
+        p_attr.valuestep = SUBARRAY_STEP if name.startswith("subarray") else 1
+        p_attr.valuedefault = default
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamprop_getvalue(self, camera_handle, prop_id, c_value):
+        name = self.names_by_id.get(_value(prop_id))
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        _target(c_value).value = self.values[name]
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamprop_setgetvalue(self, camera_handle, prop_id, p_value, option):
+        name = self.names_by_id.get(_value(prop_id))
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        type_, writable, default, valuemin, valuemax, texts = PROPERTIES[name]
+        if not writable:
+            return DCAMERR_NOTWRITABLE
+        # The sensor can't be reconfigured while it is reading out.
+        if self.capturing and (
+            name.startswith("subarray") or name == "binning"
+        ):
+            return DCAMERR_BUSY
+
+        p_value = _target(p_value)
+        value = p_value.value
+        if value < valuemin or value > valuemax:
+            return DCAMERR_OUTOFRANGE
+        if texts is not None and int(value) not in texts.values():
+            return DCAMERR_INVALIDVALUE
+        if type_ != "REAL":
+            value = int(value)
+        if name.startswith("subarray") and name != "subarray_mode":
+            value -= value % SUBARRAY_STEP
+
+        self.values[name] = value
+        self._update_derived()
+        p_value.value = self.values[name]
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamprop_getvaluetext(self, camera_handle, prop_text):
+        prop_text = _target(prop_text)
+        name = self.names_by_id.get(prop_text.iProp)
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        texts = PROPERTIES[name][5] or {}
+        for text, value in texts.items():
+            if value == int(prop_text.value):
+                _write_string(
+                    _field_address(prop_text, "text"),
+                    text,
+                    prop_text.textbytes,
+                )
+                return dcamapi.DCAMERR_NOERROR
+        return DCAMERR_INVALIDVALUE
+
+    def dcamprop_queryvalue(self, camera_handle, prop_id, p_value, option):
+        name = self.names_by_id.get(_value(prop_id))
+        if name is None:
+            return DCAMERR_INVALIDPROPERTYID
+        p_value = _target(p_value)
+        options = sorted((PROPERTIES[name][5] or {}).values())
+        later = [value for value in options if value > p_value.value]
+        if len(later) == 0:
+            return DCAMERR_OUTOFRANGE
+        p_value.value = later[0]
+        return dcamapi.DCAMERR_NOERROR
+
+    def _update_derived(self):
+        """Recompute the read-only properties that follow from the settings."""
+        values = self.values
+        binning = int(values["binning"])
+        if values["subarray_mode"] == 2:
+            width = min(
+                values["subarray_hsize"],
+                SENSOR_SIZE - values["subarray_hpos"],
+            )
+            height = min(
+                values["subarray_vsize"],
+                SENSOR_SIZE - values["subarray_vpos"],
+            )
+        else:
+            width = height = SENSOR_SIZE
+        width //= binning
+        height //= binning
+
+        readout_time = LINE_INTERVAL * np.ceil(height * binning / 2)
+        frame_interval = max(values["exposure_time"], readout_time)
+
+        values["image_width"] = width
+        values["image_height"] = height
+        values["image_rowbytes"] = values["buffer_rowbytes"] = width * 2
+        values["image_framebytes"] = values["buffer_framebytes"] = (
+            width * height * 2
+        )
+        values["timing_readout_time"] = readout_time
+        values["internal_frame_interval"] = frame_interval
+        values["internal_frame_rate"] = 1 / frame_interval
+
+    # === Buffers and capturing ===
+
+    def dcambuf_alloc(self, camera_handle, number_buffers):
+        frame_bytes = self.values["image_framebytes"]
+        self._own_buffers = [
+            np.zeros(frame_bytes // 2, dtype=np.uint16)
+            for _ in range(_value(number_buffers))
+        ]
+        self.buffers = [array.ctypes.data for array in self._own_buffers]
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcambuf_attach(self, camera_handle, paramattach):
+        paramattach = _target(paramattach)
+        self.buffers = [
+            paramattach.buffer[i] for i in range(paramattach.buffercount)
+        ]
+        # The driver locks attached buffers in memory, which touches every
+        # page. Do the same so that page faults don't slow down capturing.
+        frame_bytes = self.values["image_framebytes"]
+        for address in self.buffers:
+            ctypes.memset(address, 0, frame_bytes)
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcambuf_release(self, camera_handle, kind):
+        if self.capturing:
+            return DCAMERR_BUSY
+        self.buffers = []
+        self._own_buffers = []
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcambuf_lockframe(self, camera_handle, paramlock):
+        paramlock = _target(paramlock)
+        with self._lock:
+            if len(self.buffers) == 0:
+                return DCAMERR_NOBUFFER
+            index = paramlock.iFrame
+            if index == -1:
+                index = (self.frame_count - 1) % len(self.buffers)
+            if index < 0 or index >= min(self.frame_count, len(self.buffers)):
+                return DCAMERR_INVALIDFRAMEINDEX
+            paramlock.framestamp = self.frame_stamps[index]
+            paramlock.timestamp = int(self.timestamps[index] * 1e6)
+        paramlock.buf = self.buffers[index]
+        paramlock.width = self.values["image_width"]
+        paramlock.height = self.values["image_height"]
+        paramlock.rowbytes = self.values["image_rowbytes"]
+        paramlock.type = 2  # MONO16
+        paramlock.left = self.values["subarray_hpos"]
+        paramlock.top = self.values["subarray_vpos"]
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamcap_start(self, camera_handle, mode):
+        if self.capturing:
+            return DCAMERR_BUSY
+        if len(self.buffers) == 0:
+            return DCAMERR_NOBUFFER
+
+        with self._lock:
+            self.frame_count = 0
+            self.frames_dropped = 0
+            self._wait_seen = 0
+            self.frame_stamps = [0] * len(self.buffers)
+            self.timestamps = [0.0] * len(self.buffers)
+        self.sequence = _value(mode) == dcamapi.DCAMCAP_START_SEQUENCE
+        self._bank = self._frame_bank(
+            int(self.values["image_width"]), int(self.values["image_height"])
+        )
+        self.capturing = True
+        self._stopped.clear()
+        self._producer = threading.Thread(target=self._produce, daemon=True)
+        self._producer.start()
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamcap_stop(self, camera_handle):
+        self._stopped.set()
+        if self._producer is not None:
+            self._producer.join()
+            self._producer = None
+        self.capturing = False
+        with self._lock:
+            self._lock.notify_all()
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamcap_status(self, camera_handle, status):
+        if self.capturing:
+            value = dcamapi.DCAMCAP_STATUS_BUSY
+        elif len(self.buffers) != 0:
+            value = dcamapi.DCAMCAP_STATUS_READY
+        else:
+            value = dcamapi.DCAMCAP_STATUS_STABLE
+        _target(status).value = value
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamcap_transferinfo(self, camera_handle, paramtransfer):
+        paramtransfer = _target(paramtransfer)
+        with self._lock:
+            paramtransfer.nFrameCount = self.frame_count
+            if self.frame_count == 0:
+                paramtransfer.nNewestFrameIndex = -1
+            else:
+                paramtransfer.nNewestFrameIndex = (self.frame_count - 1) % len(
+                    self.buffers
+                )
+        return dcamapi.DCAMERR_NOERROR
+
+    def dcamwait_start(self, wait_handle, paramstart):
+        """
+        Block until a frame arrived that the last wait did not see, capture
+        stopped, or the timeout in ms runs out.
+        """
+        paramstart = _target(paramstart)
+        deadline = time.perf_counter() + paramstart.timeout / 1000
+        with self._lock:
+            while self.frame_count == self._wait_seen and self.capturing:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return DCAMERR_TIMEOUT
+                self._lock.wait(remaining)
+
+            if self.frame_count != self._wait_seen:
+                self._wait_seen = self.frame_count
+                paramstart.eventhappened = dcamapi.DCAMWAIT_CAPEVENT_FRAMEREADY
+            else:
+                paramstart.eventhappened = dcamapi.DCAMWAIT_CAPEVENT_STOPPED
+        return dcamapi.DCAMERR_NOERROR
+
+    def _frame_bank(self, width, height, number=8):
+        """
+        A few noisy frames of fluorescent cells to cycle through, so that
+        producing frames costs no more than a copy.
+        """
+        y, x = np.mgrid[0:height, 0:width]
+        image = np.full((height, width), 100.0)
+        for _ in range(max(3, width * height // 20000)):
+            cx, cy = self.rng.uniform(0, width), self.rng.uniform(0, height)
+            radius = self.rng.uniform(6, 15)
+            image += self.rng.uniform(200, 2000) * np.exp(
+                -((x - cx) ** 2 + (y - cy) ** 2) / (2 * radius**2)
+            )
+        bank = self.rng.poisson(image, size=(number, height, width))
+        return np.clip(bank, 0, 65535).astype(np.uint16).reshape(number, -1)
+
+    def _produce(self):
+        frame_rate = self.frame_rate or self.values["internal_frame_rate"]
+        bank = self._bank
+        frame_bytes = bank.shape[1] * 2
+        n_buffers = len(self.buffers)
+        if n_buffers == 0:
+            # Buffers were released before capturing got going.
+            self.capturing = False
+            return
+
+        starttime = time.perf_counter()
+        stamp = 0
+        while not self._stopped.is_set():
+            due = int((time.perf_counter() - starttime) * frame_rate) + 1
+            # At high frame rates several frames are due at once.
+            while stamp < due:
+                stamp += 1
+                if self.rng.random() < self.drop_probability:
+                    self.frames_dropped += 1
+                    continue
+
+                count = self.frame_count
+                index = count % n_buffers
+                frame = bank[stamp % len(bank)]
+                frame[0] = stamp & 0xFFFF
+                ctypes.memmove(
+                    self.buffers[index], frame.ctypes.data, frame_bytes
+                )
+                with self._lock:
+                    self.frame_stamps[index] = stamp
+                    self.timestamps[index] = time.perf_counter() - starttime
+                    self.frame_count = count + 1
+                    self._lock.notify_all()
+
+                # A snap stops once every buffer is filled.
+                if not self.sequence and self.frame_count >= n_buffers:
+                    self.capturing = False
+                    with self._lock:
+                        self._lock.notify_all()
+                    logging.info(
+                        f"Simulated camera captured {self.frame_count} frames"
+                        f", {self.frames_dropped} dropped"
+                    )
+                    return
+
+            self._stopped.wait(
+                max(0.0, starttime + due / frame_rate - time.perf_counter())
+            )
+
+
+def benchmark_streaming(
+    number_frames=4000,
+    frame_rate=1000,
+    vsize=256,
+    saving_dir=None,
+    drop_probability=0.0,
+):
+    """
+    Stream number_frames frames through HamamatsuCameraMR on the simulated
+    camera, the same way CamActuator does, and report the frame bookkeeping.
+    """
+    from .stream_writer import FrameStreamWriter
+
+    api = SimulatedDCAMAPI(
+        frame_rate=frame_rate, drop_probability=drop_probability
+    )
+    dcamapi.use_dcamapi(api)
+
+    hcam = dcamapi.HamamatsuCameraMR(camera_id=0)
+    hcam.setPropertyValue("subarray_mode", "OFF")
+    hcam.setPropertyValue("subarray_vsize", vsize)
+    hcam.setPropertyValue("subarray_vpos", (SENSOR_SIZE - vsize) // 2)
+    hcam.setPropertyValue("subarray_mode", "ON")
+    hcam.setPropertyValue("exposure_time", 1 / frame_rate)
+
+    hcam.setACQMode("fixed_length", number_frames=number_frames)
+    hcam.startAcquisition()
+    writer = None
+    if saving_dir is not None:
+        writer = FrameStreamWriter(
+            saving_dir, (hcam.frame_y, hcam.frame_x)
+        ).start()
+
+    starttime = time.perf_counter()
+    imageCount = 0
+    while imageCount + api.frames_dropped < number_frames:
+        frames, dims = hcam.getFrames()
+        if writer is not None:
+            writer.putFrames(frames)
+        imageCount += len(frames)
+        if not api.capturing and len(frames) == 0:
+            break
+    elapsed = time.perf_counter() - starttime
+    hcam.stopAcquisition()
+    if writer is not None:
+        writer.close()
+
+    result = {
+        "frames_pulled": imageCount,
+        "frames_dropped": api.frames_dropped,
+        "fps": imageCount / elapsed,
+        "max_backlog": hcam.max_backlog,
+        "buffer_overruns": hcam.buffer_overruns,
+    }
+    hcam.shutdown()
+    return result
+
+
+if __name__ == "__main__":
+    # The DCAM driver failed to load and logged while importing.
+    logging.basicConfig(level=logging.INFO, force=True)
+    logging.info(benchmark_streaming())
+    logging.info(benchmark_streaming(frame_rate=2000, drop_probability=0.01))
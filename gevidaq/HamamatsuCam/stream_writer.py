@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Write camera frames to disk while streaming.
+
+The frame pulling loop hands every frame it gets from the DCAM ring
+(HamamatsuCameraMR.hcam_data) to a FrameStreamWriter. A background thread
+takes them from a bounded queue and writes them straight away, so a recording
+never has to fit in memory and is on disk as soon as streaming stops.
+
+Frames are written as reshaped views of the ring buffers, without copies. The
+ring buffers are recycled by the camera, so a frame has to be written before
+the camera comes around to its buffer again. Keep max_queue well below the
+number of image buffers for "run_till_abort" acquisitions. In "fixed_length"
+acquisitions every frame has its own buffer.
+
+Two containers are supported:
+    "tiff": one contiguous BigTIFF series, readable by ImageJ/Fiji and
+            tifffile.
+    "raw":  raw uint16 frames with a JSON sidecar, see load_recording.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+import tifffile as skimtiff
+
+
+class FrameStreamWriter:
+    """
+    Background writer for camera frames.
+
+    Counters, also available together from status():
+        frames_queued: frames handed to put.
+        frames_written: frames on disk.
+        backlog / max_backlog: frames waiting in the queue, now and at most.
+        overruns: times put found the queue full and had to wait for the disk.
+            The camera keeps filling its ring meanwhile, so when this is not
+            zero, disk throughput is the bottleneck.
+    """
+
+    def __init__(
+        self,
+        filename,
+        frame_shape,
+        metadata="",
+        container="tiff",
+        max_queue=256,
+        dtype="uint16",
+    ):
+        """
+        Parameters
+        filename : str
+            File to write. For "raw" a filename + ".json" sidecar is added.
+        frame_shape : tuple
+            (height, width) of the frames, i.e. (dims[1], dims[0]).
+        metadata : str
+            Description stored with the frames, like CamActuator.metaData.
+        container : str
+            "tiff" or "raw".
+        max_queue : int
+            Number of frames that can wait for the disk before put blocks.
+        """
+        if container not in ("tiff", "raw"):
+            raise ValueError(f"Unknown container {container}")
+
+        self.filename = filename
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.metadata = metadata
+        self.container = container
+        self.dtype = np.dtype(dtype)
+
+        self.frames_queued = 0
+        self.frames_written = 0
+        self.max_backlog = 0
+        self.overruns = 0
+        self.write_time = 0.0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._write_frames, daemon=True)
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def put(self, frame):
+        """
+        Queue one frame, a 1-D np_array from HCamData or an image.
+        """
+        if self.error is not None:
+            raise self.error
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.overruns += 1
+            self._queue.put(frame)
+        self.frames_queued += 1
+
+        backlog = self._queue.qsize()
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    def putFrames(self, frames):
+        """
+        Queue the HCamData frames returned by getFrames.
+        """
+        for aframe in frames:
+            self.put(aframe.np_array)
+
+    def close(self, timeout=None):
+        """
+        Write the remaining frames and close the file.
+
+        Returns
+        Dictionary from status().
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        status = self.status()
+        logging.info(
+            "Streamed {frames_written} frames to {filename}, "
+            "max backlog {max_backlog}, overruns {overruns}, "
+            "{throughput_MBps:.1f} MB/s".format(**status)
+        )
+        if self.error is not None:
+            raise self.error
+        return status
+
+    def status(self):
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        throughput = 0.0
+        if self.write_time > 0:
+            throughput = (
+                self.frames_written * frame_bytes / self.write_time / 1e6
+            )
+        return {
+            "filename": self.filename,
+            "frames_queued": self.frames_queued,
+            "frames_written": self.frames_written,
+            "backlog": self.backlog,
+            "max_backlog": self.max_backlog,
+            "overruns": self.overruns,
+            "throughput_MBps": throughput,
+        }
+
+    def _write_frames(self):
+        try:
+            if self.container == "tiff":
+                self._write_tiff()
+            else:
+                self._write_raw()
+        except Exception as error:
+            logging.exception("Camera stream writer failed")
+            self.error = error
+            # Keep emptying the queue so that put does not block forever.
+            while self._queue.get() is not None:
+                pass
+
+    def _frames(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            # Reshape gives a view on the camera buffer, no copy.
+            yield frame.reshape(self.frame_shape)
+
+    def _write_tiff(self):
+        with skimtiff.TiffWriter(self.filename, bigtiff=True) as tif:
+            for image in self._frames():
+                starttime = time.perf_counter()
+                # All frames go into one contiguous series, the description
+                # is only stored with the first one.
+                tif.write(
+                    image,
+                    contiguous=True,
+                    description=self.metadata,
+                    metadata=None,
+                )
+                self.write_time += time.perf_counter() - starttime
+                self.frames_written += 1
+
+    def _write_raw(self):
+        with open(self.filename, "wb") as file:
+            for image in self._frames():
+                starttime = time.perf_counter()
+                file.write(memoryview(np.ascontiguousarray(image)).cast("B"))
+                self.write_time += time.perf_counter() - starttime
+                self.frames_written += 1
+
+        with open(self.filename + ".json", "w") as sidecar:
+            json.dump(
+                {
+                    "dtype": self.dtype.str,
+                    "shape": [self.frames_written, *self.frame_shape],
+                    "description": self.metadata,
+                },
+                sidecar,
+                indent=2,
+            )
+
+    @staticmethod
+    def load_recording(filename):
+        """
+        Open a raw recording without reading it into memory.
+
+        Returns
+        (np.memmap of shape (frames, height, width), metadata dictionary)
+        """
+        with open(filename + ".json") as sidecar:
+            metadata = json.load(sidecar)
+        data = np.memmap(
+            filename,
+            dtype=metadata["dtype"],
+            mode="r",
+            shape=tuple(metadata["shape"]),
+        )
+        return data, metadata
@@ -30,13 +30,11 @@ from scipy.optimize import curve_fit
 from scipy.signal import convolve2d
 from skimage import img_as_ubyte
 from skimage.color import gray2rgb
-from skimage.draw import polygon2mask, polygon_perimeter
 from skimage.filters import threshold_local, threshold_otsu
 from skimage.filters.rank import entropy
 from skimage.io import imread
 from skimage.measure import find_contours, label, regionprops
 from skimage.morphology import (
-    binary_dilation,
     closing,
     dilation,
     disk,
@@ -49,6 +47,7 @@ from skimage.segmentation import clear_border
 from skimage.transform import resize
 
 from ..NIDAQ import waveform_specification
+from . import cell_registration, polygon_masks, tiled_stitching
 
 # import plotly.express as px
 
@@ -1485,27 +1484,14 @@ class ProcessImage:
         param invert_mask: invert binary mask, meaning 1 and 0 interchange
         """
 
-        mask = np.zeros(mask_resolution)
-
-        if fill_contour:
-            for roi in list_of_rois:
-                mask += polygon2mask(mask_resolution, roi)
-        else:
-            for roi in list_of_rois:
-                mask[
-                    polygon_perimeter(roi[:, 0], roi[:, 1], mask_resolution)
-                ] = 1
-
-            for _ in range(contour_thickness):
-                mask += binary_dilation(binary_dilation(mask))
-
-        # Make sure the mask is binary
-        mask = (mask > 0).astype(int)
-
-        if invert_mask:
-            mask = 1 - mask
-
-        return mask
+        # All rois drawn into one label image, not a frame per roi.
+        return polygon_masks.rois_to_mask(
+            list_of_rois,
+            mask_resolution,
+            fill_contour=fill_contour,
+            contour_thickness=contour_thickness,
+            invert_mask=invert_mask,
+        )
 
     def ROIitem2Mask(
         roi_list,
@@ -1518,75 +1504,27 @@ class ProcessImage:
         Create binary mask from roi items from pyqtgraph
 
         Parameters
-        image_shape : tuple of size 2.
+        roi_list : list or dict of roi items from pyqtgraph.
+        mask_resolution : tuple of size 2.
             The shape of the mask.
-        polygon : array_like.
-            The polygon coordinates of shape (N, 2) where N is
-            the number of points.
 
         Returns
-        mask : 2-D ndarray of type 'bool'.
-            The mask that corresponds to the input polygon.
+        mask : 2-D ndarray.
+            The mask that corresponds to the input polygons, 0 and 1.
 
         """
-        list_of_rois = []
-        Width = int(mask_resolution[0])
-        Height = int(mask_resolution[1])
-
-        mask = np.zeros((Width, Height))
-
-        if type(roi_list) is list:
-            for roi in roi_list:
-                roi_handle_positions = roi.getLocalHandlePositions()
-                # print(roi.getLocalHandlePositions())
-                num_vertices = len(roi_handle_positions)
-                vertices = np.zeros([num_vertices, 2])
-
-                for idx, vertex in enumerate(roi_handle_positions):
-                    vertices[idx, :] = np.array([vertex[1].y(), vertex[1].x()])
-                #
-                list_of_rois.append(vertices)
-
-                for roi in list_of_rois:
-                    if fill_contour:
-                        mask += polygon2mask((Width, Height), roi)
-                    else:
-                        mask[
-                            polygon_perimeter(
-                                roi[:, 0], roi[:, 1], mask_resolution
-                            )
-                        ] = 1
-
-                        for _ in range(contour_thickness):
-                            mask += binary_dilation(binary_dilation(mask))
-
-        elif type(roi_list) is dict:
-            for roikey in roi_list:
-                roi = roi_list[roikey]
-                roi_handle_positions = roi.getLocalHandlePositions()
-                # print(roi.getLocalHandlePositions())
-                num_vertices = len(roi_handle_positions)
-                vertices = np.zeros([num_vertices, 2])
-
-                for idx, vertex in enumerate(roi_handle_positions):
-                    vertices[idx, :] = np.array([vertex[1].y(), vertex[1].x()])
-                #
-                list_of_rois.append(vertices)
-
-                for roi in list_of_rois:
-                    if fill_contour:
-                        mask += polygon2mask((Width, Height), roi)
-                    else:
-                        mask[
-                            polygon_perimeter(
-                                roi[:, 0], roi[:, 1], mask_resolution
-                            )
-                        ] = 1
+        if type(roi_list) is dict:
+            roi_list = list(roi_list.values())
 
-                        for _ in range(contour_thickness):
-                            mask += binary_dilation(binary_dilation(mask))
+        list_of_rois = ProcessImage.ROIitem2Vertices(roi_list)
 
-        return mask
+        return ProcessImage.CreateBinaryMaskFromRoiCoordinates(
+            list_of_rois,
+            fill_contour=fill_contour,
+            contour_thickness=contour_thickness,
+            mask_resolution=mask_resolution,
+            invert_mask=invert_mask,
+        ).astype(float)
 
     def ROIitem2Vertices(roi_items_list):
         """
@@ -1665,6 +1603,7 @@ class ProcessImage:
                 fill_contour=flag_fill_contour,
                 contour_thickness=contour_thickness,
                 invert_mask=flag_invert_mode,
+                mask_resolution=(mask_resolution[1], mask_resolution[0]),
             )
             logging.info(mask_transformed[laser].shape)
 
@@ -1704,27 +1643,47 @@ class ProcessImage:
 
         """
 
-        mask_transformed_final = np.zeros(
-            (mask_resolution[1], mask_resolution[0])
-        )
+        transformation = dict_transformations.get("camera-dmd-" + laser)
+        if transformation is not None and np.ndim(transformation) == 3:
+            # Coefficients of CoordinateTransformations, like the DMDWidget
+            # saves. Warp the mask itself with the cached lookup table, that
+            # also keeps holes in the cells.
+            from ..CoordinatesManager import CoordinateTransformations
+
+            return CoordinateTransformations.warp_image(
+                np.asarray(binary_mask, dtype=float),
+                transformation,
+                (mask_resolution[1], mask_resolution[0]),
+            )
 
         contours = find_contours(
             binary_mask, 0.5
         )  # Find iso-valued contours in a 2D array for a given level value.
-
-        for n, contour in enumerate(contours):
-            mask_transformed = ProcessImage.vertices_to_DMD_mask(
-                contour,
-                laser,
-                dict_transformations,
-                flag_fill_contour=True,
-                contour_thickness=1,
-                flag_invert_mode=False,
-                mask_resolution=(1024, 768),
+        if len(contours) == 0:
+            return np.zeros((mask_resolution[1], mask_resolution[0]))
+
+        # Transform the vertices of all contours at once.
+        if "camera-dmd-" + laser in dict_transformations.keys():
+            vertices_transformed = ProcessImage.transform(
+                np.concatenate(contours),
+                dict_transformations["camera-dmd-" + laser],
             )
-            logging.info(mask_transformed_final.shape)
-            logging.info(mask_transformed[laser].shape)
-            mask_transformed_final += mask_transformed[laser]
+            contours = np.split(
+                vertices_transformed,
+                np.cumsum([len(contour) for contour in contours])[:-1],
+            )
+        else:
+            logging.info("Warning: not registered")
+
+        # Filled, in one label image.
+        mask_transformed_final = (
+            ProcessImage.CreateBinaryMaskFromRoiCoordinates(
+                contours,
+                fill_contour=True,
+                mask_resolution=(mask_resolution[1], mask_resolution[0]),
+            ).astype(float)
+        )
+        logging.info(mask_transformed_final.shape)
 
         return mask_transformed_final
 
@@ -1735,29 +1694,15 @@ class ProcessImage:
 
         r = np.array([[1,1], [1, 2], [1,3]])
 
+        A is [t_x, t_y, x coefficients of x, y, x**2, y**2, ..., y
+        coefficients], see polynomialTransformation.transform_points.
         """
+        from ..CoordinatesManager.backend.polynomialTransformation import (
+            transform_points,
+        )
 
-        if r.ndim == 1:
-            Q = ProcessImage.createTransformationMatrix(r)
-
-            if Q is None:
-                return
-
-            return np.squeeze(np.reshape(np.dot(Q, A), (-1, 2), order="F"))
-
-        else:
-            num_points = r.shape[0]
-
-        transformed_points = np.zeros([num_points, 2])
-
-        for i in range(num_points):
-            Q = ProcessImage.createTransformationMatrix(r[i, :])
-
-            if Q is None:
-                return
-
-            transformed_points[i, :] = np.squeeze(np.dot(Q, A))
-        return np.reshape(transformed_points, (-1, 2), order="F")
+        A = np.ravel(A)
+        return transform_points(r, A, (len(A) - 2) // 4)
 
     def createTransformationMatrix(q, order=1):
         if len(q.shape) == 1:
@@ -1849,29 +1794,39 @@ class ProcessImage:
 
         total_cells_identified = 0  # All identified cells number
 
+        # === Per-cell features, collected column by column ===
+        # One DataFrame is built at the end, growing it row by row is
+        # quadratic in the number of cells.
+        cell_index = np.empty(ROInumber, dtype=object)
+        boundingbox_column = np.empty(ROInumber, dtype=object)
+        area_meanIntensity_column = np.zeros(ROInumber)
+        contour_meanIntensity_column = np.zeros(ROInumber)
+        contourSoma_ratio_column = np.zeros(ROInumber)
+        contour_pixel_number_column = np.zeros(ROInumber, dtype=int)
+        whole_pixel_number_column = np.zeros(ROInumber, dtype=int)
+
+        # If image size is larger than 1024X1024, it is resized before processed by MaskRCNN.
+        # Here we need to resize the image to match the output mask from MaskRCNN.
+        if ROInumber > 0:
+            mask_shape = MLresults["masks"].shape[:2]
+            if (
+                image.shape[0] != mask_shape[0]
+                or image.shape[1] != mask_shape[1]
+            ):
+                image = resize(
+                    image,
+                    [mask_shape[0], mask_shape[1]],
+                    preserve_range=True,
+                ).astype(image.dtype)
+
         for eachROI in range(ROInumber):
             if MLresults["class_ids"][eachROI] == 3:
                 ROIlist = MLresults["rois"][eachROI]
                 CellMask = MLresults["masks"][:, :, eachROI]
 
-                # If image size is larger than 1024X1024, it is resized before processed by MaskRCNN.
-                # Here we need to resize the image to match the output mask from MaskRCNN.
-                if (
-                    image.shape[0] != CellMask.shape[0]
-                    or image.shape[1] != CellMask.shape[1]
-                ):
-                    resized_img = resize(
-                        image,
-                        [CellMask.shape[0], CellMask.shape[1]],
-                        preserve_range=True,
-                    ).astype(image.dtype)
-                    RawImg_roi = resized_img[
-                        ROIlist[0] : ROIlist[2], ROIlist[1] : ROIlist[3]
-                    ]  # Raw image in each bounding box
-                else:
-                    RawImg_roi = image[
-                        ROIlist[0] : ROIlist[2], ROIlist[1] : ROIlist[3]
-                    ]  # Raw image in each bounding box
+                RawImg_roi = image[
+                    ROIlist[0] : ROIlist[2], ROIlist[1] : ROIlist[3]
+                ]  # Raw image in each bounding box
 
                 CellMask_roi = CellMask[
                     ROIlist[0] : ROIlist[2], ROIlist[1] : ROIlist[3]
@@ -1890,11 +1845,6 @@ class ProcessImage:
                     cell_contour_mask, CellMask_roi, dilation_parameter=7
                 )
 
-                # Trim the contour mask
-                cell_contour_mask_processed = opening(  # TODO unused
-                    cell_contour_mask_dilated, square(4)
-                )
-
                 if show_each_cell is True:
                     fig, axs = plt.subplots(2)
                     # fig.suptitle('Individual cell mask')
@@ -1904,133 +1854,55 @@ class ProcessImage:
                     axs[1].imshow(cell_contour_mask_dilated, cmap="gray")
                     axs[1].set_title("Cell contour mask")
                     axs[1].set_xticks([])
-                    # axs[2].imshow(cell_contour_mask_processed, cmap="gray")
-                    # axs[2].set_title("Cell contour trimed")
-                    # axs[2].set_xticks([])
                     plt.show()
 
                 # === Calculate intensity based on masks ===
+                whole_mask = CellMask_roi == 1
+                contour_mask = cell_contour_mask_dilated == 1
+                # Soma is the cell area without the membrane.
+                soma_mask = whole_mask & ~contour_mask
+
                 # Mean pixel value of cell membrane.
-                cell_contour_meanIntensity = np.mean(
-                    RawImg_roi[np.where(cell_contour_mask_dilated == 1)]
-                )
-                # print(cell_contour_meanIntensity)
+                cell_contour_meanIntensity = np.mean(RawImg_roi[contour_mask])
                 # Mean pixel value of whole cell area.
-                cell_area_meanIntensity = np.mean(
-                    RawImg_roi[np.where(CellMask_roi == 1)]
-                )
-
+                cell_area_meanIntensity = np.mean(RawImg_roi[whole_mask])
                 # Mean pixel value of soma area.
-                cell_soma_mask = CellMask_roi - cell_contour_mask_dilated
-                cell_soma_meanIntensity = np.mean(
-                    RawImg_roi[np.where(cell_soma_mask == 1)]
-                )
+                cell_soma_meanIntensity = np.mean(RawImg_roi[soma_mask])
 
                 # Calculate the contour/soma intensity ratio.
                 cell_contourSoma_ratio = round(
                     cell_contour_meanIntensity / cell_soma_meanIntensity, 5
                 )
 
-                boundingbox_info = "minr{}_maxr{}_minc{}_maxc{}".format(
-                    ROIlist[0], ROIlist[2], ROIlist[1], ROIlist[3]
-                )
-
                 # === Getting pixel numbers ===
-                cell_contour_mask_pixel_number = len(
-                    np.where(cell_contour_mask_dilated == 1)[0]
-                )
-                cell_whole_mask_pixel_number = len(
-                    np.where(CellMask_roi == 1)[0]
-                )
-
-                if False:
-                    # print("Membrane pixel number: {}".format(len(np.where(cell_contour_mask_dilated == 1)[0])))
-                    logging.info(
-                        "Confidence score: {}".format(
-                            MLresults["scores"][eachROI]
-                        )
-                    )
-                    logging.info(
-                        "Cell pixel number: {}".format(
-                            len(np.where(CellMask_roi == 1)[0])
-                        )
-                    )
-                    logging.info(
-                        "Mean pixel value of contour {}".format(
-                            cell_contour_meanIntensity
-                        )
-                    )
-                    logging.info(
-                        "Mean pixel value of whole cell area {}".format(
-                            cell_area_meanIntensity
-                        )
-                    )
-                    logging.info(
-                        " contour/soma intensity ratio {}".format(
-                            cell_contourSoma_ratio
-                        )
-                    )
+                cell_contour_mask_pixel_number = np.count_nonzero(contour_mask)
+                cell_whole_mask_pixel_number = np.count_nonzero(whole_mask)
 
                 # If the cell is too big or small, skip it.
                 if (
-                    len(np.where(CellMask_roi == 1)[0]) < 2500
-                    or len(np.where(CellMask_roi == 1)[0]) > 500
+                    cell_whole_mask_pixel_number < 2500
+                    or cell_whole_mask_pixel_number > 500
                 ):
-                    if flat_cell_counted_inImage == 0:
-                        Cell_DataFrame = pd.DataFrame(
-                            [
-                                [
-                                    ImgNameInfor,
-                                    boundingbox_info,
-                                    cell_area_meanIntensity,
-                                    cell_contour_meanIntensity,
-                                    cell_contourSoma_ratio,
-                                    cell_contour_mask_pixel_number,
-                                    cell_whole_mask_pixel_number,
-                                ]
-                            ],
-                            columns=[
-                                "ImgNameInfor",
-                                "BoundingBox",
-                                "Mean_intensity",
-                                "Mean_intensity_in_contour",
-                                "Contour_soma_ratio",
-                                "contour_mask_pixel_number",
-                                "whole_cell_mask_pixel_number",
-                            ],
-                            index=[
-                                "Cell {}".format(add_up_cell_counted_number)
-                            ],
-                        )
-                    else:
-                        Cell_DataFrame_new = pd.DataFrame(
-                            [
-                                [
-                                    ImgNameInfor,
-                                    boundingbox_info,
-                                    cell_area_meanIntensity,
-                                    cell_contour_meanIntensity,
-                                    cell_contourSoma_ratio,
-                                    cell_contour_mask_pixel_number,
-                                    cell_whole_mask_pixel_number,
-                                ]
-                            ],
-                            columns=[
-                                "ImgNameInfor",
-                                "BoundingBox",
-                                "Mean_intensity",
-                                "Mean_intensity_in_contour",
-                                "Contour_soma_ratio",
-                                "contour_mask_pixel_number",
-                                "whole_cell_mask_pixel_number",
-                            ],
-                            index=[
-                                "Cell {}".format(add_up_cell_counted_number)
-                            ],
-                        )
-                        Cell_DataFrame = Cell_DataFrame.append(
-                            Cell_DataFrame_new
-                        )
+                    row = flat_cell_counted_inImage
+                    cell_index[row] = "Cell {}".format(
+                        add_up_cell_counted_number
+                    )
+                    boundingbox_column[
+                        row
+                    ] = "minr{}_maxr{}_minc{}_maxc{}".format(
+                        ROIlist[0], ROIlist[2], ROIlist[1], ROIlist[3]
+                    )
+                    area_meanIntensity_column[row] = cell_area_meanIntensity
+                    contour_meanIntensity_column[
+                        row
+                    ] = cell_contour_meanIntensity
+                    contourSoma_ratio_column[row] = cell_contourSoma_ratio
+                    contour_pixel_number_column[
+                        row
+                    ] = cell_contour_mask_pixel_number
+                    whole_pixel_number_column[
+                        row
+                    ] = cell_whole_mask_pixel_number
 
                     add_up_cell_counted_number += 1
                     flat_cell_counted_inImage += 1
@@ -2046,12 +1918,32 @@ class ProcessImage:
                 add_up_cell_counted_number,
                 total_cells_identified,
             )
-        else:
-            return (
-                Cell_DataFrame,
-                add_up_cell_counted_number,
-                total_cells_identified,
-            )
+
+        counted = slice(0, flat_cell_counted_inImage)
+        Cell_DataFrame = pd.DataFrame(
+            {
+                "ImgNameInfor": ImgNameInfor,
+                "BoundingBox": boundingbox_column[counted],
+                "Mean_intensity": area_meanIntensity_column[counted],
+                "Mean_intensity_in_contour": contour_meanIntensity_column[
+                    counted
+                ],
+                "Contour_soma_ratio": contourSoma_ratio_column[counted],
+                "contour_mask_pixel_number": contour_pixel_number_column[
+                    counted
+                ],
+                "whole_cell_mask_pixel_number": whole_pixel_number_column[
+                    counted
+                ],
+            },
+            index=cell_index[counted],
+        )
+
+        return (
+            Cell_DataFrame,
+            add_up_cell_counted_number,
+            total_cells_identified,
+        )
 
     def Register_cells(data_frame_list):
         """
@@ -2067,34 +1959,35 @@ class ProcessImage:
             Registered dataframe.
 
         """
+        data_frame_list = [
+            data_frame.set_index("Unnamed: 0")
+            for data_frame in data_frame_list
+        ]
+
         # Set the first data frame as starter as it should have most cells.
-        whole_registered_dataframe = data_frame_list[0].set_index("Unnamed: 0")
-
-        for previous_dataframe_index in range(len(data_frame_list) - 1):
-            if previous_dataframe_index == 0:
-                registered_dataframe = (
-                    ProcessImage.Register_between_dataframes(
-                        data_frame_list[previous_dataframe_index].set_index(
-                            "Unnamed: 0"
-                        ),
-                        data_frame_list[
-                            previous_dataframe_index + 1
-                        ].set_index("Unnamed: 0"),
-                    )
-                )
-            else:
-                registered_dataframe = (
-                    ProcessImage.Register_between_dataframes(
-                        registered_dataframe,
-                        data_frame_list[
-                            previous_dataframe_index + 1
-                        ].set_index("Unnamed: 0"),
-                    )
-                )
+        whole_registered_dataframe = data_frame_list[0]
+
+        # Bounding boxes are parsed once per round, all rounds are followed
+        # in one go.
+        chain = cell_registration.register_rounds(
+            [
+                cell_registration.CellBoxes(data_frame)
+                for data_frame in data_frame_list
+            ]
+        )
+
+        for round_index, (first_positions, positions) in enumerate(chain):
+            registered_dataframe = data_frame_list[round_index + 1].iloc[
+                positions
+            ]
+            # Cells are named after the cell they are in the first round.
+            registered_dataframe = registered_dataframe.set_axis(
+                whole_registered_dataframe.index[first_positions], axis=0
+            )
 
             whole_registered_dataframe = whole_registered_dataframe.join(
                 registered_dataframe,
-                rsuffix="_round_{}".format(previous_dataframe_index + 1),
+                rsuffix="_round_{}".format(round_index + 1),
             )
 
         return whole_registered_dataframe
@@ -2165,125 +2058,17 @@ class ProcessImage:
             Show NAN on row instead if fail to trace back the cell.
 
         """
+        previous_positions, latter_positions = cell_registration.match_cells(
+            cell_registration.CellBoxes(dataframe_previous),
+            cell_registration.CellBoxes(dataframe_latter),
+            boundingbox_overlapping_thres,
+        )
 
-        registered_dataframe = pd.DataFrame()
-
-        for (
-            index_previous_data_frame,
-            row_previous_data_frame,
-        ) in dataframe_previous.iterrows():
-            # For each flat cell in round
-            bounding_box_str_Last_data_frame = row_previous_data_frame[
-                "BoundingBox"
-            ]
-            ImgNameInfor_string = row_previous_data_frame["ImgNameInfor"]
-
-            # Retrieve boundingbox information
-            (
-                minr_Data_1,
-                maxr_Data_1,
-                minc_Data_1,
-                maxc_Data_1,
-            ) = ProcessImage.Retrieve_boundingbox(
-                bounding_box_str_Last_data_frame
-            )
-
-            Area_bbox_Last_data_frame = (maxr_Data_1 - minr_Data_1) * (
-                maxc_Data_1 - minc_Data_1
-            )
-
-            intersection_area_percentage_list = []
-            index_list_same_coordinate = []
-
-            # From the image name information, locate rows only from the same coordinate, generate a pd.dataframe
-            DataFrame_of_same_coordinate = dataframe_latter[
-                dataframe_latter["ImgNameInfor"].str.contains(
-                    ImgNameInfor_string[
-                        ImgNameInfor_string.index("_R")
-                        + 1 : len(ImgNameInfor_string)
-                    ]
-                )
-            ]
-
-            for index_2, row_Data_2 in DataFrame_of_same_coordinate.iterrows():
-                bounding_box_str_latter = row_Data_2["BoundingBox"]
-                # Retrieve boundingbox information
-                (
-                    minr_Data_2,
-                    maxr_Data_2,
-                    minc_Data_2,
-                    maxc_Data_2,
-                ) = ProcessImage.Retrieve_boundingbox(bounding_box_str_latter)
-
-                Area_bbox_latter_round = (maxr_Data_2 - minr_Data_2) * (
-                    maxc_Data_2 - minc_Data_2
-                )
-
-                # Overlapping row
-                if minr_Data_2 < maxr_Data_1 and maxr_Data_2 > minr_Data_1:
-                    intersection_rowNumber = min(
-                        (
-                            abs(minr_Data_2 - maxr_Data_1),
-                            maxr_Data_1 - minr_Data_1,
-                        )
-                    ) - max(maxr_Data_1 - maxr_Data_2, 0)
-                else:
-                    intersection_rowNumber = 0
-                # Overlapping column
-                if minc_Data_2 < maxc_Data_1 and maxc_Data_2 > minc_Data_1:
-                    intersection_colNumber = min(
-                        (
-                            abs(minc_Data_2 - maxc_Data_1),
-                            maxc_Data_1 - minc_Data_1,
-                        )
-                    ) - max(maxc_Data_1 - maxc_Data_2, 0)
-                else:
-                    intersection_colNumber = 0
-
-                intersection_Area = (
-                    intersection_rowNumber * intersection_colNumber
-                )
-                # Calculate the percentage based on smaller number of intersection over the two.
-                intersection_Area_percentage = min(
-                    [
-                        (intersection_Area / Area_bbox_Last_data_frame),
-                        (intersection_Area / Area_bbox_latter_round),
-                    ]
-                )
-
-                intersection_area_percentage_list.append(
-                    intersection_Area_percentage
-                )
-                index_list_same_coordinate.append(index_2)
-
-            # Link back cells based on intersection area
-            if (
-                len(intersection_area_percentage_list) > 0
-                and max(intersection_area_percentage_list)
-                > boundingbox_overlapping_thres
-            ):
-                registered_cell_index = index_list_same_coordinate[
-                    intersection_area_percentage_list.index(
-                        max(intersection_area_percentage_list)
-                    )
-                ]
-
-                # Get the pd.series from dataframe.
-                registered_cell_Series = DataFrame_of_same_coordinate.loc[
-                    registered_cell_index
-                ].copy()
-
-                # Update the Cell index in the first column.
-                registered_cell_Series.name = (
-                    dataframe_previous.loc[index_previous_data_frame]
-                    .copy()
-                    .name
-                )
-
-                # Append the series as dataframe
-                registered_dataframe = registered_dataframe.append(
-                    registered_cell_Series.to_frame().T
-                )
+        # Update the Cell index to the one in the previous dataframe.
+        registered_dataframe = dataframe_latter.iloc[latter_positions]
+        registered_dataframe = registered_dataframe.set_axis(
+            dataframe_previous.index[previous_positions], axis=0
+        )
 
         return registered_dataframe
 
@@ -2314,187 +2099,34 @@ class ProcessImage:
 
             cell_Data_1 = cell_Data_1.add_suffix("_Tag")
             cell_Data_2 = cell_Data_2.add_suffix("_Lib")
-            cell_merged_num = 0
 
             logging.info("Start linking cells...")
 
             # Assume that cell_Data_1 is the tag protein dataframe, for each of the cell bounding box,
             # find the one with the most intersection from library dataframe.
             start_time = time.time()
-            for index_Data_1, row_Data_1 in cell_Data_1.iterrows():
-                # For each flat cell in round
-                bounding_box_str_Data_1 = row_Data_1["BoundingBox_Tag"]
-                ImgNameInforString_Data1 = row_Data_1["ImgNameInfor_Tag"]
-                # Retrieve boundingbox information
-                minr_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("minr")
-                        + 4 : bounding_box_str_Data_1.index("_maxr")
-                    ]
-                )
-                maxr_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("maxr")
-                        + 4 : bounding_box_str_Data_1.index("_minc")
-                    ]
-                )
-                minc_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("minc")
-                        + 4 : bounding_box_str_Data_1.index("_maxc")
-                    ]
-                )
-                maxc_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("maxc")
-                        + 4 : len(bounding_box_str_Data_1)
-                    ]
-                )
-
-                Area_cell_1 = (maxr_Data_1 - minr_Data_1) * (
-                    maxc_Data_1 - minc_Data_1
-                )
-
-                intersection_Area_percentage_list = []
-                index_list_Data_2 = []
-
-                # Iterate through DataFrame 2 calculating intersection area
-                # Get dataframe of same coordinate in dataframe from next round.
-                DataFrame_of_same_coordinate_Data2 = cell_Data_2[
-                    cell_Data_2["ImgNameInfor_Lib"].str.contains(
-                        ImgNameInforString_Data1[
-                            ImgNameInforString_Data1.index("_R")
-                            + 1 : len(ImgNameInforString_Data1)
-                        ]
-                    )
-                ]
-
-                for (
-                    index_2,
-                    row_Data_2,
-                ) in DataFrame_of_same_coordinate_Data2.iterrows():
-                    bounding_box_str_Data_2 = row_Data_2["BoundingBox_Lib"]
-                    # Retrieve boundingbox information
-                    minr_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("minr")
-                            + 4 : bounding_box_str_Data_2.index("_maxr")
-                        ]
-                    )
-                    maxr_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("maxr")
-                            + 4 : bounding_box_str_Data_2.index("_minc")
-                        ]
-                    )
-                    minc_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("minc")
-                            + 4 : bounding_box_str_Data_2.index("_maxc")
-                        ]
-                    )
-                    maxc_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("maxc")
-                            + 4 : len(bounding_box_str_Data_2)
-                        ]
-                    )
-
-                    Area_cell_2 = (maxr_Data_2 - minr_Data_2) * (
-                        maxc_Data_2 - minc_Data_2
-                    )
-
-                    # Overlapping row
-                    if minr_Data_2 < maxr_Data_1 and maxr_Data_2 > minr_Data_1:
-                        intersection_rowNumber = min(
-                            (
-                                abs(minr_Data_2 - maxr_Data_1),
-                                maxr_Data_1 - minr_Data_1,
-                            )
-                        ) - max(maxr_Data_1 - maxr_Data_2, 0)
-                    else:
-                        intersection_rowNumber = 0
-                    # Overlapping column
-                    if minc_Data_2 < maxc_Data_1 and maxc_Data_2 > minc_Data_1:
-                        intersection_colNumber = min(
-                            (
-                                abs(minc_Data_2 - maxc_Data_1),
-                                maxc_Data_1 - minc_Data_1,
-                            )
-                        ) - max(maxc_Data_1 - maxc_Data_2, 0)
-                    else:
-                        intersection_colNumber = 0
-
-                    intersection_Area = (
-                        intersection_rowNumber * intersection_colNumber
-                    )
-                    # Calculate the percentage based on smaller number of intersection over the two.
-                    intersection_Area_percentage = min(
-                        [
-                            (intersection_Area / Area_cell_1),
-                            (intersection_Area / Area_cell_2),
-                        ]
-                    )
-
-                    intersection_Area_percentage_list.append(
-                        intersection_Area_percentage
-                    )
-                    index_list_Data_2.append(index_2)
-
-                if len(intersection_Area_percentage_list) > 0:
-                    # Link back cells based on intersection area
-                    if max(intersection_Area_percentage_list) > 0.6:
-                        # If in DataFrame_2 there's a cell that has a overlapping bounding box, merge and generate a new dataframe.
-                        Merge_data2_index = index_list_Data_2[
-                            intersection_Area_percentage_list.index(
-                                max(intersection_Area_percentage_list)
-                            )
-                        ]
-
-                        pd_data_of_single_cell = pd.concat(
-                            (
-                                cell_Data_1.loc[index_Data_1],
-                                cell_Data_2.loc[Merge_data2_index],
-                            ),
-                            axis=0,
-                        )
+            positions_1, positions_2 = cell_registration.match_cells(
+                cell_registration.CellBoxes(
+                    cell_Data_1, "BoundingBox_Tag", "ImgNameInfor_Tag"
+                ),
+                cell_registration.CellBoxes(
+                    cell_Data_2, "BoundingBox_Lib", "ImgNameInfor_Lib"
+                ),
+                0.6,
+            )
 
-                        # Add the lib/tag brightness ratio
-                        Lib_Tag_ratio = pd.DataFrame(
-                            [
-                                pd_data_of_single_cell.loc[
-                                    "Mean_intensity_in_contour_Lib"
-                                ]
-                                / pd_data_of_single_cell.loc[
-                                    "Mean_intensity_in_contour_Tag"
-                                ]
-                            ],
-                            index=["Lib_Tag_contour_ratio"],
-                        )
+            Cell_DataFrame_Merged = cell_registration.merge_linked(
+                cell_Data_1, cell_Data_2, positions_1, positions_2
+            )
 
-                        pd_data_of_single_cell = pd.concat(
-                            (pd_data_of_single_cell, Lib_Tag_ratio), axis=0
-                        )
-                        pd_data_of_single_cell.rename(
-                            columns={0: "Cell {}".format(cell_merged_num)},
-                            inplace=True,
-                        )  # Rename the column name, which is the index name after T.
-
-                        if cell_merged_num == 0:
-                            Cell_DataFrame_Merged = pd_data_of_single_cell
-                        else:
-                            Cell_DataFrame_Merged = pd.concat(
-                                (
-                                    Cell_DataFrame_Merged,
-                                    pd_data_of_single_cell,
-                                ),
-                                axis=1,
-                            )
-                        cell_merged_num += 1
+            # Add the lib/tag brightness ratio
+            Cell_DataFrame_Merged["Lib_Tag_contour_ratio"] = (
+                Cell_DataFrame_Merged["Mean_intensity_in_contour_Lib"]
+                / Cell_DataFrame_Merged["Mean_intensity_in_contour_Tag"]
+            )
 
             end_time = time.time()
             logging.info("Register takes {}".format(end_time - start_time))
-            Cell_DataFrame_Merged = Cell_DataFrame_Merged.T
             logging.info("Cell_DataFrame_Merged.")
 
         elif method == "Kcl":
@@ -2507,261 +2139,56 @@ class ProcessImage:
 
             cell_Data_1 = cell_Data_1.add_suffix("_EC")
             cell_Data_2 = cell_Data_2.add_suffix("_KC")
-            cell_merged_num = 0
 
             logging.info("Start linking cells...")
             start_time = time.time()
 
-            for index_Data_1, row_Data_1 in cell_Data_1.iterrows():
-                # For each flat cell in round
-                try:
-                    # For absolute intensity
-                    bounding_box_str_Data_1 = row_Data_1["BoundingBox_EC"]
-                    ImgNameInforString_Data1 = row_Data_1["ImgNameInfor_EC"]
-                except Exception as exc:
-                    logging.critical("caught exception", exc_info=exc)
-                    # For ratio registration
-                    bounding_box_str_Data_1 = row_Data_1["BoundingBox_Tag_EC"]
-                    ImgNameInforString_Data1 = row_Data_1[
-                        "ImgNameInfor_Tag_EC"
-                    ]
+            if "BoundingBox_EC" in cell_Data_1.columns:
+                # For absolute intensity
+                fields_1 = ("BoundingBox_EC", "ImgNameInfor_EC")
+            else:
+                # For ratio registration
+                fields_1 = ("BoundingBox_Tag_EC", "ImgNameInfor_Tag_EC")
+            if "BoundingBox_KC" in cell_Data_2.columns:
+                fields_2 = ("BoundingBox_KC", "ImgNameInfor_KC")
+            else:
+                fields_2 = ("BoundingBox_Tag_KC", "ImgNameInfor_Tag_KC")
 
-                # Retrieve boundingbox information
-                minr_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("minr")
-                        + 4 : bounding_box_str_Data_1.index("_maxr")
-                    ]
-                )
-                maxr_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("maxr")
-                        + 4 : bounding_box_str_Data_1.index("_minc")
-                    ]
-                )
-                minc_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("minc")
-                        + 4 : bounding_box_str_Data_1.index("_maxc")
-                    ]
+            positions_1, positions_2 = cell_registration.match_cells(
+                cell_registration.CellBoxes(cell_Data_1, *fields_1),
+                cell_registration.CellBoxes(cell_Data_2, *fields_2),
+                0.6,
+            )
+
+            Cell_DataFrame_Merged = cell_registration.merge_linked(
+                cell_Data_1, cell_Data_2, positions_1, positions_2
+            )
+
+            # Add the lib/tag brightness ratio
+            if "Mean_intensity_in_contour_KC" in Cell_DataFrame_Merged.columns:
+                # For absolute intensity
+                # For ones with lib/tag ratio, it will have 'Mean_intensity_in_contour_Lib_KC' field instead.
+                Cell_DataFrame_Merged[
+                    "KC_EC_Mean_intensity_in_contour_ratio"
+                ] = (
+                    Cell_DataFrame_Merged["Mean_intensity_in_contour_KC"]
+                    / Cell_DataFrame_Merged["Mean_intensity_in_contour_EC"]
                 )
-                maxc_Data_1 = int(
-                    bounding_box_str_Data_1[
-                        bounding_box_str_Data_1.index("maxc")
-                        + 4 : len(bounding_box_str_Data_1)
-                    ]
+            else:
+                # For lib/tag KC/EC ratio
+                Cell_DataFrame_Merged[
+                    "KC_EC_Mean_intensity_in_contour_ratio"
+                ] = (
+                    Cell_DataFrame_Merged["Mean_intensity_in_contour_Lib_KC"]
+                    / Cell_DataFrame_Merged["Mean_intensity_in_contour_Lib_EC"]
                 )
-
-                Area_cell_1 = (maxr_Data_1 - minr_Data_1) * (
-                    maxc_Data_1 - minc_Data_1
+                Cell_DataFrame_Merged["KC_EC_LibTag_contour_ratio"] = (
+                    Cell_DataFrame_Merged["Lib_Tag_contour_ratio_KC"]
+                    / Cell_DataFrame_Merged["Lib_Tag_contour_ratio_EC"]
                 )
 
-                intersection_Area_percentage_list = []
-                index_list_Data_2 = []
-
-                # Iterate through DataFrame 2 calculating intersection area
-                # Get dataframe of same coordinate in dataframe from next round.
-                try:
-                    DataFrame_of_same_coordinate_Data2 = cell_Data_2[
-                        cell_Data_2["ImgNameInfor_KC"].str.contains(
-                            ImgNameInforString_Data1[
-                                ImgNameInforString_Data1.index("_R")
-                                + 1 : len(ImgNameInforString_Data1)
-                            ]
-                        )
-                    ]
-                except Exception as exc:
-                    logging.critical("caught exception", exc_info=exc)
-                    DataFrame_of_same_coordinate_Data2 = cell_Data_2[
-                        cell_Data_2["ImgNameInfor_Tag_KC"].str.contains(
-                            ImgNameInforString_Data1[
-                                ImgNameInforString_Data1.index("_R")
-                                + 1 : len(ImgNameInforString_Data1)
-                            ]
-                        )
-                    ]
-
-                for (
-                    index_2,
-                    row_Data_2,
-                ) in DataFrame_of_same_coordinate_Data2.iterrows():
-                    # ImgNameInforString_Data2 = row_Data_2['ImgNameInfor_KC']
-                    try:
-                        bounding_box_str_Data_2 = row_Data_2["BoundingBox_KC"]
-                    except Exception as exc:
-                        logging.critical("caught exception", exc_info=exc)
-                        bounding_box_str_Data_2 = row_Data_2[
-                            "BoundingBox_Tag_KC"
-                        ]
-                    # Retrieve boundingbox information
-                    minr_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("minr")
-                            + 4 : bounding_box_str_Data_2.index("_maxr")
-                        ]
-                    )
-                    maxr_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("maxr")
-                            + 4 : bounding_box_str_Data_2.index("_minc")
-                        ]
-                    )
-                    minc_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("minc")
-                            + 4 : bounding_box_str_Data_2.index("_maxc")
-                        ]
-                    )
-                    maxc_Data_2 = int(
-                        bounding_box_str_Data_2[
-                            bounding_box_str_Data_2.index("maxc")
-                            + 4 : len(bounding_box_str_Data_2)
-                        ]
-                    )
-
-                    Area_cell_2 = (maxr_Data_2 - minr_Data_2) * (
-                        maxc_Data_2 - minc_Data_2
-                    )
-
-                    # Overlapping row
-                    if minr_Data_2 < maxr_Data_1 and maxr_Data_2 > minr_Data_1:
-                        intersection_rowNumber = min(
-                            (
-                                abs(minr_Data_2 - maxr_Data_1),
-                                maxr_Data_1 - minr_Data_1,
-                            )
-                        ) - max(maxr_Data_1 - maxr_Data_2, 0)
-                    else:
-                        intersection_rowNumber = 0
-                    # Overlapping column
-                    if minc_Data_2 < maxc_Data_1 and maxc_Data_2 > minc_Data_1:
-                        intersection_colNumber = min(
-                            (
-                                abs(minc_Data_2 - maxc_Data_1),
-                                maxc_Data_1 - minc_Data_1,
-                            )
-                        ) - max(maxc_Data_1 - maxc_Data_2, 0)
-                    else:
-                        intersection_colNumber = 0
-
-                    intersection_Area = (
-                        intersection_rowNumber * intersection_colNumber
-                    )
-                    # Calculate the percentage based on smaller number of intersection over the two.
-                    intersection_Area_percentage = min(
-                        [
-                            (intersection_Area / Area_cell_1),
-                            (intersection_Area / Area_cell_2),
-                        ]
-                    )
-
-                    intersection_Area_percentage_list.append(
-                        intersection_Area_percentage
-                    )
-                    index_list_Data_2.append(index_2)
-
-                if len(intersection_Area_percentage_list) > 0:
-                    # Link back cells based on intersection area
-                    if max(intersection_Area_percentage_list) > 0.6:
-                        # If in DataFrame_2 there's a cell that has a overlapping bounding box, merge and generate a new dataframe.
-                        Merge_data2_index = index_list_Data_2[
-                            intersection_Area_percentage_list.index(
-                                max(intersection_Area_percentage_list)
-                            )
-                        ]
-
-                        pd_data_of_single_cell = pd.concat(
-                            (
-                                cell_Data_1.loc[index_Data_1],
-                                cell_Data_2.loc[Merge_data2_index],
-                            ),
-                            axis=0,
-                        )
-
-                        # Add the lib/tag brightness ratio
-                        if (
-                            "Mean_intensity_in_contour_KC"
-                            in pd_data_of_single_cell.index
-                        ):
-                            # For absolute intensity
-                            # For ones with lib/tag ratio, it will have 'Mean_intensity_in_contour_Lib_KC' field instead.
-                            Kcl_Lib_Tag_ratio = pd.DataFrame(
-                                [
-                                    pd_data_of_single_cell.loc[
-                                        "Mean_intensity_in_contour_KC"
-                                    ]
-                                    / pd_data_of_single_cell.loc[
-                                        "Mean_intensity_in_contour_EC"
-                                    ]
-                                ],
-                                index=[
-                                    "KC_EC_Mean_intensity_in_contour_ratio"
-                                ],
-                            )
-
-                            pd_data_of_single_cell = pd.concat(
-                                (pd_data_of_single_cell, Kcl_Lib_Tag_ratio),
-                                axis=0,
-                            )
-                        else:
-                            # For lib/tag KC/EC ratio
-                            Kcl_LibTag_contour_ratio = pd.DataFrame(
-                                [
-                                    pd_data_of_single_cell.loc[
-                                        "Lib_Tag_contour_ratio_KC"
-                                    ]
-                                    / pd_data_of_single_cell.loc[
-                                        "Lib_Tag_contour_ratio_EC"
-                                    ]
-                                ],
-                                index=["KC_EC_LibTag_contour_ratio"],
-                            )
-                            Kcl_Lib_Tag_ratio = pd.DataFrame(
-                                [
-                                    pd_data_of_single_cell.loc[
-                                        "Mean_intensity_in_contour_Lib_KC"
-                                    ]
-                                    / pd_data_of_single_cell.loc[
-                                        "Mean_intensity_in_contour_Lib_EC"
-                                    ]
-                                ],
-                                index=[
-                                    "KC_EC_Mean_intensity_in_contour_ratio"
-                                ],
-                            )
-
-                            pd_data_of_single_cell = pd.concat(
-                                (pd_data_of_single_cell, Kcl_Lib_Tag_ratio),
-                                axis=0,
-                            )
-                            pd_data_of_single_cell = pd.concat(
-                                (
-                                    pd_data_of_single_cell,
-                                    Kcl_LibTag_contour_ratio,
-                                ),
-                                axis=0,
-                            )
-
-                        pd_data_of_single_cell.rename(
-                            columns={0: "Cell {}".format(cell_merged_num)},
-                            inplace=True,
-                        )  # Rename the column name, which is the index name after T.
-
-                        if cell_merged_num == 0:
-                            Cell_DataFrame_Merged = pd_data_of_single_cell
-                        else:
-                            Cell_DataFrame_Merged = pd.concat(
-                                (
-                                    Cell_DataFrame_Merged,
-                                    pd_data_of_single_cell,
-                                ),
-                                axis=1,
-                            )
-                        cell_merged_num += 1
-
             end_time = time.time()
             logging.info("Register takes {}".format(end_time - start_time))
-            Cell_DataFrame_Merged = Cell_DataFrame_Merged.T
             logging.info("Cell_DataFrame_Merged.")
 
         return Cell_DataFrame_Merged
@@ -2785,161 +2212,54 @@ class ProcessImage:
             Return False if failed to find the same cell from other round.
 
         """
-
-        # For each flat cell in round
-        bounding_box_str_Data_1 = input_series[1]["BoundingBox_Tag"]
-        ImgNameInforString_Data1 = input_series[1]["ImgNameInfor_Tag"]
-        # Retrieve boundingbox information
-        minr_Data_1 = int(
-            bounding_box_str_Data_1[
-                bounding_box_str_Data_1.index("minr")
-                + 4 : bounding_box_str_Data_1.index("_maxr")
-            ]
-        )
-        maxr_Data_1 = int(
-            bounding_box_str_Data_1[
-                bounding_box_str_Data_1.index("maxr")
-                + 4 : bounding_box_str_Data_1.index("_minc")
-            ]
-        )
-        minc_Data_1 = int(
-            bounding_box_str_Data_1[
-                bounding_box_str_Data_1.index("minc")
-                + 4 : bounding_box_str_Data_1.index("_maxc")
-            ]
-        )
-        maxc_Data_1 = int(
-            bounding_box_str_Data_1[
-                bounding_box_str_Data_1.index("maxc")
-                + 4 : len(bounding_box_str_Data_1)
-            ]
-        )
-
-        Area_cell_1 = (maxr_Data_1 - minr_Data_1) * (maxc_Data_1 - minc_Data_1)
-
-        intersection_Area_percentage_list = []
-        index_list_Data_2 = []
-        # Iterate through DataFrame 2 calculating intersection area
         # Get dataframe of same coordinate in dataframe from next round.
+        coordinate = cell_registration.coordinate_key(
+            input_series[1]["ImgNameInfor_Tag"]
+        )
         DataFrame_of_same_coordinate_Data2 = cell_Data_2[
-            cell_Data_2["ImgNameInfor_Lib"].str.contains(
-                ImgNameInforString_Data1[
-                    ImgNameInforString_Data1.index("_R")
-                    + 1 : len(ImgNameInforString_Data1)
-                ]
+            cell_Data_2["ImgNameInfor_Lib"].map(
+                cell_registration.coordinate_key
             )
+            == coordinate
         ]
 
-        for (
-            index_2,
-            row_Data_2,
-        ) in DataFrame_of_same_coordinate_Data2.iterrows():
-            # ImgNameInforString_Data2 = row_Data_2["ImgNameInfor_Lib"]
-
-            bounding_box_str_Data_2 = row_Data_2["BoundingBox_Lib"]
-            # Retrieve boundingbox information
-            minr_Data_2 = int(
-                bounding_box_str_Data_2[
-                    bounding_box_str_Data_2.index("minr")
-                    + 4 : bounding_box_str_Data_2.index("_maxr")
-                ]
-            )
-            maxr_Data_2 = int(
-                bounding_box_str_Data_2[
-                    bounding_box_str_Data_2.index("maxr")
-                    + 4 : bounding_box_str_Data_2.index("_minc")
-                ]
-            )
-            minc_Data_2 = int(
-                bounding_box_str_Data_2[
-                    bounding_box_str_Data_2.index("minc")
-                    + 4 : bounding_box_str_Data_2.index("_maxc")
-                ]
-            )
-            maxc_Data_2 = int(
-                bounding_box_str_Data_2[
-                    bounding_box_str_Data_2.index("maxc")
-                    + 4 : len(bounding_box_str_Data_2)
-                ]
-            )
-
-            Area_cell_2 = (maxr_Data_2 - minr_Data_2) * (
-                maxc_Data_2 - minc_Data_2
-            )
-
-            # Overlapping row
-            if minr_Data_2 < maxr_Data_1 and maxr_Data_2 > minr_Data_1:
-                intersection_rowNumber = min(
-                    (abs(minr_Data_2 - maxr_Data_1), maxr_Data_1 - minr_Data_1)
-                ) - max(maxr_Data_1 - maxr_Data_2, 0)
-            else:
-                intersection_rowNumber = 0
-            # Overlapping column
-            if minc_Data_2 < maxc_Data_1 and maxc_Data_2 > minc_Data_1:
-                intersection_colNumber = min(
-                    (abs(minc_Data_2 - maxc_Data_1), maxc_Data_1 - minc_Data_1)
-                ) - max(maxc_Data_1 - maxc_Data_2, 0)
-            else:
-                intersection_colNumber = 0
-
-            intersection_Area = intersection_rowNumber * intersection_colNumber
-            # Calculate the percentage based on smaller number of intersection over the two.
-            intersection_Area_percentage = min(
-                [
-                    (intersection_Area / Area_cell_1),
-                    (intersection_Area / Area_cell_2),
-                ]
-            )
-
-            intersection_Area_percentage_list.append(
-                intersection_Area_percentage
-            )
-            index_list_Data_2.append(index_2)
-
-        if len(intersection_Area_percentage_list) > 0:
-            # Link back cells based on intersection area
-            if max(intersection_Area_percentage_list) > 0.6:
-                # If in DataFrame_2 there's a cell that has a overlapping bounding box, merge and generate a new dataframe.
-                Merge_data2_index = index_list_Data_2[
-                    intersection_Area_percentage_list.index(
-                        max(intersection_Area_percentage_list)
-                    )
-                ]
-
-                pd_data_of_single_cell = pd.concat(
-                    (
-                        cell_Data_1.loc[input_series[0]],
-                        cell_Data_2.loc[Merge_data2_index],
-                    ),
-                    axis=0,
-                )
+        intersection_Area_percentage = cell_registration.overlap_fraction(
+            cell_registration.parse_bounding_boxes(
+                [input_series[1]["BoundingBox_Tag"]]
+            ),
+            cell_registration.parse_bounding_boxes(
+                DataFrame_of_same_coordinate_Data2["BoundingBox_Lib"]
+            ),
+        )[0]
 
-                # Add the lib/tag brightness ratio
-                Lib_Tag_ratio = pd.DataFrame(
-                    [
-                        pd_data_of_single_cell.loc[
-                            "Mean_intensity_in_contour_Lib"
-                        ]
-                        / pd_data_of_single_cell.loc[
-                            "Mean_intensity_in_contour_Tag"
-                        ]
-                    ],
-                    index=["Lib_Tag_contour_ratio"],
-                )
+        # Link back cells based on intersection area
+        if (
+            len(intersection_Area_percentage) == 0
+            or intersection_Area_percentage.max() <= 0.6
+        ):
+            return False
 
-                pd_data_of_single_cell = pd.concat(
-                    (pd_data_of_single_cell, Lib_Tag_ratio), axis=0
-                )
-                pd_data_of_single_cell.rename(
-                    columns={0: "Cell {}".format(int(input_series[0][5:]))},
-                    inplace=True,
-                )  # Rename the column name, which is the index name after T.
+        Merge_data2_index = DataFrame_of_same_coordinate_Data2.index[
+            intersection_Area_percentage.argmax()
+        ]
 
-            else:
-                pd_data_of_single_cell = False
+        pd_data_of_single_cell = pd.concat(
+            (
+                cell_Data_1.loc[input_series[0]],
+                cell_Data_2.loc[Merge_data2_index],
+            ),
+            axis=0,
+        )
 
-        else:
-            pd_data_of_single_cell = False
+        # Add the lib/tag brightness ratio
+        pd_data_of_single_cell["Lib_Tag_contour_ratio"] = (
+            pd_data_of_single_cell["Mean_intensity_in_contour_Lib"]
+            / pd_data_of_single_cell["Mean_intensity_in_contour_Tag"]
+        )
+        # Rename the column name, which is the index name after T.
+        pd_data_of_single_cell = pd_data_of_single_cell.to_frame(
+            "Cell {}".format(int(input_series[0][5:]))
+        )
 
         return pd_data_of_single_cell
 
@@ -4214,7 +3534,11 @@ class ProcessImage:
     """
 
     def image_stitching(
-        Nest_data_directory, scanning_coord_step=1585, row_data_folder=True
+        Nest_data_directory,
+        scanning_coord_step=1585,
+        row_data_folder=True,
+        saving_directory=None,
+        max_workers=8,
     ):
         """
         Stitch all screening images together into one.
@@ -4224,10 +3548,18 @@ class ProcessImage:
             Directory in which all images are stored.
         row_data_folder : bool, optional
             For MaskRCNN mask stitching, this is False. The default is True.
+        saving_directory : string, optional
+            If given, every round is stitched on disk into
+            "{round} stitched" in this directory, with a pyramid of
+            downsampled levels, see tiled_stitching.StitchedMosaic.
+            The default stitches in memory.
+        max_workers : int, optional
+            Number of threads reading images. The default is 8.
 
         Returns
         Stitched_image_dict : dict
-            Dict containing stitched images of all rounds.
+            Dict containing stitched images of all rounds, in the dtype of
+            the images. Memory maps if saving_directory is given.
 
         """
         (
@@ -4238,75 +3570,24 @@ class ProcessImage:
             Nest_data_directory, row_data_folder
         )
 
-        imageinfo_DataFrame = []
-        for Each_round in RoundNumberList:
-            for Each_coord_image_filename in fileNameList:
-                if (
-                    Each_round in Each_coord_image_filename
-                ):  # Loop through each image in round
-                    if row_data_folder is True:
-                        Coord_text = Each_coord_image_filename[
-                            Each_coord_image_filename.index(
-                                "_R"
-                            ) : Each_coord_image_filename.index("_PMT")
-                        ]
-                    else:
-                        Coord_text = Each_coord_image_filename[
-                            Each_coord_image_filename.index("_R") : len(
-                                Each_coord_image_filename
-                            )
-                            - 4
-                        ]
-
-                    Stage_row_index = int(
-                        Coord_text[2 : Coord_text.index("C")]
-                    )
-                    Stage_column_index = int(
-                        Coord_text[Coord_text.index("C") + 1 : len(Coord_text)]
-                    )
-                    imageinfo_DataFrame.append(
-                        dict(
-                            zip(
-                                [
-                                    "Round",
-                                    "File name",
-                                    "Stage row index",
-                                    "Stage column index",
-                                ],
-                                [
-                                    Each_round,
-                                    Each_coord_image_filename,
-                                    Stage_row_index,
-                                    Stage_column_index,
-                                ],
-                            )
-                        )
-                    )
         # Generate the data frame which contains coordinates information
-        imageinfo_DataFrame = pd.DataFrame(imageinfo_DataFrame)
+        imageinfo_DataFrame = tiled_stitching.tile_table(fileNameList)
 
         # Get the scanning step size
-        if (
-            imageinfo_DataFrame.iloc[0]["Stage row index"]
-            != imageinfo_DataFrame.iloc[1]["Stage row index"]
-        ):
-            scanning_coord_step = (
-                imageinfo_DataFrame.iloc[1]["Stage row index"]
-                - imageinfo_DataFrame.iloc[0]["Stage row index"]
-            )
-        else:
-            scanning_coord_step = (
-                imageinfo_DataFrame.iloc[1]["Stage column index"]
-                - imageinfo_DataFrame.iloc[0]["Stage column index"]
-            )
-
+        scanning_coord_step = tiled_stitching.scanning_step(
+            imageinfo_DataFrame, scanning_coord_step
+        )
         logging.info(
             "scanning_coord_step set to {}!".format(scanning_coord_step)
         )
 
-        # Assume that col and row coordinates numbers are the same.
-        max_coord_value = imageinfo_DataFrame["Stage column index"].max()
-        number_of_coord = int(max_coord_value / scanning_coord_step + 1)
+        (
+            grid_rows,
+            grid_cols,
+            number_of_coord,
+        ) = tiled_stitching.grid_positions(
+            imageinfo_DataFrame, scanning_coord_step
+        )
 
         # Get the pixel number of image.
         example_image = imread(
@@ -4319,62 +3600,40 @@ class ProcessImage:
 
         Stitched_image_dict = {}
         for Each_round in RoundNumberList:
-            # Create the empty array holder
-            final_image_size = image_pixel_number * number_of_coord
-            if row_data_folder is True:
-                final_image_holder = np.empty(
-                    (final_image_size, final_image_size)
-                )
+            in_round = (imageinfo_DataFrame["Round"] == Each_round).to_numpy()
+            file_paths = [
+                os.path.join(Nest_data_directory, file_name)
+                for file_name in imageinfo_DataFrame["File name"][in_round]
+            ]
+
+            if saving_directory is None:
+                filename = None
             else:
-                # For ML mask assembly, its RGBA format, size MxNx4.
-                final_image_holder = np.empty(
-                    (final_image_size, final_image_size, 4), dtype="uint8"
+                round_directory = os.path.join(
+                    saving_directory, "{} stitched".format(Each_round)
                 )
+                os.makedirs(round_directory, exist_ok=True)
+                filename = os.path.join(round_directory, "level0.npy")
+
+            final_image_holder = tiled_stitching.stitch_tiles(
+                file_paths,
+                grid_rows[in_round],
+                grid_cols[in_round],
+                number_of_coord,
+                image_pixel_number,
+                example_image.shape[2:],
+                example_image.dtype,
+                filename=filename,
+                max_workers=max_workers,
+            )
 
-            for index, row_Data in imageinfo_DataFrame.iterrows():
-                if Each_round == row_Data["Round"]:
-                    # col and row in stage coordinates are opposite of np coordinates
-
-                    final_image_holder_col_start = (
-                        final_image_size
-                        - image_pixel_number
-                        * (
-                            int(
-                                row_Data["Stage row index"]
-                                / scanning_coord_step
-                            )
-                            + 1
-                        )
-                    )
-                    final_image_holder_row_start = image_pixel_number * (
-                        int(
-                            row_Data["Stage column index"]
-                            / scanning_coord_step
-                        )
-                    )
-
-                    row_image = imread(
-                        os.path.join(
-                            Nest_data_directory, row_Data["File name"]
-                        )
-                    )
-
-                    if row_data_folder is True:
-                        final_image_holder[
-                            final_image_holder_row_start : final_image_holder_row_start
-                            + image_pixel_number,
-                            final_image_holder_col_start : final_image_holder_col_start
-                            + image_pixel_number,
-                        ] = row_image
-                    else:  # In ML masks there's a white line at the bottom of image, needs to crop it.
-                        final_image_holder[
-                            final_image_holder_row_start : final_image_holder_row_start
-                            + image_pixel_number,
-                            final_image_holder_col_start : final_image_holder_col_start
-                            + image_pixel_number,
-                        ] = row_image[
-                            0:image_pixel_number, 0:image_pixel_number, :
-                        ]
+            if saving_directory is not None:
+                # For ML masks, don't blend the colors of neighbouring cells.
+                tiled_stitching.build_pyramid(
+                    final_image_holder,
+                    round_directory,
+                    method="mean" if row_data_folder is True else "nearest",
+                )
 
             Stitched_image_dict[Each_round] = final_image_holder
 
@@ -4399,62 +3658,21 @@ class ProcessImage:
             fileNameList,
         ) = ProcessImage.retrive_scanning_scheme(Nest_data_directory)
 
-        imageinfo_DataFrame = []
-        for Each_round in RoundNumberList:
-            for Each_coord_image_filename in fileNameList:
-                if (
-                    Each_round in Each_coord_image_filename
-                ):  # Loop through each image in round
-                    Coord_text = Each_coord_image_filename[
-                        Each_coord_image_filename.index(
-                            "_R"
-                        ) : Each_coord_image_filename.index("_PMT")
-                    ]
-                    Stage_row_index = int(
-                        Coord_text[2 : Coord_text.index("C")]
-                    )
-                    Stage_column_index = int(
-                        Coord_text[Coord_text.index("C") + 1 : len(Coord_text)]
-                    )
-                    imageinfo_DataFrame.append(
-                        dict(
-                            zip(
-                                [
-                                    "Round",
-                                    "File name",
-                                    "Stage row index",
-                                    "Stage column index",
-                                ],
-                                [
-                                    Each_round,
-                                    Each_coord_image_filename,
-                                    Stage_row_index,
-                                    Stage_column_index,
-                                ],
-                            )
-                        )
-                    )
         # Generate the data frame which contains coordinates information
-        imageinfo_DataFrame = pd.DataFrame(imageinfo_DataFrame)
+        imageinfo_DataFrame = tiled_stitching.tile_table(fileNameList)
 
         # Get the scanning step size
-        if (
-            imageinfo_DataFrame.iloc[0]["Stage row index"]
-            != imageinfo_DataFrame.iloc[1]["Stage row index"]
-        ):
-            scanning_coord_step = (
-                imageinfo_DataFrame.iloc[1]["Stage row index"]
-                - imageinfo_DataFrame.iloc[0]["Stage row index"]
-            )
-        else:
-            scanning_coord_step = (
-                imageinfo_DataFrame.iloc[1]["Stage column index"]
-                - imageinfo_DataFrame.iloc[0]["Stage column index"]
-            )
+        scanning_coord_step = tiled_stitching.scanning_step(
+            imageinfo_DataFrame
+        )
 
-        # Assume that col and row coordinates numbers are the same.
-        max_coord_value = imageinfo_DataFrame["Stage column index"].max()
-        number_of_coord = int(max_coord_value / scanning_coord_step + 1)
+        (
+            grid_rows,
+            grid_cols,
+            number_of_coord,
+        ) = tiled_stitching.grid_positions(
+            imageinfo_DataFrame, scanning_coord_step
+        )
 
         focus_map_dict = {}
         for Each_round in RoundNumberList:
@@ -4463,42 +3681,29 @@ class ProcessImage:
                 (number_of_coord, number_of_coord)
             )
 
-            for index, row_Data in imageinfo_DataFrame.iterrows():
-                if Each_round == row_Data["Round"]:
-                    # col and row in stage coordinates are opposite of np coordinates
-
-                    final_focus_map_col_start = number_of_coord - (
-                        int(row_Data["Stage row index"] / scanning_coord_step)
-                        + 1
-                    )
-                    final_focus_map_row_start = int(
-                        row_Data["Stage column index"] / scanning_coord_step
+            in_round = (imageinfo_DataFrame["Round"] == Each_round).to_numpy()
+            for file_name, row, col in zip(
+                imageinfo_DataFrame["File name"][in_round],
+                grid_rows[in_round],
+                grid_cols[in_round],
+            ):
+                # Read the metadata and extract the focus position information.
+                with Image.open(
+                    os.path.join(Nest_data_directory, file_name)
+                ) as img:
+                    meta_dict = {
+                        TAGS[key]: img.tag[key] for key in img.tag.keys()
+                    }
+                    ImageDescription = meta_dict["ImageDescription"][0]
+                    objective_position = float(
+                        ImageDescription[
+                            ImageDescription.index("focuspos: =")
+                            + 11 : len(ImageDescription)
+                            - 1
+                        ]
                     )
 
-                    # Read the metadata and extract the focus position information.
-                    with Image.open(
-                        os.path.join(
-                            Nest_data_directory, row_Data["File name"]
-                        )
-                    ) as img:
-                        meta_dict = {
-                            TAGS[key]: img.tag[key] for key in img.tag.keys()
-                        }
-                        ImageDescription = meta_dict["ImageDescription"][0]
-                        objective_position = float(
-                            ImageDescription[
-                                ImageDescription.index("focuspos: =")
-                                + 11 : len(ImageDescription)
-                                - 1
-                            ]
-                        )
-
-                    final_focus_map_holder[
-                        final_focus_map_row_start : final_focus_map_row_start
-                        + 1,
-                        final_focus_map_col_start : final_focus_map_col_start
-                        + 1,
-                    ] = objective_position
+                final_focus_map_holder[row, col] = objective_position
 
             focus_map_dict[Each_round] = final_focus_map_holder
 
@@ -7134,13 +6339,17 @@ if __name__ == "__main__":
     if stitch_img is True:
         Nest_data_directory = r"M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\Octoscope\Evolution screening\2022-06-10  Evolution screening validation\WT\2022-06-10_16-26-51_WT_pmt"  # TODO hardcoded path
         Stitched_image_dict = ProcessImage.image_stitching(
-            Nest_data_directory, scanning_coord_step=1568, row_data_folder=True
+            Nest_data_directory,
+            scanning_coord_step=1568,
+            row_data_folder=True,
+            saving_directory=Nest_data_directory,
         )
 
         for key in Stitched_image_dict:
-            r2 = Stitched_image_dict[key]
-            row_image = Image.fromarray(r2)
-            row_image.save(
+            mosaic = tiled_stitching.StitchedMosaic(
+                os.path.join(Nest_data_directory, "{} stitched".format(key))
+            )
+            mosaic.save_tiff(
                 os.path.join(
                     Nest_data_directory, "{} stitched.tif".format(key)
                 )
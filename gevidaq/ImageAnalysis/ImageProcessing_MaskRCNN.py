@@ -12,14 +12,17 @@ from datetime import datetime
 import MaskRCNN.Miscellaneous.visualize as visualize
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 import plotly.express as px
 import tifffile as skimtiff
 from MaskRCNN.Configurations.ConfigFileInferenceOld import cellConfig
 from MaskRCNN.Engine.MaskRCNN import MaskRCNN as modellib
+from matplotlib.figure import Figure
 from skimage.io import imread
 from skimage.morphology import binary_dilation
 
 from .ImageProcessing import ProcessImage
+from .screening_pipeline import AnalysisPipeline
 
 
 # === ProcessImage ===
@@ -27,11 +30,25 @@ class ProcessImageML:
     def __init__(
         self,
         WeigthPath=r"M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\Martijn\FinalResults\ModelWeights.h5",  # TODO hardcoded path
+        Detector=None,
         *args,
         **kwargs,
     ):
+        """
+        Parameters
+        WeigthPath : str
+            MaskRCNN weights to load.
+        Detector : object, optional
+            Detector to use instead of MaskRCNN, like
+            screening_pipeline.ThresholdDetector. The default loads MaskRCNN.
+        """
         super().__init__(*args, **kwargs)
 
+        if Detector is not None:
+            self.Detector = Detector
+            self.config = getattr(Detector, "config", None)
+            return
+
         """
         # Initialize the detector instance and load the model.
         """
@@ -189,18 +206,7 @@ class ProcessImageML:
         MLresults = results[0]
 
         if show_result is True:
-            # Set class_names = [None,None,None,None] to mute class name display.
-            visualize.display_instances(
-                Rawimage,
-                MLresults["rois"],
-                MLresults["masks"],
-                MLresults["class_ids"],
-                class_names=[None, None, None, None],
-                scores=MLresults["scores"],  # None
-                centre_coors=MLresults["Centre_coor"],
-                Centre_coor_radius=2,
-                WhiteSpace=(0, 0),
-            )  # MLresults['class_ids'],MLresults['scores'],
+            self.show_detection(Rawimage, MLresults)
 
         if axis is not None:
             # If axis is given, draw on axis.
@@ -221,11 +227,59 @@ class ProcessImageML:
         else:
             return MLresults
 
+    def show_detection(self, image, MLresults):
+        """
+        Display the detection results on image.
+        """
+        # Set class_names = [None,None,None,None] to mute class name display.
+        visualize.display_instances(
+            image,
+            MLresults["rois"],
+            MLresults["masks"],
+            MLresults["class_ids"],
+            class_names=[None, None, None, None],
+            scores=MLresults["scores"],  # None
+            centre_coors=MLresults["Centre_coor"],
+            Centre_coor_radius=2,
+            WhiteSpace=(0, 0),
+        )  # MLresults['class_ids'],MLresults['scores'],
+
+    def save_overlay(self, image, MLresults, fig_name):
+        """
+        Save the detection results drawn on image.
+
+        Called from the overlay thread of the analysis pipeline, so this
+        draws on its own Figure instead of through pyplot.
+        """
+        fig = Figure()
+        ax = fig.add_subplot()
+        # Set class_names = [None,None,None,None] to mute class name display.
+        visualize.display_instances(
+            image,
+            MLresults["rois"],
+            MLresults["masks"],
+            MLresults["class_ids"],
+            class_names=[None, None, None, None],
+            ax=ax,
+            centre_coors=MLresults["Centre_coor"],
+            Centre_coor_radius=2,
+            WhiteSpace=(0, 0),
+        )  # MLresults['class_ids'],MLresults['scores'],
+        fig.tight_layout()
+        fig.savefig(
+            fname=fig_name,
+            dpi=200,
+            pad_inches=0.0,
+            bbox_inches="tight",
+        )
+
     """
     # === Organize cell properties dictionary ===
     """
 
-    def FluorescenceAnalysis(self, folder, round_num, save_mask=True):
+    def FluorescenceAnalysis(
+        self, folder, round_num, save_mask=True, feature_workers=4
+    ):
         """
         # Given the folder and round number, return a dictionary for the round
         # that contains each scanning position as key and structured array of detailed
@@ -244,6 +298,9 @@ class ProcessImageML:
             The target round number of analysis.
         save_mask: bool.
             Whether to save segmentation masks.
+        feature_workers: int.
+            Number of processes extracting cell features, see
+            screening_pipeline.AnalysisPipeline.
 
         Returns
         cell_Data : pd.DataFrame.
@@ -262,9 +319,9 @@ class ProcessImageML:
             # If the folder is not there, create the folder to store ML segmentations
             os.mkdir(os.path.join(folder, "MLimages_{}".format(round_num)))
 
-        for EachRound in RoundNumberList:
-            cells_counted_in_round = 0
+        cell_Data = pd.DataFrame()
 
+        for EachRound in RoundNumberList:
             background_substraction = False
             # For background_substraction
             # If background images are taken
@@ -300,13 +357,9 @@ class ProcessImageML:
                     tif.save(background_image.astype(np.uint16), compress=0)
 
             if EachRound == round_num:
-                # Start numbering cells at each round
-                self.cell_counted_inRound = 0
-
+                # === Collect the image of each coordinate ===
+                tasks = []
                 for EachCoord in CoordinatesList:
-                    # For fluorescence:
-                    logging.info(EachCoord)
-                    # === readin image ===
                     for Eachfilename in enumerate(fileNameList):
                         if (
                             EachCoord in Eachfilename[1]
@@ -336,88 +389,42 @@ class ProcessImageML:
                                 folder, Eachfilename[1]
                             )
 
-                    # USING MASKRCNN...
-                    # Imagepath      = self.Detector._fixPathName(_imagefilename)
-                    Rawimage = imread(_imagefilename)
-
-                    # Background substraction
-                    if background_substraction is True:
-                        # Convert to signed int to perform substraction
-                        Rawimage = Rawimage.astype(
-                            np.int16
-                        ) - background_image.astype(np.int16)
-                        # Set min to 0
-                        Rawimage = Rawimage.clip(min=0)
-                        # Set back to uint
-                        Rawimage = Rawimage.astype(np.uint16)
-
-                    image = ProcessImage.convert_for_MaskRCNN(Rawimage)
-
-                    # Run the detection on input image.
-                    results = self.Detector.detect([image])
-
-                    MLresults = results[0]
-
+                    # Save the detection image
+                    fig_name = None
                     if save_mask is True:
-                        fig, ax = plt.subplots()
-                        # Set class_names = [None,None,None,None] to mute class name display.
-                        visualize.display_instances(
-                            image,
-                            MLresults["rois"],
-                            MLresults["masks"],
-                            MLresults["class_ids"],
-                            class_names=[None, None, None, None],
-                            ax=ax,
-                            centre_coors=MLresults["Centre_coor"],
-                            Centre_coor_radius=2,
-                            WhiteSpace=(0, 0),
-                        )  # MLresults['class_ids'],MLresults['scores'],
-                        # ax.imshow(fig)
-                        fig.tight_layout()
-                        # Save the detection image
                         fig_name = os.path.join(
                             folder,
                             "MLimages_{}/{}.tif".format(
                                 round_num, ImgNameInfor
                             ),
                         )
-                        plt.savefig(
-                            fname=fig_name,
-                            dpi=200,
-                            pad_inches=0.0,
-                            bbox_inches="tight",
-                        )
+                    tasks.append((_imagefilename, str(ImgNameInfor), fig_name))
 
-                    # Use retrieveDataFromML from ImageProcessing.py to extract numbers.
-                    if self.cell_counted_inRound == 0:
-                        (
-                            cell_Data,
-                            self.cell_counted_inRound,
-                            total_cells_counted_in_coord,
-                        ) = ProcessImage.retrieveDataFromML(
-                            Rawimage,
-                            MLresults,
-                            str(ImgNameInfor),
-                            self.cell_counted_inRound,
-                            show_each_cell=False,
-                        )
-                    else:
-                        (
-                            Cell_Data_new,
-                            self.cell_counted_inRound,
-                            total_cells_counted_in_coord,
-                        ) = ProcessImage.retrieveDataFromML(
-                            Rawimage,
-                            MLresults,
-                            str(ImgNameInfor),
-                            self.cell_counted_inRound,
-                            show_each_cell=False,
-                        )
-                        if len(Cell_Data_new) > 0:
-                            cell_Data = cell_Data.append(Cell_Data_new)
+                # Background substraction
+                preprocess = None
+                if background_substraction is True:
+
+                    def substract_background(
+                        Rawimage, background_image=background_image
+                    ):
+                        # Convert to signed int to perform substraction
+                        Rawimage = Rawimage.astype(
+                            np.int16
+                        ) - background_image.astype(np.int16)
+                        # Set min to 0, and set back to uint
+                        return Rawimage.clip(min=0).astype(np.uint16)
+
+                    preprocess = substract_background
 
-                    # Count in total how many flat and round cells are identified.
-                    cells_counted_in_round += total_cells_counted_in_coord
+                # === Detect, extract features and save masks ===
+                pipeline = AnalysisPipeline(
+                    self.Detector,
+                    feature_workers=feature_workers,
+                    render_overlay=self.save_overlay if save_mask else None,
+                    preprocess=preprocess,
+                )
+                cell_Data, cells_counted_in_round = pipeline.run(tasks)
+                self.cell_counted_inRound = len(cell_Data)
 
                 logging.info(
                     "Number of round/flat cells in this round: {}".format(
@@ -473,6 +480,7 @@ class ProcessImageML:
         show_result=True,
         save_mask=True,
         save_excel=True,
+        feature_workers=4,
     ):
         """
         Given the folder, perform general analysis over the images in it.
@@ -488,14 +496,14 @@ class ProcessImageML:
             DESCRIPTION. The default is True.
         save_excel : bool, optional
             DESCRIPTION. The default is True.
+        feature_workers : int, optional
+            Number of processes extracting cell features. The default is 4.
 
         Returns
         cell_Data : pd.dataframe
             DESCRIPTION.
 
         """
-        flat_cell_counted_in_folder = 0
-        total_cells_counted_in_folder = 0
         background_substraction = False
         root_folder = folder
 
@@ -542,42 +550,15 @@ class ProcessImageML:
 
         logging.info(fileNameList)
 
-        # Analyse each image
-        for image_file_name in fileNameList:
-            logging.info(image_file_name)
-            Rawimage = imread(os.path.join(folder, image_file_name))
-
-            if background_substraction is True:
-                Rawimage = np.abs(Rawimage - background_image).astype(
-                    np.uint16
-                )
-
-            # Analyze each image
-            # Run the detection on input image.
-            MLresults = self.DetectionOnImage(
-                Rawimage, axis=None, show_result=show_result
-            )
+        if save_mask is True:
+            if not os.path.exists(os.path.join(folder, "ML_masks")):
+                # If the folder is not there, create the folder
+                os.mkdir(os.path.join(folder, "ML_masks"))
 
+        tasks = []
+        for image_file_name in fileNameList:
+            fig_name = None
             if save_mask is True:
-                if not os.path.exists(os.path.join(folder, "ML_masks")):
-                    # If the folder is not there, create the folder
-                    os.mkdir(os.path.join(folder, "ML_masks"))
-
-                fig, ax = plt.subplots()
-                # Set class_names = [None,None,None,None] to mute class name display.
-                visualize.display_instances(
-                    Rawimage,
-                    MLresults["rois"],
-                    MLresults["masks"],
-                    MLresults["class_ids"],
-                    class_names=[None, None, None, None],
-                    ax=ax,
-                    centre_coors=MLresults["Centre_coor"],
-                    Centre_coor_radius=2,
-                    WhiteSpace=(0, 0),
-                )  # MLresults['class_ids'],MLresults['scores'],
-                # ax.imshow(fig)
-                fig.tight_layout()
                 # Save the detection Rawimage
                 fig_name = os.path.join(
                     folder,
@@ -586,38 +567,44 @@ class ProcessImageML:
                         image_file_name[0 : len(image_file_name) - 4]
                     ),
                 )
-                plt.savefig(
-                    fname=fig_name,
-                    dpi=200,
-                    pad_inches=0.0,
-                    bbox_inches="tight",
-                )
-
-            if flat_cell_counted_in_folder == 0:
+            tasks.append(
                 (
-                    cell_Data,
-                    flat_cell_counted_in_folder,
-                    total_cells_counted_in_coord,
-                ) = ProcessImage.retrieveDataFromML(
-                    Rawimage,
-                    MLresults,
+                    os.path.join(folder, image_file_name),
                     image_file_name,
-                    flat_cell_counted_in_folder,
+                    fig_name,
                 )
-            else:
-                (
-                    Cell_Data_new,
-                    flat_cell_counted_in_folder,
-                    total_cells_counted_in_coord,
-                ) = ProcessImage.retrieveDataFromML(
-                    Rawimage,
-                    MLresults,
-                    image_file_name,
-                    flat_cell_counted_in_folder,
-                )
-                if len(Cell_Data_new) > 0:
-                    cell_Data = cell_Data.append(Cell_Data_new)
-            total_cells_counted_in_folder += total_cells_counted_in_coord
+            )
+
+        preprocess = None
+        if background_substraction is True:
+
+            def substract_background(Rawimage):
+                return np.abs(Rawimage - background_image).astype(np.uint16)
+
+            preprocess = substract_background
+
+        on_detection = None
+        if show_result is True:
+
+            def show_each_detection(Rawimage, image, MLresults, ImgNameInfor):
+                logging.info(ImgNameInfor)
+                self.show_detection(image, MLresults)
+
+            on_detection = show_each_detection
+
+        # Analyze each image
+        # Run the detection on input image.
+        pipeline = AnalysisPipeline(
+            self.Detector,
+            feature_workers=feature_workers,
+            render_overlay=self.save_overlay if save_mask else None,
+            preprocess=preprocess,
+            convert_for_detector=False,
+        )
+        cell_Data, total_cells_counted_in_folder = pipeline.run(
+            tasks, on_detection=on_detection
+        )
+        flat_cell_counted_in_folder = len(cell_Data)
 
         if save_excel is True:
             # Save to excel
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Link cells between screening rounds by bounding box overlap.
+
+The cell DataFrames from retrieveDataFromML carry the bounding box of every
+cell as a "minr{}_maxr{}_minc{}_maxc{}" string in "BoundingBox", and the image
+it was found in as "ImgNameInfor", like "Round2_Coords3_R1500C0". Two cells
+from different rounds are the same cell when they come from the same
+coordinate and their bounding boxes overlap for more than a threshold, where
+overlap is the intersection area divided by the larger of the two box areas.
+
+CellBoxes parses the strings of a DataFrame once into an integer array and
+groups the rows per coordinate. Matching then only compares cells of the same
+coordinate, all pairs of a coordinate at once with overlap_fraction. There are
+a few hundred cells per field of view at most, so the dense matrix per
+coordinate is cheaper than building a spatial index.
+"""
+
+import numpy as np
+import pandas as pd
+
+BOUNDINGBOX_PATTERN = r"minr(-?\d+)_maxr(-?\d+)_minc(-?\d+)_maxc(-?\d+)"
+
+
+def parse_bounding_boxes(bounding_boxes):
+    """
+    Parse bounding box strings.
+
+    Parameters
+    bounding_boxes : pd.Series
+        Strings like "minr10_maxr50_minc20_maxc70".
+
+    Returns
+    np.ndarray of shape (cells, 4) with columns minr, maxr, minc, maxc.
+    """
+    bounding_boxes = pd.Series(bounding_boxes, dtype=object)
+    if len(bounding_boxes) == 0:
+        return np.zeros((0, 4), dtype="int64")
+    limits = bounding_boxes.str.extract(BOUNDINGBOX_PATTERN)
+    if limits.isna().any(axis=None):
+        raise ValueError("Bounding box without minr_maxr_minc_maxc limits")
+    return limits.to_numpy().astype("int64")
+
+
+def coordinate_key(ImgNameInfor):
+    """
+    Coordinate part of the image name, 'R1500C0' for
+    'Round2_Coords3_R1500C0'.
+    """
+    return ImgNameInfor[ImgNameInfor.index("_R") + 1 :]
+
+
+def overlap_fraction(boxes_1, boxes_2):
+    """
+    Intersection area over the larger box area, for all pairs of boxes.
+
+    Parameters
+    boxes_1, boxes_2 : np.ndarray
+        Boxes of shape (n, 4) and (m, 4), as from parse_bounding_boxes.
+
+    Returns
+    np.ndarray of shape (n, m).
+    """
+    minr_1, maxr_1, minc_1, maxc_1 = (boxes_1[:, [i]] for i in range(4))
+    minr_2, maxr_2, minc_2, maxc_2 = boxes_2.T
+
+    rows = np.minimum(maxr_1, maxr_2) - np.maximum(minr_1, minr_2)
+    cols = np.minimum(maxc_1, maxc_2) - np.maximum(minc_1, minc_2)
+    intersection = np.clip(rows, 0, None) * np.clip(cols, 0, None)
+
+    area_1 = (maxr_1 - minr_1) * (maxc_1 - minc_1)
+    area_2 = (maxr_2 - minr_2) * (maxc_2 - minc_2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = intersection / np.maximum(area_1, area_2)
+    # Degenerate boxes without area never match.
+    return np.nan_to_num(fraction, nan=0.0, posinf=0.0)
+
+
+class CellBoxes:
+    """
+    Bounding boxes of the cells in a DataFrame, grouped per coordinate.
+
+    Attributes
+    boxes : np.ndarray
+        (cells, 4) array of minr, maxr, minc, maxc, in DataFrame row order.
+    keys : np.ndarray
+        Coordinate key of each row.
+    groups : dict
+        Coordinate key to the row positions of that coordinate, ascending.
+    """
+
+    def __init__(
+        self,
+        dataframe,
+        boundingbox_field="BoundingBox",
+        imgname_field="ImgNameInfor",
+    ):
+        self.boxes = parse_bounding_boxes(dataframe[boundingbox_field])
+        self.keys = np.array(
+            [coordinate_key(name) for name in dataframe[imgname_field]],
+            dtype=object,
+        )
+        self.groups = {
+            key: positions.astype("int64")
+            for key, positions in pd.Series(self.keys)
+            .groupby(self.keys, sort=False)
+            .indices.items()
+        }
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+def link_cells(previous, latter, positions, threshold=0.6):
+    """
+    Find back the cells of one round in another round.
+
+    Every cell is linked to the cell of the same coordinate in the latter
+    round with the largest overlap, if that is above threshold. On equal
+    overlap the first row in latter wins. Several cells can be linked to the
+    same latter cell.
+
+    Parameters
+    previous, latter : CellBoxes
+        Cells of the two rounds.
+    positions : np.ndarray
+        Rows of previous to link.
+    threshold : float
+        Overlap fraction above which cells are seen as the same.
+
+    Returns
+    np.ndarray with for each of positions the linked row in latter, or -1.
+    """
+    positions = np.asarray(positions, dtype="int64")
+    linked = np.full(len(positions), -1, dtype="int64")
+    keys = previous.keys[positions]
+    for key in pd.unique(keys):
+        candidates = latter.groups.get(key)
+        if candidates is None:
+            continue
+        selected = np.flatnonzero(keys == key)
+        fraction = overlap_fraction(
+            previous.boxes[positions[selected]], latter.boxes[candidates]
+        )
+        best = fraction.argmax(axis=1)
+        found = fraction[np.arange(len(selected)), best] > threshold
+        linked[selected[found]] = candidates[best[found]]
+    return linked
+
+
+def match_cells(previous, latter, threshold=0.6):
+    """
+    Link all cells of previous, see link_cells.
+
+    Returns
+    (previous_positions, latter_positions) : np.ndarray
+        Row positions of the linked cells, in the row order of previous.
+    """
+    positions = np.arange(len(previous))
+    linked = link_cells(previous, latter, positions, threshold)
+    found = linked >= 0
+    return positions[found], linked[found]
+
+
+def register_rounds(cell_boxes_list, threshold=0.6):
+    """
+    Follow the cells of the first round through all later rounds.
+
+    Each round is matched against the boxes the cells had in the round
+    before, so cells can drift a bit between rounds. A cell that is lost in
+    one round is not looked for in the next rounds.
+
+    Parameters
+    cell_boxes_list : list of CellBoxes
+        Cells of all rounds, first round first.
+    threshold : float
+        Overlap fraction above which cells are seen as the same.
+
+    Returns
+    List with for every later round (first_round_positions,
+    round_positions) of the cells followed up to that round.
+    """
+    origin = np.arange(len(cell_boxes_list[0]))
+    current = origin
+    chain = []
+    for previous, latter in zip(cell_boxes_list[:-1], cell_boxes_list[1:]):
+        linked = link_cells(previous, latter, current, threshold)
+        found = linked >= 0
+        origin = origin[found]
+        current = linked[found]
+        chain.append((origin, current))
+    return chain
+
+
+def merge_linked(dataframe_1, dataframe_2, positions_1, positions_2):
+    """
+    Put the rows of linked cells next to each other.
+
+    Returns
+    pd.DataFrame with the columns of dataframe_1 followed by those of
+    dataframe_2, and index "Cell 0", "Cell 1"...
+    """
+    index = pd.Index(["Cell {}".format(i) for i in range(len(positions_1))])
+    rows_1 = dataframe_1.iloc[positions_1].set_axis(index, axis=0)
+    rows_2 = dataframe_2.iloc[positions_2].set_axis(index, axis=0)
+    return pd.concat((rows_1, rows_2), axis=1)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Rasterize many ROI polygons into one label image.
+
+Making a DMD or galvo mask used to allocate a full frame for every ROI
+(polygon2mask) and add them up, so hundreds of MaskRCNN cells took tens of
+seconds and gigabytes. PolygonMasks draws every polygon into one int32 label
+image in a single pass, each only over the pixels of its bounding box, with
+ROI i as label i + 1:
+
+    masks = PolygonMasks(list_of_rois, (768, 1024))
+    union = masks.mask()
+    group = masks.mask([0, 5, 7])
+    (rows, columns), patch, label = masks.roi_patch(5)
+    cell = patch == label
+
+Pixels are the ones skimage.draw.polygon and polygon_perimeter give, as for
+the masks before. Where ROIs overlap the later one has the label.
+"""
+
+import logging
+import time
+
+import numpy as np
+from scipy import ndimage
+from skimage.draw import polygon, polygon_perimeter
+
+
+class PolygonMasks:
+    """
+    Label image of polygons.
+
+    Parameters
+    list_of_rois : list of np.ndarray
+        Vertices (row, column) of every polygon, shape (n, 2).
+    shape : tuple
+        (rows, columns) of the mask.
+    fill_contour : bool
+        Label the inside of the polygons, else only their perimeter.
+    """
+
+    def __init__(self, list_of_rois, shape, fill_contour=True):
+        self.shape = tuple(int(size) for size in shape)
+        self.labels = np.zeros(self.shape, dtype=np.int32)
+        # (rows, columns) slices of every ROI, None if it is off the mask.
+        self.boxes = []
+
+        for index, roi in enumerate(list_of_rois):
+            roi = np.asarray(roi, dtype=float)
+            if fill_contour:
+                rr, cc = polygon(roi[:, 0], roi[:, 1], self.shape)
+            else:
+                rr, cc = polygon_perimeter(roi[:, 0], roi[:, 1], self.shape)
+            if len(rr) == 0:
+                self.boxes.append(None)
+                continue
+            self.labels[rr, cc] = index + 1
+            self.boxes.append(
+                (
+                    slice(rr.min(), rr.max() + 1),
+                    slice(cc.min(), cc.max() + 1),
+                )
+            )
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def mask(self, indices=None):
+        """
+        Binary mask of all ROIs, or of the group of ROI indices.
+        """
+        if indices is None:
+            return self.labels > 0
+        return np.isin(self.labels, np.asarray(indices) + 1)
+
+    def roi_patch(self, index):
+        """
+        One ROI in its bounding box, without copying the label image.
+
+        Returns
+        ((rows, columns), patch, label), the slices of the box in the mask,
+        the view of the label image in it and the label of the ROI, so its
+        pixels are patch == label. (None, None, label) if the ROI is off the
+        mask.
+        """
+        box = self.boxes[index]
+        if box is None:
+            return None, None, index + 1
+        return box, self.labels[box], index + 1
+
+
+def rois_to_mask(
+    list_of_rois,
+    shape,
+    fill_contour=True,
+    contour_thickness=1,
+    invert_mask=False,
+):
+    """
+    Binary mask of ROI polygons, like the DMD masks.
+
+    Parameters
+    list_of_rois : list of np.ndarray
+        Vertices (row, column) of every polygon.
+    shape : tuple
+        (rows, columns) of the mask.
+    fill_contour : bool
+        Filled polygons, else their contour, contour_thickness times dilated
+        twice.
+    invert_mask : bool
+        Swap 1 and 0.
+
+    Returns
+    np.ndarray of int, 0 and 1.
+    """
+    mask = PolygonMasks(list_of_rois, shape, fill_contour).mask()
+    if not fill_contour and contour_thickness > 0:
+        mask = ndimage.binary_dilation(mask, iterations=2 * contour_thickness)
+
+    mask = mask.astype(int)
+    if invert_mask:
+        mask = 1 - mask
+    return mask
+
+
+# === Benchmark ===
+def random_cells(number, shape=(2048, 2048), radius=15, vertices=40, seed=0):
+    """
+    Polygons of number roundish cells at random places, like the contours
+    of MaskRCNN detections.
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    list_of_rois = []
+    for _ in range(number):
+        centre = rng.uniform(radius, np.array(shape) - radius)
+        radii = radius * rng.uniform(0.7, 1.3, vertices)
+        list_of_rois.append(
+            centre
+            + np.stack([radii * np.sin(angles), radii * np.cos(angles)], 1)
+        )
+    return list_of_rois
+
+
+def benchmark_polygon_masks(number=1000, shape=(2048, 2048), legacy_rois=50):
+    """
+    Time making a filled and a contour mask of number cell polygons as
+    before and with rois_to_mask. Filled masks took a full frame per ROI,
+    so before they are timed on legacy_rois and scaled up.
+
+    Returns
+    dict of name to seconds.
+    """
+    from skimage.draw import polygon2mask
+    from skimage.morphology import binary_dilation
+
+    list_of_rois = random_cells(number, shape)
+    results = {}
+
+    for fill_contour in (True, False):
+        kind = "filled" if fill_contour else "contour"
+        # A frame per filled ROI is too slow for all of them.
+        rois = list_of_rois[:legacy_rois] if fill_contour else list_of_rois
+
+        # Before: a frame per ROI added up, the contour dilated as a whole.
+        start = time.perf_counter()
+        legacy = np.zeros(shape)
+        for roi in rois:
+            if fill_contour:
+                legacy += polygon2mask(shape, roi)
+            else:
+                legacy[polygon_perimeter(roi[:, 0], roi[:, 1], shape)] = 1
+        if not fill_contour:
+            legacy += binary_dilation(binary_dilation(legacy > 0))
+        legacy = (legacy > 0).astype(int)
+        seconds = time.perf_counter() - start
+        results["{} before".format(kind)] = seconds * number / len(rois)
+        assert np.array_equal(legacy, rois_to_mask(rois, shape, fill_contour))
+
+        start = time.perf_counter()
+        rois_to_mask(list_of_rois, shape, fill_contour)
+        results["{} label image".format(kind)] = time.perf_counter() - start
+
+    for name, seconds in results.items():
+        logging.info(
+            "{:>20}: {:8.3f} s for {} polygons".format(name, seconds, number)
+        )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    benchmark_polygon_masks()
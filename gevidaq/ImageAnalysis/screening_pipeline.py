@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+Staged analysis of screening images.
+
+Analysing a screening round means, for every image: read it, run the cell
+detector, extract the per-cell features with ProcessImage.retrieveDataFromML
+and save an overlay of the masks. Done one after the other, the GPU waits for
+the disk, the disk waits for the features and everything waits for
+matplotlib. AnalysisPipeline overlaps these stages:
+
+    reader threads -> batched detect() -> feature processes
+                                       -> overlay thread
+
+Images are read a few batches ahead, the detector gets as many images per
+call as its configuration allows, the features are extracted in a process
+pool and overlays are rendered by a single background thread, or skipped.
+
+The detector only needs a detect(images) method that returns the MaskRCNN
+result dictionaries, so ThresholdDetector can stand in for MaskRCNN to run
+and benchmark the pipeline on machines without a GPU or model weights.
+"""
+
+import collections
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tifffile as skimtiff
+from skimage.filters import threshold_otsu
+from skimage.io import imread
+from skimage.measure import label, regionprops
+
+from .ImageProcessing import ProcessImage
+
+
+class ThresholdDetector:
+    """
+    Stand-in for the MaskRCNN detector, segmenting by Otsu thresholding.
+
+    Every connected bright region larger than min_area is reported as a
+    flat cell (class id 3).
+    """
+
+    def __init__(self, batch_size=4, min_area=200, class_id=3):
+        self.batch_size = batch_size
+        self.min_area = min_area
+        self.class_id = class_id
+
+    def detect(self, images):
+        return [self._detect_image(image) for image in images]
+
+    def _detect_image(self, image):
+        if image.ndim == 3:
+            image = image[:, :, 0]
+        labels = label(image > threshold_otsu(image))
+        regions = [
+            region
+            for region in regionprops(labels)
+            if region.area >= self.min_area
+        ]
+
+        masks = np.zeros((*image.shape, len(regions)), dtype=bool)
+        rois = np.zeros((len(regions), 4), dtype=np.int32)
+        centres = np.zeros((len(regions), 2))
+        for i, region in enumerate(regions):
+            minr, minc, maxr, maxc = region.bbox
+            masks[minr:maxr, minc:maxc, i] = region.image
+            rois[i] = (minr, minc, maxr, maxc)
+            centres[i] = region.centroid
+
+        return {
+            "rois": rois,
+            "masks": masks,
+            "class_ids": np.full(len(regions), self.class_id, dtype=np.int32),
+            "scores": np.ones(len(regions), dtype=np.float32),
+            "Centre_coor": centres,
+        }
+
+
+def detection_batch_size(detector):
+    """
+    Number of images the detector takes per detect() call.
+    """
+    config = getattr(detector, "config", None)
+    for name in ("BATCH_SIZE", "IMAGES_PER_GPU"):
+        value = getattr(config, name, None)
+        if value:
+            return int(value)
+    return int(getattr(detector, "batch_size", 1))
+
+
+def pack_results(MLresults):
+    """
+    Detection results with the masks cropped to their bounding boxes.
+
+    Full size masks are images x cells booleans, too big to send to a feature
+    process. retrieveDataFromML only looks inside the bounding boxes.
+    """
+    packed = {key: value for key, value in MLresults.items() if key != "masks"}
+    masks = MLresults["masks"]
+    packed["mask_shape"] = masks.shape
+    packed["mask_crops"] = [
+        masks[minr:maxr, minc:maxc, i]
+        for i, (minr, minc, maxr, maxc) in enumerate(MLresults["rois"])
+    ]
+    return packed
+
+
+def unpack_results(packed):
+    MLresults = {
+        key: value
+        for key, value in packed.items()
+        if key not in ("mask_shape", "mask_crops")
+    }
+    # np.zeros doesn't touch the memory, only the crops get written.
+    masks = np.zeros(packed["mask_shape"], dtype=bool)
+    for i, ((minr, minc, maxr, maxc), crop) in enumerate(
+        zip(MLresults["rois"], packed["mask_crops"])
+    ):
+        masks[minr:maxr, minc:maxc, i] = crop
+    MLresults["masks"] = masks
+    return MLresults
+
+
+def extract_features(Rawimage, packed_results, ImgNameInfor):
+    """
+    retrieveDataFromML for one image, to run in a feature process.
+
+    Returns
+    (Cell_DataFrame, total_cells_identified)
+    """
+    (
+        Cell_DataFrame,
+        flat_cell_counted,
+        total_cells_identified,
+    ) = ProcessImage.retrieveDataFromML(
+        Rawimage, unpack_results(packed_results), str(ImgNameInfor), 0
+    )
+    return Cell_DataFrame, total_cells_identified
+
+
+class _Inline:
+    """
+    Runs submitted functions right away, instead of an executor.
+    """
+
+    class _Done:
+        def __init__(self, function, args):
+            self._value = function(*args)
+
+        def result(self):
+            return self._value
+
+    def submit(self, function, *args):
+        return self._Done(function, args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class OverlayWriter:
+    """
+    Renders and saves mask overlays in one background thread.
+
+    Overlays are only for looking at afterwards, so a failing overlay is
+    logged and skipped. With drop_when_full, overlays are skipped instead of
+    waiting when max_queue are already waiting.
+    """
+
+    def __init__(self, render, max_queue=8, drop_when_full=False):
+        self.render = render
+        self.drop_when_full = drop_when_full
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, image, MLresults, fig_name):
+        item = (image, MLresults, fig_name)
+        if self.drop_when_full:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self._queue.put(item)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.render(*item)
+                self.written += 1
+            except Exception as exc:
+                logging.critical("caught exception", exc_info=exc)
+
+
+class AnalysisPipeline:
+    """
+    Detect cells and extract their features for a list of images.
+
+    Parameters
+    detector : object
+        MaskRCNN model or ThresholdDetector, anything with detect(images).
+    batch_size : int, optional
+        Images per detect() call, default from the detector configuration.
+    reader_workers : int
+        Threads reading images, 0 reads them in the calling thread.
+    feature_workers : int
+        Processes extracting cell features, 0 extracts them in the calling
+        thread.
+    render_overlay : callable, optional
+        render_overlay(image, MLresults, fig_name) saves a mask overlay. The
+        default skips overlays.
+    preprocess : callable, optional
+        Applied to every raw image after reading, like background
+        substraction.
+    convert_for_detector : bool
+        Run ProcessImage.convert_for_MaskRCNN on the image for the detector.
+    """
+
+    def __init__(
+        self,
+        detector,
+        batch_size=None,
+        reader_workers=4,
+        feature_workers=4,
+        render_overlay=None,
+        preprocess=None,
+        convert_for_detector=True,
+        drop_overlays_when_busy=False,
+    ):
+        self.detector = detector
+        if batch_size is None:
+            batch_size = detection_batch_size(detector)
+        self.batch_size = batch_size
+        # MaskRCNN only takes batches of exactly its configured size.
+        self.pad_batches = hasattr(
+            getattr(detector, "config", None), "BATCH_SIZE"
+        )
+        self.reader_workers = reader_workers
+        self.feature_workers = feature_workers
+        self.render_overlay = render_overlay
+        self.preprocess = preprocess
+        self.convert_for_detector = convert_for_detector
+        self.drop_overlays_when_busy = drop_overlays_when_busy
+        self.timing = {}
+
+    def run(self, tasks, on_detection=None):
+        """
+        Parameters
+        tasks : list
+            (image file path, ImgNameInfor, overlay file name or None) for
+            every image.
+        on_detection : callable, optional
+            on_detection(Rawimage, image, MLresults, ImgNameInfor), called
+            in the calling thread for every image, like to show results.
+
+        Returns
+        cell_Data : pd.DataFrame
+            Features of all flat cells, numbered "Cell 0", "Cell 1"... in
+            the order of tasks.
+        total_cells_counted : int
+            All identified cells, flat or not.
+        """
+        self.timing = collections.defaultdict(float)
+        starttime = time.perf_counter()
+
+        if self.reader_workers > 0:
+            reader = ThreadPoolExecutor(max_workers=self.reader_workers)
+        else:
+            reader = _Inline()
+        if self.feature_workers > 0:
+            features = ProcessPoolExecutor(max_workers=self.feature_workers)
+        else:
+            features = _Inline()
+        overlays = None
+        if self.render_overlay is not None:
+            overlays = OverlayWriter(
+                self.render_overlay,
+                drop_when_full=self.drop_overlays_when_busy,
+            )
+
+        pending_features = []
+        try:
+            loaded = _prefetch(
+                reader, self._load, tasks, depth=2 * self.batch_size
+            )
+            for batch in _batches(loaded, self.batch_size):
+                images = [image for _, image, _, _ in batch]
+                if self.pad_batches and len(images) < self.batch_size:
+                    images += [images[-1]] * (self.batch_size - len(images))
+
+                detect_start = time.perf_counter()
+                results = self.detector.detect(images)
+                self.timing["detect"] += time.perf_counter() - detect_start
+
+                for (
+                    Rawimage,
+                    image,
+                    ImgNameInfor,
+                    fig_name,
+                ), MLresults in zip(batch, results):
+                    if on_detection is not None:
+                        on_detection(Rawimage, image, MLresults, ImgNameInfor)
+                    if overlays is not None and fig_name is not None:
+                        overlays.put(image, MLresults, fig_name)
+                    pending_features.append(
+                        features.submit(
+                            extract_features,
+                            Rawimage,
+                            pack_results(MLresults),
+                            ImgNameInfor,
+                        )
+                    )
+
+            wait_start = time.perf_counter()
+            extracted = [future.result() for future in pending_features]
+            self.timing["features wait"] += time.perf_counter() - wait_start
+        finally:
+            reader.shutdown(wait=True)
+            features.shutdown(wait=True)
+            if overlays is not None:
+                wait_start = time.perf_counter()
+                overlays.close()
+                self.timing["overlays wait"] += (
+                    time.perf_counter() - wait_start
+                )
+
+        cell_Data_list = [
+            Cell_DataFrame
+            for Cell_DataFrame, _ in extracted
+            if len(Cell_DataFrame) > 0
+        ]
+        total_cells_counted = sum(total for _, total in extracted)
+
+        if len(cell_Data_list) == 0:
+            cell_Data = pd.DataFrame()
+        else:
+            cell_Data = pd.concat(cell_Data_list)
+            # Every image was numbered from 0, number the cells through.
+            cell_Data.index = [
+                "Cell {}".format(i) for i in range(len(cell_Data))
+            ]
+
+        self.timing["total"] = time.perf_counter() - starttime
+        logging.info(
+            "Analysed {} images: {}".format(
+                len(tasks),
+                ", ".join(
+                    "{} {:.2f} s".format(stage, seconds)
+                    for stage, seconds in self.timing.items()
+                ),
+            )
+        )
+        return cell_Data, total_cells_counted
+
+    def _load(self, task):
+        file_path, ImgNameInfor, fig_name = task
+        Rawimage = imread(file_path)
+        if self.preprocess is not None:
+            Rawimage = self.preprocess(Rawimage)
+        if self.convert_for_detector:
+            image = ProcessImage.convert_for_MaskRCNN(Rawimage)
+        else:
+            image = Rawimage
+        return Rawimage, image, ImgNameInfor, fig_name
+
+
+def _prefetch(executor, function, items, depth):
+    """
+    Like executor.map, but with at most depth items in flight.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def benchmark_pipeline(image_number=32, image_size=1024, cells_per_image=40):
+    """
+    Compare one-by-one analysis with the pipeline, on synthetic cell images
+    and the ThresholdDetector.
+
+    Returns
+    dict of name to seconds for all images.
+    """
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        rows, cols = np.mgrid[0:image_size, 0:image_size]
+        tasks = []
+        for n in range(image_number):
+            image = rng.normal(200, 20, (image_size, image_size))
+            for r, c in rng.integers(
+                40, image_size - 40, (cells_per_image, 2)
+            ):
+                radius = rng.integers(12, 25)
+                window = (
+                    slice(r - radius, r + radius),
+                    slice(c - radius, c + radius),
+                )
+                distance = np.hypot(rows[window] - r, cols[window] - c)
+                image[window][distance < radius] += 2000
+            file_path = os.path.join(
+                folder, "Round1_Coords{}_R0C{}_PMT_0Zmax.tif".format(n, n)
+            )
+            skimtiff.imwrite(file_path, image.clip(0, 65535).astype(np.uint16))
+            tasks.append(
+                (file_path, "Round1_Coords{}_R0C{}".format(n, n), None)
+            )
+
+        sequential = AnalysisPipeline(
+            ThresholdDetector(batch_size=1),
+            reader_workers=0,
+            feature_workers=0,
+        )
+        pipelined = AnalysisPipeline(
+            ThresholdDetector(batch_size=4),
+            reader_workers=4,
+            feature_workers=min(4, os.cpu_count() or 1),
+        )
+        results = {}
+        for name, pipeline in (
+            ("one by one", sequential),
+            ("pipelined", pipelined),
+        ):
+            cell_Data, total = pipeline.run(tasks)
+            results[name] = pipeline.timing["total"]
+            logging.info(
+                "{}: {} cells in {:.2f} s, {:.1f} images/s".format(
+                    name,
+                    len(cell_Data),
+                    pipeline.timing["total"],
+                    image_number / pipeline.timing["total"],
+                )
+            )
+        return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    benchmark_pipeline()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Stitch screening images without holding the mosaic in memory.
+
+Screening images are named like "Round1_Coords3_R1500C0_PMT_0Zmax.tif", with
+the stage row and column index after "_R" and "C". A whole well of camera
+images does not fit in memory, so the tiles are written into a memory mapped
+.npy file in the dtype of the images, loaded by a pool of threads. From that
+full resolution level a pyramid of 2x downsampled levels is built, stripe by
+stripe, next to it:
+
+    Round1 stitched/level0.npy
+    Round1 stitched/level1.npy
+    ...
+
+StitchedMosaic opens such a directory, so a viewer can show a whole well from
+a small level and only read the part of level0 it zooms in on. save_tiff
+exports the pyramid as a tiled BigTIFF that Fiji, QuPath and napari open as
+a multi-resolution image.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tifffile as skimtiff
+from skimage.io import imread
+
+COORDINATE_PATTERN = r"_R(-?\d+)C(-?\d+)"
+ROUND_PATTERN = r"(Round.*?)_(?:Grid|Coord)"
+# Rows of the previous level handled at once when building the pyramid.
+STRIPE_ROWS = 4096
+
+
+def tile_table(fileNameList):
+    """
+    Parse round and stage coordinates out of the screening file names.
+
+    Parameters
+    fileNameList : list
+        File names, from retrive_scanning_scheme.
+
+    Returns
+    pd.DataFrame with columns "Round", "File name", "Stage row index" and
+    "Stage column index".
+    """
+    file_names = pd.Series(fileNameList, dtype=object)
+    coordinates = file_names.str.extract(COORDINATE_PATTERN).astype("int64")
+    return pd.DataFrame(
+        {
+            "Round": file_names.str.extract(ROUND_PATTERN)[0],
+            "File name": file_names,
+            "Stage row index": coordinates[0],
+            "Stage column index": coordinates[1],
+        }
+    )
+
+
+def scanning_step(imageinfo_DataFrame, default=1585):
+    """
+    Smallest distance between stage coordinates, default if there is only
+    one coordinate.
+    """
+    values = np.unique(
+        np.concatenate(
+            (
+                imageinfo_DataFrame["Stage row index"].to_numpy(),
+                imageinfo_DataFrame["Stage column index"].to_numpy(),
+            )
+        )
+    )
+    steps = np.diff(values)
+    if len(steps) == 0:
+        return default
+    return int(steps.min())
+
+
+def grid_positions(imageinfo_DataFrame, scanning_coord_step):
+    """
+    Place of every image in the mosaic.
+
+    Stage rows are mosaic columns counted from the right, and stage columns
+    are mosaic rows.
+
+    Returns
+    (grid_rows, grid_cols, number_of_coord), the grid is
+    number_of_coord x number_of_coord.
+    """
+    stage_rows = (
+        imageinfo_DataFrame["Stage row index"].to_numpy()
+        // scanning_coord_step
+    )
+    stage_cols = (
+        imageinfo_DataFrame["Stage column index"].to_numpy()
+        // scanning_coord_step
+    )
+    number_of_coord = int(max(stage_rows.max(), stage_cols.max())) + 1
+    return stage_cols, number_of_coord - 1 - stage_rows, number_of_coord
+
+
+def stitch_tiles(
+    file_paths,
+    grid_rows,
+    grid_cols,
+    number_of_coord,
+    image_pixel_number,
+    tile_shape,
+    dtype,
+    filename=None,
+    max_workers=8,
+):
+    """
+    Place images on a grid.
+
+    Parameters
+    file_paths : list
+        Image files.
+    grid_rows, grid_cols : np.ndarray
+        Grid place of every image.
+    number_of_coord : int
+        Grid size.
+    image_pixel_number : int
+        Size of the square each image takes, images are cropped to it.
+    tile_shape : tuple
+        Trailing dimensions of the images, like (4,) for RGBA.
+    dtype : np.dtype
+        Dtype of the images.
+    filename : str, optional
+        .npy file to stitch into. Default stitches in memory.
+    max_workers : int
+        Number of threads reading images.
+
+    Returns
+    np.ndarray, or np.memmap if filename is given.
+    """
+    final_image_size = image_pixel_number * number_of_coord
+    shape = (final_image_size, final_image_size, *tile_shape)
+    if filename is None:
+        final_image_holder = np.zeros(shape, dtype=dtype)
+    else:
+        final_image_holder = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=dtype, shape=shape
+        )
+
+    def place(file_path, row, col):
+        row_image = imread(file_path)
+        row_start = image_pixel_number * row
+        col_start = image_pixel_number * col
+        # Each thread writes its own part, no locking needed.
+        final_image_holder[
+            row_start : row_start + image_pixel_number,
+            col_start : col_start + image_pixel_number,
+        ] = row_image[:image_pixel_number, :image_pixel_number]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises errors from the threads.
+        list(executor.map(place, file_paths, grid_rows, grid_cols))
+
+    if filename is not None:
+        final_image_holder.flush()
+    return final_image_holder
+
+
+def downsample(image, method="mean"):
+    """
+    Halve the image size, by 2x2 averaging or by taking every other pixel.
+    """
+    rows = image.shape[0] // 2
+    cols = image.shape[1] // 2
+    if method == "nearest":
+        return image[: rows * 2 : 2, : cols * 2 : 2]
+    blocks = image[: rows * 2, : cols * 2].reshape(
+        rows, 2, cols, 2, *image.shape[2:]
+    )
+    return blocks.mean(axis=(1, 3), dtype="float64").astype(image.dtype)
+
+
+def build_pyramid(level0, directory, min_size=1024, method="mean"):
+    """
+    Write 2x downsampled levels of level0 into directory until a level is
+    smaller than min_size.
+
+    Parameters
+    level0 : np.ndarray
+        Full resolution image, can be a memory map.
+    directory : str
+        Levels are written as level1.npy, level2.npy...
+    method : str
+        "mean", or "nearest" for masks and labels.
+
+    Returns
+    List of the levels, level0 first.
+    """
+    levels = [level0]
+    while min(levels[-1].shape[:2]) // 2 >= min_size:
+        previous = levels[-1]
+        shape = (
+            previous.shape[0] // 2,
+            previous.shape[1] // 2,
+            *previous.shape[2:],
+        )
+        level = np.lib.format.open_memmap(
+            os.path.join(directory, "level{}.npy".format(len(levels))),
+            mode="w+",
+            dtype=previous.dtype,
+            shape=shape,
+        )
+        # Only a stripe of the previous level is in memory at a time.
+        for row in range(0, shape[0], STRIPE_ROWS // 2):
+            stripe = previous[row * 2 : (row + STRIPE_ROWS // 2) * 2]
+            level[row : row + STRIPE_ROWS // 2] = downsample(stripe, method)
+        level.flush()
+        levels.append(level)
+    return levels
+
+
+class StitchedMosaic:
+    """
+    Pyramid of a stitched round on disk.
+
+    Attributes
+    levels : list of np.memmap
+        Read-only levels, level 0 is full resolution and every next level
+        is half the size of the one before.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.levels = []
+        while True:
+            filename = os.path.join(
+                directory, "level{}.npy".format(len(self.levels))
+            )
+            if not os.path.exists(filename):
+                break
+            self.levels.append(np.load(filename, mmap_mode="r"))
+        if len(self.levels) == 0:
+            raise FileNotFoundError(f"No stitched levels in {directory}")
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level_for_downsample(self, downsample_factor):
+        """
+        Smallest level that still has at least 1 / downsample_factor of the
+        full resolution.
+        """
+        level = int(np.log2(max(downsample_factor, 1)))
+        return min(level, len(self.levels) - 1)
+
+    def region(self, row_start, row_end, col_start, col_end, level=0):
+        """
+        Part of the mosaic, in full resolution pixel coordinates, read from
+        the given level.
+        """
+        scale = 2**level
+        return np.asarray(
+            self.levels[level][
+                row_start // scale : -(-row_end // scale),
+                col_start // scale : -(-col_end // scale),
+            ]
+        )
+
+    def save_tiff(self, filename, tile=(512, 512)):
+        """
+        Write all levels as one tiled, pyramidal BigTIFF.
+        """
+        if self.levels[0].ndim == 3:
+            photometric = "rgb"
+        else:
+            photometric = "minisblack"
+        with skimtiff.TiffWriter(filename, bigtiff=True) as tif:
+            tif.write(
+                self.levels[0],
+                tile=tile,
+                subifds=len(self.levels) - 1,
+                photometric=photometric,
+                metadata=None,
+            )
+            for level in self.levels[1:]:
+                tif.write(
+                    level,
+                    tile=tile,
+                    subfiletype=1,
+                    photometric=photometric,
+                    metadata=None,
+                )
+        logging.info(f"Saved pyramid of {len(self.levels)} levels")
@@ -10,9 +10,10 @@ Created on Thu Mar 12 11:31:53 2020
 import logging
 import time
 
-import serial
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from ..GeneralUsage.serial_connection import get_connection
+
 
 class InsightX3:
     """
@@ -43,6 +44,11 @@ class InsightX3:
         self.address = address
         self.CRending = "\r"
         self.LFending = "\n"
+        # Open once and shared, so the status thread and the GUI can send
+        # commands at the same time. Try_until_Success does the retries.
+        self.connection = get_connection(
+            self.address, device="insight", baudrate=self.baudrate, retries=0
+        )
 
     def Try_until_Success(func):
         """This is the decorator to try to execute the function until succeed."""
@@ -81,12 +87,11 @@ class InsightX3:
         """
         command = "*IDN?" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii", errors="replace"))
-            LaserID_byte = Insight.readline()  # Reads an '\n' terminated line
-            LaserID = LaserID_byte.decode("utf-8", errors="replace")
+        # Reads an '\n' terminated line
+        LaserID_byte = self.connection.query(command)
+        LaserID = LaserID_byte.decode("utf-8", errors="replace")
 
-            logging.info(LaserID)
+        logging.info(LaserID)
 
     @Try_until_Success
     def QueryStatus(self):
@@ -97,13 +102,12 @@ class InsightX3:
         """
         command = "*STB?" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            status_byte = Insight.readline()  # Reads an '\n' terminated line
+        # Reads an '\n' terminated line
+        status_byte = self.connection.query(command)
 
-            Status_binary = "{:032b}".format(
-                int(status_byte.decode("utf-8"))
-            )  # It's now a 32 bit string.
+        Status_binary = "{:032b}".format(
+            int(status_byte.decode("utf-8"))
+        )  # It's now a 32 bit string.
 
         # Interpretation from bit numbers. Referring Insight Programming A-8 for details.
         Status_list = []
@@ -161,19 +165,14 @@ class InsightX3:
         """
         command = "READ:PCTWarmedup?" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            warmupstatus_byte = (
-                Insight.readline()
-            )  # Reads an '\n' terminated line
-            warmupstatus = warmupstatus_byte.decode("utf-8")
-
-            logging.info(
-                "Warming up: {}%".format(
-                    warmupstatus[0 : len(warmupstatus) - 1]
-                )
-            )
-            return warmupstatus
+        # Reads an '\n' terminated line
+        warmupstatus_byte = self.connection.query(command)
+        warmupstatus = warmupstatus_byte.decode("utf-8")
+
+        logging.info(
+            "Warming up: {}%".format(warmupstatus[0 : len(warmupstatus) - 1])
+        )
+        return warmupstatus
 
     @Try_until_Success
     def QueryPower(self):
@@ -182,13 +181,11 @@ class InsightX3:
         """
         command = "READ:POWer?" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            LaserPower = (Insight.readline()).decode("utf-8")
+        LaserPower = (self.connection.query(command)).decode("utf-8")
 
-            # print('LaserPower is {} w.'.format(LaserPower))
-            # print(LaserPower)
-            return LaserPower
+        # print('LaserPower is {} w.'.format(LaserPower))
+        # print(LaserPower)
+        return LaserPower
 
     @Try_until_Success
     def QueryWavelength(self):
@@ -198,17 +195,15 @@ class InsightX3:
         """
         command = "WAVelength?" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            LaserWavelength = (Insight.readline()).decode("utf-8")
+        LaserWavelength = (self.connection.query(command)).decode("utf-8")
 
-            logging.info(
-                "LaserWavelength is {} nm.".format(
-                    LaserWavelength[0 : len(LaserWavelength) - 1]
-                )
+        logging.info(
+            "LaserWavelength is {} nm.".format(
+                LaserWavelength[0 : len(LaserWavelength) - 1]
             )
+        )
 
-            return LaserWavelength
+        return LaserWavelength
 
     @Try_until_Success
     def SetWavelength(self, Wavelength):
@@ -219,11 +214,8 @@ class InsightX3:
         """
         command = "WAVelength " + str(Wavelength) + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            logging.info(
-                "LaserWavelength going to {} nm...".format(Wavelength)
-            )
+        self.connection.write(command)
+        logging.info("LaserWavelength going to {} nm...".format(Wavelength))
 
     @Try_until_Success
     def SetWatchdogTimer(self, timeout):
@@ -234,9 +226,8 @@ class InsightX3:
         """
         command = "TIMer:WATChdog " + str(timeout) + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            logging.info("TIMer:WATChdog set to {} s.".format(timeout))
+        self.connection.write(command)
+        logging.info("TIMer:WATChdog set to {} s.".format(timeout))
 
     @Try_until_Success
     def SetOperatingMode(self, mode):
@@ -250,9 +241,8 @@ class InsightX3:
         elif mode == "MODE ALIGN":
             command = "MODE ALIGN" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            logging.info("Setting: {}".format(mode))
+        self.connection.write(command)
+        logging.info("Setting: {}".format(mode))
 
     @Try_until_Success
     def Turn_On_PumpLaser(self):
@@ -266,8 +256,7 @@ class InsightX3:
         """
         command = "ON" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
+        self.connection.write(command)
 
     # ONresponse = (Insight.readline()).decode("utf-8")
 
@@ -281,10 +270,9 @@ class InsightX3:
         """
         command = "OFF" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
+        self.connection.write(command)
 
-            logging.info("Pump diode laser turned down.")
+        logging.info("Pump diode laser turned down.")
 
     @Try_until_Success
     def Open_TunableBeamShutter(self):
@@ -294,8 +282,7 @@ class InsightX3:
         """
         command = "SHUTter 1" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
+        self.connection.write(command)
 
     @Try_until_Success
     def Close_TunableBeamShutter(self):
@@ -304,8 +291,7 @@ class InsightX3:
         """
         command = "SHUTter 0" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
+        self.connection.write(command)
 
     @Try_until_Success
     def SaveVariables(self):
@@ -314,19 +300,16 @@ class InsightX3:
         """
         command = "SAVe" + self.CRending
 
-        with serial.Serial(self.address, self.baudrate) as Insight:
-            Insight.write(command.encode("ascii"))
-            SAVeresponse = (Insight.readline()).decode("utf-8")
+        SAVeresponse = (self.connection.query(command)).decode("utf-8")
 
-            logging.info(SAVeresponse)
+        logging.info(SAVeresponse)
 
 
 class QueryLaserStatusThread(QThread):
     """
     Thread to query laser status.
-    CAN NOT QUERY AND SEND COMMANDS AT THE SAME TIME!!!
-
-    BEFORE SENDING COMMANDS, ONE CAN SET STOPFLAG TO FALSE AND START AGAIN AFTER EXECUTION,
+    The queries and the commands of the GUI go through the same connection one
+    after the other, so commands can be sent while it runs.
     """
 
     Thread_Status_list = pyqtSignal(list)
@@ -7,17 +7,115 @@ Created on Fri May 29 15:29:22 2020
 """
 # READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT in SYN!!!
 
+import contextlib
+import json
 import logging
 import os
+import threading
 from datetime import datetime
 
-import nidaqmx
 import numpy as np
-from nidaqmx.constants import AcquisitionType, LineGrouping
-from nidaqmx.stream_readers import AnalogMultiChannelReader
+from nidaqmx.constants import (
+    AcquisitionType,
+    LineGrouping,
+    RegenerationMode,
+)
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from .compiled_waveform import compile_waveforms
 from .constants import NiDaqChannels
+from .daq_backend import get_backend
+
+
+def iter_sample_chunks(samples, chunk_size, repeats=1):
+    """
+    Cut samples into consecutive blocks for streaming.
+
+    Parameters
+    samples : np.ndarray
+        Samples of shape (channels, period) or (period,). Can be a memory map.
+    chunk_size : int
+        Number of samples per channel in each block.
+    repeats : int or None
+        How many times the period is regenerated. None repeats forever.
+
+    Yields
+    np.ndarray
+        Blocks of shape (channels, chunk_size). The last block is shorter if
+        the total length is not a multiple of chunk_size. Blocks inside one
+        period are views, blocks crossing the period boundary are copies.
+    """
+    samples = np.atleast_2d(samples)
+    period = samples.shape[1]
+    total = None if repeats is None else period * repeats
+
+    start = 0
+    while total is None or start < total:
+        stop = start + chunk_size
+        if total is not None:
+            stop = min(stop, total)
+
+        offset = start % period
+        if offset + stop - start <= period:
+            yield samples[:, offset : offset + stop - start]
+        else:
+            yield samples.take(np.arange(start, stop) % period, axis=1)
+        start = stop
+
+
+class StreamRecorder:
+    """
+    Append recorded chunks to a raw binary file while streaming.
+
+    Samples are stored as float64 in (samples, channels) order. A JSON sidecar
+    with the same name holds sampling rate, channel names and scaling
+    coefficients, so that the recording can be opened with load_recording.
+    """
+
+    def __init__(self, filename, sampling_rate, channels, scaling_coeff=()):
+        self.filename = filename
+        self.sampling_rate = sampling_rate
+        self.channels = list(channels)
+        self.scaling_coeff = [float(c) for c in scaling_coeff]
+        self.samples_written = 0
+        self.file = open(self.filename, "wb")
+
+    def write(self, chunk):
+        np.ascontiguousarray(chunk.T, dtype=np.float64).tofile(self.file)
+        self.samples_written += chunk.shape[1]
+
+    def close(self):
+        self.file.close()
+        with open(self.filename + ".json", "w") as sidecar:
+            json.dump(
+                {
+                    "sampling_rate": self.sampling_rate,
+                    "channels": self.channels,
+                    "ai_dev_scaling_coeff": self.scaling_coeff,
+                    "dtype": "float64",
+                    "shape": [self.samples_written, len(self.channels)],
+                },
+                sidecar,
+                indent=2,
+            )
+
+    @staticmethod
+    def load_recording(filename):
+        """
+        Open a streamed recording without reading it into memory.
+
+        Returns
+        (np.memmap of shape (channels, samples), metadata dictionary)
+        """
+        with open(filename + ".json") as sidecar:
+            metadata = json.load(sidecar)
+        data = np.memmap(
+            filename,
+            dtype=metadata["dtype"],
+            mode="r",
+            shape=tuple(metadata["shape"]),
+        )
+        return data.T, metadata
 
 
 class DAQmission(QThread):
@@ -26,6 +124,7 @@ class DAQmission(QThread):
     """
 
     collected_data = pyqtSignal(np.ndarray)
+    collected_chunk = pyqtSignal(np.ndarray)
     finishSignal = pyqtSignal()
 
     def __init__(self, channel_LUT=None, *args, **kwargs):
@@ -41,6 +140,8 @@ class DAQmission(QThread):
         else:
             self.channel_LUT = channel_LUT
 
+        self._stop_streaming = threading.Event()
+
     def sendSingleAnalog(self, channel, value):
         """
         Write one single digital signal.
@@ -56,11 +157,12 @@ class DAQmission(QThread):
 
         """
 
+        daq = get_backend()
         self.channelname = self.channel_LUT[channel]
         self.writting_value = value
 
         # Assume that dev1 is always employed
-        with nidaqmx.Task() as writingtask:
+        with daq.Task() as writingtask:
             writingtask.ao_channels.add_ao_voltage_chan(self.channelname)
             writingtask.write(self.writting_value)
 
@@ -79,13 +181,14 @@ class DAQmission(QThread):
 
         """
 
+        daq = get_backend()
         self.channelname = self.channel_LUT[channel]
         if value is True:
             writting_value = np.array([1], dtype=bool)
         else:
             writting_value = np.array([0], dtype=bool)
 
-        with nidaqmx.Task() as writingtask:
+        with daq.Task() as writingtask:
             writingtask.do_channels.add_do_chan(self.channelname)
             writingtask.write(writting_value)
 
@@ -121,77 +224,47 @@ class DAQmission(QThread):
               A list that contains the readin channels wanted.
         """
 
+        # Parsing specifications, dividing channels over the devices and
+        # packing digital lines is cached on the content of the waveforms.
+        compiled = compile_waveforms(
+            sampling_rate, analog_signals, digital_signals, self.channel_LUT
+        )
+        self.runCompiledWaveforms(clock_source, compiled, readin_channels)
+
+    def runCompiledWaveforms(self, clock_source, compiled, readin_channels):
+        """
+        Execute a CompiledWaveform, from compile_waveforms or loaded with
+        CompiledWaveform.load.
+
+        Parameters
+        clock_source : str
+            "DAQ" or "Camera".
+        compiled : CompiledWaveform
+            Waveforms prepared for the NI-daq.
+        readin_channels : list
+            A list that contains the readin channels wanted.
+        """
+
         # Setting up waveforms
+        daq = get_backend()
 
-        Analog_channel_number = len(analog_signals)
-        Digital_channel_number = len(digital_signals)
+        Analog_channel_number = compiled.analog_channel_number
+        Digital_channel_number = compiled.digital_channel_number
         self.readin_channels = readin_channels
-        self.sampling_rate = sampling_rate
+        self.sampling_rate = compiled.sampling_rate
 
-        # galvosx and galvosy as specification key words are already enough.
-
-        # Get the average number and y pixel number information from data
-        self.galvosx_originalkey = "galvosx"
-        self.galvosy_originalkey = "galvosy"
-
-        # If there are kyes with information like 'galvosxavgnum', extract the
-        # information and then convert the key to 'galvosx'.
-        if Analog_channel_number != 0:
-            for i in range(len(analog_signals["Specification"])):
-                if "galvosxavgnum" in analog_signals["Specification"][i]:
-                    self.averagenumber = int(
-                        analog_signals["Specification"][i][
-                            analog_signals["Specification"][i].index("_")
-                            + 1 : len(analog_signals["Specification"][i])
-                        ]
-                    )
-                    self.galvosx_originalkey = analog_signals["Specification"][
-                        i
-                    ]
-                    analog_signals["Specification"][i] = "galvosx"
-                elif "galvosyypixels" in analog_signals["Specification"][i]:
-                    self.ypixelnumber = int(
-                        analog_signals["Specification"][i][
-                            analog_signals["Specification"][i].index("_")
-                            + 1 : len(analog_signals["Specification"][i])
-                        ]
-                    )
-                    self.galvosy_originalkey = analog_signals["Specification"][
-                        i
-                    ]
-                    analog_signals["Specification"][i] = "galvosy"
-                elif "galvos_X_contour" in analog_signals["Specification"][i]:
-                    self.galvosx_originalkey = analog_signals["Specification"][
-                        i
-                    ]
-                    analog_signals["Specification"][i] = "galvosx"
-
-                elif "galvos_Y_contour" in analog_signals["Specification"][i]:
-                    self.galvosy_originalkey = analog_signals["Specification"][
-                        i
-                    ]
-                    analog_signals["Specification"][i] = "galvosy"
-
-        # === Devide samples from Dev1 or 2 ===
-        self.Dev1_analog_channel_list = []
-        self.Dev2_analog_channel_list = []
-
-        Dev1_analog_waveforms_list = []
-        Dev2_analog_waveforms_list = []
-
-        if Analog_channel_number != 0:
-            if len(analog_signals["Waveform"]) != 0:
-                num_rows, num_cols = analog_signals["Waveform"].shape
-                for i in range(int(num_rows)):
-                    specification = analog_signals["Specification"][i]
-                    channel = self.channel_LUT[specification]
-                    waveform = analog_signals["Waveform"][i]
-                    if "Dev1" in channel:
-                        self.Dev1_analog_channel_list.append(channel)
-                        Dev1_analog_waveforms_list.append(waveform)
-                    else:
-                        self.Dev2_analog_channel_list.append(channel)
-                        Dev2_analog_waveforms_list.append(waveform)
+        # Information from galvo specifications like 'galvosxavgnum_2'.
+        if compiled.averagenumber is not None:
+            self.averagenumber = compiled.averagenumber
+        if compiled.ypixelnumber is not None:
+            self.ypixelnumber = compiled.ypixelnumber
+
+        # === Samples from Dev1 or 2 ===
+        self.Dev1_analog_channel_list = compiled.dev1_channels
+        self.Dev2_analog_channel_list = compiled.dev2_channels
+        Dev1_analog_samples_to_write = compiled.dev1_analog
+        Dev2_analog_samples_to_write = compiled.dev2_analog
+        Digital_samples_to_write = compiled.digital
 
         Dev1_analog_channel_number = len(self.Dev1_analog_channel_list)
         Dev2_analog_channel_number = len(self.Dev2_analog_channel_list)
@@ -206,91 +279,12 @@ class DAQmission(QThread):
         # signals then the timing configs are different.
 
         # === Number of samples in each waveform ===
+        self.Waveforms_length = compiled.length
         if self.Only_Digital_signals is False:
-            self.Waveforms_length = len(analog_signals["Waveform"][0])
-            num_rows, num_cols = analog_signals["Waveform"].shape
-            logging.info(f"row number of analog signals:  {num_rows}")
-        elif self.Only_Digital_signals is True:
-            self.Waveforms_length = len(digital_signals["Waveform"][0])
-
-        # === Stack the Analog samples of dev1 and dev2 individually ===
-        # IN CASE OF ONLY ONE ARRAY, WE NEED TO CONVERT THE SHAPE TO (1,N) BY USING np.array([]) OUTSIDE THE ARRAY!!
-        if Dev1_analog_channel_number == 1:
-            Dev1_analog_samples_to_write = np.array(
-                [Dev1_analog_waveforms_list[0]]
+            logging.info(
+                f"row number of analog signals:  {Analog_channel_number}"
             )
 
-        elif Dev1_analog_channel_number == 0:
-            Dev1_analog_samples_to_write = []
-        else:
-            Dev1_analog_samples_to_write = Dev1_analog_waveforms_list[0]
-            for i in range(1, Dev1_analog_channel_number):
-                Dev1_analog_samples_to_write = np.vstack(
-                    (
-                        Dev1_analog_samples_to_write,
-                        Dev1_analog_waveforms_list[i],
-                    )
-                )
-
-        if Dev2_analog_channel_number == 1:
-            Dev2_analog_samples_to_write = np.array(
-                [Dev2_analog_waveforms_list[0]]
-            )
-        elif Dev2_analog_channel_number == 0:
-            Dev2_analog_samples_to_write = []
-        else:
-            Dev2_analog_samples_to_write = Dev2_analog_waveforms_list[0]
-            for i in range(1, Dev2_analog_channel_number):
-                Dev2_analog_samples_to_write = np.vstack(
-                    (
-                        Dev2_analog_samples_to_write,
-                        Dev2_analog_waveforms_list[i],
-                    )
-                )
-
-        # Stack the digital samples
-        if Digital_channel_number == 1:
-            Digital_samples_to_write = np.array(
-                [digital_signals["Waveform"][0]]
-            )
-
-        elif Digital_channel_number == 0:
-            Digital_samples_to_write = []
-        else:
-            Digital_samples_to_write = digital_signals["Waveform"][0]
-            for i in range(1, Digital_channel_number):
-                Digital_samples_to_write = np.vstack(
-                    (Digital_samples_to_write, digital_signals["Waveform"][i])
-                )
-
-        # === Set the dtype of digital signals ===
-        # For each digital waveform sample, it 0 or 1. To write to NI-daq, you
-        # need to send int number corresponding to the channel binary value,
-        # like write 8(2^3, 0001) to channel 4.
-        # The same as (0b1 << n)
-        Digital_samples_to_write = np.array(
-            Digital_samples_to_write, dtype="uint32"
-        )
-
-        for i in range(Digital_channel_number):
-            specification = digital_signals["Specification"][i]
-            channel = self.channel_LUT[specification]
-            lineindex = channel.index("line")
-            convernum = int(channel[lineindex + 4 : len(channel)])
-            Digital_samples_to_write[i] = Digital_samples_to_write[i] * (
-                2 ** (convernum)
-            )
-
-        # For example, to send commands to line 0 and line 3, you hava to write
-        # 1001 to digital port, convert to uint32 that is 9.
-        if Digital_channel_number > 1:
-            Digital_samples_to_write = np.sum(
-                Digital_samples_to_write, axis=0
-            )  # sum along the columns, for multiple lines
-            Digital_samples_to_write = np.array(
-                [Digital_samples_to_write]
-            )  # here convert the shape from (n,) to (1,n)
-
         # === Set up data holder for recording data ===
         if len(self.readin_channels) != 0:
             self.has_recording_channel = True
@@ -310,7 +304,7 @@ class DAQmission(QThread):
         # Analog signal in Dev 1 is involved
         """
         if Dev1_analog_channel_number != 0:
-            with nidaqmx.Task() as slave_Task_1_analog_dev1, nidaqmx.Task() as slave_Task_1_analog_dev2, nidaqmx.Task() as master_Task_readin, nidaqmx.Task() as slave_Task_2_digitallines:
+            with daq.Task() as slave_Task_1_analog_dev1, daq.Task() as slave_Task_1_analog_dev2, daq.Task() as master_Task_readin, daq.Task() as slave_Task_2_digitallines:
                 # === adding channels ===
                 # Set tasks from different devices apart
                 for i in range(Dev1_analog_channel_number):
@@ -358,27 +352,17 @@ class DAQmission(QThread):
                 self.ai_dev_scaling_coeff_vp = []
                 self.ai_dev_scaling_coeff_ip = []
                 if "Vp" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_vp = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Vp"]
-                        )
-                    )
-                    # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
                     self.ai_dev_scaling_coeff_vp = np.array(
-                        self.ai_dev_scaling_coeff_vp.ai_dev_scaling_coeff
+                        daq.ai_dev_scaling_coeff(
+                            master_Task_readin, self.channel_LUT["Vp"]
+                        )
                     )
 
                 if "Ip" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_ip = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Ip"]
-                        )
-                    )
-                    # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
                     self.ai_dev_scaling_coeff_ip = np.array(
-                        self.ai_dev_scaling_coeff_ip.ai_dev_scaling_coeff
+                        daq.ai_dev_scaling_coeff(
+                            master_Task_readin, self.channel_LUT["Ip"]
+                        )
                     )
 
                 self.ai_dev_scaling_coeff_list = np.append(
@@ -432,7 +416,7 @@ class DAQmission(QThread):
                         )
 
                         AnalogWriter = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev1.out_stream,
                                 auto_start=False,
                             )
@@ -440,7 +424,7 @@ class DAQmission(QThread):
                         AnalogWriter.auto_start = False
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream,
                                 auto_start=False,
                             )
@@ -512,7 +496,7 @@ class DAQmission(QThread):
                         # slave_Task_1_analog_dev2.triggers.start_trigger.cfg_dig_edge_start_trig(self.channel_LUT["trigger2Channel"])#'/Dev2/PFI7'
 
                         AnalogWriter = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev1.out_stream,
                                 auto_start=False,
                             )
@@ -520,7 +504,7 @@ class DAQmission(QThread):
                         AnalogWriter.auto_start = False
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream,
                                 auto_start=False,
                             )
@@ -541,19 +525,21 @@ class DAQmission(QThread):
                         # slave_Task_2_digitallines.triggers.sync_type.SLAVE = True
 
                 # === Configure the writer and reader ===
-                AnalogWriter = nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                AnalogWriter = daq.stream_writers.AnalogMultiChannelWriter(
                     slave_Task_1_analog_dev1.out_stream, auto_start=False
                 )
                 AnalogWriter.auto_start = False
                 if Digital_channel_number != 0:
                     DigitalWriter = (
-                        nidaqmx.stream_writers.DigitalMultiChannelWriter(
+                        daq.stream_writers.DigitalMultiChannelWriter(
                             slave_Task_2_digitallines.out_stream,
                             auto_start=False,
                         )
                     )
                     DigitalWriter.auto_start = False
-                reader = AnalogMultiChannelReader(master_Task_readin.in_stream)
+                reader = daq.stream_readers.AnalogMultiChannelReader(
+                    master_Task_readin.in_stream
+                )
                 reader.auto_start = False
 
                 # === Begin to execute in DAQ ===
@@ -611,23 +597,11 @@ class DAQmission(QThread):
                     "^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^"
                 )
 
-            # set the keys of galvos back for next round
-            if Analog_channel_number != 0:
-                for i in range(len(analog_signals["Specification"])):
-                    if "galvosx" in analog_signals["Specification"][i]:
-                        analog_signals["Specification"][
-                            i
-                        ] = self.galvosx_originalkey
-                    elif "galvosy" in analog_signals["Specification"][i]:
-                        analog_signals["Specification"][
-                            i
-                        ] = self.galvosy_originalkey
-
             """
             # Only Dev 2 is involved  in sending analog signals
             """
         elif Dev2_analog_channel_number != 0:
-            with nidaqmx.Task() as slave_Task_1_analog_dev2, nidaqmx.Task() as master_Task_readin, nidaqmx.Task() as slave_Task_2_digitallines:
+            with daq.Task() as slave_Task_1_analog_dev2, daq.Task() as master_Task_readin, daq.Task() as slave_Task_2_digitallines:
                 # adding channels
                 # Set tasks from different devices apart
                 slave_Task_2_digitallines.do_channels.add_do_chan(
@@ -667,25 +641,17 @@ class DAQmission(QThread):
                 self.ai_dev_scaling_coeff_vp = []
                 self.ai_dev_scaling_coeff_ip = []
                 if "Vp" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_vp = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Vp"]
-                        )
-                    )
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
                     self.ai_dev_scaling_coeff_vp = np.array(
-                        self.ai_dev_scaling_coeff_vp.ai_dev_scaling_coeff
+                        daq.ai_dev_scaling_coeff(
+                            master_Task_readin, self.channel_LUT["Vp"]
+                        )
                     )
 
                 if "Ip" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_ip = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Ip"]
-                        )
-                    )
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
                     self.ai_dev_scaling_coeff_ip = np.array(
-                        self.ai_dev_scaling_coeff_ip.ai_dev_scaling_coeff
+                        daq.ai_dev_scaling_coeff(
+                            master_Task_readin, self.channel_LUT["Ip"]
+                        )
                     )
 
                 self.ai_dev_scaling_coeff_list = np.append(
@@ -729,7 +695,7 @@ class DAQmission(QThread):
                         )
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream,
                                 auto_start=False,
                             )
@@ -786,7 +752,7 @@ class DAQmission(QThread):
                             self.cam_trigger_receiving_port
                         )
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            daq.stream_writers.AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream,
                                 auto_start=False,
                             )
@@ -809,13 +775,15 @@ class DAQmission(QThread):
 
                 if Digital_channel_number != 0:
                     DigitalWriter = (
-                        nidaqmx.stream_writers.DigitalMultiChannelWriter(
+                        daq.stream_writers.DigitalMultiChannelWriter(
                             slave_Task_2_digitallines.out_stream,
                             auto_start=False,
                         )
                     )
                     DigitalWriter.auto_start = False
-                reader = AnalogMultiChannelReader(master_Task_readin.in_stream)
+                reader = daq.stream_readers.AnalogMultiChannelReader(
+                    master_Task_readin.in_stream
+                )
                 reader.auto_start = False
 
                 # === Begin to execute in DAQ ===
@@ -867,31 +835,14 @@ class DAQmission(QThread):
                     "^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^"
                 )
 
-            # set the keys of galvos back for next round
-            if Analog_channel_number != 0:
-                for i in range(len(analog_signals["Specification"])):
-                    if "galvosx" in analog_signals["Specification"][i]:
-                        analog_signals["Specification"][
-                            i
-                        ] = self.galvosx_originalkey
-                    elif "galvosy" in analog_signals["Specification"][i]:
-                        analog_signals["Specification"][
-                            i
-                        ] = self.galvosy_originalkey
-
             """
             # Only digital signals
             """
         elif self.Only_Digital_signals is True:
-            # some preparations for digital lines
-            Waveforms_length = len(digital_signals["Waveform"][0])
-
-            digitalsignalslinenumber = len(
-                digital_signals["Waveform"]
-            )  # TODO unused
+            Waveforms_length = self.Waveforms_length
 
             # Assume that dev1 is always employed
-            with nidaqmx.Task() as slave_Task_2_digitallines:
+            with daq.Task() as slave_Task_2_digitallines:
                 # adding channels
                 # Set tasks from different devices apart
                 slave_Task_2_digitallines.do_channels.add_do_chan(
@@ -906,10 +857,8 @@ class DAQmission(QThread):
                 )
 
                 # Configure the writer and reader
-                DigitalWriter = (
-                    nidaqmx.stream_writers.DigitalMultiChannelWriter(
-                        slave_Task_2_digitallines.out_stream, auto_start=False
-                    )
+                DigitalWriter = daq.stream_writers.DigitalMultiChannelWriter(
+                    slave_Task_2_digitallines.out_stream, auto_start=False
                 )
                 DigitalWriter.auto_start = False
 
@@ -930,6 +879,350 @@ class DAQmission(QThread):
                     "^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^"
                 )
 
+    def _add_readin_channels(self, master_Task_readin):
+        """
+        Add the read-in channels in the fixed order PMT, Vp, Ip and collect the
+        scaling coefficients of the patch channels.
+        """
+        daq = get_backend()
+        if len(self.readin_channels) == 0:
+            # If no read-in channel is added, vp channel is added to keep the
+            # sample clock alive.
+            master_Task_readin.ai_channels.add_ai_voltage_chan(
+                self.channel_LUT["Vp"]
+            )
+        for readin in ("PMT", "Vp", "Ip"):
+            if readin in self.readin_channels:
+                master_Task_readin.ai_channels.add_ai_voltage_chan(
+                    self.channel_LUT[readin]
+                )
+
+        self.aichannelnames = master_Task_readin.ai_channels.channel_names
+        # Labels of the rows of Dataholder, in the order of aichannelnames.
+        self.readin_labels = [
+            readin
+            for readin in ("PMT", "Vp", "Ip")
+            if readin in self.readin_channels
+        ]
+
+        self.ai_dev_scaling_coeff_vp = []
+        self.ai_dev_scaling_coeff_ip = []
+        if "Vp" in self.readin_channels:
+            self.ai_dev_scaling_coeff_vp = np.array(
+                daq.ai_dev_scaling_coeff(
+                    master_Task_readin, self.channel_LUT["Vp"]
+                )
+            )
+        if "Ip" in self.readin_channels:
+            self.ai_dev_scaling_coeff_ip = np.array(
+                daq.ai_dev_scaling_coeff(
+                    master_Task_readin, self.channel_LUT["Ip"]
+                )
+            )
+        self.ai_dev_scaling_coeff_list = np.append(
+            self.ai_dev_scaling_coeff_vp, self.ai_dev_scaling_coeff_ip
+        )
+
+    def runWaveformsStreaming(
+        self,
+        clock_source,
+        sampling_rate,
+        analog_signals,
+        digital_signals,
+        readin_channels,
+        chunk_size=100000,
+        repeats=1,
+        save_directory=None,
+    ):
+        """
+        Streaming version of runWaveforms for long protocols.
+
+        Takes the same waveform containers as runWaveforms, which may also be
+        memory mapped from disk. Instead of writing the whole waveform at once
+        the waveforms are regenerated chunk by chunk, see streamWaveforms.
+
+        Parameters
+        repeats : int or None
+            Number of times the waveforms are played back to back. None keeps
+            running until stopStreaming is called.
+        """
+        self.readin_channels = readin_channels
+        compiled = compile_waveforms(
+            sampling_rate, analog_signals, digital_signals, self.channel_LUT
+        )
+        self.Dev1_analog_channel_list = compiled.dev1_channels
+        self.Dev2_analog_channel_list = compiled.dev2_channels
+
+        dev1_analog = dev2_analog = digital_chunks = None
+        if len(compiled.dev1_channels) != 0:
+            dev1_analog = (
+                compiled.dev1_channels,
+                iter_sample_chunks(compiled.dev1_analog, chunk_size, repeats),
+            )
+        if len(compiled.dev2_channels) != 0:
+            dev2_analog = (
+                compiled.dev2_channels,
+                iter_sample_chunks(compiled.dev2_analog, chunk_size, repeats),
+            )
+        if compiled.digital_channel_number != 0:
+            digital_chunks = iter_sample_chunks(
+                compiled.digital, chunk_size, repeats
+            )
+
+        return self.streamWaveforms(
+            clock_source,
+            sampling_rate,
+            readin_channels,
+            chunk_size,
+            dev1_analog=dev1_analog,
+            dev2_analog=dev2_analog,
+            digital_chunks=digital_chunks,
+            save_directory=save_directory,
+        )
+
+    def streamWaveforms(
+        self,
+        clock_source,
+        sampling_rate,
+        readin_channels,
+        chunk_size,
+        dev1_analog=None,
+        dev2_analog=None,
+        digital_chunks=None,
+        save_directory=None,
+        prefill_chunks=4,
+    ):
+        """
+        Run continuous tasks that are fed chunk by chunk from generators.
+
+        Only prefill_chunks + 1 chunks per task live in the DAQ buffers, so
+        memory stays bounded however long the protocol runs. Recorded chunks
+        are emitted through collected_chunk and, if save_directory is given,
+        appended to disk by a StreamRecorder as they arrive.
+
+        Parameters
+        clock_source : str
+            "DAQ" or "Camera", same as in runWaveforms.
+        sampling_rate : float
+            Sampling rate of the waveforms.
+        readin_channels : list
+            Read-in channels wanted, like ["PMT", "Vp"].
+        chunk_size : int
+            Number of samples per channel written and read in one go.
+        dev1_analog, dev2_analog : tuple
+            (channel list, iterator of (channels, n) float arrays) per device.
+        digital_chunks : iterator
+            Iterator of (1, n) uint32 port values for "/Dev1/port0".
+        save_directory : str
+            Where to save the recording. None only emits the chunks.
+        prefill_chunks : int
+            Number of chunks written ahead before the tasks start.
+
+        Returns
+        int
+            Number of samples per channel that were streamed.
+        """
+        daq = get_backend()
+        self.readin_channels = readin_channels
+        self.sampling_rate = sampling_rate
+        self.has_recording_channel = len(readin_channels) != 0
+        self._stop_streaming.clear()
+
+        if (
+            dev1_analog is None
+            and dev2_analog is None
+            and digital_chunks is None
+        ):
+            raise ValueError("streamWaveforms needs at least one output.")
+
+        buffer_size = chunk_size * (prefill_chunks + 1)
+        if clock_source == "Camera":
+            self.cam_trigger_receiving_port = "/Dev1/PFI0"
+            readin_clock = self.cam_trigger_receiving_port
+            dev1_clock = self.cam_trigger_receiving_port
+        else:
+            readin_clock = ""
+            dev1_clock = "ai/SampleClock"
+
+        with contextlib.ExitStack() as stack:
+            master_Task_readin = stack.enter_context(daq.Task())
+            self._add_readin_channels(master_Task_readin)
+            master_Task_readin.timing.cfg_samp_clk_timing(
+                self.sampling_rate,
+                source=readin_clock,
+                sample_mode=AcquisitionType.CONTINUOUS,
+                samps_per_chan=buffer_size,
+            )
+            master_Task_readin.export_signals.samp_clk_output_term = (
+                self.channel_LUT["clock1Channel"]
+            )
+            master_Task_readin.export_signals.start_trig_output_term = (
+                self.channel_LUT["trigger1Channel"]
+            )
+            if clock_source == "Camera":
+                master_Task_readin.triggers.start_trigger.cfg_dig_edge_start_trig(
+                    self.cam_trigger_receiving_port
+                )
+
+            # === Output tasks, each with its own chunk feeder ===
+            feeders = []
+            for analog, clock in (
+                (dev1_analog, dev1_clock),
+                (dev2_analog, self.channel_LUT["clock2Channel"]),
+            ):
+                if analog is None:
+                    continue
+                channel_list, chunks = analog
+                task = stack.enter_context(daq.Task())
+                for channel in channel_list:
+                    task.ao_channels.add_ao_voltage_chan(channel)
+                writer = daq.stream_writers.AnalogMultiChannelWriter(
+                    task.out_stream, auto_start=False
+                )
+                feeders.append(
+                    {
+                        "task": task,
+                        "write": writer.write_many_sample,
+                        "chunks": chunks,
+                        "clock": clock,
+                        "buffer": np.zeros((len(channel_list), chunk_size)),
+                    }
+                )
+
+            if digital_chunks is not None:
+                task = stack.enter_context(daq.Task())
+                task.do_channels.add_do_chan(
+                    "/Dev1/port0",
+                    line_grouping=LineGrouping.CHAN_FOR_ALL_LINES,
+                )
+                writer = daq.stream_writers.DigitalMultiChannelWriter(
+                    task.out_stream, auto_start=False
+                )
+                feeders.append(
+                    {
+                        "task": task,
+                        "write": writer.write_many_sample_port_uint32,
+                        "chunks": digital_chunks,
+                        "clock": dev1_clock,
+                        "buffer": np.zeros((1, chunk_size), dtype="uint32"),
+                    }
+                )
+
+            for feeder in feeders:
+                feeder["task"].timing.cfg_samp_clk_timing(
+                    self.sampling_rate,
+                    source=feeder["clock"],
+                    sample_mode=AcquisitionType.CONTINUOUS,
+                    samps_per_chan=buffer_size,
+                )
+                feeder[
+                    "task"
+                ].out_stream.regen_mode = (
+                    RegenerationMode.DONT_ALLOW_REGENERATION
+                )
+                # Samples that come from the generator. Once it is exhausted
+                # the output keeps holding its last value until all recorded
+                # samples are in, so the output buffer never runs dry.
+                feeder["generated"] = 0
+                feeder["exhausted"] = False
+                if clock_source == "Camera" and feeder["clock"] == dev1_clock:
+                    feeder[
+                        "task"
+                    ].triggers.start_trigger.cfg_dig_edge_start_trig(
+                        self.cam_trigger_receiving_port
+                    )
+
+            reader = daq.stream_readers.AnalogMultiChannelReader(
+                master_Task_readin.in_stream
+            )
+            reader.auto_start = False
+
+            self.stream_recorder = None
+            if save_directory is not None and self.has_recording_channel:
+                timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+                self.stream_recorder = StreamRecorder(
+                    os.path.join(
+                        save_directory, "Stream" + timestamp + ".dat"
+                    ),
+                    self.sampling_rate,
+                    self.readin_labels,
+                    self.ai_dev_scaling_coeff_list,
+                )
+                stack.callback(self.stream_recorder.close)
+
+            # The read buffer is allocated once and reused for every chunk.
+            self.Dataholder = np.zeros((len(self.aichannelnames), chunk_size))
+
+            def feed(feeder):
+                buffer = feeder["buffer"]
+                chunk = None
+                if not feeder["exhausted"]:
+                    chunk = next(feeder["chunks"], None)
+                if chunk is None:
+                    feeder["exhausted"] = True
+                    buffer[:] = buffer[:, -1:]
+                else:
+                    n = chunk.shape[1]
+                    buffer[:, :n] = chunk
+                    buffer[:, n:] = chunk[:, -1:]
+                    feeder["generated"] += n
+                    if n < chunk_size:
+                        feeder["exhausted"] = True
+                feeder["write"](buffer, timeout=605.0)
+
+            for _ in range(prefill_chunks):
+                for feeder in feeders:
+                    feed(feeder)
+
+            logging.info(
+                "^^^^^^^^^^^^^^^^^^Daq streaming start^^^^^^^^^^^^^^^^^^"
+            )
+            for feeder in feeders:
+                feeder["task"].start()
+            master_Task_readin.start()  # !!!!!!!!!!!!!!!!!!!! READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT SYN!!!
+
+            samples_read = 0
+            while not self._stop_streaming.is_set():
+                finished = all(feeder["exhausted"] for feeder in feeders)
+                samples_total = max(feeder["generated"] for feeder in feeders)
+                if finished and samples_read >= samples_total:
+                    break
+
+                reader.read_many_sample(
+                    data=self.Dataholder,
+                    number_of_samples_per_channel=chunk_size,
+                    timeout=605.0,
+                )
+                valid = chunk_size
+                if finished:
+                    valid = min(chunk_size, samples_total - samples_read)
+                samples_read += valid
+
+                if self.has_recording_channel is True:
+                    chunk = self.Dataholder[:, :valid]
+                    if self.stream_recorder is not None:
+                        self.stream_recorder.write(chunk)
+                    self.collected_chunk.emit(chunk.copy())
+
+                for feeder in feeders:
+                    feed(feeder)
+
+            for feeder in feeders:
+                feeder["task"].stop()
+            master_Task_readin.stop()
+
+        self.finishSignal.emit()
+        logging.info(
+            "^^^^^^^^^^^^^^^^^^Daq streaming finish^^^^^^^^^^^^^^^^^^"
+        )
+        return samples_read
+
+    def stopStreaming(self):
+        """
+        Stop a running streamWaveforms after the current chunk.
+        """
+        self._stop_streaming.set()
+
     def get_raw_data(self):
         return self.Dataholder
 
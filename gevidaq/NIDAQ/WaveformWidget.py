@@ -19,8 +19,8 @@ from datetime import datetime
 import numpy as np
 import pyqtgraph as pg
 import pyqtgraph.exporters
+import tifffile as skimtiff
 from matplotlib import pyplot as plt
-from PIL import Image
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import (
@@ -40,17 +40,19 @@ from PyQt5.QtWidgets import (
     QTabWidget,
     QWidget,
 )
-from pyqtgraph import PlotDataItem
 
 from .. import StylishQT
 from ..ThorlabsFilterSlider.filterpyserial import ELL9Filter
 from . import waveform_specification
 from .DAQoperator import DAQmission
+from .decimated_plot import DecimatedPlotDataItem
 from .wavegenerator import (
     generate_AO,
     generate_AO_for640,
     generate_digital_waveform,
     generate_ramp,
+    raster_image_index,
+    reconstruct_raster_images,
     waveRecPic,
 )
 
@@ -254,6 +256,14 @@ class WaveformGenerator(QWidget):
         record_channel_container_layout.addWidget(self.ReadChanIpTextbox, 1, 3)
         self.patchRecordingGroup.addButton(self.ReadChanIpTextbox)
 
+        self.checkbox_showPMTImages = QCheckBox("Show images")
+        self.checkbox_showPMTImages.setToolTip(
+            "Open a figure of every reconstructed PMT image."
+        )
+        record_channel_container_layout.addWidget(
+            self.checkbox_showPMTImages, 0, 4
+        )
+
         record_channel_container.setLayout(record_channel_container_layout)
 
         self.ReadLayout.addWidget(record_channel_container, 0, 2, 3, 1)
@@ -1248,17 +1258,15 @@ class WaveformGenerator(QWidget):
         )
 
         # self.PMT_data_index_array_repeated is created to help locate pmt data
-        # at different pre-set average or repeat scanning scheme.
-        for i in range(
-            self.repeatnum
-        ):  # Array value where sits the second PMT image will be 2, etc.
-            if i == 0:
-                self.PMT_data_index_array_repeated = self.PMT_data_index_array
-            else:
-                self.PMT_data_index_array_repeated = np.append(
-                    self.PMT_data_index_array_repeated,
-                    self.PMT_data_index_array * (i + 1),
-                )
+        # at different pre-set average or repeat scanning scheme. Array value
+        # where sits the second PMT image will be 2, etc.
+        self.PMT_data_index_array_repeated = raster_image_index(
+            len(self.samples_1),
+            self.averagenum,
+            self.repeatnum,
+            self.gapsamples_number_galvo,
+            len(self.offsetsamples_galvo),
+        )
 
         self.repeated_samples_1 = np.append(
             self.offsetsamples_galvo, self.repeated_samples_1
@@ -1273,9 +1281,6 @@ class WaveformGenerator(QWidget):
             self.repeated_samples_2_yaxis, 0
         )
 
-        self.PMT_data_index_array_repeated = np.append(
-            self.offsetsamples_galvo, self.PMT_data_index_array_repeated
-        )
         # self.PMT_data_index_array_repeated = np.append(
         # self.PMT_data_index_array_repeated, 0
         # )
@@ -1643,8 +1648,9 @@ class WaveformGenerator(QWidget):
         if waveform.dtype == "bool":
             waveform = waveform.astype(int)
 
-        x_label = np.arange(len(waveform)) / self.uiDaq_sample_rate
-        current_PlotDataItem = PlotDataItem(x_label, waveform, name=channel)
+        current_PlotDataItem = DecimatedPlotDataItem(
+            waveform, sample_rate=self.uiDaq_sample_rate, name=channel
+        )
         current_PlotDataItem.setPen(self.color_dictionary[channel])
 
         if self.Append_Mode is True:
@@ -1954,43 +1960,41 @@ class WaveformGenerator(QWidget):
         )
 
         # === Reset the PlotDataItem ===
-        x_label = np.arange(self.reference_length) / self.uiDaq_sample_rate
-
         for waveform_key in self.waveform_data_dict:
             #
             if self.waveform_data_dict[waveform_key].dtype == "float64":
                 # In case of galvos re-drawing
                 if "galvos_contour" in waveform_key:
-                    self.PlotDataItem_dict["galvos_contour"].setData(
-                        x_label,
+                    self.PlotDataItem_dict["galvos_contour"].setWaveform(
                         self.waveform_data_dict[waveform_key],
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
                 elif "galvosx" in waveform_key or "galvosy" in waveform_key:
-                    self.PlotDataItem_dict["galvos"].setData(
-                        x_label,
+                    self.PlotDataItem_dict["galvos"].setWaveform(
                         self.waveform_data_dict[waveform_key],
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
                 elif "galvos_X" in waveform_key or "galvos_Y" in waveform_key:
-                    self.PlotDataItem_dict["galvos_contour"].setData(
-                        x_label,
+                    self.PlotDataItem_dict["galvos_contour"].setWaveform(
                         self.waveform_data_dict[waveform_key],
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
                 else:
-                    self.PlotDataItem_dict[waveform_key].setData(
-                        x_label,
+                    self.PlotDataItem_dict[waveform_key].setWaveform(
                         self.waveform_data_dict[waveform_key],
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
             else:
                 if waveform_key != "cameratrigger":
                     # In case of digital boolean signals, convert to int before
                     # plotting.
-                    self.PlotDataItem_dict[waveform_key].setData(
-                        x_label,
+                    self.PlotDataItem_dict[waveform_key].setWaveform(
                         self.waveform_data_dict[waveform_key].astype(int),
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
                 else:
@@ -2000,9 +2004,9 @@ class WaveformGenerator(QWidget):
                         len(self.waveform_data_dict[waveform_key]), dtype=bool
                     )
 
-                    self.PlotDataItem_dict[waveform_key].setData(
-                        x_label,
+                    self.PlotDataItem_dict[waveform_key].setWaveform(
                         rectified_waveform.astype(int),
+                        self.uiDaq_sample_rate,
                         name=waveform_key,
                     )
 
@@ -2204,8 +2208,8 @@ class WaveformGenerator(QWidget):
             if "Vp" in self.readinchan:
                 self.data_collected_0 = data_waveformreceived[0]
 
-                self.PlotDataItem_patch_voltage = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
+                self.PlotDataItem_patch_voltage = DecimatedPlotDataItem(
+                    self.data_collected_0, sample_rate=self.uiDaq_sample_rate
                 )
                 # use the same color as before, taking advantages of employing
                 # same keys in dictionary
@@ -2220,8 +2224,8 @@ class WaveformGenerator(QWidget):
             elif "Ip" in self.readinchan:
                 self.data_collected_0 = data_waveformreceived[0]
 
-                self.PlotDataItem_patch_current = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
+                self.PlotDataItem_patch_current = DecimatedPlotDataItem(
+                    self.data_collected_0, sample_rate=self.uiDaq_sample_rate
                 )
                 # use the same color as before, taking advantages of employing
                 # same keys in dictionary
@@ -2243,85 +2247,14 @@ class WaveformGenerator(QWidget):
 
                 # pmt data could come from raster scanning mode or from contour
                 # scanning mode.
-                try:
-                    for i in range(self.repeatnum):
-                        self.PMT_image_reconstructed_array = (
-                            self.data_collected_0[
-                                np.where(
-                                    self.PMT_data_index_array_repeated == i + 1
-                                )
-                            ]
-                        )
-                        Dataholder_average = np.mean(
-                            self.PMT_image_reconstructed_array.reshape(
-                                self.averagenum, -1
-                            ),
-                            axis=0,
-                        )
-                        Value_yPixels = int(
-                            len(self.samples_1) / self.ScanArrayXnum
-                        )
-                        self.PMT_image_reconstructed = np.reshape(
-                            Dataholder_average,
-                            (Value_yPixels, self.ScanArrayXnum),
-                        )
-
-                        # Stack the arrays into a 3d array
-                        if i == 0:
-                            self.PMT_image_reconstructed_stack = (
-                                self.PMT_image_reconstructed
-                            )
-                        else:
-                            self.PMT_image_reconstructed_stack = (
-                                np.concatenate(
-                                    (
-                                        self.PMT_image_reconstructed_stack,
-                                        self.PMT_image_reconstructed,
-                                    ),
-                                    axis=0,
-                                )
-                            )
-
-                        # generate an image object
-                        Localimg = Image.fromarray(
-                            self.PMT_image_reconstructed
-                        )
-                        timestamp = datetime.now().strftime(
-                            "%Y-%m-%d_%H-%M-%S"
-                        )
-                        filename = (
-                            f"{timestamp}_PMT_{self.saving_prefix}_{i}.tif"
-                        )
-                        # save as tif
-                        Localimg.save(
-                            os.path.join(self.savedirectory, filename)
-                        )
-
-                        plt.figure()
-                        plt.imshow(
-                            self.PMT_image_reconstructed, cmap=plt.cm.gray
-                        )
-                        plt.show()
-                except Exception as exc:
-                    logging.critical("caught exception", exc_info=exc)
-                    np.save(
-                        os.path.join(
-                            self.savedirectory,
-                            datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                            + "_PMT_"
-                            + self.saving_prefix
-                            + "_"
-                            + "flatten",
-                        ),
-                        self.data_collected_0,
-                    )
+                self.reconstruct_pmt_images("flatten")
 
         elif self.channel_number == 2:
             if "PMT" not in self.readinchan:
                 self.data_collected_0 = data_waveformreceived[0]
 
-                self.PlotDataItem_patch_voltage = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
+                self.PlotDataItem_patch_voltage = DecimatedPlotDataItem(
+                    self.data_collected_0, sample_rate=self.uiDaq_sample_rate
                 )
                 # use the same color as before, taking advantage of employing
                 # same keys in dictionary
@@ -2336,8 +2269,8 @@ class WaveformGenerator(QWidget):
 
                 self.data_collected_1 = data_waveformreceived[1]
 
-                self.PlotDataItem_patch_current = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_1
+                self.PlotDataItem_patch_current = DecimatedPlotDataItem(
+                    self.data_collected_1, sample_rate=self.uiDaq_sample_rate
                 )
                 # use the same color as before, taking advantage of employing
                 # same keys in dictionary
@@ -2355,84 +2288,14 @@ class WaveformGenerator(QWidget):
                     0 : len(self.data_collected_0) - 1
                 ]
 
-                try:
-                    for i in range(self.repeatnum):
-                        self.PMT_image_reconstructed_array = (
-                            self.data_collected_0[
-                                np.where(
-                                    self.PMT_data_index_array_repeated == i + 1
-                                )
-                            ]
-                        )
-                        Dataholder_average = np.mean(
-                            self.PMT_image_reconstructed_array.reshape(
-                                self.averagenum, -1
-                            ),
-                            axis=0,
-                        )
-                        Value_yPixels = int(
-                            len(self.samples_1) / self.ScanArrayXnum
-                        )
-                        self.PMT_image_reconstructed = np.reshape(
-                            Dataholder_average,
-                            (Value_yPixels, self.ScanArrayXnum),
-                        )
-
-                        # Stack the arrays into a 3d array
-                        if i == 0:
-                            self.PMT_image_reconstructed_stack = (
-                                self.PMT_image_reconstructed
-                            )
-                        else:
-                            self.PMT_image_reconstructed_stack = (
-                                np.concatenate(
-                                    (
-                                        self.PMT_image_reconstructed_stack,
-                                        self.PMT_image_reconstructed,
-                                    ),
-                                    axis=0,
-                                )
-                            )
-
-                        # generate an image object
-                        Localimg = Image.fromarray(
-                            self.PMT_image_reconstructed
-                        )
-                        timestamp = datetime.now().strftime(
-                            "%Y-%m-%d_%H-%M-%S"
-                        )
-                        filename = (
-                            f"{timestamp}_PMT_{self.saving_prefix}_{i}.tif"
-                        )
-                        # save as tif
-                        Localimg.save(
-                            os.path.join(self.savedirectory, filename)
-                        )
-
-                        plt.figure()
-                        plt.imshow(
-                            self.PMT_image_reconstructed, cmap=plt.cm.gray
-                        )
-                        plt.show()
-                except Exception as exc:
-                    logging.critical("caught exception", exc_info=exc)
-                    np.save(
-                        os.path.join(
-                            self.savedirectory,
-                            datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                            + "_PMT_"
-                            + self.saving_prefix
-                            + "_"
-                            + "contourscanning",
-                        ),
-                        self.data_collected_0,
-                    )
+                self.reconstruct_pmt_images("contourscanning")
 
                 if "Vp" in self.readinchan:
                     self.data_collected_1 = data_waveformreceived[1]
 
-                    self.PlotDataItem_patch_voltage = PlotDataItem(
-                        self.xlabelhere_all, self.data_collected_1
+                    self.PlotDataItem_patch_voltage = DecimatedPlotDataItem(
+                        self.data_collected_1,
+                        sample_rate=self.uiDaq_sample_rate,
                     )
                     # use the same color as before, taking advantage of
                     # employing same keys in dictionary
@@ -2447,8 +2310,9 @@ class WaveformGenerator(QWidget):
                 elif "Ip" in self.readinchan:
                     self.data_collected_1 = data_waveformreceived[1]
 
-                    self.PlotDataItem_patch_current = PlotDataItem(
-                        self.xlabelhere_all, self.data_collected_1
+                    self.PlotDataItem_patch_current = DecimatedPlotDataItem(
+                        self.data_collected_1,
+                        sample_rate=self.uiDaq_sample_rate,
                     )
                     # use the same color as before, taking advantage of
                     # employing same keys in dictionary
@@ -2461,6 +2325,64 @@ class WaveformGenerator(QWidget):
                     self.textitem_patch_current.setPos(0, 1)
                     self.pw_data.addItem(self.textitem_patch_current)
 
+    def reconstruct_pmt_images(self, fallback_name):
+        """
+        Rebuild the images of all repeats of a raster scan from the PMT
+        recording, save them as one multi-page tif in the background and
+        show them if asked for.
+
+        When the recording does not fit a raster scan, like from contour
+        scanning, it is saved flat instead.
+
+        Parameters
+        fallback_name : str
+            Name of the flat npy file.
+        """
+        try:
+            self.PMT_image_reconstructed_stack = reconstruct_raster_images(
+                self.data_collected_0,
+                len(self.samples_1),
+                self.averagenum,
+                self.repeatnum,
+                self.gapsamples_number_galvo,
+                len(self.offsetsamples_galvo),
+                self.ScanArrayXnum,
+            )
+            self.PMT_image_reconstructed = self.PMT_image_reconstructed_stack[
+                -1
+            ]
+
+            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            filename = f"{timestamp}_PMT_{self.saving_prefix}.tif"
+            # Saving should not keep the GUI waiting.
+            threading.Thread(
+                target=skimtiff.imwrite,
+                args=(
+                    os.path.join(self.savedirectory, filename),
+                    self.PMT_image_reconstructed_stack.astype("float32"),
+                ),
+                daemon=False,
+            ).start()
+
+            if self.checkbox_showPMTImages.isChecked():
+                for image in self.PMT_image_reconstructed_stack:
+                    plt.figure()
+                    plt.imshow(image, cmap=plt.cm.gray)
+                plt.show()
+        except Exception as exc:
+            logging.critical("caught exception", exc_info=exc)
+            np.save(
+                os.path.join(
+                    self.savedirectory,
+                    datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+                    + "_PMT_"
+                    + self.saving_prefix
+                    + "_"
+                    + fallback_name,
+                ),
+                self.data_collected_0,
+            )
+
     def startProgressBar(self):
         self.DaqProgressBar_thread = DaqProgressBar()
         self.TotalTimeProgressBar = round(
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled waveforms.
+
+Before the waveforms given to DAQmission.runWaveforms can be written to the
+NI-daq, waveform_samples.stack_samples parses their specifications, divides
+the analog waveforms over Dev1 and Dev2 and packs the digital lines into
+port values. A CompiledWaveform holds the result of that work, so that a
+waveform package that is executed over and over again, like at every
+coordinate during screening, is only prepared once.
+
+Compiled waveforms can be saved to a single non-pickled file: a JSON header
+followed by the raw sample arrays. load() memory maps the arrays, so opening
+a file takes the same time whatever its length and the arrays can be handed
+to the stream writers without copying.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+
+import numpy as np
+
+from .waveform_samples import stack_samples
+
+MAGIC = b"GEVIDAQWAVE\x00"
+FORMAT_VERSION = 1
+# Raw arrays in the file start at multiples of this, in bytes.
+ALIGNMENT = 64
+
+
+def waveform_key(sampling_rate, analog_signals, digital_signals, channel_LUT):
+    """
+    Content hash of a waveform package, used as the compile cache key.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr(float(sampling_rate)).encode())
+    digest.update(json.dumps(channel_LUT, sort_keys=True).encode())
+    for signals in (analog_signals, digital_signals):
+        digest.update(b"|")
+        if len(signals) == 0:
+            continue
+        for specification in signals["Specification"]:
+            digest.update(str(specification).encode() + b"\x00")
+        waveforms = np.ascontiguousarray(signals["Waveform"])
+        digest.update(str(waveforms.dtype).encode())
+        digest.update(str(waveforms.shape).encode())
+        digest.update(memoryview(waveforms).cast("B"))
+    return digest.hexdigest()
+
+
+class CompiledWaveform:
+    """
+    Waveform package, prepared to be written to the NI-daq.
+
+    Attributes
+    sampling_rate : float
+    length : int
+        Number of samples per channel.
+    dev1_channels, dev2_channels : list of str
+        Analog output channels on Dev1 and Dev2.
+    dev1_analog, dev2_analog : np.ndarray
+        C-contiguous float64 samples of shape (channels, length).
+    digital_channels : list of str
+        Digital lines that are packed into digital.
+    digital : np.ndarray
+        uint32 port values of shape (1, length).
+    averagenumber, ypixelnumber : int or None
+        Information carried by the galvo specifications, if any.
+    key : str
+        Content hash of the waveforms the package was compiled from.
+    """
+
+    def __init__(
+        self,
+        sampling_rate,
+        length,
+        dev1_channels,
+        dev1_analog,
+        dev2_channels,
+        dev2_analog,
+        digital_channels,
+        digital,
+        averagenumber=None,
+        ypixelnumber=None,
+        key=None,
+    ):
+        self.sampling_rate = sampling_rate
+        self.length = length
+        self.dev1_channels = list(dev1_channels)
+        self.dev1_analog = dev1_analog
+        self.dev2_channels = list(dev2_channels)
+        self.dev2_analog = dev2_analog
+        self.digital_channels = list(digital_channels)
+        self.digital = digital
+        self.averagenumber = averagenumber
+        self.ypixelnumber = ypixelnumber
+        self.key = key
+
+    @property
+    def analog_channel_number(self):
+        return len(self.dev1_channels) + len(self.dev2_channels)
+
+    @property
+    def digital_channel_number(self):
+        return len(self.digital_channels)
+
+    @property
+    def nbytes(self):
+        return (
+            self.dev1_analog.nbytes
+            + self.dev2_analog.nbytes
+            + self.digital.nbytes
+        )
+
+    @classmethod
+    def compile(
+        cls,
+        sampling_rate,
+        analog_signals,
+        digital_signals,
+        channel_LUT,
+        key=None,
+    ):
+        """
+        Prepare waveforms in the runWaveforms format.
+
+        Parameters
+        sampling_rate : float
+            Sampling rate of the waveforms.
+        analog_signals, digital_signals : np.ndarray or {}
+            Structured arrays with 'Waveform' and 'Specification' fields, see
+            DAQmission.runWaveforms. The inputs are not modified.
+        channel_LUT : dict
+            Look up table from specification to NI-daq port.
+        key : str
+            Content hash, computed if not given.
+
+        Returns
+        CompiledWaveform.
+        """
+        if key is None:
+            key = waveform_key(
+                sampling_rate, analog_signals, digital_signals, channel_LUT
+            )
+
+        return cls(
+            sampling_rate,
+            key=key,
+            **stack_samples(analog_signals, digital_signals, channel_LUT),
+        )
+
+    # === On-disk format ===
+
+    def save(self, filename):
+        """
+        Write the compiled waveform as JSON header plus raw arrays.
+        """
+        arrays = {
+            "dev1_analog": self.dev1_analog,
+            "dev2_analog": self.dev2_analog,
+            "digital": self.digital,
+        }
+        header = {
+            "version": FORMAT_VERSION,
+            "sampling_rate": self.sampling_rate,
+            "length": self.length,
+            "dev1_channels": self.dev1_channels,
+            "dev2_channels": self.dev2_channels,
+            "digital_channels": self.digital_channels,
+            "averagenumber": self.averagenumber,
+            "ypixelnumber": self.ypixelnumber,
+            "key": self.key,
+            "arrays": {},
+        }
+
+        # The offsets depend on the header size, so reserve room for them
+        # first and fill them in once the header length is known.
+        def layout(header_size):
+            offset = _align(len(MAGIC) + 8 + header_size)
+            for name, array in arrays.items():
+                header["arrays"][name] = {
+                    "offset": offset,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                }
+                offset = _align(offset + array.nbytes)
+            return json.dumps(header).encode()
+
+        encoded = layout(0)
+        while True:
+            relaid = layout(len(encoded))
+            if len(relaid) == len(encoded):
+                encoded = relaid
+                break
+            encoded = relaid
+
+        with open(filename, "wb") as file:
+            file.write(MAGIC)
+            file.write(np.uint64(len(encoded)).tobytes())
+            file.write(encoded)
+            for name, array in arrays.items():
+                file.seek(header["arrays"][name]["offset"])
+                np.ascontiguousarray(array).tofile(file)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Open a saved compiled waveform. The arrays are read-only memory maps.
+        """
+        with open(filename, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename} is not a compiled waveform file")
+            header_size = int(np.frombuffer(file.read(8), dtype="uint64")[0])
+            header = json.loads(file.read(header_size))
+
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported compiled waveform version {header['version']}"
+            )
+
+        arrays = {}
+        for name, layout in header["arrays"].items():
+            shape = tuple(layout["shape"])
+            if 0 in shape:
+                # Zero sized arrays can't be memory mapped.
+                arrays[name] = np.zeros(shape, dtype=layout["dtype"])
+            else:
+                arrays[name] = np.memmap(
+                    filename,
+                    dtype=layout["dtype"],
+                    mode="r",
+                    offset=layout["offset"],
+                    shape=shape,
+                )
+
+        return cls(
+            header["sampling_rate"],
+            header["length"],
+            header["dev1_channels"],
+            arrays["dev1_analog"],
+            header["dev2_channels"],
+            arrays["dev2_analog"],
+            header["digital_channels"],
+            arrays["digital"],
+            averagenumber=header["averagenumber"],
+            ypixelnumber=header["ypixelnumber"],
+            key=header["key"],
+        )
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# === Compile cache ===
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_cache_nbytes = 0
+# Total size of the cached sample arrays. A package larger than this on its
+# own is compiled but not cached.
+CACHE_BYTES = 512 * 1024**2
+
+
+def compile_waveforms(
+    sampling_rate, analog_signals, digital_signals, channel_LUT
+):
+    """
+    Compile a waveform package, reusing an earlier result with the same
+    content.
+
+    The content of the waveforms is hashed at every call, a caller that
+    runs the same package many times, like the screening at every
+    coordinate, should keep the result instead of calling again.
+
+    Returns
+    CompiledWaveform. Treat it as read-only, it is shared with later calls.
+    """
+    global _cache_nbytes
+    key = waveform_key(
+        sampling_rate, analog_signals, digital_signals, channel_LUT
+    )
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    compiled = CompiledWaveform.compile(
+        sampling_rate, analog_signals, digital_signals, channel_LUT, key=key
+    )
+    for array in (
+        compiled.dev1_analog,
+        compiled.dev2_analog,
+        compiled.digital,
+    ):
+        array.flags.writeable = False
+
+    if compiled.nbytes > CACHE_BYTES:
+        # Would push out every other package and then itself.
+        logging.info(
+            f"Compiled waveforms {key[:8]}, {compiled.length} samples, "
+            "too large to cache"
+        )
+        return compiled
+
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = compiled
+            _cache_nbytes += compiled.nbytes
+        while _cache_nbytes > CACHE_BYTES:
+            _cache_nbytes -= _cache.popitem(last=False)[1].nbytes
+    logging.info(f"Compiled waveforms {key[:8]}, {compiled.length} samples")
+    return compiled
+
+
+def clear_cache():
+    global _cache_nbytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_nbytes = 0
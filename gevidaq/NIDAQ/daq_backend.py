@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable NI-DAQ backend.
+
+Acquisition code asks get_backend() for Task, stream_readers and
+stream_writers instead of using nidaqmx directly. By default this is the
+nidaqmx package talking to the hardware. Setting the environment variable
+GEVIDAQ_DAQ_BACKEND=simulated, or calling use_backend("simulated"), swaps
+in the simulated DAQ from NIDAQ.simulated_daq so the acquisition pipeline
+can run and be profiled without a rig.
+"""
+
+import logging
+import os
+
+
+class NidaqmxBackend:
+    """The nidaqmx package, talking to real NI-DAQ devices."""
+
+    name = "nidaqmx"
+
+    def __init__(self):
+        import nidaqmx
+        import nidaqmx.stream_readers
+        import nidaqmx.stream_writers
+
+        self.Task = nidaqmx.Task
+        self.stream_readers = nidaqmx.stream_readers
+        self.stream_writers = nidaqmx.stream_writers
+
+    def ai_dev_scaling_coeff(self, task, channel):
+        """Polynomial coefficients converting raw ADC codes to volts."""
+        import nidaqmx
+
+        # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
+        return nidaqmx._task_modules.channels.ai_channel.AIChannel(
+            task._handle, channel
+        ).ai_dev_scaling_coeff
+
+
+_backend = None
+
+
+def use_backend(backend):
+    """
+    Select the DAQ backend used by all acquisition code.
+
+    Parameters
+    backend : str or backend object
+        "nidaqmx", "simulated", or an already constructed backend, e.g. a
+        SimulatedBackend with custom settings.
+
+    Returns
+    The backend in use.
+    """
+    global _backend
+
+    if backend == "nidaqmx":
+        backend = NidaqmxBackend()
+    elif backend == "simulated":
+        from .simulated_daq import SimulatedBackend
+
+        backend = SimulatedBackend()
+    elif isinstance(backend, str):
+        raise ValueError(f"Unknown DAQ backend {backend}")
+
+    _backend = backend
+    logging.info(f"DAQ backend: {backend.name}")
+    return _backend
+
+
+def get_backend():
+    """Return the DAQ backend in use, creating the default one on first use."""
+    if _backend is None:
+        use_backend(os.environ.get("GEVIDAQ_DAQ_BACKEND", "nidaqmx"))
+    return _backend
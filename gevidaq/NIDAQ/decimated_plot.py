@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail plotting of long waveforms.
+
+A multi-minute recording at hundreds of kS/s has tens of millions of samples,
+far more than the plot has pixels, and handing all of them to a PlotDataItem
+freezes the GUI on every redraw. MinMaxPyramid keeps the minimum and maximum
+of blocks of 4, 16, 64, ... samples, computed once per trace, and
+DecimatedPlotDataItem draws the level that gives about two points per pixel
+of the visible x range. A spike of a single sample stays visible at every
+level, unlike with mean or subsample downsampling. Zoomed in far enough the
+samples themselves are drawn, sliced from the trace only for the view.
+
+The x axis is implicit, sample i is at x0 + i / sample_rate, so no time
+array is made.
+
+    item = DecimatedPlotDataItem(recording, sample_rate=50000, pen="w")
+    plot_widget.addItem(item)
+"""
+
+import logging
+import time
+
+import numpy as np
+from pyqtgraph import PlotDataItem
+
+
+class MinMaxPyramid:
+    """
+    Minimum and maximum of a trace over blocks of factor**level samples.
+
+    Parameters
+    data : np.ndarray
+        1D trace, kept by reference, so a np.memmap is only read to build
+        the levels and to slice the samples that are shown.
+    factor : int
+        Samples per block of one level down.
+    smallest : int
+        Stop adding levels once a level has fewer blocks than this.
+    """
+
+    def __init__(self, data, factor=4, smallest=1024):
+        self.data = np.asarray(data).ravel()
+        self.factor = factor
+        if self.data.dtype == bool:
+            self.data = self.data.astype("int8")
+
+        # (block size, minima, maxima), level 0 are the samples themselves.
+        self.levels = [(1, self.data, self.data)]
+        minima = maxima = self.data
+        block = 1
+        while len(minima) > smallest:
+            minima = self._reduce(minima, np.minimum)
+            maxima = self._reduce(maxima, np.maximum)
+            block *= factor
+            self.levels.append((block, minima, maxima))
+
+    def _reduce(self, values, function):
+        whole = len(values) // self.factor * self.factor
+        # Element-wise over strided slices, much faster than reducing along
+        # a short axis of length factor.
+        reduced = values[0 : whole : self.factor]
+        for offset in range(1, self.factor):
+            reduced = function(reduced, values[offset : whole : self.factor])
+        if whole < len(values):
+            # Last block is partial.
+            reduced = np.append(reduced, function.reduce(values[whole:]))
+        return reduced
+
+    def __len__(self):
+        return len(self.data)
+
+    def level_for(self, samples, points):
+        """
+        Highest level that still has at least points blocks in samples.
+        """
+        level = 0
+        while (
+            level + 1 < len(self.levels)
+            and samples / self.levels[level + 1][0] >= points
+        ):
+            level += 1
+        return level
+
+    def segment(self, start, stop, level):
+        """
+        Points to draw samples start to stop at a level.
+
+        Returns
+        (sample indices, values), at level > 0 every block is drawn as a
+        vertical line from its minimum to its maximum, at the middle of the
+        block.
+        """
+        block, minima, maxima = self.levels[level]
+        if level == 0:
+            return np.arange(start, stop), self.data[start:stop]
+        first = start // block
+        last = -(-stop // block)
+        values = np.empty(2 * (last - first), dtype=minima.dtype)
+        values[0::2] = minima[first:last]
+        values[1::2] = maxima[first:last]
+        centres = np.arange(first, last) * block + (block - 1) / 2
+        return np.repeat(centres, 2), values
+
+    def bounds(self):
+        """
+        (minimum, maximum) of the trace.
+        """
+        block, minima, maxima = self.levels[-1]
+        if len(minima) == 0:
+            return None, None
+        return minima.min(), maxima.max()
+
+
+class DecimatedPlotDataItem(PlotDataItem):
+    """
+    PlotDataItem of a trace at uniform sample rate, drawn from a
+    MinMaxPyramid at the level of detail of the view.
+
+    Parameters
+    data : np.ndarray, optional
+        The trace.
+    sample_rate : float
+        Samples per x unit.
+    x0 : float
+        x of the first sample.
+    points_per_pixel : float
+        Points drawn per pixel of plot width, 2 draws every pixel column
+        from its minimum to its maximum.
+    kwargs
+        Passed on to PlotDataItem, like pen and name.
+    """
+
+    def __init__(
+        self,
+        data=None,
+        sample_rate=1.0,
+        x0=0.0,
+        points_per_pixel=2,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.points_per_pixel = points_per_pixel
+        self.pyramid = None
+        self._window = None
+        if data is not None:
+            self.setWaveform(data, sample_rate, x0)
+
+    def setWaveform(self, data, sample_rate=None, x0=None, name=None):
+        """
+        Replace the trace, the pyramid is built here once.
+        """
+        if sample_rate is not None:
+            self.sample_rate = float(sample_rate)
+        if x0 is not None:
+            self.x0 = float(x0)
+        if name is not None:
+            self.opts["name"] = name
+        self.pyramid = MinMaxPyramid(data)
+        self._window = None
+        self.updateLevelOfDetail()
+
+    def _view_samples(self):
+        """
+        Visible samples and the plot width in pixels.
+        """
+        n = len(self.pyramid)
+        view_box = self.getViewBox()
+        if view_box is None or n == 0:
+            return 0, n, 1000
+        x_min, x_max = view_box.viewRange()[0]
+        start = int(np.floor((x_min - self.x0) * self.sample_rate))
+        stop = int(np.ceil((x_max - self.x0) * self.sample_rate)) + 1
+        start = min(max(start, 0), n)
+        stop = min(max(stop, start), n)
+        return start, stop, max(view_box.width(), 1)
+
+    def updateLevelOfDetail(self):
+        """
+        Draw the level that matches the view, if it changed.
+
+        The drawn window is the visible range and half its width on both
+        sides, so small pans do not redraw.
+        """
+        if self.pyramid is None:
+            return
+        start, stop, pixels = self._view_samples()
+        level = self.pyramid.level_for(
+            stop - start, pixels * self.points_per_pixel
+        )
+        if self._window is not None:
+            drawn_level, drawn_start, drawn_stop = self._window
+            if (
+                drawn_level == level
+                and drawn_start <= start
+                and stop <= drawn_stop
+            ):
+                return
+
+        margin = (stop - start) // 2
+        start = max(start - margin, 0)
+        stop = min(stop + margin, len(self.pyramid))
+        self._window = (level, start, stop)
+        indices, values = self.pyramid.segment(start, stop, level)
+        PlotDataItem.setData(
+            self, self.x0 + indices / self.sample_rate, values
+        )
+
+    def viewRangeChanged(self, vb=None, ranges=None, changed=None):
+        if changed is None or changed[0]:
+            self.updateLevelOfDetail()
+        super().viewRangeChanged(vb, ranges, changed)
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        # Bounds of the whole trace, not of the drawn window, so auto range
+        # does not zoom in on what is drawn.
+        if self.pyramid is None or len(self.pyramid) == 0:
+            return None, None
+        if ax == 0:
+            return (
+                self.x0,
+                self.x0 + (len(self.pyramid) - 1) / self.sample_rate,
+            )
+        return self.pyramid.bounds()
+
+
+# === Benchmark ===
+def benchmark_decimated_plot(samples=30_000_000, sample_rate=500_000):
+    """
+    Time to show a trace with PlotDataItem and with DecimatedPlotDataItem,
+    and to redraw after zooming in, on an offscreen plot.
+
+    Returns
+    dict of name to seconds.
+    """
+    import pyqtgraph as pg
+    from PyQt5 import QtWidgets
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    rng = np.random.default_rng(0)
+    trace = rng.normal(0, 0.01, samples).astype("float32")
+    # Single sample spikes, which must stay visible when zoomed out.
+    trace[rng.integers(0, samples, 20)] = 1.0
+
+    def show(item):
+        widget = pg.PlotWidget()
+        widget.resize(1200, 400)
+        widget.addItem(item)
+        widget.show()
+        start = time.perf_counter()
+        widget.grab()
+        app.processEvents()
+        shown = time.perf_counter() - start
+
+        start = time.perf_counter()
+        widget.setXRange(10.0, 10.01, padding=0)
+        app.processEvents()
+        widget.grab()
+        zoomed = time.perf_counter() - start
+        widget.close()
+        return shown, zoomed
+
+    results = {}
+    start = time.perf_counter()
+    x = np.arange(samples) / sample_rate
+    full = PlotDataItem(x, trace)
+    results["PlotDataItem create"] = time.perf_counter() - start
+    (
+        results["PlotDataItem show"],
+        results["PlotDataItem zoom"],
+    ) = show(full)
+
+    start = time.perf_counter()
+    decimated = DecimatedPlotDataItem(trace, sample_rate=sample_rate)
+    results["DecimatedPlotDataItem create"] = time.perf_counter() - start
+    assert decimated.getData()[1].max() == 1.0, "Spikes lost"
+    (
+        results["DecimatedPlotDataItem show"],
+        results["DecimatedPlotDataItem zoom"],
+    ) = show(decimated)
+
+    for name, seconds in results.items():
+        logging.info("{:>30}: {:8.1f} ms".format(name, seconds * 1000))
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    benchmark_decimated_plot()
@@ -0,0 +1,720 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated NI-DAQ devices.
+
+Implements the part of the nidaqmx API that gevidaq uses: Task with AO, DO
+and AI channels, sample clock timing, finite and continuous acquisition,
+regeneration modes and the stream readers/writers. Analog inputs are
+synthesized from what the outputs are generating at the same sample:
+    - the PMT channel images a synthetic specimen at the galvo position,
+    - the patch clamp channels follow a series resistance/membrane RC model
+      driven by the patch command output.
+
+Use it through NIDAQ.daq_backend, e.g. use_backend("simulated").
+"""
+
+import logging
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from nidaqmx.constants import AcquisitionType, RegenerationMode
+from nidaqmx.errors import DaqError
+from scipy.signal import lfilter
+
+from .constants import NiDaqChannels
+
+
+def expand_channels(physical_channel):
+    """
+    Expand a physical channel string like "/Dev1/ao0:1, Dev2/ao2" into
+    ["Dev1/ao0", "Dev1/ao1", "Dev2/ao2"].
+    """
+    channels = []
+    for name in physical_channel.split(","):
+        name = name.strip().lstrip("/")
+        match = re.match(r"^(.*?)(\d+):(\d+)$", name)
+        if match is None:
+            channels.append(name)
+        else:
+            prefix, first, last = match.groups()
+            step = 1 if int(last) >= int(first) else -1
+            channels.extend(
+                f"{prefix}{i}"
+                for i in range(int(first), int(last) + step, step)
+            )
+    return channels
+
+
+def default_buffer_size(rate):
+    """Input buffer size NI-DAQmx picks for continuous acquisition."""
+    if rate <= 100:
+        return 1000
+    elif rate <= 10000:
+        return 10000
+    elif rate <= 1000000:
+        return 100000
+    return 1000000
+
+
+class PatchModel:
+    """
+    Seal test circuit: a pipette with series resistance Rs on a membrane
+    with resistance Rm and capacitance Cm, held by a voltage clamp amplifier.
+
+    Gains follow the default settings of the seal test widget.
+    """
+
+    def __init__(
+        self,
+        series_resistance=10e6,
+        membrane_resistance=1e9,
+        membrane_capacitance=20e-12,
+        command_gain=0.1,
+        voltage_out_gain=10,
+        current_out_gain=1e8,
+    ):
+        self.Rs = series_resistance
+        self.Rm = membrane_resistance
+        self.Cm = membrane_capacitance
+        self.command_gain = command_gain  # membrane volt per AO volt
+        self.voltage_out_gain = voltage_out_gain  # AI volt per membrane volt
+        self.current_out_gain = current_out_gain  # AI volt per ampere
+
+    def membrane_filter(self, rate):
+        """Exact zero-order-hold discretization of dVm/dt."""
+        dt = 1 / rate
+        decay = (1 / self.Rs + 1 / self.Rm) / self.Cm
+        pole = np.exp(-decay * dt)
+        gain = (1 / (self.Rs * self.Cm)) / decay * (1 - pole)
+        return [0, gain], [1, -pole]
+
+    def respond(self, command, rate, state):
+        """
+        Parameters
+        command : np.ndarray
+            AO command samples in volt.
+        rate : float
+            Sampling rate.
+        state : dict
+            Filter state, carried over between consecutive reads.
+
+        Returns
+        (voltage, current) as AI volts.
+        """
+        command_voltage = command * self.command_gain
+        b, a = self.membrane_filter(rate)
+        zi = state.get("zi", np.zeros(1))
+        membrane_voltage, state["zi"] = lfilter(b, a, command_voltage, zi=zi)
+        current = (command_voltage - membrane_voltage) / self.Rs
+        return (
+            command_voltage * self.voltage_out_gain,
+            current * self.current_out_gain,
+        )
+
+
+class Specimen:
+    """Fluorescent cells in the galvo field of view, as seen by the PMT."""
+
+    def __init__(
+        self, cell_number=60, pixels=512, field_volt=10, seed=0, gain=2.0
+    ):
+        self.field_volt = field_volt
+        self.gain = gain
+        self.pixels = pixels
+
+        rng = np.random.default_rng(seed)
+        grid = np.linspace(-field_volt, field_volt, pixels)
+        xx, yy = np.meshgrid(grid, grid)
+        image = np.zeros((pixels, pixels))
+        for cx, cy, size, brightness in zip(
+            rng.uniform(-0.8, 0.8, cell_number) * field_volt,
+            rng.uniform(-0.8, 0.8, cell_number) * field_volt,
+            rng.uniform(0.1, 0.3, cell_number),
+            rng.uniform(0.3, 1.0, cell_number),
+        ):
+            image += brightness * np.exp(
+                -((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * size**2)
+            )
+        self.image = image
+
+    def pmt_signal(self, x, y):
+        """PMT output for galvo voltages x and y, negative like the real PMT."""
+        scale = (self.pixels - 1) / (2 * self.field_volt)
+        ix = np.clip(
+            np.rint((x + self.field_volt) * scale), 0, self.pixels - 1
+        ).astype(np.intp)
+        iy = np.clip(
+            np.rint((y + self.field_volt) * scale), 0, self.pixels - 1
+        ).astype(np.intp)
+        return -self.gain * (0.05 + self.image[iy, ix])
+
+
+class SimulatedDAQ:
+    """
+    The simulated devices, shared by all tasks.
+
+    Keeps track of which task generates which output channel, so that the
+    analog inputs can be synthesized from it, and of the shared sample clock.
+
+    Parameters
+    time_scale : float
+        1 runs in real time, honouring the sample clocks. 0 runs as fast as
+        possible, the clock then advances with the samples that are read.
+    noise : float
+        Standard deviation of the noise added to every analog input, in volt.
+    """
+
+    def __init__(
+        self,
+        time_scale=1.0,
+        noise=0.002,
+        channel_LUT=None,
+        specimen=None,
+        patch=None,
+        seed=0,
+    ):
+        self.time_scale = time_scale
+        self.noise = noise
+        if channel_LUT is None:
+            channel_LUT = NiDaqChannels().look_up_table
+        self.channel_LUT = channel_LUT
+        self.specimen = Specimen() if specimen is None else specimen
+        self.patch = PatchModel() if patch is None else patch
+        self.rng = np.random.default_rng(seed)
+
+        self.lock = threading.RLock()
+        self.static_outputs = {}
+        self.running_outputs = {}  # channel: (task, row)
+        self.running_tasks = set()
+        self.epoch = None
+        self.virtual_position = 0
+
+    # === sample clock ===
+    def start_clock(self):
+        with self.lock:
+            if self.epoch is None:
+                self.epoch = time.perf_counter()
+                self.virtual_position = 0
+
+    def clock_position(self, rate):
+        """Number of sample clock ticks since the clock master started."""
+        if self.epoch is None:
+            return 0
+        if self.time_scale > 0:
+            elapsed = (time.perf_counter() - self.epoch) / self.time_scale
+            return int(elapsed * rate)
+        return self.virtual_position
+
+    def wait_for_clock(self, rate, position, timeout):
+        """Block until the sample clock reached position."""
+        if self.time_scale > 0:
+            target = self.epoch + position / rate * self.time_scale
+            delay = target - time.perf_counter()
+            if delay > timeout:
+                raise DaqError(
+                    "Some or all of the samples requested have not yet been "
+                    "acquired.",
+                    -200284,
+                )
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            with self.lock:
+                self.virtual_position = max(self.virtual_position, position)
+
+    # === task bookkeeping ===
+    def task_started(self, task):
+        with self.lock:
+            self.running_tasks.add(task)
+            for row, channel in enumerate(task.output_channels):
+                self.running_outputs[channel] = (task, row)
+            # Input tasks are the clock masters, also when they follow an
+            # external clock like the camera trigger.
+            if task.timed and (not task.slaved or len(task.ai_channels)):
+                self.start_clock()
+
+    def task_stopped(self, task):
+        with self.lock:
+            self.running_tasks.discard(task)
+            for row, channel in enumerate(task.output_channels):
+                if self.running_outputs.get(channel, (None,))[0] is task:
+                    del self.running_outputs[channel]
+                    last = task.last_output(row)
+                    if last is not None:
+                        self.static_outputs[channel] = last
+            if not any(t.timed for t in self.running_tasks):
+                self.epoch = None
+
+    def output_samples(self, channel, start, stop):
+        """Values an output channel generates at samples [start, stop)."""
+        with self.lock:
+            entry = self.running_outputs.get(channel)
+        if entry is None:
+            value = self.static_outputs.get(channel, 0.0)
+            return np.full(stop - start, value, dtype=float)
+        task, row = entry
+        return task.generated_samples(row, start, stop).astype(float)
+
+    # === analog input synthesis ===
+    def synthesize(self, channel, start, stop, rate, state):
+        """Analog input samples [start, stop) of a channel."""
+        n = stop - start
+        lut = self.channel_LUT
+        if channel == lut["PMT"]:
+            x = self.output_samples(lut["galvosx"], start, stop)
+            y = self.output_samples(lut["galvosy"], start, stop)
+            signal = self.specimen.pmt_signal(x, y)
+        elif channel in (lut["Ip"], lut["VpPatch"]):
+            command = self.output_samples(lut["patchAO"], start, stop)
+            voltage, current = self.patch.respond(command, rate, state)
+            signal = current if channel == lut["Ip"] else voltage
+        else:
+            signal = np.zeros(n)
+        if self.noise:
+            signal = signal + self.rng.normal(0, self.noise, n)
+        return signal
+
+
+class _ChannelCollection:
+    def __init__(self, task, kind):
+        self._task = task
+        self._kind = kind
+        self.channel_names = []
+
+    def __len__(self):
+        return len(self.channel_names)
+
+    def _add(self, physical_channel):
+        if self._task.is_running:
+            raise DaqError(
+                "Channels cannot be added to a running task.", -200479
+            )
+        self.channel_names.extend(expand_channels(physical_channel))
+
+    def add_ai_voltage_chan(self, physical_channel, *args, **kwargs):
+        self._add(physical_channel)
+
+    def add_ao_voltage_chan(self, physical_channel, *args, **kwargs):
+        self._add(physical_channel)
+
+    def add_do_chan(self, lines, *args, **kwargs):
+        self._add(lines)
+
+
+class _Timing:
+    def __init__(self):
+        self.samp_clk_rate = None
+        self.samp_clk_src = ""
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = 0
+
+    def cfg_samp_clk_timing(
+        self,
+        rate,
+        source="",
+        active_edge=None,
+        sample_mode=AcquisitionType.FINITE,
+        samps_per_chan=1000,
+    ):
+        self.samp_clk_rate = float(rate)
+        self.samp_clk_src = source or ""
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = int(samps_per_chan)
+
+
+class _StartTrigger:
+    def __init__(self):
+        self.dig_edge_src = ""
+
+    def cfg_dig_edge_start_trig(self, trigger_source, *args, **kwargs):
+        self.dig_edge_src = trigger_source
+
+
+class _OutStream:
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+
+
+class _InStream:
+    def __init__(self, task):
+        self._task = task
+
+
+class SimulatedTask:
+    """Drop-in replacement for nidaqmx.Task."""
+
+    def __init__(self, daq, new_task_name=""):
+        self._daq = daq
+        self.name = new_task_name
+        self.ai_channels = _ChannelCollection(self, "ai")
+        self.ao_channels = _ChannelCollection(self, "ao")
+        self.do_channels = _ChannelCollection(self, "do")
+        self.timing = _Timing()
+        self.triggers = SimpleNamespace(start_trigger=_StartTrigger())
+        self.export_signals = SimpleNamespace(
+            samp_clk_output_term="", start_trig_output_term=""
+        )
+        self.in_stream = _InStream(self)
+        self.out_stream = _OutStream(self)
+        self.is_running = False
+
+        self._position = 0  # samples read by an input task
+        self._buffer = None  # output buffer for finite/regenerating tasks
+        self._stream = []  # written chunks when regeneration is disallowed
+        self._stream_start = 0
+        self._written = 0
+        self._states = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.is_running:
+            self.stop()
+
+    # === properties used by the simulated devices ===
+    @property
+    def output_channels(self):
+        return self.ao_channels.channel_names + self.do_channels.channel_names
+
+    @property
+    def timed(self):
+        return self.timing.samp_clk_rate is not None
+
+    @property
+    def slaved(self):
+        """Whether the sample clock or start trigger comes from elsewhere."""
+        source = self.timing.samp_clk_src
+        return bool(source) or bool(self.triggers.start_trigger.dig_edge_src)
+
+    @property
+    def finite(self):
+        return self.timing.samp_quant_samp_mode == AcquisitionType.FINITE
+
+    @property
+    def regenerating(self):
+        return (
+            self.out_stream.regen_mode == RegenerationMode.ALLOW_REGENERATION
+        )
+
+    def last_output(self, row):
+        if self._buffer is not None:
+            return self._buffer[row, -1]
+        if self._stream:
+            return self._stream[-1][row, -1]
+        return None
+
+    def generated_samples(self, row, start, stop):
+        """Samples [start, stop) generated on one output row."""
+        if self._buffer is not None:
+            length = self._buffer.shape[1]
+            if self.finite:
+                index = np.minimum(np.arange(start, stop), length - 1)
+                return self._buffer[row, index]
+            return self._buffer[row].take(np.arange(start, stop), mode="wrap")
+
+        # Regeneration disallowed: the samples must have been written.
+        if stop > self._written:
+            raise DaqError(
+                "The generation has stopped to prevent the regeneration of "
+                "old samples. Your application was unable to write samples "
+                "to the background buffer fast enough to prevent old samples "
+                "from being regenerated.",
+                -200290,
+            )
+        self._release(start)
+        pieces = []
+        chunk_start = self._stream_start
+        for chunk in self._stream:
+            chunk_stop = chunk_start + chunk.shape[1]
+            if chunk_stop > start and chunk_start < stop:
+                pieces.append(
+                    chunk[
+                        row,
+                        max(start - chunk_start, 0) : min(stop, chunk_stop)
+                        - chunk_start,
+                    ]
+                )
+            chunk_start = chunk_stop
+        return np.concatenate(pieces)
+
+    def _release(self, position):
+        """Drop streamed chunks that are completely generated."""
+        while (
+            len(self._stream) > 1
+            and self._stream_start + self._stream[0].shape[1] <= position
+        ):
+            self._stream_start += self._stream.pop(0).shape[1]
+
+    # === writing ===
+    def _write(self, data, timeout=10.0):
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data.reshape(len(self.output_channels), -1)
+        if data.shape[0] != len(self.output_channels):
+            raise DaqError(
+                f"Write cannot be performed, because the number of channels "
+                f"in the data ({data.shape[0]}) does not match the number of "
+                f"channels in the task ({len(self.output_channels)}).",
+                -200524,
+            )
+
+        if not self.timed:
+            # On demand output, the last value sticks.
+            with self._daq.lock:
+                for row, channel in enumerate(self.output_channels):
+                    self._daq.static_outputs[channel] = data[row, -1]
+            return data.shape[1]
+
+        if self.finite or self.regenerating:
+            if self.is_running and self.finite:
+                raise DaqError(
+                    "Buffer cannot be rewritten while a finite generation "
+                    "is running.",
+                    -200547,
+                )
+            # The driver copies the samples into its own buffer.
+            self._buffer = np.array(data, copy=True)
+            return data.shape[1]
+
+        buffer_size = max(self.timing.samp_quant_samp_per_chan, data.shape[1])
+        rate = self.timing.samp_clk_rate
+        deadline = time.perf_counter() + timeout
+        while True:
+            consumed = self._daq.clock_position(rate) if self.is_running else 0
+            self._release(consumed)
+            if self._written + data.shape[1] - consumed <= buffer_size:
+                break
+            if self._daq.time_scale == 0 or time.perf_counter() > deadline:
+                raise DaqError(
+                    "Write cannot be performed because there is no space "
+                    "available in the buffer.",
+                    -200292,
+                )
+            time.sleep(0.001)
+        self._stream.append(np.array(data, copy=True))
+        self._written += data.shape[1]
+        return data.shape[1]
+
+    def write(self, data, auto_start=None, timeout=10.0):
+        data = np.asarray(data)
+        if data.dtype == bool:
+            data = data.astype(np.uint32)
+        written = self._write(np.atleast_1d(data), timeout)
+        if auto_start or (auto_start is None and not self.timed):
+            if self.timed and not self.is_running:
+                self.start()
+        return written
+
+    # === reading ===
+    def _read(self, data, number_of_samples_per_channel, timeout=10.0):
+        rate = self.timing.samp_clk_rate or 1000.0
+        n = number_of_samples_per_channel
+        start = self._position
+        stop = start + n
+
+        if self.timed:
+            if not self.is_running:
+                self.start()
+            if self.finite and stop > self.timing.samp_quant_samp_per_chan:
+                raise DaqError(
+                    "Attempted to read samples that are no longer available. "
+                    "The requested sample was previously available, but has "
+                    "since been overwritten.",
+                    -200278,
+                )
+            if not self.finite and self._daq.time_scale > 0:
+                buffer_size = max(
+                    self.timing.samp_quant_samp_per_chan,
+                    default_buffer_size(rate),
+                )
+                if self._daq.clock_position(rate) - start > buffer_size:
+                    raise DaqError(
+                        "The application is not able to keep up with the "
+                        "hardware acquisition.",
+                        -200279,
+                    )
+            self._daq.wait_for_clock(rate, stop, timeout)
+
+        for row, channel in enumerate(self.ai_channels.channel_names):
+            state = self._states.setdefault(channel, {})
+            data[row] = self._daq.synthesize(channel, start, stop, rate, state)
+        self._position = stop
+        return n
+
+    def read(self, number_of_samples_per_channel=1, timeout=10.0):
+        data = np.zeros((len(self.ai_channels), number_of_samples_per_channel))
+        self._read(data, number_of_samples_per_channel, timeout)
+        if number_of_samples_per_channel == 1:
+            data = data[:, 0]
+        if len(self.ai_channels) == 1:
+            return data[0].tolist() if data.ndim > 1 else float(data[0])
+        return data.tolist()
+
+    # === task state ===
+    def start(self):
+        if self.is_running:
+            return
+        if (
+            self.output_channels
+            and self.timed
+            and self._buffer is None
+            and not self._stream
+        ):
+            raise DaqError(
+                "Generation cannot be started, because the output buffer is "
+                "empty.",
+                -200462,
+            )
+        self.is_running = True
+        self._position = 0
+        self._stream_start = 0
+        self._states = {}
+        self._daq.task_started(self)
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self._daq.task_stopped(self)
+        self._stream = []
+        self._written = 0
+
+    def wait_until_done(self, timeout=10.0):
+        if not self.is_running or not self.finite:
+            return
+        if self._daq.epoch is None:
+            raise DaqError(
+                "Wait Until Done did not indicate that the task was done "
+                "within the specified timeout, the sample clock never "
+                "started.",
+                -200560,
+            )
+        if self.output_channels:
+            length = self._buffer.shape[1]
+        else:
+            length = self.timing.samp_quant_samp_per_chan
+        self._daq.wait_for_clock(self.timing.samp_clk_rate, length, timeout)
+
+
+class _Reader:
+    def __init__(self, task_in_stream):
+        self._task = task_in_stream._task
+        self.auto_start = True
+
+
+class AnalogMultiChannelReader(_Reader):
+    def read_many_sample(
+        self, data, number_of_samples_per_channel=-1, timeout=10.0
+    ):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[1]
+        return self._task._read(data, number_of_samples_per_channel, timeout)
+
+
+class AnalogSingleChannelReader(_Reader):
+    def read_many_sample(
+        self, data, number_of_samples_per_channel=-1, timeout=10.0
+    ):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[0]
+        view = data.reshape(1, -1)
+        return self._task._read(view, number_of_samples_per_channel, timeout)
+
+
+class _Writer:
+    def __init__(self, task_out_stream, auto_start=None):
+        self._task = task_out_stream._task
+        self.auto_start = auto_start
+
+    def _write(self, data, timeout):
+        written = self._task._write(data, timeout)
+        auto_start = self.auto_start
+        if auto_start is None:
+            auto_start = not self._task.timed
+        if auto_start and self._task.timed and not self._task.is_running:
+            self._task.start()
+        return written
+
+
+class AnalogMultiChannelWriter(_Writer):
+    def write_many_sample(self, data, timeout=10.0):
+        return self._write(np.atleast_2d(data), timeout)
+
+
+class AnalogSingleChannelWriter(_Writer):
+    def write_many_sample(self, data, timeout=10.0):
+        return self._write(np.reshape(data, (1, -1)), timeout)
+
+
+class DigitalMultiChannelWriter(_Writer):
+    def write_many_sample_port_uint32(self, data, timeout=10.0):
+        return self._write(np.atleast_2d(data), timeout)
+
+
+class SimulatedBackend:
+    """DAQ backend running on SimulatedDAQ, see NIDAQ.daq_backend."""
+
+    name = "simulated"
+
+    def __init__(self, daq=None, **kwargs):
+        self.daq = SimulatedDAQ(**kwargs) if daq is None else daq
+        self.stream_readers = SimpleNamespace(
+            AnalogMultiChannelReader=AnalogMultiChannelReader,
+            AnalogSingleChannelReader=AnalogSingleChannelReader,
+        )
+        self.stream_writers = SimpleNamespace(
+            AnalogMultiChannelWriter=AnalogMultiChannelWriter,
+            AnalogSingleChannelWriter=AnalogSingleChannelWriter,
+            DigitalMultiChannelWriter=DigitalMultiChannelWriter,
+        )
+
+    def Task(self, new_task_name=""):
+        return SimulatedTask(self.daq, new_task_name)
+
+    def ai_dev_scaling_coeff(self, task, channel):
+        # Identity: raw codes are volts already.
+        return [0.0, 1.0, 0.0, 0.0]
+
+
+if __name__ == "__main__":
+    # Throughput of a PMT raster scan through DAQmission, without hardware.
+    # Run with python -m gevidaq.NIDAQ.simulated_daq
+    from . import wavegenerator
+    from .daq_backend import use_backend
+    from .DAQoperator import DAQmission
+    from .waveform_specification import make_dtype
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    use_backend(SimulatedBackend(time_scale=0))
+
+    samples_X, samples_Y = wavegenerator.waveRecPic(
+        sampleRate=500000,
+        imAngle=0,
+        voltXMin=-5,
+        voltXMax=5,
+        voltYMin=-5,
+        voltYMax=5,
+        xPixels=500,
+        yPixels=500,
+        sawtooth=True,
+    )
+    analog_signals = np.zeros(2, dtype=make_dtype(len(samples_X), float))
+    analog_signals[0] = (samples_X, "galvosx")
+    analog_signals[1] = (samples_Y, "galvosy")
+
+    mission = DAQmission()
+    start = time.perf_counter()
+    mission.runWaveforms("DAQ", 500000, analog_signals, {}, ["PMT"])
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"{len(samples_X)} samples in {elapsed:.3f} s, "
+        f"{len(samples_X) / elapsed / 1e6:.1f} MS/s"
+    )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Preparing waveform samples for the NI-daq.
+
+DAQmission.runWaveforms takes structured waveform arrays with a 'Waveform'
+and a 'Specification' field. Before they can be written, the specifications
+are looked up in the channel LUT, the analog waveforms are divided over Dev1
+and Dev2 and stacked per device, and the digital lines are packed into port
+values. stack_samples does that without modifying its inputs.
+"""
+
+import numpy as np
+
+
+def parse_galvo_specification(specification):
+    """
+    Galvo specifications can carry extra information, like 'galvosxavgnum_2'
+    or 'galvosyypixels_500'.
+
+    Returns
+    (key to look up in channel_LUT, average number or None,
+    y pixel number or None)
+    """
+    if "galvosxavgnum" in specification:
+        averagenumber = int(specification[specification.index("_") + 1 :])
+        return "galvosx", averagenumber, None
+    elif "galvosyypixels" in specification:
+        ypixelnumber = int(specification[specification.index("_") + 1 :])
+        return "galvosy", None, ypixelnumber
+    elif "galvos_X_contour" in specification:
+        return "galvosx", None, None
+    elif "galvos_Y_contour" in specification:
+        return "galvosy", None, None
+    return specification, None, None
+
+
+def pack_digital_lines(waveforms, channels):
+    """
+    Pack digital lines into the uint32 values written to the port.
+
+    For each digital waveform sample, it 0 or 1. To write to NI-daq, you need
+    to send int number corresponding to the channel binary value, like write
+    8 (2^3, 0001) to channel 4. To send commands to line 0 and line 3, you
+    hava to write 1001 to digital port, which as uint32 is 9.
+
+    Parameters
+    waveforms : np.ndarray
+        Digital waveforms of shape (lines, samples).
+    channels : list of str
+        Channel of each line, like "Dev1/port0/line25".
+
+    Returns
+    np.ndarray of shape (1, samples) and dtype uint32.
+    """
+    packed = np.zeros((1, waveforms.shape[1]), dtype="uint32")
+    for waveform, channel in zip(waveforms, channels):
+        line = int(channel[channel.index("line") + 4 :])
+        packed[0] |= waveform.astype("uint32") << np.uint32(line)
+    return packed
+
+
+def stack_samples(analog_signals, digital_signals, channel_LUT):
+    """
+    Divide the analog samples over Dev1 and Dev2, stack them per device and
+    pack the digital lines into port values.
+
+    Parameters
+    analog_signals, digital_signals : np.ndarray or {}
+        Structured arrays with 'Waveform' and 'Specification' fields, see
+        DAQmission.runWaveforms. The inputs are not modified.
+    channel_LUT : dict
+        Look up table from specification to NI-daq port.
+
+    Returns
+    dict with
+    length : int
+        Number of samples per channel.
+    dev1_channels, dev2_channels : list of str
+        Analog output channels on Dev1 and Dev2.
+    dev1_analog, dev2_analog : np.ndarray
+        C-contiguous float64 samples of shape (channels, length).
+    digital_channels : list of str
+        Digital lines that are packed into digital.
+    digital : np.ndarray
+        uint32 port values of shape (1, length), (0, length) without lines.
+    averagenumber, ypixelnumber : int or None
+        Information carried by the galvo specifications, if any.
+    """
+    averagenumber = None
+    ypixelnumber = None
+    dev1_channels = []
+    dev2_channels = []
+    dev1_rows = []
+    dev2_rows = []
+    length = 0
+
+    # === Devide analog samples over Dev1 and Dev2 ===
+    if len(analog_signals) != 0:
+        length = analog_signals["Waveform"].shape[1]
+        for i, specification in enumerate(analog_signals["Specification"]):
+            lut_key, avgnum, ypixels = parse_galvo_specification(specification)
+            if avgnum is not None:
+                averagenumber = avgnum
+            if ypixels is not None:
+                ypixelnumber = ypixels
+
+            channel = channel_LUT[lut_key]
+            if "Dev1" in channel:
+                dev1_channels.append(channel)
+                dev1_rows.append(i)
+            else:
+                dev2_channels.append(channel)
+                dev2_rows.append(i)
+
+    # === Pack the digital lines into port values ===
+    digital_channels = []
+    if len(digital_signals) != 0:
+        digital_waveforms = digital_signals["Waveform"]
+        if length == 0:
+            length = digital_waveforms.shape[1]
+        digital_channels = [
+            channel_LUT[specification]
+            for specification in digital_signals["Specification"]
+        ]
+        digital = pack_digital_lines(digital_waveforms, digital_channels)
+    else:
+        digital = np.zeros((0, length), dtype="uint32")
+
+    def stack(rows):
+        # Fancy indexing always returns a fresh C-contiguous array.
+        if len(rows) == 0:
+            return np.zeros((0, length), dtype="float64")
+        return np.asarray(
+            analog_signals["Waveform"][rows], dtype="float64", order="C"
+        )
+
+    return {
+        "length": length,
+        "dev1_channels": dev1_channels,
+        "dev1_analog": stack(dev1_rows),
+        "dev2_channels": dev2_channels,
+        "dev2_analog": stack(dev2_rows),
+        "digital_channels": digital_channels,
+        "digital": digital,
+        "averagenumber": averagenumber,
+        "ypixelnumber": ypixelnumber,
+    }
@@ -1,4 +1,7 @@
+import functools
+import logging
 import math
+import time
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -175,7 +178,7 @@ def repeatWave(wave, repeats):
     return extendedWave
 
 
-def waveRecPic(
+def raster_scan_samples(
     sampleRate=4000,
     imAngle=0,
     voltXMin=0,
@@ -185,35 +188,215 @@ def waveRecPic(
     xPixels=1024,
     yPixels=512,
     sawtooth=True,
+    repeats=1,
+    dtype="float64",
+    volt_range=10.0,
+    out=None,
 ):
     """
-    Generates a the x and y values for making rectangular picture with a scanning laser.
+    Generates the x and y galvo samples of a raster scan in one go.
+
+    Same waveform as waveRecPic, but instead of appending line after line the
+    scan is written as a (yPixels, lineSize) grid: x only depends on the
+    column (and the line parity for triangle waves) and y only on the line and
+    whether the column is before or after the step, so every value, including
+    the rotation, is a broadcast of two short vectors into the buffer.
+
+    Parameters
+    repeats : int
+        Number of frames, e.g. for averaging. Frames are copied back to back.
+    dtype : str
+        "float64" or "float32" for volts, or an integer type like "int16" for
+        raw DAC codes, scaled so that volt_range maps to the full type range.
+    out : np.ndarray, optional
+        Preallocated (2, repeats * frame length) buffer of dtype to write in.
+
+    Returns
+    np.ndarray of shape (2, repeats * frame length): x in row 0, y in row 1.
     """
     xArray, lineSize = xValuesSingleSawtooth(
         sampleRate, voltXMin, voltXMax, xPixels, sawtooth
     )
-    yArray = yValuesFullSawtooth(
-        sampleRate, voltYMin, voltYMax, xPixels, yPixels, lineSize
-    )
+    frame_length = lineSize * yPixels
+    if out is None:
+        out = np.empty((2, frame_length * repeats), dtype=dtype)
+    elif out.shape != (2, frame_length * repeats):
+        raise ValueError(
+            f"out has shape {out.shape}, expected "
+            f"{(2, frame_length * repeats)}"
+        )
 
-    # Looping it to get the desired amount of periods for x
-    if sawtooth is True:
-        extendedXArray = repeatWave(xArray, yPixels)
+    # x pattern per line parity: one for sawtooth, up and down for triangle.
+    x_lines = xArray.reshape(-1, lineSize)
+    period = len(x_lines)
+
+    # y is at the line's value until the step, which starts at the beginning
+    # of the inertial part, then at the next line's value. The last line
+    # falls back to voltYMin.
+    stepSize = (voltYMax - voltYMin) / yPixels
+    y_before = np.arange(yPixels) * stepSize + voltYMin
+    y_after = np.append(y_before[1:], voltYMin)
+
+    radAngle = math.pi / 180 * imAngle
+    centerX = (voltXMax - voltXMin) / 2 + voltXMin
+    centerY = (voltYMax - voltYMin) / 2 + voltYMin
+    cos, sin = math.cos(radAngle), math.sin(radAngle)
+
+    integer = np.issubdtype(out.dtype, np.integer)
+    if integer:
+        scale = np.iinfo(out.dtype).max / volt_range
+        scratch = np.empty((2, yPixels, lineSize))
+        grids = scratch
     else:
-        repeats = int(math.ceil(yPixels / 2))
-        extendedXArray = repeatWave(xArray, repeats)
+        grids = out[:, :frame_length].reshape(2, yPixels, lineSize)
+
+    for parity in range(period):
+        for columns, y_values in (
+            (slice(0, xPixels), y_before),
+            (slice(xPixels, lineSize), y_after),
+        ):
+            x_shifted = x_lines[parity, columns] - centerX
+            y_shifted = (y_values[parity::period] - centerY)[:, None]
+            x_grid = grids[0, parity::period, columns]
+            y_grid = grids[1, parity::period, columns]
+            # Same operation order as rotateXandY.
+            np.subtract(x_shifted * cos, y_shifted * sin, out=x_grid)
+            np.add(x_grid, centerX, out=x_grid)
+            np.add(x_shifted * sin, y_shifted * cos, out=y_grid)
+            np.add(y_grid, centerY, out=y_grid)
+
+    if integer:
+        np.multiply(scratch, scale, out=scratch)
+        np.rint(scratch, out=scratch)
+        # Overshoots of the fly back beyond the range saturate.
+        limits = np.iinfo(out.dtype)
+        np.clip(scratch, limits.min, limits.max, out=scratch)
+        out[:, :frame_length] = scratch.reshape(2, frame_length)
+
+    if repeats > 1:
+        frames = out.reshape(2, repeats, frame_length)
+        frames[:, 1:] = frames[:, :1]
+
+    return out
+
+
+@functools.lru_cache(maxsize=8)
+def cached_raster_scan_samples(
+    sampleRate=4000,
+    imAngle=0,
+    voltXMin=0,
+    voltXMax=5,
+    voltYMin=0,
+    voltYMax=5,
+    xPixels=1024,
+    yPixels=512,
+    sawtooth=True,
+    repeats=1,
+    dtype="float64",
+):
+    """
+    raster_scan_samples, remembered for the last few scan settings so that
+    repeated scans, like the ones of autofocus, cost nothing to set up.
+
+    The returned array is shared, so it is read-only.
+    """
+    samples = raster_scan_samples(
+        sampleRate,
+        imAngle,
+        voltXMin,
+        voltXMax,
+        voltYMin,
+        voltYMax,
+        xPixels,
+        yPixels,
+        sawtooth,
+        repeats,
+        dtype,
+    )
+    samples.setflags(write=False)
+    return samples
 
-        # Checking if we should remove the last ramp down
-        if yPixels % 2 == 1:
-            extendedXArray = extendedXArray[0:-lineSize]
 
-    # Rotatin
-    finalX, finalY = rotateXandY(
-        extendedXArray, yArray, voltXMin, voltXMax, voltYMin, voltYMax, imAngle
+def waveRecPic(
+    sampleRate=4000,
+    imAngle=0,
+    voltXMin=0,
+    voltXMax=5,
+    voltYMin=0,
+    voltYMax=5,
+    xPixels=1024,
+    yPixels=512,
+    sawtooth=True,
+):
+    """
+    Generates a the x and y values for making rectangular picture with a scanning laser.
+    """
+    finalX, finalY = raster_scan_samples(
+        sampleRate,
+        imAngle,
+        voltXMin,
+        voltXMax,
+        voltYMin,
+        voltYMax,
+        xPixels,
+        yPixels,
+        sawtooth,
     )
     return finalX, finalY
 
 
+def raster_image_index(frame_samples, averagenum, repeatnum, gap, offset):
+    """
+    Image number of every sample of a repeated raster scan, as recorded:
+    offset samples, then repeatnum times averagenum frames and a gap.
+
+    Returns
+    np.ndarray, 0 outside the frames, i + 1 in the frames of repeat i.
+    """
+    one_repeat = np.append(np.ones(frame_samples * averagenum), np.zeros(gap))
+    repeated = np.arange(1, repeatnum + 1)[:, np.newaxis] * one_repeat
+    return np.append(np.zeros(offset), repeated.ravel())
+
+
+def reconstruct_raster_images(
+    data, frame_samples, averagenum, repeatnum, gap, offset, x_pixels
+):
+    """
+    All images of a repeated raster scan in one pass, laid out like
+    raster_image_index.
+
+    The recording is reshaped to (repeatnum, frames and gap), a view without
+    copy, so every repeat is found by its stride instead of by searching the
+    index array.
+
+    Parameters
+    data : np.ndarray
+        Recorded samples.
+    frame_samples : int
+        Samples per frame.
+    averagenum : int
+        Frames per image, averaged.
+    repeatnum : int
+        Number of images.
+    gap : int
+        Samples between repeats.
+    offset : int
+        Samples before the first frame.
+    x_pixels : int
+        Samples per line.
+
+    Returns
+    np.ndarray of shape (repeatnum, lines, x_pixels).
+    """
+    period = frame_samples * averagenum + gap
+    repeats = np.asarray(data)[offset : offset + repeatnum * period]
+    frames = repeats.reshape(repeatnum, period)[
+        :, : frame_samples * averagenum
+    ]
+    images = frames.reshape(repeatnum, averagenum, frame_samples).mean(axis=1)
+    return images.reshape(repeatnum, -1, x_pixels)
+
+
 def blockWave(sampleRate, frequency, voltMin, voltMax, dutycycle):
     """
     Generates a one period blockwave.
@@ -232,6 +415,115 @@ def blockWave(sampleRate, frequency, voltMin, voltMax, dutycycle):
     return np.append(high, low)
 
 
+def benchmark_raster_scan(sampleRate=500000, pixels=500, repeats=3):
+    """
+    Compares raster_scan_samples against the line by line construction with
+    yValuesFullSawtooth and repeatWave that waveRecPic used before.
+
+    Returns
+    dict of (sawtooth, imAngle) to dict of seconds per construction.
+    """
+    settings = dict(
+        sampleRate=sampleRate,
+        voltXMin=-5,
+        voltXMax=5,
+        voltYMin=-5,
+        voltYMax=5,
+        xPixels=pixels,
+        yPixels=pixels,
+    )
+
+    results = {}
+    for sawtooth, imAngle in ((True, 0), (False, 0), (True, 30)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            xArray, lineSize = xValuesSingleSawtooth(
+                sampleRate, -5, 5, pixels, sawtooth
+            )
+            yArray = yValuesFullSawtooth(
+                sampleRate, -5, 5, pixels, pixels, lineSize
+            )
+            if sawtooth is True:
+                extendedXArray = repeatWave(xArray, pixels)
+            else:
+                extendedXArray = repeatWave(xArray, int(math.ceil(pixels / 2)))
+                if pixels % 2 == 1:
+                    extendedXArray = extendedXArray[0:-lineSize]
+            legacy = rotateXandY(extendedXArray, yArray, -5, 5, -5, 5, imAngle)
+        legacy_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            samples = raster_scan_samples(
+                imAngle=imAngle, sawtooth=sawtooth, **settings
+            )
+        fast_time = (time.perf_counter() - start) / repeats
+
+        cached_raster_scan_samples(
+            imAngle=imAngle, sawtooth=sawtooth, **settings
+        )
+        start = time.perf_counter()
+        cached_raster_scan_samples(
+            imAngle=imAngle, sawtooth=sawtooth, **settings
+        )
+        cached_time = time.perf_counter() - start
+
+        identical = np.array_equal(samples, np.vstack(legacy))
+        results[(sawtooth, imAngle)] = {
+            "line by line": legacy_time,
+            "broadcast": fast_time,
+            "cached": cached_time,
+        }
+        logging.info(
+            f"sawtooth={sawtooth}, angle={imAngle}: {samples.shape[1]} samples,"
+            f" line by line {legacy_time * 1000:.1f} ms,"
+            f" broadcast {fast_time * 1000:.1f} ms,"
+            f" cached {cached_time * 1e6:.1f} us, identical {identical}"
+        )
+    return results
+
+
+def benchmark_raster_reconstruction(
+    pixels=500, sampleRate=500000, averagenum=1, repeatnum=100, gap=1000
+):
+    """
+    Compares reconstruct_raster_images against the per repeat np.where and
+    np.concatenate that WaveformWidget.recive_data used before.
+
+    Returns
+    dict of name to seconds.
+    """
+    xArray, lineSize = xValuesSingleSawtooth(sampleRate, -5, 5, pixels)
+    frame_samples = lineSize * pixels
+    index = raster_image_index(frame_samples, averagenum, repeatnum, gap, 10)
+    data = np.random.default_rng(0).random(len(index))
+
+    start = time.perf_counter()
+    for i in range(repeatnum):
+        image = np.mean(
+            data[np.where(index == i + 1)].reshape(averagenum, -1), axis=0
+        ).reshape(pixels, lineSize)
+        if i == 0:
+            legacy = image
+        else:
+            legacy = np.concatenate((legacy, image), axis=0)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    images = reconstruct_raster_images(
+        data, frame_samples, averagenum, repeatnum, gap, 10, lineSize
+    )
+    fast_time = time.perf_counter() - start
+
+    identical = np.array_equal(images.reshape(legacy.shape), legacy)
+    logging.info(
+        f"{repeatnum} repeats of {pixels}x{lineSize}: per repeat"
+        f" {legacy_time * 1000:.1f} ms, one pass {fast_time * 1000:.1f} ms,"
+        f" identical {identical}"
+    )
+    return {"per repeat": legacy_time, "one pass": fast_time}
+
+
 def testSawtooth():
     sRate = 2000000
     imAngle = 0
@@ -8,6 +8,7 @@ Created on Tue Aug 18 13:54:51 2020
 # === Auto focus workflow ===
 # --1. Find local minima range. (one direction until value getting smaller)
 # --2. Bisection to find the optimal.
+# model_search fits the focus curve instead, see focus_search.py.
 
 import logging
 import os
@@ -21,6 +22,7 @@ from ..GalvoWidget.GalvoScan_backend import RasterScan
 from ..HamamatsuCam.HamamatsuActuator import CamActuator
 from ..ImageAnalysis.ImageProcessing import ProcessImage
 from ..NIDAQ.DAQoperator import DAQmission
+from .focus_search import ModelFocusSearch
 from .focuser import PIMotor
 
 
@@ -86,6 +88,9 @@ class FocusFinder:
         self.previous_degree_of_focus = 0
         # Number of going backwards.
         self.turning_point = 0
+        # Position in mm within which the objective counts as settled, for
+        # model_search.
+        self.settle_tolerance = 0.0002
         # The input source of image.
         self.source_of_image = source_of_image
         if source_of_image == "PMT":
@@ -131,6 +136,62 @@ class FocusFinder:
 
         return max_focus_pos
 
+    def model_search(
+        self, move_to_focus=True, tolerance=0.0005, model="parabola"
+    ):
+        """
+        Find the focus by fitting the focus curve as the positions come in,
+        see ModelFocusSearch. Waits for the objective to settle instead of
+        fixed sleeps and does not plot the images.
+
+        Parameters
+        move_to_focus : bool
+            Move the objective to the focus found.
+        tolerance : float
+            Wanted accuracy of the focus position in mm.
+        model : str
+            "parabola" or "gaussian".
+
+        Returns
+        focus_position : float
+            False if there's no cell in the PMT image.
+
+        """
+        search = ModelFocusSearch(
+            self.current_pos - self.init_search_range,
+            self.current_pos + self.init_search_range,
+            tolerance=tolerance,
+            max_evaluations=self.total_step_number + 3,
+            model=model,
+        )
+        while not search.done:
+            position = round(search.ask(), 6)
+            degree_of_focus = self.evaluate_focus(position, fast=True)
+            search.tell(position, degree_of_focus)
+
+            if len(search.positions) == 1 and self.source_of_image == "PMT":
+                # Like bisection, stop if there's no cell in image.
+                if not ProcessImage.if_theres_cell(
+                    self.galvo_image.astype("float32")
+                ):
+                    logging.info("no cell")
+                    return False
+
+        logging.info(
+            "Focus at {} +- {} after {} positions.".format(
+                search.peak, search.peak_error, len(search.positions)
+            )
+        )
+        # Often the search ends on the focus, then the objective is there.
+        if move_to_focus is True and abs(position - search.peak) >= (
+            tolerance / 2
+        ):
+            self.pi_device_instance.move(
+                search.peak, settle_tolerance=self.settle_tolerance
+            )
+
+        return search.peak
+
     def bisection(self):
         """
         Bisection way of finding focus.
@@ -228,13 +289,16 @@ class FocusFinder:
 
         return mid_position
 
-    def evaluate_focus(self, obj_position=None):
+    def evaluate_focus(self, obj_position=None, fast=False):
         """
         Evaluate the focus degree of certain objective position.
 
         Parameters
         obj_position : float, optional
             The target objective position. The default is None.
+        fast : bool, optional
+            Wait for the objective to settle instead of fixed sleeps, and do
+            not plot the image. The default is False.
 
         Returns
         degree_of_focus : float
@@ -243,14 +307,20 @@ class FocusFinder:
         """
 
         if obj_position is not None:
-            self.pi_device_instance.move(obj_position)
+            if fast:
+                self.pi_device_instance.move(
+                    obj_position, settle_tolerance=self.settle_tolerance
+                )
+            else:
+                self.pi_device_instance.move(obj_position)
 
         # Get the image.
         if self.source_of_image == "PMT":
             self.galvo_image = self.galvo.run()
-            plt.figure()
-            plt.imshow(self.galvo_image)
-            plt.show()
+            if not fast:
+                plt.figure()
+                plt.imshow(self.galvo_image)
+                plt.show()
 
             if False:
                 with skimtiff.TiffWriter(
@@ -284,15 +354,17 @@ class FocusFinder:
             self.camera_image = self.HamamatsuCam_ins.SnapImage(
                 self.imaging_conditions["exposure_time"]
             )
-            time.sleep(0.5)
+            if not fast:
+                time.sleep(0.5)
 
             # Set back AOTF
             self.AOTF_runner.sendSingleDigital("blankingall", False)
             self.AOTF_runner.sendSingleAnalog(AOTF_channel_key, 0)
 
-            plt.figure()
-            plt.imshow(self.camera_image)
-            plt.show()
+            if not fast:
+                plt.figure()
+                plt.imshow(self.camera_image)
+                plt.show()
 
             if False:
                 with skimtiff.TiffWriter(
@@ -307,7 +379,8 @@ class FocusFinder:
                 self.camera_image.astype("float32")
             )
 
-        time.sleep(0.2)
+        if not fast:
+            time.sleep(0.2)
 
         return degree_of_focus
 
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Predict the focus over a well from the positions focused so far.
+
+The focus of a well changes smoothly with the stage position: the plate is
+tilted and a bit bent. So after auto-focusing at a few coordinates, the focus
+at the others can be predicted by a surface through the measured positions,
+and the slow auto-focus is only needed where that prediction is not good
+enough.
+
+FocusSurface fits either a polynomial of the stage row and column, of the
+highest degree up to the set one that the points allow, or a thin plate
+spline. needs_autofocus tells whether to trust the prediction at a
+coordinate: not if the points do not span a plane yet, if the leave one out
+error of the surface is above threshold, or if the uncertainty of the
+prediction there is above threshold.
+
+benchmark_focus_surface replays a recorded focus map, like the auto-focus
+positions in a screening journal, to see how many auto-focus runs a threshold
+saves and how far the predictions are off.
+"""
+
+import json
+import logging
+
+import numpy as np
+from scipy.interpolate import RBFInterpolator
+from scipy.spatial import Delaunay
+
+
+def polynomial_terms(rows, cols, degree):
+    """
+    Design matrix with columns row**i * col**j for i + j <= degree.
+    """
+    rows = np.asarray(rows, dtype="float64")
+    cols = np.asarray(cols, dtype="float64")
+    return np.stack(
+        [
+            rows**i * cols ** (total - i)
+            for total in range(degree + 1)
+            for i in range(total + 1)
+        ],
+        axis=-1,
+    )
+
+
+def number_of_terms(degree):
+    return (degree + 1) * (degree + 2) // 2
+
+
+class FocusSurface:
+    """
+    Focus positions of a well and the surface through them.
+
+    Parameters
+    method : str
+        "polynomial" or "spline" for a thin plate spline.
+    degree : int
+        Highest polynomial degree.
+    threshold : float
+        Largest accepted uncertainty and fit residual, in the unit of the focus
+        positions, mm for the PI motor.
+    smoothing : float
+        Smoothing of the thin plate spline, 0 goes through all points.
+    max_extrapolation : float
+        How far outside the measured positions to predict, in units of the
+        typical distance between them. The uncertainties only cover the noise
+        of the measurements, not how the real focus bends away from the
+        surface, so far out the predictions are not trusted.
+    """
+
+    def __init__(
+        self,
+        method="polynomial",
+        degree=2,
+        threshold=0.001,
+        smoothing=0.0,
+        max_extrapolation=1.0,
+    ):
+        self.method = method
+        self.degree = degree
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.max_extrapolation = max_extrapolation
+
+        self.rows = []
+        self.cols = []
+        self.focus_positions = []
+        self._fitted = False
+
+    def __len__(self):
+        return len(self.focus_positions)
+
+    def add(self, row, col, focus_position):
+        """
+        Add a focus position found by auto-focus.
+        """
+        self.rows.append(float(row))
+        self.cols.append(float(col))
+        self.focus_positions.append(float(focus_position))
+        self._fitted = False
+
+    # === Fitting ===
+    def _normalize(self, rows, cols):
+        return (
+            (np.asarray(rows, dtype="float64") - self._center[0])
+            / self._scale,
+            (np.asarray(cols, dtype="float64") - self._center[1])
+            / self._scale,
+        )
+
+    def fit(self):
+        """
+        Fit the surface, returns False if there are too few points.
+        """
+        self._fitted = True
+        self._usable = False
+        self.residual = np.inf
+        # At least a plane with 2 degrees of freedom left.
+        if len(self) < number_of_terms(1) + 2:
+            return False
+
+        rows = np.array(self.rows)
+        cols = np.array(self.cols)
+        focus = np.array(self.focus_positions)
+        # Stage indices are large, normalize for a well conditioned fit.
+        self._center = (rows.mean(), cols.mean())
+        self._scale = max(np.ptp(rows), np.ptp(cols), 1.0)
+        rows, cols = self._normalize(rows, cols)
+
+        # Points on a line say nothing about the tilt across it.
+        if np.linalg.matrix_rank(polynomial_terms(rows, cols, 1)) < 3:
+            return False
+
+        self._points = np.column_stack((rows, cols))
+        self._hull = Delaunay(self._points)
+        distances = np.sqrt(
+            ((self._points[:, np.newaxis] - self._points) ** 2).sum(axis=-1)
+        )
+        np.fill_diagonal(distances, np.inf)
+        self._spacing = np.median(distances.min(axis=1))
+
+        if self.method == "spline":
+            self._fit_spline(rows, cols, focus)
+        else:
+            self._fit_polynomial(rows, cols, focus)
+        self._usable = True
+        return True
+
+    def _fit_polynomial(self, rows, cols, focus):
+        # Highest degree that the points determine, with at least 2 degrees
+        # of freedom left for the residual.
+        degree = self.degree
+        while degree > 1 and (
+            number_of_terms(degree) + 2 > len(focus)
+            or np.linalg.matrix_rank(polynomial_terms(rows, cols, degree))
+            < number_of_terms(degree)
+        ):
+            degree -= 1
+        self._degree = degree
+
+        terms = polynomial_terms(rows, cols, degree)
+        self._coefficients = np.linalg.lstsq(terms, focus, rcond=None)[0]
+        residuals = focus - terms @ self._coefficients
+        freedom = len(focus) - terms.shape[1]
+        self._variance = (residuals**2).sum() / freedom
+        self._inverse = np.linalg.pinv(terms.T @ terms)
+        # Leave one out errors, from the leverage of each point.
+        leverage = np.einsum("ij,jk,ik->i", terms, self._inverse, terms)
+        errors = residuals / np.clip(1 - leverage, 1e-6, None)
+        self.residual = np.sqrt((errors**2).mean())
+
+    def _fit_spline(self, rows, cols, focus):
+        points = self._points
+        self._spline = RBFInterpolator(
+            points,
+            focus,
+            kernel="thin_plate_spline",
+            smoothing=self.smoothing,
+            degree=1,
+        )
+        # A spline always goes (near) through its points, so the plain
+        # residuals say nothing.
+        errors = np.full(len(focus), np.nan)
+        for i in range(len(focus)):
+            others = np.arange(len(focus)) != i
+            try:
+                spline = RBFInterpolator(
+                    points[others],
+                    focus[others],
+                    kernel="thin_plate_spline",
+                    smoothing=self.smoothing,
+                    degree=1,
+                )
+            except np.linalg.LinAlgError:
+                # The other points are on a line.
+                continue
+            errors[i] = spline(points[[i]])[0] - focus[i]
+        if np.isnan(errors).all():
+            self.residual = np.inf
+        else:
+            self.residual = np.sqrt(np.nanmean(errors**2))
+
+    # === Prediction ===
+    def predict(self, row, col):
+        """
+        Predicted focus position and its uncertainty.
+
+        For the polynomial the uncertainty is the standard error of the
+        fitted surface at that position. The spline has no such error, its
+        leave one out error is used, growing with the distance to the nearest
+        measured position in units of the typical spacing of the points.
+
+        Returns
+        (focus_position, uncertainty), uncertainty is inf if there are too few
+        points to predict.
+        """
+        if not self._fitted:
+            self.fit()
+        if not self._usable:
+            return np.nan, np.inf
+
+        rows, cols = self._normalize(np.atleast_1d(row), np.atleast_1d(col))
+        if self.method == "spline":
+            points = np.column_stack((rows, cols))
+            prediction = self._spline(points)
+            distance = self._distance(points)
+            uncertainty = self.residual * np.sqrt(
+                1 + (distance / self._spacing) ** 2
+            )
+        else:
+            terms = polynomial_terms(rows, cols, self._degree)
+            prediction = terms @ self._coefficients
+            leverage = np.einsum("ij,jk,ik->i", terms, self._inverse, terms)
+            uncertainty = np.sqrt(self._variance * leverage)
+
+        if np.ndim(row) == 0:
+            return float(prediction[0]), float(uncertainty[0])
+        return prediction, uncertainty
+
+    def _distance(self, points):
+        """
+        Distance to the nearest measured position.
+        """
+        return np.sqrt(
+            ((points[:, np.newaxis] - self._points) ** 2).sum(axis=-1)
+        ).min(axis=1)
+
+    def needs_autofocus(self, row, col):
+        """
+        Whether the prediction at row, col is not good enough to skip the
+        auto-focus.
+        """
+        prediction, uncertainty = self.predict(row, col)
+        if not np.isfinite(uncertainty):
+            return True
+        if self.residual > self.threshold:
+            return True
+
+        point = np.column_stack(self._normalize([row], [col]))
+        inside = self._hull.find_simplex(point)[0] >= 0
+        if (
+            not inside
+            and self._distance(point)[0]
+            > self.max_extrapolation * self._spacing
+        ):
+            return True
+        return uncertainty > self.threshold
+
+
+# === Offline benchmark ===
+def focus_map_from_journal(path, grid=None, round_index=None):
+    """
+    Auto-focus positions written in a screening journal.
+
+    Parameters
+    path : str
+        Journal file.
+    grid, round_index : int, optional
+        Only the positions of this grid and round. The coordinates of every
+        grid are at the same stage positions relative to the grid, so the
+        focus maps of several grids do not make one surface.
+
+    Returns
+    (rows, cols, focus_positions) : np.ndarray
+    """
+    rows, cols, focus = [], [], []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record["event"] != "focus":
+                continue
+            if grid is not None and record.get("grid", 0) != grid:
+                continue
+            if round_index is not None and record["round"] != round_index:
+                continue
+            rows.append(record["row"])
+            cols.append(record["col"])
+            focus.append(record["focus_position"])
+    return np.array(rows), np.array(cols), np.array(focus)
+
+
+def benchmark_focus_surface(
+    rows,
+    cols,
+    focus_positions,
+    autofocus_time=20.0,
+    tolerance=None,
+    **surface_kwargs,
+):
+    """
+    Replay a focus map in order, auto-focusing only when the surface asks.
+
+    Parameters
+    rows, cols, focus_positions : np.ndarray
+        Recorded focus map, in the order the coordinates are visited.
+    autofocus_time : float
+        Seconds an auto-focus run takes.
+    tolerance : float
+        Error counted as out of focus, default the threshold of the surface.
+    surface_kwargs
+        Passed on to FocusSurface.
+
+    Returns
+    dict with "autofocus_runs", "time_saved", "rms_error", "max_error" and
+    "out_of_focus" of the predicted coordinates.
+    """
+    surface = FocusSurface(**surface_kwargs)
+    if tolerance is None:
+        tolerance = surface.threshold
+    errors = []
+    for row, col, focus in zip(rows, cols, focus_positions):
+        if surface.needs_autofocus(row, col):
+            surface.add(row, col, focus)
+        else:
+            errors.append(surface.predict(row, col)[0] - focus)
+
+    errors = np.abs(np.array(errors))
+    predicted = len(errors)
+    return {
+        "autofocus_runs": len(surface),
+        "time_saved": predicted * autofocus_time,
+        "rms_error": float(np.sqrt((errors**2).mean()))
+        if predicted
+        else 0.0,
+        "max_error": float(errors.max()) if predicted else 0.0,
+        "out_of_focus": int((errors > tolerance).sum()),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    # Simulated focus map of a tilted, slightly bent well, 20 x 20 coordinates,
+    # with 0.3 um noise on every auto-focus.
+    rng = np.random.default_rng(0)
+    step = 1568
+    rows, cols = np.meshgrid(
+        np.arange(20) * step, np.arange(20) * step, indexing="ij"
+    )
+    rows = rows.ravel()
+    cols = cols.ravel()
+    x = rows / rows.max() - 0.5
+    y = cols / cols.max() - 0.5
+    focus = (
+        3.5
+        + 0.004 * x
+        - 0.003 * y
+        + 0.006 * x**2
+        + 0.002 * x * y
+        + rng.normal(0, 0.0003, len(x))
+    )
+
+    # The threshold decides between predicting and auto-focusing. Out of
+    # focus is counted against a fixed depth of field, so the runs compare.
+    # With the default max_extrapolation a coordinate visited in raster order
+    # is mostly too far from the measured ones anyway, whatever the
+    # threshold, so here the surface may extrapolate 3 spacings.
+    for threshold in (0.0003, 0.0005, 0.001, 0.002):
+        kwargs = {
+            "method": "polynomial",
+            "degree": 2,
+            "threshold": threshold,
+            "max_extrapolation": 3.0,
+        }
+        result = benchmark_focus_surface(
+            rows, cols, focus, tolerance=0.001, **kwargs
+        )
+        logging.info("{}: {}".format(kwargs, result))
+
+    for kwargs in (
+        {"method": "polynomial", "degree": 1, "threshold": 0.001},
+        {"method": "spline", "smoothing": 1e-6, "threshold": 0.001},
+    ):
+        result = benchmark_focus_surface(
+            rows, cols, focus, tolerance=0.001, **kwargs
+        )
+        logging.info("{}: {}".format(kwargs, result))
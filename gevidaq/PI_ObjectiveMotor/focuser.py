@@ -73,7 +73,17 @@ class PIMotor:
             logging.critical("caught exception", exc_info=exc)
             logging.info("PI device not initilized.")
 
-    def move(self, target_pos):
+    def move(self, target_pos, settle_tolerance=None):
+        """
+        Move the objective to target_pos.
+
+        Parameters
+        target_pos : float
+            Target position, mm.
+        settle_tolerance : float, optional
+            If given, wait until the position is within settle_tolerance mm
+            of the target instead of a fixed 0.3 s after the move.
+        """
         # pidevice.StopAll()
         # pidevice.SVO(pidevice.axes, [True] * len(pidevice.axes))
         # pitools.waitontarget(pidevice, axes=pidevice.axes)
@@ -91,13 +101,50 @@ class PIMotor:
         targets = [target_pos]
         self.pidevice.MOV(self.pidevice.axes, targets)
         pitools.waitontarget(self.pidevice)
-        time.sleep(0.3)
+        if settle_tolerance is None:
+            time.sleep(0.3)
+        else:
+            self.waitForSettle(target_pos, settle_tolerance)
         positions = self.pidevice.qPOS(self.pidevice.axes)
         for axis in self.pidevice.axes:
             logging.info(
                 "position of axis {} = {:.5f}".format(axis, positions[axis])
             )
 
+    def waitForSettle(
+        self,
+        target_pos,
+        tolerance=0.0002,
+        timeout=2.0,
+        poll_interval=0.01,
+        stable_reads=2,
+    ):
+        """
+        Poll the position until it is within tolerance of target_pos for
+        stable_reads reads in a row.
+
+        Returns
+        True if the objective settled, False on timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        reads_at_target = 0
+        while True:
+            if abs(self.GetCurrentPos() - target_pos) <= tolerance:
+                reads_at_target += 1
+                if reads_at_target >= stable_reads:
+                    return True
+            else:
+                reads_at_target = 0
+
+            if time.perf_counter() >= deadline:
+                logging.info(
+                    "Objective did not settle at {} within {} s.".format(
+                        target_pos, timeout
+                    )
+                )
+                return False
+            time.sleep(poll_interval)
+
     def GetCurrentPos(self):
         # positions is a dictionary with key being axis name, here '1'.
         positions = self.pidevice.qPOS(self.pidevice.axes)
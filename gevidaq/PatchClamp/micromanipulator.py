@@ -9,7 +9,8 @@ Created on Wed Aug 11 11:09:56 2021
 import time
 
 import numpy as np
-import serial
+
+from ..GeneralUsage.serial_connection import get_connection
 
 
 class ScientificaPatchStar:
@@ -22,20 +23,24 @@ class ScientificaPatchStar:
         self.baudrate = baud  # Baudrate of the micromanipulator
         self.ENDOFLINE = "\r"  # Carriage return
         self.units = 100  # 1um is 100 PatchStar units
+        # Port stays open, shared by all commands. Not retried, a relative
+        # move that is sent again after its reply got lost moves twice.
+        self.connection = get_connection(
+            self.port,
+            device="patchstar",
+            baudrate=self.baudrate,
+            timeout=3,
+            retries=0,
+        )
 
     def send_and_recieve(self, command):
         # Add an end-of-line signature to indicate the end of a command
         command = command + self.ENDOFLINE
 
-        with serial.Serial(self.port, self.baudrate, timeout=3) as patchstar:
-            # Encode the command to ascii and send to PatchStar
-            patchstar.write(command.encode("ascii"))
-
-            # Wait until all data is written
-            patchstar.flush()
-
-            # Read PatchStar response until carriage return
-            response = patchstar.read_until(self.ENDOFLINE.encode("ascii"))
+        # Send to PatchStar and read its response until carriage return
+        response = self.connection.query(
+            command, terminator=self.ENDOFLINE.encode("ascii")
+        )
 
         # Decodes response to utf-8
         response = response.decode("utf-8")
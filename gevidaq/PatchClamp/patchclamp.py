@@ -9,11 +9,10 @@ Notes:
 """
 import nidaqmx
 import numpy as np
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from ..NIDAQ.constants import MeasurementConstants, NiDaqChannels
+from ..NIDAQ.daq_backend import get_backend
 from ..NIDAQ.wavegenerator import blockWave
 
 
@@ -91,15 +90,20 @@ class ContinuousPatchThread(QThread):
         self.patchVoltInChan = self.configs["patchAO"]
 
         # DAQ
-        with nidaqmx.Task() as writeTask, nidaqmx.Task() as readTask:
+        daq = get_backend()
+        with daq.Task() as writeTask, daq.Task() as readTask:
             writeTask.ao_channels.add_ao_voltage_chan(self.patchVoltInChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchVoltOutChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchCurOutChan)
 
             self.setTiming(writeTask, readTask)
 
-            reader = AnalogMultiChannelReader(readTask.in_stream)
-            writer = AnalogSingleChannelWriter(writeTask.out_stream)
+            reader = daq.stream_readers.AnalogMultiChannelReader(
+                readTask.in_stream
+            )
+            writer = daq.stream_writers.AnalogSingleChannelWriter(
+                writeTask.out_stream
+            )
 
             writer.write_many_sample(self.wave)
 
@@ -247,15 +251,20 @@ class ContinuousPatchThread_hold(QThread):
         self.patchVoltInChan = self.configs["patchAO"]
 
         # DAQ
-        with nidaqmx.Task() as writeTask, nidaqmx.Task() as readTask:
+        daq = get_backend()
+        with daq.Task() as writeTask, daq.Task() as readTask:
             writeTask.ao_channels.add_ao_voltage_chan(self.patchVoltInChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchVoltOutChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchCurOutChan)
 
             self.setTiming(writeTask, readTask)
 
-            reader = AnalogMultiChannelReader(readTask.in_stream)
-            writer = AnalogSingleChannelWriter(writeTask.out_stream)
+            reader = daq.stream_readers.AnalogMultiChannelReader(
+                readTask.in_stream
+            )
+            writer = daq.stream_writers.AnalogSingleChannelWriter(
+                writeTask.out_stream
+            )
 
             writer.write_many_sample(self.wave)
 
@@ -404,15 +413,20 @@ class ContinuousPatchThread_currentclamp(QThread):
         self.patchCurInChan = self.configs["patchAO"]
 
         # DAQ
-        with nidaqmx.Task() as writeTask, nidaqmx.Task() as readTask:
+        daq = get_backend()
+        with daq.Task() as writeTask, daq.Task() as readTask:
             writeTask.ao_channels.add_ao_voltage_chan(self.patchCurInChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchVoltOutChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchCurOutChan)
 
             self.setTiming(writeTask, readTask)
 
-            reader = AnalogMultiChannelReader(readTask.in_stream)
-            writer = AnalogSingleChannelWriter(writeTask.out_stream)
+            reader = daq.stream_readers.AnalogMultiChannelReader(
+                readTask.in_stream
+            )
+            writer = daq.stream_writers.AnalogSingleChannelWriter(
+                writeTask.out_stream
+            )
 
             writer.write_many_sample(self.wave)
 
@@ -559,17 +573,20 @@ class ContinuousPatchThread_zap(QThread):
         self.patchVoltInChan = self.configs["patchAO"]
 
         # DAQ
-        with nidaqmx.Task() as writeTask, nidaqmx.Task() as readTask:
+        daq = get_backend()
+        with daq.Task() as writeTask, daq.Task() as readTask:
             writeTask.ao_channels.add_ao_voltage_chan(self.patchVoltInChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchVoltOutChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchCurOutChan)
 
             self.setTiming(writeTask, readTask)
 
-            reader = AnalogMultiChannelReader(
+            reader = daq.stream_readers.AnalogMultiChannelReader(
                 readTask.in_stream
             )  # TODO unused
-            writer = AnalogSingleChannelWriter(writeTask.out_stream)
+            writer = daq.stream_writers.AnalogSingleChannelWriter(
+                writeTask.out_stream
+            )
 
             writer.write_many_sample(self.wave)
 
@@ -11,11 +11,10 @@ import logging
 
 import nidaqmx
 import numpy as np
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
 
 from ..NIDAQ.constants import MeasurementConstants, NiDaqChannels
+from ..NIDAQ.daq_backend import get_backend
 from ..NIDAQ.wavegenerator import blockWave
 
 
@@ -185,15 +184,20 @@ class SealTestThread(QThread):
         self.patchVoltInChan = self.configs["patchAO"]
 
         # DAQ
-        with nidaqmx.Task() as writeTask, nidaqmx.Task() as readTask:
+        daq = get_backend()
+        with daq.Task() as writeTask, daq.Task() as readTask:
             writeTask.ao_channels.add_ao_voltage_chan(self.patchVoltInChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchVoltOutChan)
             readTask.ai_channels.add_ai_voltage_chan(self.patchCurOutChan)
 
             self.setTiming(writeTask, readTask)
 
-            reader = AnalogMultiChannelReader(readTask.in_stream)
-            writer = AnalogSingleChannelWriter(writeTask.out_stream)
+            reader = daq.stream_readers.AnalogMultiChannelReader(
+                readTask.in_stream
+            )
+            writer = daq.stream_writers.AnalogSingleChannelWriter(
+                writeTask.out_stream
+            )
 
             writer.write_many_sample(self.wave)
 
@@ -10,6 +10,8 @@ import time
 
 import serial
 
+from ..GeneralUsage.serial_connection import get_connection
+
 
 class LudlStage:
     """
@@ -25,10 +27,21 @@ class LudlStage:
         interface initialization routine which is approximately 5 seconds after
         power up.
         The COM port has to be specified as a string: "COM#".
+
+        The port stays open, all commands go through one shared connection.
+        Try_until_Success already retries, so the connection does not.
         """
         self.address = address
         self.baudrate = 9600
         self.endOfLine = "\r"
+        self.connection = get_connection(
+            self.address,
+            device="ludl",
+            baudrate=self.baudrate,
+            timeout=1,
+            retries=0,
+            stopbits=serial.STOPBITS_TWO,
+        )
 
     def Try_until_Success(func):
         """This is the decorator to try to execute the function until succeed."""
@@ -72,26 +85,21 @@ class LudlStage:
         """
         command = "Where X Y" + self.endOfLine
 
-        with serial.Serial(
-            self.address,
-            self.baudrate,
-            stopbits=serial.STOPBITS_TWO,
-            timeout=1,
-        ) as stage:
-            stage.write(command.encode())
-            position = stage.readline()  # Reads an '\n' terminated line
-            position = position.decode().split(
-                " "
-            )  # Go from bytes to string and split
-
-            if len(position) > 2:
-                xPosition = position[1]
-                yPosition = position[2]
-                stage.close()
-
-                return xPosition, yPosition
-            else:
-                return False, False
+        try:
+            position = self.connection.query(command)  # '\n' terminated line
+        except serial.SerialTimeoutException:
+            return False, False
+        position = position.decode().split(
+            " "
+        )  # Go from bytes to string and split
+
+        if len(position) > 2:
+            xPosition = position[1]
+            yPosition = position[2]
+
+            return xPosition, yPosition
+        else:
+            return False, False
 
     @Try_until_Success
     def moveAbs(self, x, y):
@@ -104,14 +112,11 @@ class LudlStage:
         """
         command = "Move X = %d Y = %d" % (x, y) + self.endOfLine
 
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
-            # stage.flush()
-            stage.close()
+        # Wait for the :A reply, so it is not taken for the reply of the next
+        # query and serial errors reach Try_until_Success.
+        self.connection.query(command)
 
-            return True
+        return True
 
     @Try_until_Success
     def moveVec(self, x, y):
@@ -120,16 +125,16 @@ class LudlStage:
         adjusts the speeds to plot a straight line.
         """
         command = "Vmove X = %d Y = %d" % (x, y) + self.endOfLine
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
+        self.connection.query(command)
 
-    @Try_until_Success
     def moveRel(self, xRel=None, yRel=None):
         """
         Moves the motor to a relative position.
         Set position to None if this axis is not used.
+
+        Not retried like the absolute moves: when the reply got lost the move
+        may have been done, and sending it again would move twice as far.
+        Returns False if there was no reply.
         """
         if xRel is None:
             command = "Movrel Y = %d" % yRel + self.endOfLine
@@ -138,14 +143,14 @@ class LudlStage:
         else:
             command = "Movrel X = %d Y = %d" % (xRel, yRel) + self.endOfLine
 
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
-            stage.flush()
-            stage.close()
+        try:
+            self.connection.query(command)
+        except serial.SerialTimeoutException as exc:
+            logging.critical("caught exception", exc_info=exc)
+            logging.info("No reply on relative move, not sent again.")
+            return False
 
-            return True
+        return True
 
     @Try_until_Success
     def home(self):
@@ -155,10 +160,7 @@ class LudlStage:
         If there are no errors a positive reply is sent back.
         """
         command = "Home" + self.endOfLine
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
+        self.connection.query(command)
 
     @Try_until_Success
     def setZero(self):
@@ -166,10 +168,7 @@ class LudlStage:
         Sets the current position as zero position.
         """
         command = "Here X = 0 Y = 0" + self.endOfLine
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
+        self.connection.query(command)
 
     @Try_until_Success
     def joystick(self, on=True):
@@ -181,10 +180,7 @@ class LudlStage:
             switch = "-"
 
         command = "Joystick X%s Y%s" % (switch, switch) + self.endOfLine
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
+        self.connection.query(command)
 
     @Try_until_Success
     def motorsStopped(self):
@@ -195,18 +191,64 @@ class LudlStage:
             "B" if one or more motors are is still running. Returns False
         """
         command = "Status" + self.endOfLine
-        with serial.Serial(
-            self.address,
-            self.baudrate,
-            stopbits=serial.STOPBITS_TWO,
-            timeout=1,
-        ) as stage:
-            stage.write(command.encode())
-            status = stage.readline()
-            status = status.decode()  # Go from bytes to string
-            if status == "N":
-                return True
-            return False
+        status = self.connection.query(command, reply=1)  # One character
+        status = status.decode()  # Go from bytes to string
+        if status == "N":
+            return True
+        return False
+
+    def waitForPos(
+        self, x, y, timeout=5.0, poll_interval=0.05, stable_reads=2
+    ):
+        """
+        Poll the position until the stage is at x, y and stays there.
+
+        The reply on moveAbs comes before the movement is done, so instead of
+        waiting a fixed time the position is read until it equals the target
+        for stable_reads reads in a row.
+
+        Parameters
+        x, y : int
+            Target position.
+        timeout : float
+            Seconds to wait at most.
+        poll_interval : float
+            Seconds between two reads.
+        stable_reads : int
+            Number of reads in a row at the target.
+
+        Returns
+        True if the stage settled at the target, False on timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        reads_at_target = 0
+        while True:
+            xPosition, yPosition = self.getPos()
+            # getPos returns False, False on a negative reply.
+            at_target = False
+            if xPosition is not False:
+                try:
+                    at_target = int(float(xPosition)) == int(x) and int(
+                        float(yPosition)
+                    ) == int(y)
+                except ValueError:
+                    pass
+
+            if at_target:
+                reads_at_target += 1
+                if reads_at_target >= stable_reads:
+                    return True
+            else:
+                reads_at_target = 0
+
+            if time.perf_counter() >= deadline:
+                logging.info(
+                    "Stage not at {},{} after {} s, last pos: {},{}".format(
+                        x, y, timeout, xPosition, yPosition
+                    )
+                )
+                return False
+            time.sleep(poll_interval)
 
     @Try_until_Success
     def reset(self):
@@ -215,11 +257,8 @@ class LudlStage:
         reply is provided.
         """
         command = "REMRES" + self.endOfLine
-        with serial.Serial(
-            self.address, self.baudrate, stopbits=serial.STOPBITS_TWO
-        ) as stage:
-            stage.write(command.encode())
-            time.sleep(5)  # Sleep for 5 seconds to initialize.
+        self.connection.write(command)
+        time.sleep(5)  # Sleep for 5 seconds to initialize.
 
 
 if __name__ == "__main__":
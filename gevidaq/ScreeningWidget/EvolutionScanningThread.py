@@ -19,17 +19,24 @@ from skimage.io import imread
 from ..HamamatsuCam.HamamatsuActuator import CamActuator
 from ..ImageAnalysis.ImageProcessing import ProcessImage
 from ..InsightX3.TwoPhotonLaser_backend import InsightX3
+from ..NIDAQ.compiled_waveform import compile_waveforms
 from ..NIDAQ.DAQoperator import DAQmission
 from ..PI_ObjectiveMotor.AutoFocus import FocusFinder
+from ..PI_ObjectiveMotor.focus_surface import FocusSurface
 from ..PI_ObjectiveMotor.focuser import PIMotor
 from ..SampleStageControl.stage import LudlStage
 from ..ThorlabsFilterSlider.filterpyserial import ELL9Filter
+from .pipelined_executor import DEAD, PipelinedExecutor
+from .screening_journal import JOURNAL_NAME, ScreeningJournal
 
 
 class ScanningExecutionThread(QThread):
     ScanningResult = pyqtSignal(
         np.ndarray, np.ndarray, object, object
     )  # The signal for the measurement, we can connect to this signal
+    # Reconstructed PMT images, matplotlib can only show them on the GUI
+    # thread. Connect to show_PMT_image.
+    PMTImage = pyqtSignal(np.ndarray)
 
     # %%
     def __init__(
@@ -38,6 +45,7 @@ class ScanningExecutionThread(QThread):
         RoundCoordsDict,
         GeneralSettingDict,
         *args,
+        resume=False,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
@@ -58,6 +66,23 @@ class ScanningExecutionThread(QThread):
         )
         # Ditch the worst focus image from stack of more than 2.
         self.ditch_worst_focus = False
+        # Show each reconstructed PMT image.
+        self.show_PMT_images = True
+        # Seconds to wait for the stage to reach a coordinate.
+        self.stage_move_timeout = 5
+        # Predict the focus at auto-focus coordinates from the ones focused
+        # before in the same grid, and only auto-focus if it is uncertain.
+        self.predict_focus = True
+        self.focus_surface_settings = {"degree": 2, "threshold": 0.001}
+        self.focus_surfaces = {}
+        # Find the focus by fitting the focus curve, with fewer objective
+        # moves, instead of gaussian_fit for camera or bisection for PMT.
+        self.model_focus_search = True
+        # Waveform packages compiled for the NI-daq, by (round, package).
+        self.compiled_waveforms = {}
+        # Skip the coordinates that are done in the journal of the saving
+        # directory.
+        self.resume = resume
 
     # %%
     def run(self):
@@ -70,12 +95,10 @@ class ScanningExecutionThread(QThread):
         logging.info(
             "----------------------Starting to connect the Objective motor-------------------------"
         )
-        self.pi_device_instance = PIMotor()
+        self.pi_device_instance = self.connect_objective_motor()
         logging.info("Objective motor connected.")
         self.errornum = 0
-        self.init_focus_position = self.pi_device_instance.pidevice.qPOS(
-            self.pi_device_instance.pidevice.axes
-        )["1"]
+        self.init_focus_position = self.pi_device_instance.GetCurrentPos()
         logging.info(
             "init_focus_position : {}".format(self.init_focus_position)
         )
@@ -159,6 +182,35 @@ class ScanningExecutionThread(QThread):
         """~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Execution
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"""
+        # Saving and image evaluation run on worker threads, the hardware
+        # stays on this thread.
+        self.executor = PipelinedExecutor()
+
+        # Finished coordinates are journaled, to resume after a crash.
+        self.journal = ScreeningJournal(
+            os.path.join(self.scansavedirectory, JOURNAL_NAME),
+            resume=self.resume,
+        )
+        if self.resume:
+            self.journal.apply_focus_positions(self.RoundCoordsDict)
+            self.errornum += self.journal.error_number()
+
+        try:
+            self.scan_grids()
+        finally:
+            # Let the workers finish saving, and journaling what is saved,
+            # also when the run stops on an error.
+            self.executor.shutdown()
+            self.executor.report()
+            self.journal.close()
+
+        self.disconnect_devices()
+
+    def scan_grids(self):
+        """
+        Go through grid -> round -> coordinate -> z stack, skipping the
+        coordinates that are done in the journal.
+        """
         TotalGridNumber = self.meshgridnumber**2
 
         for EachGrid in range(TotalGridNumber):
@@ -186,15 +238,28 @@ class ScanningExecutionThread(QThread):
                         EachGrid, EachRound + 1
                     )
                 )  # EachRound+1 is the corresponding round number when setting the dictionary starting from round 1.
-                """
-                # Execute Insight event at the beginning of each round
-                """
-                self.laser_init(EachRound)
+                CoordsPackage = self.RoundCoordsDict[
+                    "CoordsPackage_{}".format(EachRound + 1)
+                ]
+                round_done = all(
+                    self.journal.is_done(
+                        EachGrid,
+                        EachRound,
+                        *self.stage_position(EachGrid, coordinate),
+                    )
+                    for coordinate in CoordsPackage
+                )
 
-                """
-                # Execute filter event at the beginning of each round
-                """
-                self.filters_init(EachRound)
+                if not round_done:
+                    """
+                    # Execute Insight event at the beginning of each round
+                    """
+                    self.laser_init(EachRound)
+
+                    """
+                    # Execute filter event at the beginning of each round
+                    """
+                    self.filters_init(EachRound)
 
                 """
                 # Generate focus position list at the beginning of each round
@@ -243,56 +308,57 @@ class ScanningExecutionThread(QThread):
 
                     self.currentCoordsSeq += 1
 
-                    """
-                    # Stage movement
-                    """
                     self.coord_array = self.RoundCoordsDict[
                         "CoordsPackage_{}".format(EachRound + 1)
                     ][EachCoord]
 
-                    # Offset coordinate row value for each well.
-                    ScanningGridOffset_Row = int(
-                        EachGrid % self.meshgridnumber
-                    ) * (self.GeneralSettingDict["StageGridOffset"])
-                    # Offset coordinate colunm value for each well.
-                    ScanningGridOffset_Col = int(
-                        EachGrid / self.meshgridnumber
-                    ) * (self.GeneralSettingDict["StageGridOffset"])
-
-                    RowIndex = self.coord_array["row"] + ScanningGridOffset_Row
-                    ColumnIndex = (
-                        self.coord_array["col"] + ScanningGridOffset_Col
+                    RowIndex, ColumnIndex = self.stage_position(
+                        EachGrid, self.coord_array
                     )
 
+                    if self.journal.is_done(
+                        EachGrid, EachRound, RowIndex, ColumnIndex
+                    ):
+                        # Coordinates without auto-focus reuse the stack of
+                        # the coordinate before.
+                        self.ZStackPosList = self.journal.ZStackPosList(
+                            EachGrid, EachRound, RowIndex, ColumnIndex
+                        )
+                        logging.info(
+                            "Coordinate {} done before, skipped.".format(
+                                self.currentCoordsSeq
+                            )
+                        )
+                        continue
+
+                    self.executor.start_coordinate(
+                        "Round{}_Grid{}_Coords{}".format(
+                            EachRound + 1, EachGrid, self.currentCoordsSeq
+                        )
+                    )
+
+                    """
+                    # Stage movement
+                    """
                     try:
                         move_executed = False
                         trial_number = 0
 
                         while move_executed is False:
-                            # Row/Column indexs of np.array are opposite of stage row-col indexs.
-                            self.ludlStage.moveAbs(RowIndex, ColumnIndex)
-                            time.sleep(1.5)
-
-                            # Check the position again
-                            (
-                                row_Position,
-                                col_Position,
-                            ) = self.ludlStage.getPos()
-                            logging.info(
-                                "=== Get pos: {},{} ===".format(
-                                    row_Position, col_Position
+                            with self.executor.timed("stage move"):
+                                # Row/Column indexs of np.array are opposite of stage row-col indexs.
+                                self.ludlStage.moveAbs(RowIndex, ColumnIndex)
+
+                                # Poll the position until the stage settled.
+                                move_executed = self.ludlStage.waitForPos(
+                                    RowIndex,
+                                    ColumnIndex,
+                                    timeout=self.stage_move_timeout,
                                 )
-                            )
-
-                            if (
-                                row_Position == RowIndex
-                                and col_Position == ColumnIndex
-                            ):
-                                move_executed = True
 
                             trial_number += 1
 
-                            if trial_number >= 2:
+                            if move_executed is False and trial_number >= 2:
                                 logging.info("Move failed")
                                 self.error_massage = "Fail_MoveStage"
                                 self.errornum += 1
@@ -303,8 +369,6 @@ class ScanningExecutionThread(QThread):
                                 [RowIndex, ColumnIndex]
                             )
                         )
-                        # Typically it needs 1~ second to move across 15000 stage index.
-                        time.sleep(0.3)
                     except Exception as exc:
                         logging.critical("caught exception", exc_info=exc)
                         self.error_massage = "Fail_MoveStage"
@@ -315,16 +379,17 @@ class ScanningExecutionThread(QThread):
                             )
                         )
 
-                    time.sleep(0.2)
+                    self.executor.sleep(0.2, "stage settle")
 
                     """
                     # Focus position
                     # Unpack the focus stack information, conduct auto-focusing if set.
                     """
                     # Here also generate the ZStackPosList.
-                    self.ZStackNum = self.unpack_focus_stack(
-                        EachGrid, EachRound, EachCoord
-                    )
+                    with self.executor.timed("focus stack"):
+                        self.ZStackNum = self.unpack_focus_stack(
+                            EachGrid, EachRound, EachCoord
+                        )
 
                     self.stack_focus_degree_list = []
 
@@ -357,8 +422,12 @@ class ScanningExecutionThread(QThread):
                             # For stack of 3 only.
                             if EachZStackPos > 0:
                                 try:
+                                    # Evaluated by the analysis worker.
                                     self.stack_focus_degree_list.append(
-                                        self.FocusDegree_img_reconstructed
+                                        self.executor.result(
+                                            self.FocusDegree_img_reconstructed,
+                                            "waiting for focus degree",
+                                        )
                                     )
 
                                 except Exception as exc:
@@ -399,11 +468,12 @@ class ScanningExecutionThread(QThread):
                                 "Target focus pos: {}".format(self.FocusPos)
                             )
 
-                            self.pi_device_instance.move(self.FocusPos)
+                            with self.executor.timed("focus move"):
+                                self.pi_device_instance.move(self.FocusPos)
                             # self.auto_focus_positionInStack = self.pi_device_instance.pidevice.qPOS(self.pi_device_instance.pidevice.axes)
                             # print("Current position: {:.4f}".format(self.auto_focus_positionInStack['1']))
 
-                            time.sleep(0.3)
+                            self.executor.sleep(0.3, "focus settle")
                         else:
                             self.focus_degree_decreasing = False
                             # No Z-stack or auto-focus.
@@ -496,20 +566,69 @@ class ScanningExecutionThread(QThread):
                                 EachRound, EachWaveform, RowIndex, ColumnIndex
                             )
 
-                        time.sleep(0.6)  # Wait for receiving data to be done.
-                    time.sleep(0.5)
+                        # Wait for receiving data to be done.
+                        self.executor.sleep(0.6)
+
+                        # Journaled after the files of this position are saved.
+                        self.executor.submit(
+                            "saving",
+                            "journal",
+                            self.journal.record_z,
+                            EachGrid,
+                            EachRound,
+                            EachCoord,
+                            EachZStackPos,
+                            self.FocusPos,
+                        )
+                    self.executor.sleep(0.5)
+
+                    self.executor.submit(
+                        "saving",
+                        "journal",
+                        self.journal.record_coordinate,
+                        EachGrid,
+                        EachRound,
+                        EachCoord,
+                        RowIndex,
+                        ColumnIndex,
+                        list(self.ZStackPosList),
+                        self.error_massage,
+                    )
 
                     logging.info(
                         "*************************************************************************************************************************"
                     )
+                    self.executor.finish_coordinate()
 
                 # Time out for each round
                 time.sleep(1 * 0.5)
 
+    def stage_position(self, EachGrid, coordinate):
+        """
+        Stage row and column of a coordinate in grid EachGrid.
+        """
+        # Offset coordinate row value for each well.
+        ScanningGridOffset_Row = int(EachGrid % self.meshgridnumber) * (
+            self.GeneralSettingDict["StageGridOffset"]
+        )
+        # Offset coordinate colunm value for each well.
+        ScanningGridOffset_Col = int(EachGrid / self.meshgridnumber) * (
+            self.GeneralSettingDict["StageGridOffset"]
+        )
+
+        RowIndex = coordinate["row"] + ScanningGridOffset_Row
+        ColumnIndex = coordinate["col"] + ScanningGridOffset_Col
+        return RowIndex, ColumnIndex
+
+    def connect_objective_motor(self):
+        return PIMotor()
+
+    def disconnect_devices(self):
         # %%
         """~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Disconnect devices.
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"""
+        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        """
 
         # Switch off laser
         if len(self.RoundQueueDict["InsightEvents"]) != 0:
@@ -830,76 +949,97 @@ class ScanningExecutionThread(QThread):
             # === Auto focus ===
             if auto_focus_flag == "yes":
                 if self.coord_array["focus_position"] == -1.0:
-                    instance_FocusFinder = FocusFinder(
-                        source_of_image=AutoFocusConfig["source_of_image"],
-                        init_search_range=AutoFocusConfig["init_search_range"],
-                        total_step_number=AutoFocusConfig["total_step_number"],
-                        imaging_conditions=AutoFocusConfig[
-                            "imaging_conditions"
-                        ],
-                        motor_handle=self.pi_device_instance,
-                        camera_handle=self.HamamatsuCam,
+                    row = self.coord_array["row"]
+                    col = self.coord_array["col"]
+                    focus_surface = self.focus_surfaces.setdefault(
+                        EachGrid, FocusSurface(**self.focus_surface_settings)
                     )
-                    logging.info(
-                        "--------------Start auto-focusing-----------------"
-                    )
-                    if self.HamamatsuCam is not None:
-                        # For camera AF
-                        self.auto_focus_position = (
-                            instance_FocusFinder.gaussian_fit()
+                    if (
+                        self.predict_focus
+                        and not focus_surface.needs_autofocus(row, col)
+                    ):
+                        # Close enough to the focused coordinates.
+                        self.auto_focus_position = focus_surface.predict(
+                            row, col
+                        )[0]
+                        logging.info(
+                            "Focus predicted from {} focused coordinates: {}".format(
+                                len(focus_surface), self.auto_focus_position
+                            )
                         )
                     else:
-                        # For PMT AF
-                        self.auto_focus_position = (
-                            instance_FocusFinder.bisection()
+                        instance_FocusFinder = FocusFinder(
+                            source_of_image=AutoFocusConfig["source_of_image"],
+                            init_search_range=AutoFocusConfig[
+                                "init_search_range"
+                            ],
+                            total_step_number=AutoFocusConfig[
+                                "total_step_number"
+                            ],
+                            imaging_conditions=AutoFocusConfig[
+                                "imaging_conditions"
+                            ],
+                            motor_handle=self.pi_device_instance,
+                            camera_handle=self.HamamatsuCam,
+                        )
+                        logging.info(
+                            "--------------Start auto-focusing-----------------"
+                        )
+                        self.auto_focus_position = self.find_focus(
+                            instance_FocusFinder
                         )
 
-                    relative_move_coords = [[1550, 0], [0, 1550], [1550, 1550]]
-                    trial_num = 0
-                    # If there's no cell in FOV
-                    while self.auto_focus_position is False:
-                        if trial_num <= 2:
-                            logging.info("No cells found. move to next pos.")
-                            # Move to next position in real scanning coordinates.
-                            self.ludlStage.moveRel(
-                                relative_move_coords[trial_num][0],
-                                relative_move_coords[trial_num][1],
-                            )
-                            time.sleep(1)
-                            logging.info(
-                                "Now stage pos is {}".format(
-                                    self.ludlStage.getPos()
+                        relative_move_coords = [
+                            [1550, 0],
+                            [0, 1550],
+                            [1550, 1550],
+                        ]
+                        trial_num = 0
+                        # If there's no cell in FOV
+                        while self.auto_focus_position is False:
+                            if trial_num <= 2:
+                                logging.info(
+                                    "No cells found. move to next pos."
+                                )
+                                # Move to next position in real scanning coordinates.
+                                self.ludlStage.moveRel(
+                                    relative_move_coords[trial_num][0],
+                                    relative_move_coords[trial_num][1],
+                                )
+                                time.sleep(1)
+                                logging.info(
+                                    "Now stage pos is {}".format(
+                                        self.ludlStage.getPos()
+                                    )
                                 )
-                            )
 
-                            if self.HamamatsuCam is not None:
-                                # For camera AF
-                                self.auto_focus_position = (
-                                    instance_FocusFinder.gaussian_fit()
+                                self.auto_focus_position = self.find_focus(
+                                    instance_FocusFinder
                                 )
-                            else:
-                                # For PMT AF
-                                self.auto_focus_position = (
-                                    instance_FocusFinder.bisection()
+                                # Move back
+                                self.ludlStage.moveRel(
+                                    -1 * relative_move_coords[trial_num][0],
+                                    -1 * relative_move_coords[trial_num][1],
                                 )
-                            # Move back
-                            self.ludlStage.moveRel(
-                                -1 * relative_move_coords[trial_num][0],
-                                -1 * relative_move_coords[trial_num][1],
-                            )
 
-                            trial_num += 1
-                        else:
-                            logging.info("No cells in neighbouring area.")
-                            self.auto_focus_position = self.ZStackPosList[
-                                int(len(self.ZStackPosList) / 2)
-                            ]
-                            break
+                                trial_num += 1
+                            else:
+                                logging.info("No cells in neighbouring area.")
+                                self.auto_focus_position = self.ZStackPosList[
+                                    int(len(self.ZStackPosList) / 2)
+                                ]
+                                break
 
-                    logging.info(
-                        "--------------End of auto-focusing----------------"
-                    )
-                    time.sleep(1)
+                        logging.info(
+                            "--------------End of auto-focusing----------------"
+                        )
+                        time.sleep(1)
+
+                        # Only a focus found at the coordinate itself.
+                        if trial_num == 0:
+                            focus_surface.add(
+                                row, col, self.auto_focus_position
+                            )
 
                     # Record the position, try to write it in the NEXT round dict.
                     try:
@@ -921,6 +1061,13 @@ class ScanningExecutionThread(QThread):
                                 coordinate[
                                     "focus_position"
                                 ] = self.auto_focus_position
+                                self.journal.record_focus(
+                                    EachGrid,
+                                    EachRound + 1,
+                                    AF_coord_row,
+                                    AF_coord_col,
+                                    self.auto_focus_position,
+                                )
                                 logging.info(
                                     "Write founded focus position to next round coord: {}.".format(
                                         coordinate
@@ -987,14 +1134,9 @@ class ScanningExecutionThread(QThread):
                 logging.info(
                     "--------------Start auto-focusing-----------------"
                 )
-                if self.HamamatsuCam is not None:
-                    # For camera AF
-                    self.auto_focus_position = (
-                        instance_FocusFinder.gaussian_fit()
-                    )
-                else:
-                    # For PMT AF
-                    self.auto_focus_position = instance_FocusFinder.bisection()
+                self.auto_focus_position = self.find_focus(
+                    instance_FocusFinder
+                )
 
                 relative_move_coords = [[1550, 0], [0, 1550], [1550, 1550]]
                 trial_num = 0
@@ -1014,16 +1156,9 @@ class ScanningExecutionThread(QThread):
                             )
                         )
 
-                        if self.HamamatsuCam is not None:
-                            # For camera AF
-                            self.auto_focus_position = (
-                                instance_FocusFinder.gaussian_fit()
-                            )
-                        else:
-                            # For PMT AF
-                            self.auto_focus_position = (
-                                instance_FocusFinder.bisection()
-                            )
+                        self.auto_focus_position = self.find_focus(
+                            instance_FocusFinder
+                        )
 
                         # Move back
                         self.ludlStage.moveRel(
@@ -1070,6 +1205,13 @@ class ScanningExecutionThread(QThread):
                             coordinate[
                                 "focus_position"
                             ] = self.auto_focus_position
+                            self.journal.record_focus(
+                                EachGrid,
+                                EachRound + 1,
+                                AF_coord_row,
+                                AF_coord_col,
+                                self.auto_focus_position,
+                            )
 
                             logging.info(
                                 "Write founded focus position to next round coord: {}.".format(
@@ -1087,6 +1229,42 @@ class ScanningExecutionThread(QThread):
 
         return ZStackNum
 
+    def find_focus(self, instance_FocusFinder):
+        """
+        Run the auto-focus of instance_FocusFinder.
+
+        Returns
+        The focus position, False if there's no cell in view.
+        """
+        if self.model_focus_search:
+            return instance_FocusFinder.model_search()
+        elif self.HamamatsuCam is not None:
+            # For camera AF
+            return instance_FocusFinder.gaussian_fit()
+        else:
+            # For PMT AF
+            return instance_FocusFinder.bisection()
+
+    def compiled_waveform(
+        self, EachRound, EachWaveform, WaveformPackageToBeExecute
+    ):
+        """
+        Compile a waveform package once per run.
+
+        The round queue doesn't change during the screening, so the package
+        is not hashed again at every coordinate to look it up in the compile
+        cache.
+        """
+        key = (EachRound, EachWaveform)
+        if key not in self.compiled_waveforms:
+            self.compiled_waveforms[key] = compile_waveforms(
+                WaveformPackageToBeExecute[0],
+                WaveformPackageToBeExecute[1],
+                WaveformPackageToBeExecute[2],
+                self.adcollector.channel_LUT,
+            )
+        return self.compiled_waveforms[key]
+
     def inidividual_coordinate_operation(
         self, EachRound, EachWaveform, RowIndex, ColumnIndex
     ):
@@ -1133,36 +1311,46 @@ class ScanningExecutionThread(QThread):
         ):  # if camera operations are configured
             _camera_isUsed = True
             CamSettigList = CameraPackageToBeExecute["Settings"]
-            self.HamamatsuCam.StartStreaming(
-                BufferNumber=CameraPackageToBeExecute["Buffer_number"],
-                trigger_source=CamSettigList[
-                    CamSettigList.index("trigger_source") + 1
-                ],
-                exposure_time=CamSettigList[
-                    CamSettigList.index("exposure_time") + 1
-                ],
-                trigger_active=CamSettigList[
-                    CamSettigList.index("trigger_active") + 1
-                ],
-                subarray_hsize=CamSettigList[
-                    CamSettigList.index("subarray_hsize") + 1
-                ],
-                subarray_vsize=CamSettigList[
-                    CamSettigList.index("subarray_vsize") + 1
-                ],
-                subarray_hpos=CamSettigList[
-                    CamSettigList.index("subarray_hpos") + 1
-                ],
-                subarray_vpos=CamSettigList[
-                    CamSettigList.index("subarray_vpos") + 1
-                ],
+            img_text = (
+                "_Cam_"
+                + str(self.RoundWaveformIndex[1])
+                + "_Zpos"
+                + str(self.ZStackOrder)
             )
+            self.cam_tif_name = self.generate_tif_name(extra_text=img_text)
+            # Frames are written to the file while streaming.
+            with self.executor.timed("camera"):
+                self.HamamatsuCam.StartStreaming(
+                    BufferNumber=CameraPackageToBeExecute["Buffer_number"],
+                    saving_dir=self.cam_tif_name,
+                    trigger_source=CamSettigList[
+                        CamSettigList.index("trigger_source") + 1
+                    ],
+                    exposure_time=CamSettigList[
+                        CamSettigList.index("exposure_time") + 1
+                    ],
+                    trigger_active=CamSettigList[
+                        CamSettigList.index("trigger_active") + 1
+                    ],
+                    subarray_hsize=CamSettigList[
+                        CamSettigList.index("subarray_hsize") + 1
+                    ],
+                    subarray_vsize=CamSettigList[
+                        CamSettigList.index("subarray_vsize") + 1
+                    ],
+                    subarray_hpos=CamSettigList[
+                        CamSettigList.index("subarray_hpos") + 1
+                    ],
+                    subarray_vpos=CamSettigList[
+                        CamSettigList.index("subarray_vpos") + 1
+                    ],
+                )
             # HamamatsuCam starts another thread to pull out frames from buffer.
             # Make sure that the camera is prepared before waveform execution.
             # while self.HamamatsuCam.isStreaming is False:
             # print('Waiting for camera...')
             # time.sleep(0.5)
-            time.sleep(1)
+            self.executor.sleep(1, "camera start")
         logging.info("Now start waveforms")
         # === Waveforms operations ===
         if (
@@ -1177,14 +1365,23 @@ class ScanningExecutionThread(QThread):
 
         self.adcollector = DAQmission()
         # self.adcollector.collected_data.connect(self.ProcessData)
-        self.adcollector.runWaveforms(
-            clock_source=self.clock_source,
-            sampling_rate=WaveformPackageToBeExecute[0],
-            analog_signals=WaveformPackageToBeExecute[1],
-            digital_signals=WaveformPackageToBeExecute[2],
-            readin_channels=WaveformPackageToBeExecute[3],
+        compiled = self.compiled_waveform(
+            EachRound, EachWaveform, WaveformPackageToBeExecute
+        )
+        with self.executor.timed("waveforms"):
+            self.adcollector.runCompiledWaveforms(
+                clock_source=self.clock_source,
+                compiled=compiled,
+                readin_channels=WaveformPackageToBeExecute[3],
+            )
+        # A new DAQmission is made for every waveform package, so this one
+        # can be saved while the next coordinate runs.
+        self.executor.submit(
+            "saving",
+            "binary saving",
+            self.adcollector.save_as_binary,
+            self.scansavedirectory,
         )
-        self.adcollector.save_as_binary(self.scansavedirectory)
         self.recorded_raw_data = self.adcollector.get_raw_data()
 
         # Reconstruct the image from np array and save it.
@@ -1192,22 +1389,16 @@ class ScanningExecutionThread(QThread):
 
         # === Camera saving ===
         if _camera_isUsed is True:
-            self.HamamatsuCam.isSaving = True
-            img_text = (
-                "_Cam_"
-                + str(self.RoundWaveformIndex[1])
-                + "_Zpos"
-                + str(self.ZStackOrder)
-            )
-            self.cam_tif_name = self.generate_tif_name(extra_text=img_text)
-            self.HamamatsuCam.StopStreaming(saving_dir=self.cam_tif_name)
-            # Make sure that the saving process is finished.
-            while self.HamamatsuCam.isSaving is True:
-                logging.info("Camera saving...")
-                time.sleep(0.5)
-            time.sleep(1)
+            with self.executor.timed("camera saving", DEAD):
+                self.HamamatsuCam.isSaving = True
+                self.HamamatsuCam.StopStreaming()
+                # Make sure that the saving process is finished.
+                while self.HamamatsuCam.isSaving is True:
+                    logging.info("Camera saving...")
+                    time.sleep(0.5)
+            self.executor.sleep(1)
 
-        time.sleep(0.5)
+        self.executor.sleep(0.5)
 
     def Process_raw_data(self):
         self.channel_number = len(self.recorded_raw_data)
@@ -1287,19 +1478,19 @@ class ScanningExecutionThread(QThread):
                 # Crop size based on: M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\Xin\2019-12-30 2p beads area test 4um
 
                 # === Evaluate the focus degree of re-constructed image. =======
-                self.FocusDegree_img_reconstructed = (
-                    ProcessImage.local_entropy(
-                        self.PMT_image_reconstructed.astype("float32")
-                    )
-                )
-                logging.info(
-                    "FocusDegree_img_reconstructed is {}".format(
-                        self.FocusDegree_img_reconstructed
-                    )
+                # A future, the next z stack position waits for it.
+                self.FocusDegree_img_reconstructed = self.executor.submit(
+                    "analysis",
+                    "focus degree",
+                    self.evaluate_focus_degree,
+                    self.PMT_image_reconstructed,
                 )
 
                 # Save the individual file.
-                with skimtiff.TiffWriter(
+                self.executor.submit(
+                    "saving",
+                    "tif saving",
+                    self.save_PMT_image,
                     os.path.join(
                         self.scansavedirectory,
                         "Round"
@@ -1318,19 +1509,12 @@ class ScanningExecutionThread(QThread):
                         + str(self.ZStackOrder)
                         + ".tif",
                     ),
-                    imagej=True,
-                ) as tif:
-                    tif.save(
-                        self.PMT_image_reconstructed.astype("float32"),
-                        compress=0,
-                        metadata={"FocusPos: ": str(self.FocusPos)},
-                    )
+                    self.PMT_image_reconstructed,
+                    self.FocusPos,
+                )
 
-                plt.figure()
-                plt.imshow(
-                    self.PMT_image_reconstructed, cmap=plt.cm.gray
-                )  # For reconstructed image we pull out the first layer, getting 2d img.
-                plt.show()
+                if self.show_PMT_images is True:
+                    self.PMTImage.emit(self.PMT_image_reconstructed)
 
                 # === Calculate the z max projection ===
                 if self.repeatnum == 1:  # Consider one repeat image situlation
@@ -1388,7 +1572,10 @@ class ScanningExecutionThread(QThread):
                     )
 
                     # Save the zmax file.
-                    with skimtiff.TiffWriter(
+                    self.executor.submit(
+                        "saving",
+                        "tif saving",
+                        self.save_PMT_image,
                         os.path.join(
                             self.scansavedirectory,
                             "Round"
@@ -1406,13 +1593,9 @@ class ScanningExecutionThread(QThread):
                             + "Zmax"
                             + ".tif",
                         ),
-                        imagej=True,
-                    ) as tif:
-                        tif.save(
-                            self.PMT_image_maxprojection.astype("float32"),
-                            compress=0,
-                            metadata={"FocusPos: ": str(self.FocusPos)},
-                        )
+                        self.PMT_image_maxprojection,
+                        self.FocusPos,
+                    )
 
             except Exception as exc:
                 logging.critical("caught exception", exc_info=exc)
@@ -1420,6 +1603,35 @@ class ScanningExecutionThread(QThread):
                     "No.{} image failed to generate.".format(imageSequence)
                 )
 
+    @staticmethod
+    def evaluate_focus_degree(image):
+        FocusDegree_img_reconstructed = ProcessImage.local_entropy(
+            image.astype("float32")
+        )
+        logging.info(
+            "FocusDegree_img_reconstructed is {}".format(
+                FocusDegree_img_reconstructed
+            )
+        )
+        return FocusDegree_img_reconstructed
+
+    @staticmethod
+    def save_PMT_image(file_name, image, FocusPos):
+        with skimtiff.TiffWriter(file_name, imagej=True) as tif:
+            tif.save(
+                image.astype("float32"),
+                compress=0,
+                metadata={"FocusPos: ": str(FocusPos)},
+            )
+
+    @staticmethod
+    def show_PMT_image(image):
+        plt.figure()
+        plt.imshow(
+            image, cmap=plt.cm.gray
+        )  # For reconstructed image we pull out the first layer, getting 2d img.
+        plt.show()
+
     def generate_tif_name(self, extra_text="_"):
         tif_name = os.path.join(
             self.scansavedirectory,
@@ -19,6 +19,7 @@ from PyQt5.QtGui import QFont, QIcon, QTextCursor
 
 from .. import NIDAQ, Icons, StylishQT
 from ..ImageAnalysis import EvolutionAnalysisWidget
+from . import scan_coordinates
 from .EvolutionScanningThread import ScanningExecutionThread
 
 
@@ -165,6 +166,15 @@ class Mainbody(QtWidgets.QWidget):
             self.Analyse_roundCheckbox, 0, 4
         )
 
+        self.ResumeCheckbox = QtWidgets.QCheckBox("Resume")
+        self.ResumeCheckbox.setStyleSheet(
+            'color:navy;font:bold "Times New Roman"'
+        )
+        self.ResumeCheckbox.setToolTip(
+            "Skip the coordinates already done in the journal of the saving directory."
+        )
+        self.GeneralSettingContainerLayout.addWidget(self.ResumeCheckbox, 1, 4)
+
         self.GeneralSettingContainer.setLayout(
             self.GeneralSettingContainerLayout
         )
@@ -322,6 +332,14 @@ class Mainbody(QtWidgets.QWidget):
             QtWidgets.QLabel("Focus stack step size(mm):"), 1, 6
         )
 
+        self.VisitingOrderCombox = QtWidgets.QComboBox()
+        self.VisitingOrderCombox.addItems(scan_coordinates.VISITING_ORDERS)
+        self.VisitingOrderCombox.setToolTip(
+            "Order the stage visits the coordinates in, auto-focus blocks are kept together."
+        )
+        ScanSettingLayout.addWidget(self.VisitingOrderCombox, 2, 1)
+        ScanSettingLayout.addWidget(QtWidgets.QLabel("Visiting order:"), 2, 0)
+
         ScanContainer.setLayout(ScanSettingLayout)
 
         # === GUI for Laser/filter ===
@@ -1050,126 +1068,29 @@ class Mainbody(QtWidgets.QWidget):
 
         """
         CurrentRoundSequence = self.RoundOrderBox.value()
-        # settings for scanning index
-        step = self.ScanstepTextbox.value()
-
-        row_start = 0
-        row_end = (self.ScanStepsNumTextbox.value() - 1) * step
-
-        column_start = 0
-        column_end = (self.ScanStepsNumTextbox.value() - 1) * step
 
         # Generate structured array containing scanning coordinates' information.
-        AutoFocusGrid_steps = self.AutoFocusGapTextbox.value()
-        AutoFocusCoordGap = AutoFocusGrid_steps * step
-
-        # Number of coordinates per row
-        Coords_number_per_row = (row_end - row_start) / step + 1
-
-        # Generate the
-        if AutoFocusGrid_steps != 0:
-            AutoFocusGridNum = int(Coords_number_per_row / AutoFocusGrid_steps)
-            AutoFocusGridOffsetList = []
-            # Auto focus grid coordinates offset list
-            for row_offset in range(AutoFocusGridNum):
-                for col_offset in range(AutoFocusGridNum):
-                    AutoFocusGridOffsetList.append(
-                        [
-                            row_offset * step * AutoFocusGrid_steps,
-                            col_offset * step * AutoFocusGrid_steps,
-                        ]
-                    )
-        else:
-            AutoFocusGridOffsetList = [[0, 0]]
-
-        # Data type of structured array.
-        Coords_array_dtype = np.dtype(
-            [
-                ("row", "i4"),
-                ("col", "i4"),
-                ("auto_focus_flag", "U10"),
-                ("focus_position", "f4"),
-            ]
+        Coords_array = scan_coordinates.generate_scan_coords(
+            step=self.ScanstepTextbox.value(),
+            steps_number=self.ScanStepsNumTextbox.value(),
+            auto_focus_steps=self.AutoFocusGapTextbox.value(),
+            pure_auto_focus=self.AF_roundCheckbox.isChecked(),
+        )
+        Coords_array = scan_coordinates.order_coordinates(
+            Coords_array, self.VisitingOrderCombox.currentText()
         )
 
-        Coords_array = np.array([], dtype=Coords_array_dtype)
-
-        if not self.AF_roundCheckbox.isChecked():
-            # If not auto-focus round
-            for AutoFocusGridOffset in AutoFocusGridOffsetList:
-                # In each small auto-focus grid
-                AutoFocusOffset_row = AutoFocusGridOffset[0]
-                AutoFocusOffset_col = AutoFocusGridOffset[1]
-
-                if AutoFocusCoordGap != 0:
-                    # If auto-focus involved:
-                    for row_pos in range(row_start, AutoFocusCoordGap, step):
-                        for col_pos in range(
-                            column_start, AutoFocusCoordGap, step
-                        ):
-                            # At each left-top corner of the coordinates grid, place the
-                            # flag for auto focus
-                            if (
-                                col_pos == 0
-                                and row_pos == 0
-                                and AutoFocusGrid_steps != 0
-                            ):
-                                current_coord_array = np.array(
-                                    [
-                                        (
-                                            row_pos + AutoFocusOffset_row,
-                                            col_pos + AutoFocusOffset_col,
-                                            "yes",
-                                            -1,
-                                        )
-                                    ],
-                                    dtype=Coords_array_dtype,
-                                )
-                            else:
-                                current_coord_array = np.array(
-                                    [
-                                        (
-                                            row_pos + AutoFocusOffset_row,
-                                            col_pos + AutoFocusOffset_col,
-                                            "no",
-                                            -1,
-                                        )
-                                    ],
-                                    dtype=Coords_array_dtype,
-                                )
-
-                            Coords_array = np.append(
-                                Coords_array, current_coord_array
-                            )
-
-                else:
-                    # If no auto-focus, put 'no' in auto_focus_flag field.
-                    for row_pos in range(row_start, row_end + step, step):
-                        for col_pos in range(
-                            column_start, column_end + step, step
-                        ):
-                            current_coord_array = np.array(
-                                [(row_pos, col_pos, "no", -1)],
-                                dtype=Coords_array_dtype,
-                            )
-
-                            Coords_array = np.append(
-                                Coords_array, current_coord_array
-                            )
-
-        else:
-            # In case of pure auto-focus round, generate coordinates at only
-            # calibration positions, and put flag 'pure AF'.
-            for row_pos in range(row_start, row_end, AutoFocusCoordGap):
-                for col_pos in range(
-                    column_start, column_end, AutoFocusCoordGap
-                ):
-                    current_coord_array = np.array(
-                        [(row_pos, col_pos, "pure AF", -1)],
-                        dtype=Coords_array_dtype,
-                    )
+        travel_times = scan_coordinates.compare_visiting_orders(Coords_array)
+        self.normalOutputWritten(
+            "Round {} predicted stage travel per grid: {}.\n".format(
+                CurrentRoundSequence,
+                ", ".join(
+                    "{} {:.1f} s".format(method, seconds)
+                    for method, seconds in travel_times.items()
+                ),
+            )
+        )
 
-                    Coords_array = np.append(Coords_array, current_coord_array)
         logging.info(Coords_array)
         self.RoundCoordsDict[
             "CoordsPackage_{}".format(CurrentRoundSequence)
@@ -1312,6 +1233,20 @@ class Mainbody(QtWidgets.QWidget):
     def ExecutePipeline(self):
         self.Savepipeline()
 
+        # Show how long the stage will be moving.
+        for key, Coords_array in self.RoundCoordsDict.items():
+            travel = scan_coordinates.travel_time(Coords_array)
+            self.normalOutputWritten(
+                "{} predicted stage travel per grid: {:.1f} s.\n".format(
+                    key, travel
+                )
+            )
+            logging.info(
+                "{} predicted stage travel per grid: {:.1f} s.".format(
+                    key, travel
+                )
+            )
+
         try:
             get_ipython = sys.modules["IPython"].get_ipython
         except KeyError:
@@ -1322,14 +1257,22 @@ class Mainbody(QtWidgets.QWidget):
             )  # before start, set spyder back to inline
 
         self.ExecuteThreadInstance = ScanningExecutionThread(
-            self.RoundQueueDict, self.RoundCoordsDict, self.GeneralSettingDict
+            self.RoundQueueDict,
+            self.RoundCoordsDict,
+            self.GeneralSettingDict,
+            resume=self.ResumeCheckbox.isChecked(),
         )
+        # Slot of this widget, so the images are shown on the GUI thread.
+        self.ExecuteThreadInstance.PMTImage.connect(self.show_PMT_image)
         self.ExecuteThreadInstance.start()
 
         self.ExecuteThreadInstance.finished.connect(
             lambda: self.run_in_thread(self.start_analysis)
         )
 
+    def show_PMT_image(self, image):
+        ScanningExecutionThread.show_PMT_image(image)
+
     def Savepipeline(self):
         SavepipelineInstance = []
         SavepipelineInstance.extend(
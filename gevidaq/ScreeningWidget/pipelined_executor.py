@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Overlap the data handling of a screening with the hardware.
+
+ScanningExecutionThread moves the stage and the objective and plays the
+waveforms one after the other, these can not overlap. What can overlap is
+the work on the recorded data: writing tif and binary files and evaluating
+the images. PipelinedExecutor keeps the hardware on the thread that calls it
+and puts this work on worker queues, one thread per queue so files and
+results come out in the order they were submitted. A queue holds at most
+maxsize jobs, when saving falls behind the hardware waits instead of piling
+up images in memory.
+
+Every step is timed per coordinate. report() splits the wall clock time of
+each coordinate on the hardware thread into:
+
+    hardware : stage moves and settling, focus moves, waveforms, camera.
+    dead : fixed waits, and waiting for results of the workers.
+    other : the rest, like reconstructing images.
+
+Time spent in the workers is listed apart, it overlaps with the above.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import pandas as pd
+
+HARDWARE = "hardware"
+DEAD = "dead"
+WORKER = "worker"
+
+
+class PipelinedExecutor:
+    """
+    Worker queues and per coordinate timing for the screening thread.
+
+    Parameters
+    queues : tuple
+        Names of the worker queues, each gets its own thread.
+    maxsize : int
+        Number of jobs a queue holds, waiting and running, before submit
+        blocks.
+    """
+
+    def __init__(self, queues=("saving", "analysis"), maxsize=8):
+        self.workers = {
+            name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+            for name in queues
+        }
+        self.slots = {name: threading.Semaphore(maxsize) for name in queues}
+        self.pending = []
+        # (coordinate, stage, kind, seconds)
+        self.records = []
+        # (coordinate, wall clock seconds)
+        self.coordinates = []
+        self.coordinate = None
+        self._coordinate_start = None
+        self._lock = threading.Lock()
+
+    # === Timing ===
+    def start_coordinate(self, coordinate):
+        """
+        Attribute the timing from now on to coordinate.
+        """
+        self.finish_coordinate()
+        self.coordinate = coordinate
+        self._coordinate_start = time.perf_counter()
+
+    def finish_coordinate(self):
+        if self._coordinate_start is not None:
+            self.coordinates.append(
+                (self.coordinate, time.perf_counter() - self._coordinate_start)
+            )
+            self._coordinate_start = None
+
+    def record(self, stage, kind, seconds, coordinate=None):
+        if coordinate is None:
+            coordinate = self.coordinate
+        with self._lock:
+            self.records.append((coordinate, stage, kind, seconds))
+
+    @contextmanager
+    def timed(self, stage, kind=HARDWARE):
+        """
+        Time the block as stage.
+
+        Example
+        with executor.timed("stage move"):
+            stage.moveAbs(row, col)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, kind, time.perf_counter() - start)
+
+    def sleep(self, seconds, stage="wait"):
+        """
+        Fixed wait, counted as dead time.
+        """
+        with self.timed(stage, DEAD):
+            time.sleep(seconds)
+
+    # === Worker queues ===
+    def submit(self, queue, stage, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on the worker of queue.
+
+        Exceptions are logged, and raised again by future.result(). If the
+        queue is full, waits for a free place, counted as dead time.
+
+        Returns
+        concurrent.futures.Future
+        """
+        coordinate = self.coordinate
+
+        def timed_call():
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as exc:
+                logging.critical("caught exception", exc_info=exc)
+                raise
+            finally:
+                self.record(
+                    stage, WORKER, time.perf_counter() - start, coordinate
+                )
+
+        slots = self.slots[queue]
+        if not slots.acquire(blocking=False):
+            with self.timed("{} queue full".format(queue), DEAD):
+                slots.acquire()
+        future = self.workers[queue].submit(timed_call)
+        future.add_done_callback(lambda future: slots.release())
+        with self._lock:
+            self.pending = [f for f in self.pending if not f.done()]
+            self.pending.append(future)
+        return future
+
+    def result(self, future, stage="waiting for workers"):
+        """
+        Wait for a result of a worker, counted as dead time.
+        """
+        with self.timed(stage, DEAD):
+            return future.result()
+
+    def drain(self):
+        """
+        Wait until all submitted work is done.
+        """
+        with self._lock:
+            pending = self.pending
+            self.pending = []
+        if len(pending) > 0:
+            with self.timed("draining workers", DEAD):
+                wait(pending)
+
+    def shutdown(self):
+        self.drain()
+        self.finish_coordinate()
+        for worker in self.workers.values():
+            worker.shutdown(wait=True)
+
+    # === Report ===
+    def timing_table(self):
+        """
+        Seconds per coordinate.
+
+        Returns
+        pd.DataFrame with a row per coordinate and columns "wall", "hardware",
+        "dead", "other" and "worker", and for every stage its seconds.
+        """
+        records = pd.DataFrame(
+            self.records, columns=["coordinate", "stage", "kind", "seconds"]
+        )
+        wall = pd.DataFrame(
+            self.coordinates, columns=["coordinate", "wall"]
+        ).set_index("coordinate")
+        kinds = records.pivot_table(
+            index="coordinate",
+            columns="kind",
+            values="seconds",
+            aggfunc="sum",
+        )
+        stages = records.pivot_table(
+            index="coordinate",
+            columns="stage",
+            values="seconds",
+            aggfunc="sum",
+        )
+        table = wall.join(kinds, how="left")
+        for kind in (HARDWARE, DEAD, WORKER):
+            if kind not in table:
+                table[kind] = 0.0
+        table = table.fillna(0.0)
+        table["other"] = (table["wall"] - table[HARDWARE] - table[DEAD]).clip(
+            lower=0
+        )
+        table = table[["wall", HARDWARE, DEAD, "other", WORKER]]
+        return table.join(stages, how="left").fillna(0.0)
+
+    def report(self):
+        """
+        Log the timing per coordinate and in total.
+
+        Returns
+        The timing_table.
+        """
+        table = self.timing_table()
+        if len(table) == 0:
+            return table
+        total = table.sum()
+        logging.info(
+            "Timing per coordinate (s):\n{}".format(table.round(3).to_string())
+        )
+        logging.info(
+            "Total {:.1f} s over {} coordinates: hardware {:.1f} s ({:.0%}), "
+            "dead {:.1f} s ({:.0%}), other {:.1f} s, "
+            "{:.1f} s of saving and analysis in the background.".format(
+                total["wall"],
+                len(table),
+                total[HARDWARE],
+                total[HARDWARE] / total["wall"],
+                total[DEAD],
+                total[DEAD] / total["wall"],
+                total["other"],
+                total[WORKER],
+            )
+        )
+        return table
+
+
+if __name__ == "__main__":
+    # Importing the package already logged, at warning level.
+    logging.basicConfig(level=logging.INFO, force=True)
+
+    # Simulated coordinates: 0.2 s of hardware, 0.15 s of saving each.
+    executor = PipelinedExecutor()
+    start = time.perf_counter()
+    for coordinate in range(5):
+        executor.start_coordinate("Coords{}".format(coordinate))
+        with executor.timed("stage move"):
+            time.sleep(0.1)
+        executor.sleep(0.02, "settle")
+        with executor.timed("waveforms"):
+            time.sleep(0.1)
+        executor.submit("saving", "tif saving", time.sleep, 0.15)
+    executor.shutdown()
+    executor.report()
+    logging.info(
+        "Pipelined: {:.2f} s, in-line would take {:.2f} s".format(
+            time.perf_counter() - start, 5 * (0.1 + 0.02 + 0.1 + 0.15)
+        )
+    )
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Scanning coordinates of a screening round and the order they are visited in.
+
+A round scans a square grid of stage positions. With auto-focus, the grid is
+cut in square auto-focus blocks, the left-top coordinate of each block gets
+"yes" in the auto_focus_flag field and the other coordinates of the block get
+"no": ScanningExecutionThread focuses at the "yes" coordinate and reuses that
+focus for the "no" coordinates after it. So a visiting order keeps every
+block together with its auto-focus coordinate first, it only changes the order
+of the blocks and the order inside each block.
+
+Visiting orders:
+
+    raster : row by row, each row in the same direction. The stage returns
+        over the whole row at the end of each row.
+    serpentine : row by row, every other row backwards, the rows run along
+        the faster stage axis.
+    hilbert : along a Hilbert curve, neighbouring coordinates stay close.
+    nearest : always the nearest coordinate that is not visited yet, in
+        travel time.
+
+The stage moves both axes at the same time, so a move takes as long as the
+slowest axis needs: max(|row step| / speed_row, |col step| / speed_col).
+"""
+
+import logging
+
+import numpy as np
+
+Coords_array_dtype = np.dtype(
+    [
+        ("row", "i4"),
+        ("col", "i4"),
+        ("auto_focus_flag", "U10"),
+        ("focus_position", "f4"),
+    ]
+)
+
+VISITING_ORDERS = ("raster", "serpentine", "hilbert", "nearest")
+
+# Stage index per second, it takes about a second to move 15000 indices.
+STAGE_SPEED_ROW = 15000
+STAGE_SPEED_COL = 15000
+
+
+def _grid(row_positions, col_positions):
+    rows, cols = np.meshgrid(row_positions, col_positions, indexing="ij")
+    return rows.ravel(), cols.ravel()
+
+
+def generate_scan_coords(
+    step, steps_number, auto_focus_steps=0, pure_auto_focus=False
+):
+    """
+    Coordinates of a round, in raster order.
+
+    Parameters
+    step : int
+        Stage scanning step size.
+    steps_number : int
+        Number of coordinates per row and per column.
+    auto_focus_steps : int
+        Size of the auto-focus blocks in steps, 0 for no auto-focus.
+    pure_auto_focus : bool
+        Only generate the auto-focus coordinates, flagged "pure AF".
+
+    Returns
+    np.ndarray of Coords_array_dtype, focus_position is -1.
+    """
+    row_end = (steps_number - 1) * step
+    AutoFocusCoordGap = auto_focus_steps * step
+
+    if pure_auto_focus:
+        positions = np.arange(0, row_end, AutoFocusCoordGap)
+        rows, cols = _grid(positions, positions)
+        flags = np.full(len(rows), "pure AF")
+
+    elif auto_focus_steps != 0:
+        AutoFocusGridNum = int(steps_number / auto_focus_steps)
+        block_positions = np.arange(AutoFocusGridNum) * AutoFocusCoordGap
+        block_rows, block_cols = _grid(block_positions, block_positions)
+        local_positions = np.arange(0, AutoFocusCoordGap, step)
+        local_rows, local_cols = _grid(local_positions, local_positions)
+
+        # Blocks one after the other, each from its left-top corner.
+        rows = (block_rows[:, np.newaxis] + local_rows).ravel()
+        cols = (block_cols[:, np.newaxis] + local_cols).ravel()
+        local_flags = np.where(
+            (local_rows == 0) & (local_cols == 0), "yes", "no"
+        )
+        flags = np.tile(local_flags, len(block_rows))
+
+    else:
+        positions = np.arange(0, row_end + step, step)
+        rows, cols = _grid(positions, positions)
+        flags = np.full(len(rows), "no")
+
+    Coords_array = np.zeros(len(rows), dtype=Coords_array_dtype)
+    Coords_array["row"] = rows
+    Coords_array["col"] = cols
+    Coords_array["auto_focus_flag"] = flags
+    Coords_array["focus_position"] = -1
+    return Coords_array
+
+
+# === Travel time ===
+def move_time(
+    rows_from,
+    cols_from,
+    rows_to,
+    cols_to,
+    speed_row=STAGE_SPEED_ROW,
+    speed_col=STAGE_SPEED_COL,
+):
+    """
+    Seconds for the stage to move, the slowest axis decides.
+    """
+    return np.maximum(
+        np.abs(np.asarray(rows_to) - rows_from) / speed_row,
+        np.abs(np.asarray(cols_to) - cols_from) / speed_col,
+    )
+
+
+def travel_time(
+    Coords_array,
+    speed_row=STAGE_SPEED_ROW,
+    speed_col=STAGE_SPEED_COL,
+    move_overhead=0,
+):
+    """
+    Seconds the stage spends moving through the coordinates in order.
+
+    Parameters
+    move_overhead : float
+        Seconds added for every move, like settling.
+    """
+    rows = Coords_array["row"].astype("float64")
+    cols = Coords_array["col"].astype("float64")
+    moves = move_time(
+        rows[:-1], cols[:-1], rows[1:], cols[1:], speed_row, speed_col
+    )
+    return float(moves.sum() + move_overhead * len(moves))
+
+
+# === Orders of a set of positions ===
+def _ranks(values):
+    return np.unique(values, return_inverse=True)[1].ravel()
+
+
+def raster_order(rows, cols):
+    return np.lexsort((cols, rows))
+
+
+def serpentine_order(rows, cols, speed_row, speed_col):
+    if speed_col >= speed_row:
+        lines, along = rows, cols
+    else:
+        lines, along = cols, rows
+    line_index = _ranks(lines)
+    # Every other line backwards.
+    along = np.where(line_index % 2 == 1, -along, along)
+    return np.lexsort((along, line_index))
+
+
+def hilbert_index(x, y, n):
+    """
+    Distance along the Hilbert curve through an n x n grid, n a power of 2.
+    """
+    x = np.array(x, dtype="int64")
+    y = np.array(y, dtype="int64")
+    d = np.zeros(len(x), dtype="int64")
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant.
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s //= 2
+    return d
+
+
+def hilbert_order(rows, cols):
+    x = _ranks(rows)
+    y = _ranks(cols)
+    n = 1
+    while n <= max(x.max(), y.max()):
+        n *= 2
+    return np.argsort(hilbert_index(x, y, n), kind="stable")
+
+
+def nearest_order(rows, cols, speed_row, speed_col, start=0):
+    """
+    Greedy nearest neighbour tour in travel time, from start.
+    """
+    rows = np.asarray(rows, dtype="float64")
+    cols = np.asarray(cols, dtype="float64")
+    visited = np.zeros(len(rows), dtype=bool)
+    order = np.empty(len(rows), dtype="int64")
+    current = start
+    for i in range(len(rows)):
+        order[i] = current
+        visited[current] = True
+        if i == len(rows) - 1:
+            break
+        times = move_time(
+            rows[current], cols[current], rows, cols, speed_row, speed_col
+        )
+        times[visited] = np.inf
+        current = int(times.argmin())
+    return order
+
+
+def position_order(
+    rows,
+    cols,
+    method="raster",
+    speed_row=STAGE_SPEED_ROW,
+    speed_col=STAGE_SPEED_COL,
+):
+    """
+    Order of the positions for one of VISITING_ORDERS. Raster, serpentine and
+    hilbert start at the left-top position, nearest at the first.
+    """
+    if len(rows) == 0:
+        return np.zeros(0, dtype="int64")
+    if method == "raster":
+        return raster_order(rows, cols)
+    elif method == "serpentine":
+        return serpentine_order(rows, cols, speed_row, speed_col)
+    elif method == "hilbert":
+        return hilbert_order(rows, cols)
+    elif method == "nearest":
+        return nearest_order(rows, cols, speed_row, speed_col)
+    raise ValueError(
+        "Unknown visiting order {}, use one of {}".format(
+            method, VISITING_ORDERS
+        )
+    )
+
+
+# === Order of a round ===
+def order_coordinates(
+    Coords_array,
+    method="raster",
+    speed_row=STAGE_SPEED_ROW,
+    speed_col=STAGE_SPEED_COL,
+):
+    """
+    Reorder the coordinates of a round, keeping the auto-focus blocks.
+
+    A block is an auto-focus coordinate with the coordinates after it up to
+    the next auto-focus coordinate. Blocks are ordered by the position of
+    their auto-focus coordinate, and inside a block the auto-focus coordinate
+    stays first.
+
+    Returns
+    Reordered copy of Coords_array.
+    """
+    if len(Coords_array) == 0:
+        return Coords_array.copy()
+
+    block_starts = np.flatnonzero(Coords_array["auto_focus_flag"] == "yes")
+    blocks = np.split(
+        np.arange(len(Coords_array)), block_starts[block_starts > 0]
+    )
+
+    ordered_blocks = []
+    for block in blocks:
+        rows = Coords_array["row"][block]
+        cols = Coords_array["col"][block]
+        order = position_order(rows, cols, method, speed_row, speed_col)
+        if Coords_array["auto_focus_flag"][block[0]] == "yes":
+            # The auto-focus coordinate is the left-top one and normally
+            # already first, make sure it is.
+            order = np.concatenate(([0], order[order != 0]))
+        ordered_blocks.append(block[order])
+
+    first = np.array([block[0] for block in ordered_blocks])
+    block_order = position_order(
+        Coords_array["row"][first],
+        Coords_array["col"][first],
+        method,
+        speed_row,
+        speed_col,
+    )
+    order = np.concatenate([ordered_blocks[i] for i in block_order])
+    return Coords_array[order]
+
+
+def compare_visiting_orders(
+    Coords_array,
+    speed_row=STAGE_SPEED_ROW,
+    speed_col=STAGE_SPEED_COL,
+    move_overhead=0,
+):
+    """
+    Predicted travel time of every visiting order.
+
+    Returns
+    dict of order name to seconds.
+    """
+    return {
+        method: travel_time(
+            order_coordinates(Coords_array, method, speed_row, speed_col),
+            speed_row,
+            speed_col,
+            move_overhead,
+        )
+        for method in VISITING_ORDERS
+    }
+
+
+if __name__ == "__main__":
+    import time
+
+    # The DCAM driver failed to load and logged while importing.
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+    # 40 x 40 coordinates with 4 x 4 auto-focus blocks, the column axis is
+    # twice as fast as the row axis.
+    speeds = (7500, 15000)
+    Coords_array = generate_scan_coords(1568, 40, auto_focus_steps=4)
+    for method in VISITING_ORDERS:
+        start = time.perf_counter()
+        ordered = order_coordinates(Coords_array, method, *speeds)
+        elapsed = time.perf_counter() - start
+        logging.info(
+            "{:>10}: travel {:6.1f} s, ordered in {:.3f} s".format(
+                method, travel_time(ordered, *speeds), elapsed
+            )
+        )
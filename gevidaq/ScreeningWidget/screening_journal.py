@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Journal of the finished work of a screening, to resume it after a crash.
+
+ScanningExecutionThread walks grid -> round -> coordinate -> z stack. Every
+finished unit is appended as one JSON line to screening_journal.jsonl in the
+saving directory, and the file is synced to disk before the next unit starts:
+
+    {"event": "z", "grid": 0, "round": 0, "coord": 3, "z": 1, ...}
+    {"event": "coordinate", "grid": 0, "round": 0, "coord": 3, ...}
+    {"event": "focus", "grid": 0, "round": 1, "row": 1585, "col": 0, ...}
+
+A coordinate is only skipped on resume when its "coordinate" line is there,
+a coordinate that crashed half way through its z stack is done again as the
+max projection needs the whole stack. Finished coordinates are looked up by
+grid, round and stage position, so the coordinates of a round may be
+generated again in another visiting order for the resumed run. "focus" lines are the auto-focus
+positions that were written into the coordinates of the next round, they are
+written into RoundCoordsDict again on resume.
+
+A line that was cut off by the crash is removed when the journal is opened.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+JOURNAL_NAME = "screening_journal.jsonl"
+
+
+class ScreeningJournal:
+    """
+    Append-only journal of a screening run.
+
+    Parameters
+    path : str
+        Journal file.
+    resume : bool
+        Read back the journal to continue a run. If False an existing journal
+        is renamed with a timestamp and a new one is started.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        # (grid, round_index, row, col) to its "coordinate" record.
+        self.completed = {}
+        self.focus_records = []
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            if resume:
+                self._load()
+            else:
+                root, ext = os.path.splitext(path)
+                os.replace(
+                    path,
+                    root
+                    + datetime.datetime.now().strftime("_%Y-%m-%d_%H-%M-%S")
+                    + ext,
+                )
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._append({"event": "start", "resume": bool(resume)})
+
+    def _load(self):
+        with open(self.path, "rb") as file:
+            content = file.read()
+
+        good_length = 0
+        for line in content.splitlines(keepends=True):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if not line.endswith(b"\n"):
+                    # Torn write of the last line.
+                    break
+                logging.info(
+                    "Skipped unreadable journal line: {}".format(line)
+                )
+                good_length += len(line)
+                continue
+            good_length += len(line)
+
+            if record["event"] == "coordinate":
+                key = (
+                    record["grid"],
+                    record["round"],
+                    record["row"],
+                    record["col"],
+                )
+                self.completed[key] = record
+            elif record["event"] == "focus":
+                self.focus_records.append(record)
+
+        if good_length < len(content):
+            logging.info("Removed cut off line from the journal.")
+            with open(self.path, "r+b") as file:
+                file.truncate(good_length)
+                file.flush()
+                os.fsync(file.fileno())
+
+        logging.info(
+            "Journal loaded, {} coordinates done.".format(len(self.completed))
+        )
+
+    def _append(self, record):
+        record["time"] = datetime.datetime.now().isoformat()
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    # === Writing ===
+    def record_z(self, grid, round_index, coord, z, focus_position):
+        """
+        A z stack position of a coordinate is done.
+        """
+        self._append(
+            {
+                "event": "z",
+                "grid": int(grid),
+                "round": int(round_index),
+                "coord": int(coord),
+                "z": int(z),
+                "focus_position": float(focus_position),
+            }
+        )
+
+    def record_coordinate(
+        self,
+        grid,
+        round_index,
+        coord,
+        row,
+        col,
+        ZStackPosList,
+        error_massage=None,
+    ):
+        """
+        All work of a coordinate is done and saved.
+        """
+        self._append(
+            {
+                "event": "coordinate",
+                "grid": int(grid),
+                "round": int(round_index),
+                "coord": int(coord),
+                "row": int(row),
+                "col": int(col),
+                "ZStackPosList": [float(pos) for pos in ZStackPosList],
+                "error": error_massage,
+            }
+        )
+
+    def record_focus(self, grid, round_index, row, col, focus_position):
+        """
+        Auto-focus position written to the coordinate at row, col of round_index.
+        """
+        self._append(
+            {
+                "event": "focus",
+                "grid": int(grid),
+                "round": int(round_index),
+                "row": int(row),
+                "col": int(col),
+                "focus_position": float(focus_position),
+            }
+        )
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    # === Reading ===
+    def is_done(self, grid, round_index, row, col):
+        """
+        If the coordinate at stage position row, col is finished.
+        """
+        return (grid, round_index, int(row), int(col)) in self.completed
+
+    def ZStackPosList(self, grid, round_index, row, col):
+        """
+        Focus stack positions used at a finished coordinate.
+        """
+        return np.array(
+            self.completed[(grid, round_index, int(row), int(col))][
+                "ZStackPosList"
+            ]
+        )
+
+    def error_number(self):
+        return sum(
+            record["error"] is not None for record in self.completed.values()
+        )
+
+    def apply_focus_positions(self, RoundCoordsDict):
+        """
+        Write the journaled auto-focus positions into the coordinates.
+
+        The coordinates are the same for every grid, so only the positions of
+        the last journaled grid, the one to resume, are written.
+        """
+        if not self.focus_records:
+            return
+        grid = self.focus_records[-1].get("grid", 0)
+        for record in self.focus_records:
+            if record.get("grid", 0) != grid:
+                continue
+            for coordinate in RoundCoordsDict[
+                "CoordsPackage_{}".format(record["round"] + 1)
+            ]:
+                if (
+                    coordinate["row"] == record["row"]
+                    and coordinate["col"] == record["col"]
+                ):
+                    coordinate["focus_position"] = record["focus_position"]
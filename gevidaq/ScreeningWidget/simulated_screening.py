@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Screening on simulated hardware, to check resuming after a crash.
+
+SimulatedScanningThread is a ScanningExecutionThread with the simulated
+objective and focus camera of PI_ObjectiveMotor.focus_search. The stage,
+laser and filter sliders are the simulated serial devices, the NI-daq is the
+simulated DAQ backend. It can crash on purpose after a number of images, and
+records what it imaged.
+
+resume_after_crash runs a small screening that crashes twice and is resumed
+from the journal each time, the second time with the coordinates in another
+visiting order, and checks that every coordinate is imaged exactly once.
+"""
+
+import collections
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from ..NIDAQ.daq_backend import use_backend
+from ..PI_ObjectiveMotor.focus_search import (
+    SimulatedFocusCamera,
+    SimulatedObjectiveMotor,
+    simulated_focus_finder,
+)
+from .EvolutionScanningThread import ScanningExecutionThread
+from .scan_coordinates import generate_scan_coords, order_coordinates
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+class SimulatedScanningThread(ScanningExecutionThread):
+    """
+    ScanningExecutionThread on simulated hardware.
+
+    Parameters
+    crash_after : int, optional
+        Raise SimulatedCrash instead of taking this image, counted from 0.
+    sample_focus : float
+        Focus of the sample everywhere, mm.
+
+    Attributes
+    images : list
+        (grid, round, row, col, focus position) of every image taken.
+    focus_searches : list
+        (row, col, found focus) of every auto-focus.
+    laser_rounds : list
+        Rounds the laser events were executed for.
+    """
+
+    def __init__(self, *args, crash_after=None, sample_focus=3.503, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.crash_after = crash_after
+        self.sample_focus = sample_focus
+        self.show_PMT_images = False
+        self.images = []
+        self.focus_searches = []
+        self.laser_rounds = []
+
+    def connect_objective_motor(self):
+        return SimulatedObjectiveMotor(position=3.5)
+
+    def find_focus(self, instance_FocusFinder):
+        camera = SimulatedFocusCamera(
+            self.pi_device_instance, focus=self.sample_focus
+        )
+        finder = simulated_focus_finder(
+            self.pi_device_instance,
+            camera,
+            init_search_range=instance_FocusFinder.init_search_range,
+            total_step_number=instance_FocusFinder.total_step_number,
+        )
+        focus = finder.model_search()
+        self.focus_searches.append(
+            (self.coord_array["row"], self.coord_array["col"], focus)
+        )
+        return focus
+
+    def laser_init(self, EachRound):
+        self.laser_rounds.append(EachRound)
+        super().laser_init(EachRound)
+
+    def inidividual_coordinate_operation(
+        self, EachRound, EachWaveform, RowIndex, ColumnIndex
+    ):
+        if len(self.images) == self.crash_after:
+            raise SimulatedCrash("Stage not responding")
+        self.images.append(
+            (self.Grid_index, EachRound, RowIndex, ColumnIndex, self.FocusPos)
+        )
+        super().inidividual_coordinate_operation(
+            EachRound, EachWaveform, RowIndex, ColumnIndex
+        )
+
+
+def simulated_round_queue(rounds, sampling_rate=50000, samples=5000):
+    """
+    RoundQueueDict with one waveform package per round: a 640AO pulse while
+    recording Vp, no galvos, no camera. The laser shutter opens at the first
+    round.
+    """
+    dtype = np.dtype(
+        [("Waveform", float, (samples,)), ("Specification", "U20")]
+    )
+    analog_signals = np.zeros(1, dtype=dtype)
+    analog_signals["Waveform"][0, samples // 4 : samples // 2] = 1
+    analog_signals["Specification"][0] = "640AO"
+
+    RoundQueueDict = {
+        "InsightEvents": ["Round_1_Shutter_Open"],
+        "FilterEvents": [],
+    }
+    for round_number in range(1, rounds + 1):
+        RoundQueueDict["RoundPackage_{}".format(round_number)] = [
+            {
+                "WaveformPackage_1": [
+                    sampling_rate,
+                    analog_signals,
+                    {},
+                    ["Vp"],
+                ]
+            },
+            {"CameraPackage_1": {}},
+            {"PhotocyclePackage_1": {}},
+        ]
+        RoundQueueDict["GalvoInforPackage_{}".format(round_number)] = {
+            "GalvoInfor_1": "NoGalvo"
+        }
+    return RoundQueueDict
+
+
+def simulated_general_settings(savedirectory, rounds, step=1568):
+    focus_stack = "NumberOfFocus1WithIncrementBeing0.002"
+    return {
+        "savedirectory": savedirectory,
+        "FocusCorrectionMatrixDict": {},
+        "FocusStackInfoDict": {
+            "RoundPackage_{}".format(round_number): focus_stack
+            for round_number in range(1, rounds + 1)
+        },
+        "StageGridOffset": 2 * step,
+        "Meshgrid": 1,
+        "StartUpEvents": [],
+        "AutoFocusConfig": {
+            "source_of_image": "PMT",
+            "init_search_range": 0.010,
+            "total_step_number": 5,
+            "imaging_conditions": {"edge_volt": 3},
+        },
+    }
+
+
+def simulated_round_coords(rounds, method, step=1568):
+    """
+    2 x 2 coordinates per round, one auto-focus block.
+    """
+    return {
+        "CoordsPackage_{}".format(round_number): order_coordinates(
+            generate_scan_coords(step, 2, auto_focus_steps=2), method
+        )
+        for round_number in range(1, rounds + 1)
+    }
+
+
+def resume_after_crash(directory=None, rounds=2):
+    """
+    Screen rounds rounds of 2 x 2 coordinates, crash in the first round
+    right after the auto-focus coordinate, resume, crash in the second round
+    after its auto-focus coordinate, and resume again with the coordinates
+    in serpentine instead of raster order. The stage times out on the moves
+    of the first run, so it leaves journaled errors.
+
+    Checks that every coordinate is imaged exactly once, that the auto-focus
+    of the first round is not repeated and its focus is used at every
+    coordinate, that the laser events of the finished first round are not
+    run again, and that the error number is restored.
+
+    Returns
+    list of the SimulatedScanningThread of every run.
+    """
+    os.environ["GEVIDAQ_SERIAL_BACKEND"] = "simulated"
+    use_backend("simulated")
+
+    if directory is None:
+        with tempfile.TemporaryDirectory() as directory:
+            return resume_after_crash(directory, rounds)
+
+    RoundQueueDict = simulated_round_queue(rounds)
+    GeneralSettingDict = simulated_general_settings(directory, rounds)
+    runs = [
+        ("raster", 2, False),
+        ("raster", 3, True),
+        ("serpentine", None, True),
+    ]
+
+    threads = []
+    for method, crash_after, resume in runs:
+        thread = SimulatedScanningThread(
+            RoundQueueDict,
+            simulated_round_coords(rounds, method),
+            GeneralSettingDict,
+            resume=resume,
+            crash_after=crash_after,
+        )
+        if len(threads) == 0:
+            # Moves of 1568 take about 0.1 s, so all but the first fail.
+            thread.stage_move_timeout = 0.01
+        threads.append(thread)
+        try:
+            thread.run()
+        except SimulatedCrash as exc:
+            logging.info("Simulated screening stopped: {}".format(exc))
+
+    images = [image for thread in threads for image in thread.images]
+    imaged = collections.Counter(image[:4] for image in images)
+    coordinates = 4 * rounds
+    assert len(imaged) == coordinates, imaged
+    assert set(imaged.values()) == {1}, imaged
+
+    focus_searches = [
+        search for thread in threads for search in thread.focus_searches
+    ]
+    assert len(focus_searches) == 1, focus_searches
+    found = focus_searches[0][2]
+    # Focus positions are float32 in the coordinates array.
+    assert all(abs(image[4] - found) < 1e-6 for image in images), images
+
+    assert threads[0].laser_rounds == [0]
+    assert threads[1].laser_rounds == [0, 1]
+    assert threads[2].laser_rounds == [1]
+
+    # The errors of the first run are journaled with its coordinates.
+    errors = threads[2].errornum
+    assert errors == threads[1].errornum > 0
+
+    logging.info(
+        "{} coordinates imaged once each over {} runs, focus {:.4f} mm "
+        "found once, {} errors kept.".format(
+            coordinates, len(threads), found, errors
+        )
+    )
+    return threads
+
+
+if __name__ == "__main__":
+    # Importing the hardware modules already logged, at warning level.
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+    resume_after_crash()
@@ -7,7 +7,7 @@ Created on Thu Nov  8 12:55:22 2018
 import logging
 import time
 
-import serial
+from ..GeneralUsage.serial_connection import get_connection
 
 
 class ELL9Filter:
@@ -22,6 +22,10 @@ class ELL9Filter:
         self.baudrate = 9600
         self.parity = None
         self.address = address
+        # Open once and shared, Try_until_Success does the retries.
+        self.connection = get_connection(
+            self.address, device="ell9", baudrate=self.baudrate, retries=0
+        )
 
     def Try_until_Success(func):
         """This is the decorator to try to execute the function until succeed."""
@@ -58,35 +62,27 @@ class ELL9Filter:
         """
         Moves the stage to its home position.
         """
-        with serial.Serial(
-            self.address, self.baudrate
-        ) as motor:  # You can find the COM# using ELLO
-            command = "0ho0"
-            motor.write(
-                command.encode()
-            )  # Moves the stage of channel 0 to home
+        # You can find the COM# using ELLO
+        command = "0ho0"
+        self.connection.write(command)  # Moves the stage of channel 0 to home
 
     @Try_until_Success
     def forward(self):
         """
         Moves the stage one position forward.
         """
-        with serial.Serial(self.address, self.baudrate) as motor:
-            command = "0fw"
-            motor.write(
-                command.encode()
-            )  # Moves the stage of channel 0 one position forward
+        command = "0fw"
+        # Moves the stage of channel 0 one position forward
+        self.connection.write(command)
 
     @Try_until_Success
     def backward(self):
         """
         Moves the stage one position backward.
         """
-        with serial.Serial(self.address, self.baudrate) as motor:
-            command = "0bw"
-            motor.write(
-                command.encode()
-            )  # Moves the stage of channel 0 one position backward
+        command = "0bw"
+        # Moves the stage of channel 0 one position backward
+        self.connection.write(command)
 
     @Try_until_Success
     def moveToPosition(self, position=0):
@@ -96,32 +92,29 @@ class ELL9Filter:
         """
         assert position < 4, "Choose a position 0, 1, 2 or 3"
 
-        with serial.Serial(self.address, self.baudrate, timeout=1) as motor:
-            if position == 0:
-                command = "0ma00000000"
-            elif position == 1:
-                command = "0ma0000001F"
-            elif position == 2:
-                command = "0ma0000003E"
-            elif position == 3:
-                command = "0ma0000005D"
-            motor.write(command.encode())
+        if position == 0:
+            command = "0ma00000000"
+        elif position == 1:
+            command = "0ma0000001F"
+        elif position == 2:
+            command = "0ma0000003E"
+        elif position == 3:
+            command = "0ma0000005D"
+        self.connection.write(command)
 
     @Try_until_Success
     def getPosition(self):
         """
         Retrieves the current position of the filter and prints the value.
         """
-        with serial.Serial(self.address, self.baudrate, timeout=1) as motor:
-            command = "0gp"
-            motor.write(command.encode())
-            position = motor.read(size=11)
-
-            if position == b"0PO00000000":
-                return 0
-            elif position == b"0PO0000001F":
-                return 1
-            elif position == b"0PO0000003E":
-                return 2
-            elif position == b"0PO0000005D":
-                return 3
+        command = "0gp"
+        position = self.connection.query(command, reply=11)
+
+        if position == b"0PO00000000":
+            return 0
+        elif position == b"0PO0000001F":
+            return 1
+        elif position == b"0PO0000003E":
+            return 2
+        elif position == b"0PO0000005D":
+            return 3